@@ -1,13 +1,13 @@
 import os
 import asyncio
 import json
-import uuid
+import time
 import platform
 import nest_asyncio
-import shutil
 from typing import Dict, List, Optional, Any
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse as HTTPStreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
@@ -17,9 +17,10 @@ import logging
 from langgraph.prebuilt import create_react_agent
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, ToolMessage
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from utils import astream_graph, random_uuid
-from langgraph.checkpoint.memory import MemorySaver
+import mcp_registry
+import thread_store
+import upload_store
 from langchain_core.runnables import RunnableConfig
 
 # 스키마 관리자 import
@@ -343,16 +344,10 @@ def save_config_to_json(config):
         print(f"설정 파일 저장 오류: {str(e)}")
         return False
 
-# MCP 클라이언트와 에이전트 저장소
-mcp_clients = {}
-agents = {}
-conversation_histories = {}
-agent_models = {}  # 스레드별 사용 중인 모델 저장
+# 스레드별 에이전트/대화 기록/모델/멀티 에이전트 워크플로우는 thread_store에서 관리
+# (MCP 세션/도구는 mcp_registry에서 모든 스레드가 공유)
 tool_count = 0  # 전역 변수로 tool_count 선언
 
-# 멀티 에이전트 워크플로우 저장소
-multi_agent_workflows = {}  # 스레드별 멀티 에이전트 워크플로우
-
 # 요청 및 응답 모델 정의
 class Message(BaseModel):
     role: str
@@ -383,6 +378,7 @@ class SettingsResponse(BaseModel):
     tool_count: int
     available_models: List[str]
     current_config: Dict[str, Any]
+    tools: List[Dict[str, Any]] = []  # 도구 카탈로그 (server, name, description, args_schema)
 
 class ThreadResponse(BaseModel):
     thread_id: str
@@ -391,6 +387,9 @@ class FileUploadResponse(BaseModel):
     file_path: str
     file_name: str
     file_size: int
+    sha256: Optional[str] = None
+    deduplicated: bool = False  # 같은 내용의 파일이 이미 있어 기존 파일을 사용했는지
+    csv: Optional[Dict[str, Any]] = None  # CSV 구조 (encoding, delimiter, columns, row_count, sample)
 
 # FastAPI 애플리케이션 설정
 @asynccontextmanager
@@ -399,13 +398,71 @@ async def lifespan(app: FastAPI):
     if not os.path.exists(ABSOLUTE_UPLOAD_DIR):
         os.makedirs(ABSOLUTE_UPLOAD_DIR)
     print(f"업로드 디렉토리 경로: {ABSOLUTE_UPLOAD_DIR}")
+    # 스레드 저장소 (디스크로 내린 스레드 기록 + 공유 checkpointer)
+    await thread_store.setup()
+    sweeper = asyncio.create_task(thread_store.sweep())
+    # 첫 스레드가 MCP 서버 기동을 기다리지 않도록 공유 세션과 도구 카탈로그를 미리 준비
+    warm_up = schedule_refresh()
     yield
-    # 애플리케이션 종료 시 모든 MCP 클라이언트 종료
-    for client in mcp_clients.values():
-        try:
-            await client.__aexit__(None, None, None)
-        except Exception as e:
-            print(f"MCP 클라이언트 종료 오류: {str(e)}")
+    if warm_up is not None:
+        warm_up.cancel()
+    sweeper.cancel()
+    # 메모리의 스레드를 디스크에 저장
+    try:
+        await thread_store.close()
+    except Exception as e:
+        print(f"스레드 저장소 종료 오류: {str(e)}")
+    # 애플리케이션 종료 시 공유 MCP 세션 종료
+    try:
+        await mcp_registry.close()
+    except Exception as e:
+        print(f"MCP 세션 종료 오류: {str(e)}")
+
+
+async def refresh_tools(mcp_config=None):
+    """
+    공유 MCP 도구 목록을 가져오고 도구 개수를 갱신합니다.
+    config.json 내용이 바뀐 경우에만 MCP 세션을 다시 엽니다.
+
+    Returns:
+        list: 도구 목록 (연결 실패 시 빈 리스트)
+    """
+    global tool_count  # 전역 변수 사용 선언
+
+    if mcp_config is None:
+        mcp_config = load_config_from_json()
+    try:
+        tools = await mcp_registry.get_tools(mcp_config)
+    except Exception as e:
+        print(f"MCP 도구 로드 오류: {str(e)}")
+        # 오류 발생 시 설정 파일의 도구 개수를 사용
+        tool_count = len(mcp_config)
+        return []
+    tool_count = len(tools)
+    return tools
+
+
+MCP_REFRESH_RETRY_SECONDS = float(os.getenv("MCP_REFRESH_RETRY_SECONDS", "60"))
+_refresh_task: Optional[asyncio.Task] = None
+_refresh_failed_at = float("-inf")
+
+async def _background_refresh(mcp_config=None):
+    global _refresh_failed_at
+    if not await refresh_tools(mcp_config):
+        _refresh_failed_at = time.monotonic()
+
+def schedule_refresh(mcp_config=None):
+    """
+    MCP 세션 연결/도구 카탈로그 갱신을 백그라운드에서 실행합니다.
+    이미 실행 중이거나 최근(MCP_REFRESH_RETRY_SECONDS 이내)에 연결에 실패했으면 새로 시작하지 않습니다.
+    """
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        return _refresh_task
+    if time.monotonic() - _refresh_failed_at < MCP_REFRESH_RETRY_SECONDS:
+        return None
+    _refresh_task = asyncio.create_task(_background_refresh(mcp_config))
+    return _refresh_task
 
 # 파일 업로드 크기 제한을 300MB로 설정
 app = FastAPI(title="MCP Tool Agent API", lifespan=lifespan)
@@ -422,16 +479,52 @@ app.add_middleware(
 # 정적 파일 서빙 설정 (업로드 파일 액세스용)
 app.mount("/uploads", StaticFiles(directory=ABSOLUTE_UPLOAD_DIR), name="uploads")
 
-# HTML 보고서 서빙 설정
-REPORT_DIR = os.path.join(BASE_DIR, "report")
+# HTML 보고서 서빙 설정 (mcp_tools/report_store.py 가 저장하는 디렉토리)
+REPORT_DIR = os.path.realpath(os.getenv("REPORT_STORE_DIR", os.path.join(BASE_DIR, "report")))
 if not os.path.exists(REPORT_DIR):
     os.makedirs(REPORT_DIR, exist_ok=True)
-app.mount("/reports", StaticFiles(directory=REPORT_DIR), name="reports")
+
+# Accept-Encoding 토큰 -> (미리 압축된 파일 확장자, Content-Encoding) - 선호 순
+REPORT_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+@app.get("/reports/{filename}")
+async def serve_report(filename: str, request: Request):
+    """
+    저장된 HTML 보고서 서빙
+
+    보고서 파일은 내용 주소 방식이라 한 번 저장되면 바뀌지 않으므로
+    미리 압축된 .br/.gz 파일을 그대로 보내고 ETag와 장기 캐시 헤더를 붙입니다.
+    """
+    path = os.path.realpath(os.path.join(REPORT_DIR, filename))
+    if os.path.dirname(path) != REPORT_DIR or not filename.endswith(".html") or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="보고서를 찾을 수 없습니다")
+
+    accepted = {token.split(";")[0].strip() for token in request.headers.get("accept-encoding", "").split(",")}
+    encoding = None
+    for token, suffix in REPORT_ENCODINGS:
+        if token in accepted and os.path.isfile(path + suffix):
+            encoding, path = token, path + suffix
+            break
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}{"-" + encoding if encoding else ""}"'
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
 
 # 에이전트 초기화 함수
 async def initialize_agent(thread_id: str, model: str = "gpt-4o", mcp_config=None):
     """
     MCP 세션과 에이전트를 초기화합니다.
+    스레드가 메모리에서 내려가 있었으면 디스크의 대화 기록과 checkpoint로 이어서 대화합니다.
 
     Args:
         thread_id: 대화 스레드 ID
@@ -442,28 +535,9 @@ async def initialize_agent(thread_id: str, model: str = "gpt-4o", mcp_config=Non
         bool: 초기화 성공 여부
     """
     try:
-        global tool_count  # 전역 변수 사용 선언
-        
-        # 기존 클라이언트가 있으면 삭제
-        if thread_id in mcp_clients:
-            del mcp_clients[thread_id]
-        
-        if mcp_config is None:
-            # 설정 파일에서 설정 로드
-            mcp_config = load_config_from_json()
-        
-        # 새로운 API 사용 방식 적용
-        client = MultiServerMCPClient(mcp_config)
-        tools = await client.get_tools()  # get_tools 메서드가 이제 비동기식입니다
-        tool_count = len(tools)  # 전역 변수에 할당
-        
-        print(f"🔍 [TOOLS] 사용 가능한 도구 개수: {tool_count}")
-        for i, tool in enumerate(tools[:3]):  # 처음 3개만 출력
-            print(f"🔍 [TOOLS] 도구 {i+1}: {getattr(tool, 'name', 'name 없음')}")
-            if hasattr(tool, 'description'):
-                print(f"  설명: {tool.description[:100]}...")
-        if len(tools) > 3:
-            print(f"🔍 [TOOLS] ... 외 {len(tools)-3}개 더")
+        # 공유 MCP 세션의 도구 사용 (설정이 바뀌지 않았으면 서버 프로세스를 새로 띄우지 않음)
+        tools = await mcp_registry.get_tools(mcp_config if mcp_config is not None else load_config_from_json())
+        print(f"🔍 [TOOLS] 사용 가능한 도구 개수: {len(tools)} (MCP 세션 세대 {mcp_registry.generation})")
         
         # OpenAI 모델 사용
         model_info = OUTPUT_TOKEN_INFO[model]
@@ -478,18 +552,19 @@ async def initialize_agent(thread_id: str, model: str = "gpt-4o", mcp_config=Non
             
         llm = ChatOpenAI(**llm_kwargs)
         
+        # 대화 상태는 공유 checkpointer에 thread_id로 저장 (모델 변경/MCP 세션 재연결/메모리에서 내린 뒤에도 이어서 대화)
         agent = create_react_agent(
             llm,
             tools,
-            checkpointer=MemorySaver(),
+            checkpointer=thread_store.checkpointer,
             prompt=get_system_prompt(),
         )
         
-        # 클라이언트와 에이전트 저장
-        mcp_clients[thread_id] = client
-        agents[thread_id] = agent
-        conversation_histories[thread_id] = []
-        agent_models[thread_id] = model  # 현재 모델 저장
+        # 에이전트 저장
+        async with thread_store.use(thread_id) as state:
+            state.agent = agent
+            state.model = model  # 현재 모델 저장
+            state.generation = mcp_registry.generation
         
         return True
     except Exception as e:
@@ -671,7 +746,8 @@ async def process_query(thread_id: str, query: str, timeout_seconds=60, recursio
         final_tool: 최종 도구 호출 정보
     """
     try:
-        if thread_id in agents:
+        state = await thread_store.get(thread_id)
+        if state is not None and state.agent is not None:
             streaming_response = StreamingResponse()
             
             try:                
@@ -680,7 +756,7 @@ async def process_query(thread_id: str, query: str, timeout_seconds=60, recursio
                 
                 response = await asyncio.wait_for(
                     astream_graph(
-                        agents[thread_id],
+                        state.agent,
                         {"messages": messages},
                         callback=streaming_response.callback,
                         config=RunnableConfig(
@@ -710,53 +786,45 @@ async def process_query(thread_id: str, query: str, timeout_seconds=60, recursio
 async def get_settings():
     """현재 설정 정보를 반환합니다."""
     print("[GET] /api/settings")
-    global tool_count  # 전역 변수 사용 선언
     
     config = load_config_from_json()
     
-    # MCP 클라이언트가 아직 초기화되지 않았으면 임시 클라이언트를 생성하여 도구 개수 확인
-    if tool_count == 0:
-        try:
-            # 새로운 API 사용 방식 적용
-            temp_client = MultiServerMCPClient(config)
-            tools = await temp_client.get_tools()
-            tool_count = len(tools)
-        except Exception as e:
-            print(f"도구 개수 확인 중 오류 발생: {str(e)}")
-            # 오류 발생 시 설정 파일의 도구 개수를 사용
-            tool_count = len(config)
+    # 설정 fingerprint별로 저장된 도구 카탈로그 사용 (MCP 서버 연결을 기다리지 않음)
+    tools = mcp_registry.catalog(config)
+    if tools is None:
+        # 처음 보는 설정이면 백그라운드에서 연결하고, 그동안은 설정 파일의 서버 개수를 반환
+        schedule_refresh(config)
     
     return SettingsResponse(
-        tool_count=tool_count,
+        tool_count=len(tools) if tools is not None else len(config),
         available_models=list(OUTPUT_TOKEN_INFO.keys()),
-        current_config=config
+        current_config=config,
+        tools=tools or [],
     )
 
 @app.post("/api/settings")
 async def update_settings(tool_config: ToolRequest):
     """설정을 업데이트하고 저장합니다."""
     print("[POST] /api/settings")
-    global tool_count  # 전역 변수 사용 선언
     
     success = save_config_to_json(tool_config.tool_config)
     if not success:
         raise HTTPException(status_code=500, detail="설정 저장 중 오류가 발생했습니다.")
     
-    # 설정이 업데이트되면 도구 개수도 업데이트
-    try:
-        # 새로운 API 사용 방식 적용
-        temp_client = MultiServerMCPClient(tool_config.tool_config)
-        tools = await temp_client.get_tools()
-        tool_count = len(tools)
-    except Exception as e:
-        print(f"도구 개수 업데이트 중 오류 발생: {str(e)}")
-        # 오류 발생 시 설정 파일의 도구 개수를 사용
-        tool_count = len(tool_config.tool_config)
+    # 설정이 바뀌었으면 공유 MCP 세션을 다시 열고 도구 개수 업데이트
+    # (각 스레드 에이전트는 다음 질문에서 새 도구로 다시 만들어짐)
+    # 이전에 연결해 본 설정이면 저장된 카탈로그로 바로 응답하고 세션은 백그라운드에서 다시 엶
+    tools = mcp_registry.catalog(tool_config.tool_config)
+    if tools is None:
+        await refresh_tools(tool_config.tool_config)
+        tools = mcp_registry.catalog(tool_config.tool_config)
+    else:
+        schedule_refresh(tool_config.tool_config)
     
     return {
         "success": True, 
         "message": "설정이 업데이트되었습니다.", 
-        "tool_count": tool_count
+        "tool_count": len(tools) if tools is not None else tool_count
     }
 
 @app.post("/api/threads")
@@ -771,10 +839,11 @@ async def create_thread():
 async def get_thread(thread_id: str):
     """특정 스레드의 대화 기록을 반환합니다."""
     print("[GET] /api/threads/{thread_id}")
-    if thread_id not in conversation_histories:
+    state = await thread_store.get(thread_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="스레드를 찾을 수 없습니다.")
     return MessageResponse(
-        messages=conversation_histories[thread_id],
+        messages=state.history,
         thread_id=thread_id
     )
 
@@ -782,15 +851,8 @@ async def get_thread(thread_id: str):
 async def delete_thread(thread_id: str):
     """스레드를 삭제합니다."""
     print("[DELETE] /api/threads/{thread_id}")
-    if thread_id in mcp_clients:
-        # 새 버전에서는 context manager 인터페이스를 사용하지 않으므로 직접 삭제만 함
-        del mcp_clients[thread_id]
-    
-    if thread_id in agents:
-        del agents[thread_id]
-    
-    if thread_id in conversation_histories:
-        del conversation_histories[thread_id]
+    # MCP 세션은 스레드들이 공유하므로 스레드 고유 상태(메모리, 디스크 기록, checkpoint)만 삭제
+    await thread_store.delete(thread_id)
     
     return {"success": True, "message": "스레드가 삭제되었습니다."}
 
@@ -801,32 +863,29 @@ async def upload_file(file: UploadFile = File(...)):
     """
     print(f"[POST] /api/upload - 파일 이름: {file.filename}, 크기: {file.size if hasattr(file, 'size') else '알 수 없음'}")
     try:
-        # 고유 파일명 생성 (파일명 충돌 방지)
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(ABSOLUTE_UPLOAD_DIR, unique_filename)
-        
-        # 파일 저장
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        
-        # 파일 정보 반환
-        file_size = os.path.getsize(file_path)
-        print(f"파일 업로드 완료: {file_path}, 크기: {file_size}")
+        # 청크 단위로 저장하면서 sha256 계산 (같은 내용이면 기존 파일 사용), CSV는 구조를 사이드카에 저장
+        meta = await upload_store.save_upload(file, ABSOLUTE_UPLOAD_DIR)
+        print(f"파일 업로드 완료: {meta['file_path']}, 크기: {meta['size']}{' (기존 파일 사용)' if meta['deduplicated'] else ''}")
         
         # 응답 데이터 구성
         response_data = FileUploadResponse(
-            file_path=file_path,  # 절대 경로로 반환
+            file_path=meta["file_path"],  # 절대 경로로 반환
             file_name=file.filename,
-            file_size=file_size
+            file_size=meta["size"],
+            sha256=meta["sha256"],
+            deduplicated=meta["deduplicated"],
+            csv=meta.get("csv"),
         )
         print(f"응답 데이터: {response_data}")
         return response_data
+    except upload_store.UploadTooLarge as e:
+        print(f"파일 업로드 거부: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print(f"파일 업로드 중 오류 발생: {str(e)}")
         raise HTTPException(status_code=500, detail=f"파일 업로드 중 오류 발생: {str(e)}")
     finally:
-        file.file.close()
+        await file.close()
 
 @app.post("/api/threads/{thread_id}/query")
 async def query_agent(thread_id: str, request: QueryRequest, background_tasks: BackgroundTasks):
@@ -838,32 +897,47 @@ async def query_agent(thread_id: str, request: QueryRequest, background_tasks: B
     if not thread_id:
         thread_id = random_uuid()
     
-    # 에이전트가 없거나 모델이 변경된 경우 재초기화
+    # 메모리에서 내려간 스레드는 디스크에서 복원하고, 처리하는 동안에는 내리지 않음
+    async with thread_store.use(thread_id) as state:
+        return await _query_agent(thread_id, state, request)
+
+async def _ensure_agent(thread_id: str, state: thread_store.ThreadState, model: str):
+    """스레드 에이전트가 없거나 모델/MCP 세션이 바뀌었으면 다시 만듭니다."""
+    # config.json이 바뀌었으면 공유 MCP 세션을 다시 열기 (바뀌지 않았으면 기존 세션 그대로)
+    await refresh_tools()
+    
+    # 에이전트가 없거나 모델이 변경됐거나 MCP 세션이 다시 열린 경우 재초기화
     need_init = (
-        thread_id not in agents or 
-        thread_id not in agent_models or 
-        agent_models.get(thread_id) != request.model
+        state.agent is None or 
+        state.model != model or
+        state.generation != mcp_registry.generation
     )
     
     if need_init:
-        print(f"에이전트 초기화/재초기화 필요: thread_id={thread_id}, model={request.model}")
+        print(f"에이전트 초기화/재초기화 필요: thread_id={thread_id}, model={model}")
         # 에이전트 초기화
         success = await initialize_agent(
             thread_id, 
-            model=request.model
+            model=model
         )
         
         if not success:
             raise HTTPException(status_code=500, detail="에이전트 초기화 중 오류가 발생했습니다.")
-    
-    # 첨부 파일 경로 추출
+
+def _extract_attachment(query: str):
+    """
+    질문의 "[첨부 파일: 경로]"에서 첨부 파일 경로를 추출합니다.
+
+    Returns:
+        (attachment_path, error_msg): 파일이 없으면 error_msg에 오류 메시지
+    """
     attachment_path = None
-    if "[첨부 파일: " in request.query:
+    if "[첨부 파일: " in query:
         try:
             # 첨부 파일 경로 추출
-            start_idx = request.query.find("[첨부 파일: ") + len("[첨부 파일: ")
-            end_idx = request.query.find("]", start_idx)
-            attachment_path = request.query[start_idx:end_idx]
+            start_idx = query.find("[첨부 파일: ") + len("[첨부 파일: ")
+            end_idx = query.find("]", start_idx)
+            attachment_path = query[start_idx:end_idx]
             
             # 상대 경로인 경우 절대 경로로 변환
             if attachment_path.startswith("./uploads/") or attachment_path.startswith("/uploads/"):
@@ -874,79 +948,124 @@ async def query_agent(thread_id: str, request: QueryRequest, background_tasks: B
             # 파일 존재 여부 확인
             if not os.path.exists(attachment_path):
                 print(f"경고: 파일이 존재하지 않습니다: {attachment_path}")
-                return {
-                    "response": f"오류: 파일을 찾을 수 없습니다. 경로: {attachment_path}",
-                    "thread_id": thread_id
-                }
+                return attachment_path, f"오류: 파일을 찾을 수 없습니다. 경로: {attachment_path}"
             else:
                 print(f"파일 확인 완료: {attachment_path} (크기: {os.path.getsize(attachment_path)} bytes)")
         except Exception as e:
             print(f"첨부 파일 경로 추출 중 오류 발생: {str(e)}")
+    return attachment_path, None
+
+def _timeout_for(request: QueryRequest, attachment_path: Optional[str]) -> int:
+    """대용량 첨부 파일이 있으면 늘린 응답 제한 시간(초)"""
+    timeout_value = request.timeout_seconds
+    if attachment_path and os.path.exists(attachment_path):
+        meta = upload_store.load_meta(attachment_path)
+        file_size = meta["size"] if meta else os.path.getsize(attachment_path)
+        # 파일 크기가 10MB를 초과하면 타임아웃 값 증가
+        if file_size > 10 * 1024 * 1024:
+            timeout_value = max(timeout_value, 300)  # 최소 300초
+            print(f"대용량 파일 감지: 타임아웃 값을 {timeout_value}초로 증가")
+    return timeout_value
+
+async def _run_multi_agent(thread_id: str, state: thread_store.ThreadState, request: QueryRequest, query: str) -> Optional[str]:
+    """멀티 에이전트 워크플로우로 질문을 처리합니다. 실패하면 None (ReAct 에이전트로 폴백)"""
+    try:
+        # 멀티 에이전트 워크플로우 초기화 (필요시)
+        if state.workflow is None:
+            # 공유 MCP 클라이언트 가져오기
+            mcp_client = mcp_registry.get_client()
+            if not mcp_client:
+                # MCP 클라이언트가 없으면 기본 ReAct 에이전트로 폴백
+                raise RuntimeError("MCP 클라이언트가 초기화되지 않음")
+            
+            # LLM 모델 초기화
+            model_config = OUTPUT_TOKEN_INFO.get(request.model, OUTPUT_TOKEN_INFO["gpt-4o"])
+            llm_model = ChatOpenAI(
+                model=request.model,  # 선택한 모델 그대로 사용 (gpt-5, gpt-4o)
+                temperature=model_config["temperature"],
+                max_tokens=model_config["max_tokens"]
+            )
+            
+            state.workflow = MultiAgentWorkflow(
+                mcp_client=mcp_client,
+                model=llm_model
+            )
+            print(f"✨ [MULTI-AGENT] 멀티 에이전트 워크플로우 초기화 완료: {thread_id}")
+        
+        # 멀티 에이전트 워크플로우로 쿼리 처리
+        workflow_result = await state.workflow.execute(
+            user_query=query,
+            session_id=thread_id
+        )
+        
+        final_text = workflow_result.get("final_insight", "멀티 에이전트 분석 완료")
+        print(f"✨ [MULTI-AGENT] 멀티 에이전트 분석 완료: {len(final_text)} chars")
+        return final_text
+        
+    except Exception as e:
+        print(f"⚠️ [MULTI-AGENT] 멀티 에이전트 처리 실패, ReAct 에이전트로 폴백: {e}")
+        return None
+
+def _with_attachment_info(query: str, attachment_path: Optional[str]) -> str:
+    """업로드 시 파악한 CSV 구조가 있으면 에이전트 질문에 덧붙입니다 (에이전트가 파일을 다시 읽지 않도록)."""
+    meta = upload_store.load_meta(attachment_path) if attachment_path else None
+    if not meta or not meta.get("csv"):
+        return query
+    info = meta["csv"]
+    return (
+        f"{query}\n[첨부 파일 정보: CSV {info['row_count']:,}행, 인코딩 {info['encoding']}, "
+        f"구분자 {info['delimiter']!r}, 컬럼 {', '.join(info['columns'])}]"
+    )
+
+def _record_exchange(state: thread_store.ThreadState, query: str, attachment_path: Optional[str], answer: str):
+    """질문과 응답을 스레드 대화 기록에 추가합니다."""
+    state.history.append(
+        Message(
+            role="user", 
+            content=query,
+            attachment_path=attachment_path
+        )
+    )
+    state.history.append(
+        Message(
+            role="assistant", 
+            content=answer
+        )
+    )
+
+async def _query_agent(thread_id: str, state: thread_store.ThreadState, request: QueryRequest):
+    """스레드 상태를 잡은 채로 질문을 처리합니다."""
+    await _ensure_agent(thread_id, state, request.model)
+    
+    # 첨부 파일 경로 추출
+    attachment_path, attachment_error = _extract_attachment(request.query)
+    if attachment_error:
+        return {
+            "response": attachment_error,
+            "thread_id": thread_id
+        }
     
     try:
         # 대용량 파일이 포함된 경우 타임아웃 값 증가
-        timeout_value = request.timeout_seconds
-        if attachment_path and os.path.exists(attachment_path):
-            file_size = os.path.getsize(attachment_path)
-            # 파일 크기가 10MB를 초과하면 타임아웃 값 증가
-            if file_size > 10 * 1024 * 1024:
-                timeout_value = max(timeout_value, 300)  # 최소 300초
-                print(f"대용량 파일 감지: 타임아웃 값을 {timeout_value}초로 증가")
+        timeout_value = _timeout_for(request, attachment_path)
         
         # 백그라운드 작업 시작 로깅
         print(f"대화 처리 시작: 타임아웃={timeout_value}초, 재귀 제한={request.recursion_limit}")
         
+        # 업로드 시 파악한 첨부 CSV 구조를 에이전트 질문에 포함 (대화 기록에는 원래 질문 저장)
+        agent_query = _with_attachment_info(request.query, attachment_path)
+        
         # 질문 처리 - 멀티 에이전트 시스템 사용 여부에 따라 분기
+        final_text, final_tool = None, ""  # 멀티 에이전트는 도구 정보를 별도로 제공하지 않음
         if request.use_multi_agent and MULTI_AGENT_AVAILABLE:
-            try:
-                # 멀티 에이전트 워크플로우 초기화 (필요시)
-                if thread_id not in multi_agent_workflows:
-                    # MCP 클라이언트 가져오기
-                    mcp_client = mcp_clients.get(thread_id)
-                    if not mcp_client:
-                        # MCP 클라이언트가 없으면 기본 ReAct 에이전트로 폴백
-                        raise RuntimeError("MCP 클라이언트가 초기화되지 않음")
-                    
-                    # LLM 모델 초기화
-                    model_config = OUTPUT_TOKEN_INFO.get(request.model, OUTPUT_TOKEN_INFO["gpt-4o"])
-                    llm_model = ChatOpenAI(
-                        model=request.model,  # 선택한 모델 그대로 사용 (gpt-5, gpt-4o)
-                        temperature=model_config["temperature"],
-                        max_tokens=model_config["max_tokens"]
-                    )
-                    
-                    multi_agent_workflows[thread_id] = MultiAgentWorkflow(
-                        mcp_client=mcp_client,
-                        model=llm_model
-                    )
-                    print(f"✨ [MULTI-AGENT] 멀티 에이전트 워크플로우 초기화 완료: {thread_id}")
-                
-                # 멀티 에이전트 워크플로우로 쿼리 처리
-                workflow_result = await multi_agent_workflows[thread_id].execute(
-                    user_query=request.query,
-                    session_id=thread_id
-                )
-                
-                final_text = workflow_result.get("final_insight", "멀티 에이전트 분석 완료")
-                final_tool = ""  # 멀티 에이전트는 도구 정보를 별도로 제공하지 않음
-                
-                print(f"✨ [MULTI-AGENT] 멀티 에이전트 분석 완료: {len(final_text)} chars")
-                
-            except Exception as e:
-                print(f"⚠️ [MULTI-AGENT] 멀티 에이전트 처리 실패, ReAct 에이전트로 폴백: {e}")
-                # 기본 ReAct 에이전트로 폴백
-                _, final_text, final_tool = await process_query(
-                    thread_id, 
-                    request.query,
-                    timeout_seconds=timeout_value,
-                    recursion_limit=request.recursion_limit
-                )
+            final_text = await _run_multi_agent(thread_id, state, request, agent_query)
         else:
-            # 기본 ReAct 에이전트 사용
             print(f"🔧 [REACT] 기본 ReAct 에이전트 사용")
+        if final_text is None:
+            # 기본 ReAct 에이전트 사용 (멀티 에이전트 실패 시 폴백)
             _, final_text, final_tool = await process_query(
                 thread_id, 
-                request.query,
+                agent_query,
                 timeout_seconds=timeout_value,
                 recursion_limit=request.recursion_limit
             )
@@ -957,19 +1076,7 @@ async def query_agent(thread_id: str, request: QueryRequest, background_tasks: B
             print(f"final_tool 샘플: {final_tool[:200]}..." if len(final_tool) > 200 else final_tool)
         
         # 대화 기록에 추가
-        conversation_histories[thread_id].append(
-            Message(
-                role="user", 
-                content=request.query,
-                attachment_path=attachment_path
-            )
-        )
-        conversation_histories[thread_id].append(
-            Message(
-                role="assistant", 
-                content=final_text
-            )
-        )
+        _record_exchange(state, request.query, attachment_path, final_text)
         
         # 도구 정보가 있으면 해당 정보 반환
         tool_info = None
@@ -987,19 +1094,7 @@ async def query_agent(thread_id: str, request: QueryRequest, background_tasks: B
         print(f"오류: 타임아웃 발생 - {error_msg}")
         
         # 타임아웃 발생 시 대화 기록에 오류 메시지 추가
-        conversation_histories[thread_id].append(
-            Message(
-                role="user", 
-                content=request.query,
-                attachment_path=attachment_path
-            )
-        )
-        conversation_histories[thread_id].append(
-            Message(
-                role="assistant", 
-                content=error_msg
-            )
-        )
+        _record_exchange(state, request.query, attachment_path, error_msg)
         
         return QueryResponse(
             response=error_msg,
@@ -1011,25 +1106,165 @@ async def query_agent(thread_id: str, request: QueryRequest, background_tasks: B
         print(f"오류: {error_msg}")
         
         # 오류 발생 시 대화 기록에 오류 메시지 추가
-        conversation_histories[thread_id].append(
-            Message(
-                role="user", 
-                content=request.query,
-                attachment_path=attachment_path
-            )
-        )
-        conversation_histories[thread_id].append(
-            Message(
-                role="assistant", 
-                content=f"오류가 발생했습니다: {str(e)}"
-            )
-        )
+        _record_exchange(state, request.query, attachment_path, f"오류가 발생했습니다: {str(e)}")
         
         return QueryResponse(
             response=f"오류가 발생했습니다: {str(e)}",
             thread_id=thread_id
         )
 
+# SSE 스트리밍 설정
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "64"))  # 클라이언트가 느리면 이 개수만큼 쌓인 뒤 그래프 실행이 대기
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))  # 이벤트가 없을 때 연결 유지용 주석 전송 간격
+
+def _sse(event: str, data: dict) -> str:
+    """SSE 이벤트 한 개를 직렬화합니다."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def _stream_events(message: dict) -> List[tuple]:
+    """
+    astream_graph 콜백 메시지를 SSE 이벤트 목록으로 변환합니다.
+
+    Returns:
+        [(event, data)]: token(텍스트 조각), tool_call(도구 호출 조각), tool_result(도구 응답)
+    """
+    chunk = message.get("content", None)
+    events = []
+    if isinstance(chunk, AIMessageChunk):
+        content = chunk.content
+        if isinstance(content, str) and content:
+            events.append(("token", {"text": content}))
+        elif isinstance(content, list):
+            for item in content:
+                if isinstance(item, dict) and item.get("type") == "text" and item.get("text"):
+                    events.append(("token", {"text": item["text"]}))
+        # 도구 호출은 조각 단위로 전달 (같은 index의 args를 이어 붙이면 전체 인자)
+        for tool_call_chunk in chunk.tool_call_chunks or []:
+            events.append(("tool_call", {
+                "index": tool_call_chunk.get("index"),
+                "id": tool_call_chunk.get("id"),
+                "name": tool_call_chunk.get("name"),
+                "args": tool_call_chunk.get("args") or "",
+            }))
+    elif isinstance(chunk, ToolMessage):
+        events.append(("tool_result", {
+            "tool_call_id": chunk.tool_call_id,
+            "name": chunk.name,
+            "content": chunk.content if isinstance(chunk.content, str) else json.dumps(chunk.content, ensure_ascii=False, default=str),
+        }))
+    return events
+
+@app.post("/api/threads/{thread_id}/query/stream")
+async def stream_query_agent(thread_id: str, request: QueryRequest, http_request: Request):
+    """
+    에이전트 응답을 SSE(text/event-stream)로 스트리밍합니다.
+
+    이벤트:
+        token       {"text"}                         답변 텍스트 조각
+        tool_call   {"index", "id", "name", "args"}  도구 호출 조각 (args는 이어 붙이는 문자열)
+        tool_result {"tool_call_id", "name", "content"}
+        done        {"response", "tool_info", "thread_id"}  /query 응답과 같은 최종 결과
+        error       {"message"}
+
+    클라이언트가 이벤트를 읽는 속도보다 그래프가 빠르면 큐가 찰 때 그래프 실행이 대기하고,
+    클라이언트 연결이 끊기면 그래프 실행을 취소합니다.
+    """
+    print(f"[POST] /api/threads/{thread_id}/query/stream: {request.query}")
+    
+    # 응답을 시작하기 전에 에이전트 준비와 첨부 파일 확인 (오류는 HTTP 상태 코드로 반환)
+    async with thread_store.use(thread_id) as state:
+        await _ensure_agent(thread_id, state, request.model)
+    attachment_path, attachment_error = _extract_attachment(request.query)
+    timeout_value = _timeout_for(request, attachment_path)
+    agent_query = _with_attachment_info(request.query, attachment_path)
+    
+    async def event_stream():
+        if attachment_error:
+            yield _sse("done", {"response": attachment_error, "tool_info": None, "thread_id": thread_id})
+            return
+        
+        # 스트리밍하는 동안 스레드를 메모리에서 내리지 않음
+        async with thread_store.use(thread_id) as state:
+            # 응답 시작 전 사이에 스레드가 메모리에서 내려갔으면 에이전트를 다시 만듦
+            await _ensure_agent(thread_id, state, request.model)
+            
+            queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+            accumulator = StreamingResponse()  # /query 응답과 같은 최종 텍스트/도구 정보
+            
+            async def forward(message: dict):
+                accumulator.callback(message)
+                for event in _stream_events(message):
+                    # 큐가 가득 차면 클라이언트가 읽을 때까지 그래프 실행 대기 (backpressure)
+                    await queue.put(event)
+            
+            async def run():
+                try:
+                    final_text = None
+                    if request.use_multi_agent and MULTI_AGENT_AVAILABLE:
+                        # 멀티 에이전트는 토큰 스트리밍이 없으므로 최종 인사이트를 한 번에 전달
+                        final_text = await asyncio.wait_for(_run_multi_agent(thread_id, state, request, agent_query), timeout=timeout_value)
+                    if final_text is not None:
+                        accumulator.accumulated_text.append(final_text)
+                        await queue.put(("token", {"text": final_text}))
+                    else:
+                        await asyncio.wait_for(
+                            astream_graph(
+                                state.agent,
+                                {"messages": [HumanMessage(content=agent_query)]},
+                                callback=forward,
+                                config=RunnableConfig(
+                                    recursion_limit=request.recursion_limit,
+                                    thread_id=thread_id,
+                                ),
+                            ),
+                            timeout=timeout_value,
+                        )
+                except asyncio.TimeoutError:
+                    await queue.put(("error", {"message": f"요청 시간이 {timeout_value}초를 초과했습니다. 나중에 다시 시도해주세요."}))
+                except Exception as e:
+                    print(f"스트리밍 질문 처리 중 오류 발생: {str(e)}")
+                    await queue.put(("error", {"message": f"오류가 발생했습니다: {str(e)}"}))
+                finally:
+                    await queue.put(None)
+            
+            task = asyncio.create_task(run())
+            error_msg = None
+            try:
+                while True:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        if await http_request.is_disconnected():
+                            print(f"클라이언트 연결 종료 감지: {thread_id}")
+                            return
+                        yield ": ping\n\n"
+                        continue
+                    if item is None:
+                        break
+                    event, data = item
+                    if event == "error":
+                        error_msg = data["message"]
+                    yield _sse(event, data)
+                
+                final_text, final_tool = accumulator.get_results()
+                answer = error_msg or final_text
+                _record_exchange(state, request.query, attachment_path, answer)
+                yield _sse("done", {"response": answer, "tool_info": final_tool or None, "thread_id": thread_id})
+            finally:
+                # 클라이언트 연결이 끊겨 스트림이 닫힌 경우 그래프 실행 취소
+                if not task.done():
+                    print(f"⛔ 스트리밍 중단 - 그래프 실행 취소: {thread_id}")
+                    task.cancel()
+    
+    return HTTPStreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx 프록시 버퍼링 끄기
+        },
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""
+MCP Registry
+============
+
+채팅 스레드들이 함께 쓰는 프로세스 단위 MCP 세션/도구 레지스트리
+
+- config.json의 서버마다 stdio 세션을 한 번만 열어 두고, 모든 스레드가 같은 도구 목록을 공유
+  (스레드마다 MultiServerMCPClient를 만들면 대화마다 MCP 서버 프로세스가 새로 뜸)
+- 설정 내용(fingerprint)이 바뀌거나 세션이 끊긴 경우에만 세션을 닫고 다시 연결
+- 세션마다 전용 태스크가 열고 닫음 (stdio 세션은 연 태스크에서 닫아야 함)
+- 서버들은 병렬로 연결하고, 연결에 실패한 서버는 건너뛰고 나머지 도구로 동작
+- 도구 카탈로그(서버, 이름, 설명, 인자 스키마)를 설정 fingerprint별로 파일에 저장해
+  설정 화면은 MCP 서버를 띄우지 않고 바로 도구 정보를 보여줌 (재시작 후에도 유지)
+
+사용법:
+    tools = await mcp_registry.get_tools(config)   # 설정이 같으면 열린 세션의 도구를 그대로 반환
+    mcp_registry.generation                         # 세션을 다시 열 때마다 증가 (에이전트 재생성 판단용)
+    mcp_registry.catalog(config)                    # 저장된 도구 카탈로그 (없으면 None)
+    await mcp_registry.close()                      # 앱 종료 시
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+# 서버 하나의 세션 연결 + 도구 목록 조회 제한 시간 (초)
+MCP_SESSION_START_TIMEOUT = float(os.getenv("MCP_SESSION_START_TIMEOUT", "60"))
+MCP_TOOL_CATALOG_PATH = os.getenv(
+    "MCP_TOOL_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tool_catalog.json")
+)
+_CATALOG_KEEP = 8  # 파일에 남겨 둘 설정(fingerprint) 수
+
+_lock = asyncio.Lock()
+_fingerprint: Optional[str] = None
+_client: Optional[MultiServerMCPClient] = None
+_tools: List[Any] = []
+_tasks: Dict[str, asyncio.Task] = {}
+_stop: Optional[asyncio.Event] = None
+_catalogs: Optional[Dict[str, List[Dict[str, Any]]]] = None  # fingerprint -> 도구 카탈로그 (최근 순)
+
+# 세션을 다시 열 때마다 증가 - 이전 세션의 도구로 만든 에이전트를 다시 만들어야 하는지 판단
+generation = 0
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """MCP 서버 설정의 fingerprint (JSON 직렬화 후 sha256)"""
+    raw = json.dumps(config, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _describe(server: str, tool: Any) -> Dict[str, Any]:
+    """설정 화면에 보여줄 도구 정보"""
+    schema = tool.args_schema
+    if schema is not None and not isinstance(schema, dict):
+        schema = schema.model_json_schema()
+    return {
+        "server": server,
+        "name": tool.name,
+        "description": tool.description,
+        "args_schema": schema or {},
+    }
+
+
+def _load_catalogs() -> Dict[str, List[Dict[str, Any]]]:
+    global _catalogs
+    if _catalogs is None:
+        try:
+            with open(MCP_TOOL_CATALOG_PATH, "r", encoding="utf-8") as f:
+                _catalogs = json.load(f)
+        except (OSError, ValueError):
+            _catalogs = {}
+    return _catalogs
+
+
+def _save_catalog(fingerprint: str, entries: List[Dict[str, Any]]):
+    catalogs = _load_catalogs()
+    catalogs.pop(fingerprint, None)
+    catalogs[fingerprint] = entries
+    while len(catalogs) > _CATALOG_KEEP:
+        catalogs.pop(next(iter(catalogs)))
+    try:
+        os.makedirs(os.path.dirname(MCP_TOOL_CATALOG_PATH), exist_ok=True)
+        tmp = f"{MCP_TOOL_CATALOG_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(catalogs, f, ensure_ascii=False, default=str)
+        os.replace(tmp, MCP_TOOL_CATALOG_PATH)
+    except OSError as e:
+        print(f"⚠️ [MCP] 도구 카탈로그 저장 실패: {e}")
+
+
+def catalog(config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """설정에 해당하는 도구 카탈로그 - 한 번이라도 연결한 적 없는 설정이면 None"""
+    return _load_catalogs().get(config_fingerprint(config))
+
+
+async def _hold_session(
+    client: MultiServerMCPClient,
+    name: str,
+    ready: asyncio.Future,
+    stop: asyncio.Event,
+):
+    """서버 세션을 열어 도구를 전달하고, 종료 신호가 올 때까지 세션 유지"""
+    try:
+        async with client.session(name) as session:
+            tools = await load_mcp_tools(session)
+            ready.set_result(tools)
+            await stop.wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        elif not stop.is_set():
+            # 서버 프로세스가 죽은 경우 - 다음 요청에서 다시 연결
+            print(f"⚠️ [MCP] {name} 세션이 끊어졌습니다: {e}")
+
+
+def _alive() -> bool:
+    return bool(_tasks) and not any(task.done() for task in _tasks.values())
+
+
+async def _open(config: Dict[str, Any], fingerprint: str):
+    global _fingerprint, _client, _tools, _tasks, _stop, generation
+
+    loop = asyncio.get_running_loop()
+    client = MultiServerMCPClient(config)
+    stop = asyncio.Event()
+    ready = {name: loop.create_future() for name in config}
+    tasks = {
+        name: asyncio.create_task(_hold_session(client, name, ready[name], stop), name=f"mcp-session-{name}")
+        for name in config
+    }
+
+    tools: List[Any] = []
+    entries: List[Dict[str, Any]] = []
+    for name, future in ready.items():
+        try:
+            server_tools = await asyncio.wait_for(asyncio.shield(future), timeout=MCP_SESSION_START_TIMEOUT)
+        except Exception as e:
+            print(f"❌ [MCP] {name} 서버 연결 실패: {e}")
+            tasks.pop(name).cancel()
+            continue
+        print(f"🔌 [MCP] {name}: 도구 {len(server_tools)}개")
+        tools.extend(server_tools)
+        entries.extend(_describe(name, tool) for tool in server_tools)
+
+    if not tasks:
+        raise RuntimeError("연결된 MCP 서버가 없습니다")
+    _save_catalog(fingerprint, entries)
+
+    _fingerprint, _client, _tools, _tasks, _stop = fingerprint, client, tools, tasks, stop
+    generation += 1
+
+
+async def _close():
+    global _fingerprint, _client, _tools, _tasks, _stop
+
+    if _stop is not None:
+        _stop.set()
+    if _tasks:
+        await asyncio.gather(*_tasks.values(), return_exceptions=True)
+    _fingerprint, _client, _tools, _tasks, _stop = None, None, [], {}, None
+
+
+async def get_tools(config: Dict[str, Any]) -> List[Any]:
+    """
+    공유 MCP 세션의 도구 목록
+
+    설정이 마지막으로 연결한 설정과 같고 세션이 살아 있으면 그대로 반환하고,
+    다르면 기존 세션을 닫고 새 설정으로 다시 연결합니다.
+    """
+    fingerprint = config_fingerprint(config)
+    if fingerprint == _fingerprint and _alive():
+        return _tools
+
+    async with _lock:
+        if fingerprint != _fingerprint or not _alive():
+            if _fingerprint is not None:
+                print("🔄 [MCP] 설정 변경 또는 세션 종료 감지 - MCP 세션을 다시 엽니다")
+            await _close()
+            await _open(config, fingerprint)
+    return _tools
+
+
+def get_client() -> Optional[MultiServerMCPClient]:
+    """공유 MCP 클라이언트 (아직 연결 전이면 None)"""
+    return _client
+
+
+async def close():
+    """모든 MCP 세션 종료 (앱 종료 시)"""
+    async with _lock:
+        await _close()
@@ -0,0 +1,294 @@
+"""
+Thread Store
+============
+
+채팅 스레드별 상태(에이전트, 대화 기록, 모델, 멀티 에이전트 워크플로우) 저장소
+
+- 메모리에는 최근 사용한 스레드만 유지 (LRU, 최대 THREAD_STORE_MAX_LIVE개)
+  THREAD_STORE_IDLE_TTL 동안 사용하지 않은 스레드도 메모리에서 내림
+- 내린 스레드의 대화 기록은 SQLite(THREAD_STORE_DB)에 저장하고, 다음 요청에서 다시 불러옴
+  (에이전트는 다음 질문에서 다시 만들어짐)
+- 에이전트 대화 상태(checkpoint)는 모든 스레드가 공유하는 checkpointer에 thread_id로 저장
+  langgraph-checkpoint-sqlite가 있으면 같은 SQLite 파일에 저장해 메모리에 쌓이지 않음
+  (없으면 MemorySaver 사용 - 대화 기록만 디스크로 내려가고 checkpoint는 메모리에 남음)
+- 마지막 사용 후 THREAD_STORE_RETENTION_DAYS가 지난 스레드는 디스크에서도 삭제
+- SQLite 읽기/쓰기는 스레드 풀에서 실행해 이벤트 루프(진행 중인 SSE 스트림)를 막지 않음
+
+사용법:
+    await thread_store.setup()                # 앱 시작 시
+    async with thread_store.use(thread_id) as state:    # 요청 처리 중에는 메모리에서 내리지 않음
+        state.history.append(...)
+    await thread_store.close()                # 앱 종료 시 (메모리의 스레드를 디스크에 저장)
+"""
+
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from langgraph.checkpoint.memory import MemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    SQLITE_CHECKPOINT_AVAILABLE = True
+except ImportError:
+    SQLITE_CHECKPOINT_AVAILABLE = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+THREAD_STORE_DB = os.getenv("THREAD_STORE_DB", os.path.join(BASE_DIR, "data", "threads.sqlite"))
+THREAD_STORE_MAX_LIVE = int(os.getenv("THREAD_STORE_MAX_LIVE", "200"))
+THREAD_STORE_IDLE_TTL = float(os.getenv("THREAD_STORE_IDLE_TTL", "1800"))
+THREAD_STORE_RETENTION_DAYS = float(os.getenv("THREAD_STORE_RETENTION_DAYS", "30"))
+
+
+@dataclass
+class ThreadState:
+    """메모리에 올라와 있는 스레드 하나의 상태"""
+    history: List[Any] = field(default_factory=list)  # 화면에 보여줄 대화 기록 (Message 또는 dict)
+    model: Optional[str] = None
+    agent: Any = None  # ReAct 에이전트 (메모리에서 내리면 다음 질문에서 다시 생성)
+    generation: int = -1  # 에이전트를 만들 때 사용한 MCP 세션 세대
+    workflow: Any = None  # 멀티 에이전트 워크플로우
+    last_used: float = field(default_factory=time.monotonic)
+    active: int = 0  # 처리 중인 요청 수 (0보다 크면 메모리에서 내리지 않음)
+
+
+_threads: "OrderedDict[str, ThreadState]" = OrderedDict()
+# 디스크로 내리는 중인 스레드 (저장이 끝나기 전에 요청이 오면 디스크 대신 이 상태를 다시 올림)
+_spilling: Dict[str, ThreadState] = {}
+_lock = threading.Lock()
+# 스레드 기록 저장/삭제 순서 보장 (삭제한 스레드를 늦게 끝난 저장이 되살리지 않도록)
+_disk_lock = threading.Lock()
+_exit_stack: Optional[AsyncExitStack] = None
+
+# 모든 스레드가 공유하는 에이전트 checkpointer (setup() 이후 SQLite로 교체)
+checkpointer: Any = MemorySaver()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(THREAD_STORE_DB, timeout=30)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS thread_history (
+            thread_id TEXT PRIMARY KEY,
+            model TEXT,
+            history TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def _dump_message(message: Any) -> Dict[str, Any]:
+    return message.model_dump() if hasattr(message, "model_dump") else dict(message)
+
+
+def _spill(snapshots: List[Tuple[str, ThreadState, Optional[str], List[Any]]]):
+    """스레드 대화 기록을 디스크에 저장 (스레드 풀에서 실행)
+
+    snapshots: (thread_id, 상태, 모델, 대화 기록 복사본). 저장 전에 삭제된 스레드는 건너뜀
+    """
+    rows = [
+        (thread_id, model, json.dumps([_dump_message(m) for m in history], ensure_ascii=False), time.time())
+        for thread_id, _, model, history in snapshots
+    ]
+    with _disk_lock:
+        with _lock:
+            rows = [row for row, (thread_id, state, _, _) in zip(rows, snapshots) if _spilling.get(thread_id) is state]
+        if not rows:
+            return
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO thread_history (thread_id, model, history, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        conn.close()
+
+
+async def _spill_async(evicted: List[Tuple[str, ThreadState]]):
+    """evicted 스레드를 _spilling에 올려 둔 상태에서 스레드 풀로 저장하고 _spilling에서 제거"""
+    # 대화 기록은 이벤트 루프에서 복사해 두고 직렬화/쓰기만 스레드 풀에서 실행
+    snapshots = [(thread_id, state, state.model, list(state.history)) for thread_id, state in evicted]
+    try:
+        await asyncio.to_thread(_spill, snapshots)
+    finally:
+        with _lock:
+            for thread_id, state in evicted:
+                if _spilling.get(thread_id) is state:
+                    del _spilling[thread_id]
+
+
+def _rehydrate(thread_id: str) -> Optional[ThreadState]:
+    """디스크에 저장된 스레드를 메모리 상태로 복원 (없으면 None)"""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT model, history FROM thread_history WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    print(f"💾 [THREAD] 디스크에서 스레드 복원: {thread_id}")
+    return ThreadState(history=json.loads(row[1]), model=row[0])
+
+
+async def evict() -> int:
+    """유휴 시간이 지났거나 최대 개수를 넘는 스레드를 디스크로 내림 -> 내린 스레드 수"""
+    now = time.monotonic()
+    evicted = []
+    with _lock:
+        for thread_id, state in list(_threads.items()):
+            over_capacity = len(_threads) > THREAD_STORE_MAX_LIVE
+            idle = now - state.last_used > THREAD_STORE_IDLE_TTL
+            if not over_capacity and not idle:
+                break
+            if state.active:
+                continue
+            _spilling[thread_id] = _threads.pop(thread_id)
+            evicted.append((thread_id, _spilling[thread_id]))
+
+    if evicted:
+        await _spill_async(evicted)
+        print(f"🧹 [THREAD] 스레드 {len(evicted)}개를 디스크로 내림 (메모리 {len(_threads)}개)")
+    return len(evicted)
+
+
+async def create(thread_id: str) -> ThreadState:
+    """새 스레드 등록"""
+    with _lock:
+        state = _threads[thread_id] = ThreadState()
+    await evict()
+    return state
+
+
+def _get_live(thread_id: str) -> Optional[ThreadState]:
+    """메모리(또는 디스크로 내리는 중)의 스레드 상태 (_lock을 잡은 상태에서 호출)"""
+    state = _threads.get(thread_id)
+    if state is None:
+        state = _spilling.get(thread_id)
+        if state is None:
+            return None
+        _threads[thread_id] = state
+    _threads.move_to_end(thread_id)
+    state.last_used = time.monotonic()
+    return state
+
+
+async def get(thread_id: str) -> Optional[ThreadState]:
+    """메모리 또는 디스크의 스레드 상태 (없으면 None)"""
+    with _lock:
+        state = _get_live(thread_id)
+    if state is not None:
+        return state
+
+    state = await asyncio.to_thread(_rehydrate, thread_id)
+    if state is None:
+        return None
+    with _lock:
+        # 복원하는 사이 다른 요청이 먼저 올렸으면 그 상태 사용
+        state = _get_live(thread_id) or _threads.setdefault(thread_id, state)
+        _threads.move_to_end(thread_id)
+    await evict()
+    return state
+
+
+@asynccontextmanager
+async def use(thread_id: str) -> AsyncIterator[ThreadState]:
+    """요청 처리 동안 스레드 상태 사용 (없으면 새로 만들고, 처리 중에는 메모리에서 내리지 않음)"""
+    state = await get(thread_id) or await create(thread_id)
+    state.active += 1
+    try:
+        yield state
+    finally:
+        state.active -= 1
+        state.last_used = time.monotonic()
+
+
+def _delete_row(thread_id: str) -> bool:
+    with _disk_lock:
+        with _connect() as conn:
+            deleted = conn.execute("DELETE FROM thread_history WHERE thread_id = ?", (thread_id,)).rowcount > 0
+        conn.close()
+    return deleted
+
+
+async def delete(thread_id: str) -> bool:
+    """스레드를 메모리, 디스크, checkpointer에서 삭제 -> 스레드가 있었는지 여부"""
+    with _lock:
+        existed = _threads.pop(thread_id, None) is not None
+        existed = _spilling.pop(thread_id, None) is not None or existed
+    existed = await asyncio.to_thread(_delete_row, thread_id) or existed
+    if hasattr(checkpointer, "adelete_thread"):
+        await checkpointer.adelete_thread(thread_id)
+    return existed
+
+
+async def sweep(interval: float = 60):
+    """트래픽이 없어도 유휴 스레드를 내리도록 주기적으로 evict() 실행 (백그라운드 태스크)"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await evict()
+        except Exception as e:
+            print(f"⚠️ [THREAD] 스레드 정리 오류: {e}")
+
+
+def _expired_threads(cutoff: float) -> List[str]:
+    conn = _connect()
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT thread_id FROM thread_history WHERE updated_at < ?", (cutoff,)
+        )]
+    finally:
+        conn.close()
+
+
+async def purge() -> int:
+    """보관 기간이 지난 스레드를 디스크에서 삭제 -> 삭제한 스레드 수"""
+    cutoff = time.time() - THREAD_STORE_RETENTION_DAYS * 86400
+    expired = await asyncio.to_thread(_expired_threads, cutoff)
+    for thread_id in expired:
+        await delete(thread_id)
+    if expired:
+        print(f"🗑️ [THREAD] 보관 기간이 지난 스레드 {len(expired)}개 삭제")
+    return len(expired)
+
+
+async def setup():
+    """디스크 저장소와 공유 checkpointer 준비 (앱 시작 시)"""
+    global checkpointer, _exit_stack
+
+    os.makedirs(os.path.dirname(THREAD_STORE_DB), exist_ok=True)
+    _connect().close()
+
+    if SQLITE_CHECKPOINT_AVAILABLE:
+        _exit_stack = AsyncExitStack()
+        checkpointer = await _exit_stack.enter_async_context(AsyncSqliteSaver.from_conn_string(THREAD_STORE_DB))
+        print(f"💾 [THREAD] 에이전트 대화 상태를 SQLite에 저장: {THREAD_STORE_DB}")
+    else:
+        print("⚠️ [THREAD] langgraph-checkpoint-sqlite 패키지가 없어 에이전트 대화 상태는 메모리에 유지합니다.")
+    await purge()
+
+
+async def close():
+    """메모리의 스레드를 디스크에 저장하고 checkpointer 종료 (앱 종료 시)"""
+    global _exit_stack
+
+    with _lock:
+        live = list(_threads.items())
+        _threads.clear()
+        _spilling.update(live)
+    if live:
+        await _spill_async(live)
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+        _exit_stack = None
@@ -0,0 +1,163 @@
+"""
+Upload Store
+============
+
+업로드 파일을 내용 해시(sha256)로 한 번만 저장하고, CSV는 업로드 시점에 구조를 미리 파악해 두는 저장소
+
+- 업로드 본문을 청크 단위로 읽어 임시 파일에 쓰면서 sha256과 크기를 계산 (파일 I/O는 executor에서 실행)
+  UPLOAD_MAX_BYTES를 넘으면 중단하고 UploadTooLarge 발생
+- 저장 파일명은 "{sha256 앞 32자리}{확장자}" - 같은 내용을 다시 올리면 기존 파일을 그대로 사용
+- CSV는 인코딩/구분자/컬럼/행 수/앞부분 샘플을 "{파일}.meta.json" 사이드카에 저장
+  백엔드(첨부 파일 안내, 타임아웃 계산)와 MCP 도구(create_report_from_csv)가 파일을 다시 읽지 않고 사용
+
+사용법:
+    meta = await upload_store.save_upload(file, ABSOLUTE_UPLOAD_DIR)
+    meta = upload_store.load_meta(file_path)    # 사이드카가 없으면 None
+"""
+
+import os
+import csv
+import json
+import uuid
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(300 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+CSV_SNIFF_BYTES = 64 * 1024  # 인코딩/구분자 판별에 사용할 앞부분 크기
+CSV_SAMPLE_ROWS = 5
+CSV_ENCODINGS = ("utf-8-sig", "cp949")  # 판별 순서 (엑셀에서 저장한 한글 CSV는 cp949인 경우가 많음)
+
+META_SUFFIX = ".meta.json"
+
+
+class UploadTooLarge(ValueError):
+    """업로드 파일이 UPLOAD_MAX_BYTES를 넘는 경우"""
+
+
+def meta_path(file_path: str) -> str:
+    return file_path + META_SUFFIX
+
+
+def load_meta(file_path: str) -> Optional[Dict[str, Any]]:
+    """업로드 파일의 사이드카 메타데이터 (없거나 읽을 수 없으면 None)"""
+    try:
+        with open(meta_path(file_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _detect_encoding(head: bytes) -> str:
+    for encoding in CSV_ENCODINGS:
+        try:
+            head.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            # 잘린 멀티바이트 문자 때문에 끝에서 실패한 경우는 해당 인코딩으로 판단
+            if e.start >= len(head) - 3:
+                return encoding
+    return "latin-1"
+
+
+def sniff_csv(file_path: str) -> Dict[str, Any]:
+    """CSV 인코딩, 구분자, 컬럼, 행 수(헤더 제외), 앞부분 샘플 (파일 전체를 한 번 읽음)"""
+    with open(file_path, "rb") as f:
+        head = f.read(CSV_SNIFF_BYTES)
+    encoding = _detect_encoding(head)
+
+    sample_text = head.decode(encoding, errors="ignore")
+    try:
+        delimiter = csv.Sniffer().sniff(sample_text, delimiters=",\t;|").delimiter
+    except csv.Error:
+        delimiter = ","
+
+    columns: List[str] = []
+    sample: List[Dict[str, str]] = []
+    row_count = 0
+    with open(file_path, "r", encoding=encoding, errors="replace", newline="") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        columns = next(reader, [])
+        for row in reader:
+            if not row:
+                continue
+            if row_count < CSV_SAMPLE_ROWS:
+                sample.append(dict(zip(columns, row)))
+            row_count += 1
+
+    return {
+        "encoding": encoding,
+        "delimiter": delimiter,
+        "columns": columns,
+        "row_count": row_count,
+        "sample": sample,
+    }
+
+
+def _finalize(tmp_path: str, upload_dir: str, extension: str, sha256: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    """임시 파일을 내용 해시 파일명으로 옮기고 사이드카 작성 (같은 내용이 있으면 기존 파일 사용)"""
+    file_path = os.path.join(upload_dir, f"{sha256[:32]}{extension}")
+    existing = load_meta(file_path) if os.path.exists(file_path) else None
+    if existing is not None:
+        os.remove(tmp_path)
+        print(f"♻️ 같은 내용의 업로드 파일이 이미 있음: {file_path}")
+        return dict(existing, file_path=file_path, original_name=meta["original_name"], deduplicated=True)
+
+    os.replace(tmp_path, file_path)
+    meta = dict(meta, file_path=file_path, sha256=sha256)
+    if extension.lower() in (".csv", ".tsv"):
+        try:
+            meta["csv"] = sniff_csv(file_path)
+        except Exception as e:
+            print(f"⚠️ CSV 구조 파악 실패: {e}")
+
+    tmp_meta = meta_path(file_path) + f".{uuid.uuid4().hex}.tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_meta, meta_path(file_path))
+    return dict(meta, deduplicated=False)
+
+
+async def save_upload(upload: Any, upload_dir: str) -> Dict[str, Any]:
+    """
+    업로드 파일(FastAPI UploadFile)을 청크 단위로 저장
+
+    Returns:
+        메타데이터 dict (file_path, original_name, size, sha256, deduplicated, CSV면 csv)
+
+    Raises:
+        UploadTooLarge: UPLOAD_MAX_BYTES 초과
+    """
+    if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"파일 크기 {upload.size:,} bytes가 제한({UPLOAD_MAX_BYTES:,} bytes)을 넘습니다.")
+
+    loop = asyncio.get_running_loop()
+    extension = os.path.splitext(upload.filename)[1] if upload.filename else ""
+    tmp_path = os.path.join(upload_dir, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+
+    f = await loop.run_in_executor(None, open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(f"파일 크기가 제한({UPLOAD_MAX_BYTES:,} bytes)을 넘습니다.")
+            digest.update(chunk)
+            await loop.run_in_executor(None, f.write, chunk)
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    await loop.run_in_executor(None, f.close)
+
+    meta = {
+        "original_name": upload.filename,
+        "content_type": upload.content_type,
+        "size": size,
+    }
+    return await loop.run_in_executor(None, _finalize, tmp_path, upload_dir, extension, digest.hexdigest(), meta)
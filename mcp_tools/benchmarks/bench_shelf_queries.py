@@ -0,0 +1,211 @@
+"""
+Shelf Query Benchmark
+=====================
+
+진열대 분석 쿼리(get_shelf_analysis_flexible, pickup_gaze_summary)의 개편 전/후 비교 벤치마크
+
+합성 데이터(customer_behavior_event / customer_behavior_area / zone)를 별도 데이터베이스에 만들고
+두 버전의 쿼리를 번갈아 실행한 뒤 system.query_log에서 실행 시간, 최대 메모리, 읽은 행 수를 비교합니다.
+결과가 같은지도 함께 확인합니다.
+
+사용법 (.env의 CLICKHOUSE_* / SSH_* 설정 사용):
+    python benchmarks/bench_shelf_queries.py --persons 200000 --repeat 5
+    python benchmarks/bench_shelf_queries.py --keep          # 합성 데이터베이스를 지우지 않음
+"""
+
+import os
+import sys
+import uuid
+import argparse
+import statistics
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_manager import get_env_client
+from query_templates import QueryTemplate
+from mcp_shelf import SHELF_ANALYSIS_QUERY, PICKUP_GAZE_SUMMARY_QUERY
+from benchmarks.legacy_shelf_queries import LEGACY_SHELF_ANALYSIS_QUERY, LEGACY_PICKUP_GAZE_SUMMARY_QUERY
+
+ZONE_NAMES = [
+    "빵", "우유", "라면", "과자", "음료", "커피", "아이스크림", "도시락", "삼각김밥", "샌드위치",
+    "주류", "생활용품", "냉동식품", "즉석식품", "디저트", "껌/사탕", "시리얼", "요거트", "과일", "계산대",
+]
+
+START_DATE = "2025-06-01"
+
+SETUP_SQL = [
+    "CREATE TABLE zone (id UInt32, name String, coords Array(Tuple(Float64, Float64))) ENGINE = MergeTree ORDER BY id",
+    "CREATE TABLE customer_behavior_area (id UInt32, attention_target_zone_id UInt32) ENGINE = MergeTree ORDER BY id",
+    """
+    CREATE TABLE customer_behavior_event
+    (
+        person_seq UInt64,
+        customer_behavior_area_id UInt32,
+        `timestamp` DateTime,
+        date Date,
+        event_type UInt8,
+        is_staff Nullable(UInt8),
+        age Nullable(Int32),
+        gender Nullable(Int8)
+    )
+    ENGINE = MergeTree
+    PARTITION BY toYYYYMM(date)
+    ORDER BY (date, person_seq)
+    """,
+]
+
+
+def _populate_sql(persons: int, events_per_person: int, days: int, areas: int) -> List[str]:
+    """결정적인 합성 데이터 생성 SQL (고객마다 8개 안팎의 구역을 반복 방문해 3회 이상 응시가 생기도록)"""
+    zone_values = ", ".join(
+        f"({i + 1}, '{name}', [({i * 10.0}, 0.0), ({i * 10.0 + 5}, 5.0)])" for i, name in enumerate(ZONE_NAMES)
+    )
+    persons_per_day = max(1, persons // days)
+    return [
+        f"INSERT INTO zone VALUES {zone_values}",
+        f"""
+        INSERT INTO customer_behavior_area
+        SELECT number + 1, (number % {len(ZONE_NAMES)}) + 1 FROM numbers({areas})
+        """,
+        f"""
+        INSERT INTO customer_behavior_event
+        SELECT
+            intDiv(number, {events_per_person}) + 1                                       AS person_seq,
+            (cityHash64(person_seq, number % 8) % {areas}) + 1                              AS customer_behavior_area_id,
+            toDateTime('{START_DATE} 08:00:00')
+                + intDiv(person_seq - 1, {persons_per_day}) * 86400
+                + (cityHash64(person_seq) % 43200)
+                + (number % {events_per_person}) * 7                                        AS `timestamp`,
+            toDate(`timestamp`)                                                             AS date,
+            if(cityHash64(number, 2) % 4 = 0, 1, 0)                                         AS event_type,
+            if(cityHash64(person_seq, 5) % 50 = 0, NULL, 0)                                 AS is_staff,
+            toInt32(5 + cityHash64(person_seq, 3) % 65)                                     AS age,
+            toInt8(cityHash64(person_seq, 4) % 2)                                           AS gender
+        FROM numbers({persons * events_per_person})
+        """,
+    ]
+
+
+def _run(client: Any, template: QueryTemplate, params: Dict[str, Any]) -> Tuple[str, List[Tuple]]:
+    query_id = f"bench-{template.name}-{uuid.uuid4().hex[:12]}"
+    result = client.query(
+        template.sql,
+        parameters=template.bind(**params),
+        settings={"query_id": query_id, "use_query_cache": 0},
+    )
+    return query_id, [tuple(row) for row in result.result_rows]
+
+
+def _query_log(client: Any, query_ids: List[str]) -> Dict[str, Tuple[int, int, int]]:
+    """query_id -> (실행 시간 ms, 최대 메모리 bytes, 읽은 행 수)"""
+    client.command("SYSTEM FLUSH LOGS")
+    result = client.query(
+        """
+        SELECT query_id, query_duration_ms, memory_usage, read_rows
+        FROM system.query_log
+        WHERE type = 'QueryFinish' AND has({ids:Array(String)}, query_id)
+        """,
+        parameters={"ids": query_ids},
+    )
+    return {row[0]: (row[1], row[2], row[3]) for row in result.result_rows}
+
+
+def _summarize(label: str, stats: List[Tuple[int, int, int]]) -> str:
+    durations = [s[0] for s in stats]
+    memories = [s[1] for s in stats]
+    return (
+        f"{label:<34} median {statistics.median(durations):>8.0f} ms   "
+        f"max mem {max(memories) / 1024 / 1024:>9.1f} MiB   read {stats[0][2]:>12,} rows"
+    )
+
+
+def _comparable_analysis(rows: List[Tuple], legacy: bool) -> Counter:
+    """같은 비율의 진열대는 순위가 정해지지 않으므로 (전/후, 순위, 비율)로 비교"""
+    if legacy:
+        return Counter((row[0].lower(), row[1], row[3]) for row in rows)
+    return Counter((row[0].lower(), row[2], row[4]) for row in rows if row[1] == 1)
+
+
+def run_benchmark(client: Any, repeat: int, params: Dict[str, Any]) -> List[str]:
+    cases = [
+        ("shelf_analysis (legacy)", LEGACY_SHELF_ANALYSIS_QUERY,
+         {k: v for k, v in params.items() if k not in ("depth", "top_n")}),
+        ("shelf_analysis (depth=1)", SHELF_ANALYSIS_QUERY, dict(params, depth=1)),
+        ("shelf_analysis (depth=5)", SHELF_ANALYSIS_QUERY, dict(params, depth=5)),
+        ("pickup_gaze_summary (legacy)", LEGACY_PICKUP_GAZE_SUMMARY_QUERY,
+         {k: params[k] for k in ("start_date", "end_date", "exclude_dates")}),
+        ("pickup_gaze_summary (new)", PICKUP_GAZE_SUMMARY_QUERY,
+         {k: params[k] for k in ("start_date", "end_date", "exclude_dates")}),
+    ]
+
+    query_ids: Dict[str, List[str]] = {label: [] for label, _, _ in cases}
+    outputs: Dict[str, List[Tuple]] = {}
+    # 캐시 영향을 줄이기 위해 한 번씩 워밍업 후 번갈아 실행
+    for label, template, case_params in cases:
+        _, outputs[label] = _run(client, template, case_params)
+    for _ in range(repeat):
+        for label, template, case_params in cases:
+            query_id, _ = _run(client, template, case_params)
+            query_ids[label].append(query_id)
+
+    log = _query_log(client, [qid for ids in query_ids.values() for qid in ids])
+    lines = [_summarize(label, [log[qid] for qid in ids if qid in log]) for label, ids in query_ids.items()]
+
+    same_analysis = (
+        _comparable_analysis(outputs["shelf_analysis (legacy)"], legacy=True)
+        == _comparable_analysis(outputs["shelf_analysis (depth=1)"], legacy=False)
+    )
+    legacy_summary = {(r[0], r[1]): (round(r[2], 6), round(r[3], 6)) for r in outputs["pickup_gaze_summary (legacy)"]}
+    new_summary = {(r[0], r[1]): (round(r[2], 6), round(r[3], 6)) for r in outputs["pickup_gaze_summary (new)"]}
+    lines.append("")
+    lines.append(f"shelf_analysis 결과 일치 (depth=1): {'✅' if same_analysis else '❌'}")
+    lines.append(f"pickup_gaze_summary 결과 일치: {'✅' if legacy_summary == new_summary else '❌'}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="진열대 분석 쿼리 개편 전/후 벤치마크")
+    parser.add_argument("--database", default="bench_shelf_queries", help="합성 데이터를 만들 데이터베이스")
+    parser.add_argument("--persons", type=int, default=200000, help="합성 고객 수")
+    parser.add_argument("--events-per-person", type=int, default=40, help="고객당 이벤트 수")
+    parser.add_argument("--days", type=int, default=30, help="기간 (일, 최대 30)")
+    parser.add_argument("--areas", type=int, default=60, help="행동 영역 수")
+    parser.add_argument("--repeat", type=int, default=5, help="쿼리별 반복 횟수")
+    parser.add_argument("--keep", action="store_true", help="벤치마크 후 데이터베이스를 지우지 않음")
+    args = parser.parse_args()
+    args.days = max(1, min(args.days, 30))
+
+    admin = get_env_client("default")
+    if admin is None:
+        print("❌ ClickHouse 연결 실패 (.env 확인)")
+        sys.exit(1)
+
+    admin.command(f"DROP DATABASE IF EXISTS {args.database}")
+    admin.command(f"CREATE DATABASE {args.database}")
+    try:
+        client = get_env_client(args.database)
+        for sql in SETUP_SQL + _populate_sql(args.persons, args.events_per_person, args.days, args.areas):
+            client.command(sql)
+        print(f"📦 합성 데이터: 고객 {args.persons:,}명, 이벤트 {args.persons * args.events_per_person:,}건, {args.days}일")
+
+        params = {
+            "start_date": START_DATE,
+            "end_date": f"{START_DATE[:8]}{args.days:02d}",
+            "exclude_dates": [],
+            "target_shelves": ["빵"],
+            "age_groups": [],
+            "gender_labels": [],
+            "exclude_shelves": [],
+            "top_n": 5,
+        }
+        for line in run_benchmark(client, args.repeat, params):
+            print(line)
+    finally:
+        if not args.keep:
+            admin.command(f"DROP DATABASE IF EXISTS {args.database}")
+
+
+if __name__ == "__main__":
+    main()
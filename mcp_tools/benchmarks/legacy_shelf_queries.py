@@ -0,0 +1,934 @@
+"""
+Legacy Shelf Queries
+====================
+
+진열대 분석 쿼리 개편 전 버전 (벤치마크 비교용)
+
+integrated_routes CTE에서 고객별 arraySort(groupArray(...))를 컬럼마다 다시 계산하고
+픽업 직전/직후 응시 매대를 1~5번째 컬럼으로 고정해 두었던 쿼리입니다.
+도구에서는 사용하지 않으며 bench_shelf_queries.py에서만 import 합니다.
+"""
+
+from query_templates import QueryTemplate
+
+# 고객별 첫 픽업 전후 응시 진열대 분석 쿼리 (초기에 조건 필터링 하지 않고 pivot에서 필터링)
+LEGACY_SHELF_ANALYSIS_QUERY = QueryTemplate("bench.legacy_shelf_analysis", """
+    WITH pickup_visit_counts AS (
+        SELECT
+            cbe.person_seq AS person_seq,
+            cba.attention_target_zone_id AS attention_target_zone_id,
+            z.name AS zone_name,
+            z.coords AS coords,
+            MIN(cbe.`timestamp`) AS first_event_date,
+            cbe.age AS age,
+            cbe.gender AS gender,
+            COUNT(*) AS visit_count
+        FROM customer_behavior_event cbe
+        LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+        LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+        WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+            AND NOT has({exclude_dates:Array(String)}, toString(cbe.date))
+            AND cbe.event_type = 1  -- 픽업
+            AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+            AND z.name IS NOT NULL
+            -- 초기 필터링 제거: age_condition, gender_condition, target_shelf_condition
+        GROUP BY
+            cbe.person_seq,
+            cbe.age,
+            cbe.gender,
+            cba.attention_target_zone_id,
+            z.name,
+            z.coords
+    ),
+    gaze_visit_counts AS (
+        SELECT
+            cbe.person_seq AS person_seq,
+            cba.attention_target_zone_id AS attention_target_zone_id,
+            z.name AS zone_name,
+            z.coords AS coords,
+            MIN(cbe.`timestamp`) AS first_event_date,
+            cbe.age AS age,
+            cbe.gender AS gender,
+            COUNT(*) AS visit_count
+        FROM customer_behavior_event cbe
+        LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+        LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+        WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+            AND NOT has({exclude_dates:Array(String)}, toString(cbe.date))
+            AND cbe.event_type = 0  -- 응시
+            AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+            AND z.name IS NOT NULL
+            -- 초기 필터링 제거: age_condition, gender_condition
+        GROUP BY
+            cbe.person_seq,
+            cbe.age,
+            cbe.gender,
+            cba.attention_target_zone_id,
+            z.name,
+            z.coords
+    ),
+    pickup_df AS (
+        SELECT
+            person_seq,
+            attention_target_zone_id,
+            zone_name,
+            coords,
+            first_event_date,
+            age,
+            gender,
+            visit_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY person_seq
+                ORDER BY first_event_date
+            ) AS pickup_order
+        FROM pickup_visit_counts
+    ),
+    gaze_df AS (
+        SELECT
+            person_seq,
+            attention_target_zone_id,
+            zone_name,
+            coords,
+            first_event_date,
+            age,
+            gender,
+            visit_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY person_seq
+                ORDER BY first_event_date
+            ) AS gaze_order
+        FROM gaze_visit_counts
+        WHERE visit_count >= 3
+    ),
+    combined_events AS (
+        -- 픽업 이벤트 (모든 방문)
+        SELECT 
+            person_seq,
+            first_event_date,
+            zone_name,
+            coords,
+            age,
+            gender,
+            'P' as event_type_label  -- P for Pickup
+        FROM pickup_df
+        UNION ALL
+        -- 응시 이벤트 (3회 이상 방문한 존만)
+        SELECT 
+            person_seq,
+            first_event_date,
+            zone_name,
+            coords,
+            age,
+            gender,
+            'G' as event_type_label  -- G for Gaze
+        FROM gaze_df
+    ),
+    integrated_routes AS (
+        SELECT
+            person_seq,
+            multiIf(
+                age >= 60, '60대 이상',
+                age >= 50, '50대',
+                age >= 40, '40대',
+                age >= 30, '30대',
+                age >= 20, '20대',
+                age >= 10, '10대',
+                age IS NULL, '미상',
+                '10세 미만'
+            ) AS age_group,
+            multiIf(
+                gender = 0, '남자',
+                gender = 1, '여자',
+                '미상'
+            ) AS gender_label,
+            -- 시간순으로 정렬된 통합 경로 (이벤트 타입 포함)
+            arrayStringConcat(
+                arrayMap(x -> concat(x.2, '(', x.4, ')'), arraySort(
+                    groupArray((first_event_date, zone_name, coords, event_type_label))
+                )), ' → '
+            ) AS integrated_route,
+            -- 시간순 존 이름들
+            arrayMap(x -> x.2,
+                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+            ) AS zone_names,
+            -- 시간순 좌표들
+            arrayMap(x -> x.3,
+                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+            ) AS zone_coords,
+            -- 시간순 이벤트 발생시간들
+            arrayMap(x -> x.1,
+                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+            ) AS event_timestamps,
+            -- 시간순 이벤트 타입들
+            arrayMap(x -> x.4,
+                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+            ) AS event_types,
+            -- 첫 번째 픽업 전 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
+            multiIf(
+                arrayFirstIndex(x -> x = 'P', 
+                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                ) = 0, 0,
+                arrayCount(x -> x = 'G', 
+                    arraySlice(
+                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ) AS gaze_count_before_first_pickup,
+            -- 첫 번째 픽업 직후 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
+            multiIf(
+                arrayFirstIndex(x -> x = 'P', 
+                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                ) = 0, 0,
+                arrayCount(x -> x = 'G',
+                    arraySlice(
+                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) + 1,
+                        length(arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                )
+            ) AS gaze_count_after_first_pickup,
+            -- 첫 번째 픽업한 매대 이름
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                ), 1
+            ) AS first_pickup_zone,
+            -- 첫 번째 픽업 시간
+            arrayElement(
+                arrayMap(x -> x.1,
+                    arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                ), 1
+            ) AS first_pickup_time,
+            -- 픽업 전 응시 매대 경로 (시간순)
+            arrayStringConcat(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                ), ' → '
+            ) AS gaze_route_before_first_pickup,
+            -- 픽업 직전 1번째 응시 매대 (가장 마지막)
+            arrayElement(
+                arrayReverse(
+                    arrayMap(x -> x.2,
+                        arraySlice(
+                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    )
+                ), 1
+            ) AS before_pickup_gaze_1st,
+            -- 픽업 직전 2번째 응시 매대
+            arrayElement(
+                arrayReverse(
+                    arrayMap(x -> x.2,
+                        arraySlice(
+                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    )
+                ), 2
+            ) AS before_pickup_gaze_2nd,
+            -- 픽업 직전 3번째 응시 매대
+            arrayElement(
+                arrayReverse(
+                    arrayMap(x -> x.2,
+                        arraySlice(
+                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    )
+                ), 3
+            ) AS before_pickup_gaze_3rd,
+            -- 픽업 직전 4번째 응시 매대
+            arrayElement(
+                arrayReverse(
+                    arrayMap(x -> x.2,
+                        arraySlice(
+                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    )
+                ), 4
+            ) AS before_pickup_gaze_4th,
+            -- 픽업 직전 5번째 응시 매대
+            arrayElement(
+                arrayReverse(
+                    arrayMap(x -> x.2,
+                        arraySlice(
+                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    )
+                ), 5
+            ) AS before_pickup_gaze_5th,
+            -- 픽업 후 응시 매대 경로 (시간순)
+            arrayStringConcat(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), ' → '
+            ) AS gaze_route_after_first_pickup,
+            -- 픽업 후 1번째 응시 매대
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), 1
+            ) AS after_pickup_gaze_1st,
+            -- 픽업 후 2번째 응시 매대
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), 2
+            ) AS after_pickup_gaze_2nd,
+            -- 픽업 후 3번째 응시 매대
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), 3
+            ) AS after_pickup_gaze_3rd,
+            -- 픽업 후 4번째 응시 매대
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), 4
+            ) AS after_pickup_gaze_4th,
+            -- 픽업 후 5번째 응시 매대
+            arrayElement(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        arrayCount(x -> x = 'G', 
+                            arraySlice(
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                                1,
+                                arrayFirstIndex(x -> x = 'P', 
+                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                                ) - 1
+                            )
+                        ) + 1,
+                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                    )
+                ), 5
+            ) AS after_pickup_gaze_5th
+        FROM combined_events
+        GROUP BY person_seq, age, gender
+    )
+    , pivot as (
+    SELECT
+        person_seq,
+        age_group,
+        gender_label,
+        integrated_route,      -- 픽업과 응시가 시간순으로 통합된 경로
+        zone_names,            -- 시간순 존 이름 배열
+        zone_coords,           -- 시간순 좌표 배열
+        event_timestamps,      -- 시간순 이벤트 발생시간 배열
+        event_types,           -- 시간순 이벤트 타입 배열 (P: 픽업, G: 응시)
+        gaze_count_before_first_pickup,  -- 첫 번째 픽업 전 응시 매대 수
+        gaze_count_after_first_pickup,   -- 첫 번째 픽업 후 응시 매대 수
+        first_pickup_zone,               -- 첫 번째 픽업한 매대 이름
+        first_pickup_time,               -- 첫 번째 픽업 시간
+        gaze_route_before_first_pickup,  -- 픽업 전 응시 매대 경로
+        gaze_route_after_first_pickup,   -- 픽업 후 응시 매대 경로
+        before_pickup_gaze_1st,          -- 픽업 직전 1번째 응시 매대 (가장 마지막)
+        before_pickup_gaze_2nd,          -- 픽업 직전 2번째 응시 매대
+        before_pickup_gaze_3rd,          -- 픽업 직전 3번째 응시 매대
+        before_pickup_gaze_4th,          -- 픽업 직전 4번째 응시 매대
+        before_pickup_gaze_5th,          -- 픽업 직전 5번째 응시 매대
+        after_pickup_gaze_1st,           -- 픽업 후 1번째 응시 매대
+        after_pickup_gaze_2nd,           -- 픽업 후 2번째 응시 매대
+        after_pickup_gaze_3rd,           -- 픽업 후 3번째 응시 매대
+        after_pickup_gaze_4th,           -- 픽업 후 4번째 응시 매대
+        after_pickup_gaze_5th            -- 픽업 후 5번째 응시 매대
+    FROM integrated_routes
+    ORDER BY person_seq
+    )
+    , filtered_pivot AS (
+        -- pivot 테이블에서 조건 필터링 (리버스 엔지니어링으로 발견한 올바른 방식)
+        SELECT *
+        FROM pivot
+        WHERE first_pickup_zone IS NOT NULL  -- 픽업이 있는 고객만
+            AND (empty({target_shelves:Array(String)}) OR has({target_shelves:Array(String)}, first_pickup_zone))
+            AND (empty({age_groups:Array(String)}) OR has({age_groups:Array(String)}, age_group))
+            AND (empty({gender_labels:Array(String)}) OR has({gender_labels:Array(String)}, gender_label))
+    )
+    , shelf_analysis AS (
+        -- 픽업 직전 마지막 응시매대 (1st만, 계산대 제외)
+        SELECT 
+            'before' as period,
+            COALESCE(NULLIF(before_pickup_gaze_1st, ''), '진열대없음') as shelf_name
+        FROM filtered_pivot
+        WHERE COALESCE(NULLIF(before_pickup_gaze_1st, ''), '진열대없음') != '계산대'
+            AND NOT has({exclude_shelves:Array(String)}, COALESCE(NULLIF(shelf_name, ''), '진열대없음'))
+        
+        UNION ALL
+        
+        -- 픽업 후 첫 번째 응시매대 (1st만, 계산대 제외)
+        SELECT 
+            'after' as period,
+            COALESCE(NULLIF(after_pickup_gaze_1st, ''), '진열대없음') as shelf_name
+        FROM filtered_pivot
+        WHERE COALESCE(NULLIF(after_pickup_gaze_1st, ''), '진열대없음') != '계산대'
+            AND NOT has({exclude_shelves:Array(String)}, COALESCE(NULLIF(shelf_name, ''), '진열대없음'))
+    ),
+    
+    -- 진열대별 집계 및 비율 계산
+    aggregated AS (
+        SELECT 
+            period,
+            shelf_name,
+            COUNT(*) as visit_count,
+            ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (PARTITION BY period)) as percentage
+        FROM shelf_analysis
+        GROUP BY period, shelf_name
+    ),
+    
+    -- 기간별 Top 5 순위 매기기
+    ranked AS (
+        SELECT 
+            period,
+            shelf_name,
+            percentage,
+            ROW_NUMBER() OVER (PARTITION BY period ORDER BY percentage DESC) as rank
+        FROM aggregated
+        WHERE percentage > 0  -- 0% 제외z 
+    ),
+    
+    -- Top 5만 필터링
+    top5 AS (
+        SELECT *
+        FROM ranked
+        WHERE rank <= 5
+    ),
+    
+    -- 픽업 전 Top5 결과
+    before_results AS (
+        SELECT 
+            'BEFORE' as analysis_type,
+            rank as no,
+            shelf_name,
+            CONCAT(CAST(percentage as String), '%') as pct
+        FROM top5 
+        WHERE period = 'before'
+    ),
+    
+    -- 픽업 후 Top5 결과
+    after_results AS (
+        SELECT 
+            'AFTER' as analysis_type,
+            rank as no,
+            shelf_name,
+            CONCAT(CAST(percentage as String), '%') as pct
+        FROM top5 
+        WHERE period = 'after'
+    )
+    
+    -- 최종 결과 (픽업 전/후 별도 테이블)
+    SELECT * FROM before_results
+    UNION ALL
+    SELECT * FROM after_results
+    ORDER BY analysis_type, no
+    """)
+
+# 첫 픽업 전후 응시 매대 개수 요약 쿼리
+LEGACY_PICKUP_GAZE_SUMMARY_QUERY = QueryTemplate("bench.legacy_pickup_gaze_summary", """
+WITH pickup_visit_counts AS (
+    SELECT
+        cbe.person_seq AS person_seq,
+        cba.attention_target_zone_id AS attention_target_zone_id,
+        z.name AS zone_name,
+        z.coords AS coords,
+        MIN(cbe.`timestamp`) AS first_event_date,
+        cbe.age AS age,
+        cbe.gender AS gender,
+        COUNT(*) AS visit_count
+    FROM customer_behavior_event cbe
+    LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+    LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+    WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+        AND NOT has({exclude_dates:Array(String)}, toString(cbe.date))
+        AND cbe.event_type = 1  -- 픽업
+        AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+        AND z.name IS NOT NULL
+    GROUP BY
+        cbe.person_seq,
+        cbe.age,
+        cbe.gender,
+        cba.attention_target_zone_id,
+        z.name,
+        z.coords
+),
+gaze_visit_counts AS (
+    SELECT
+        cbe.person_seq AS person_seq,
+        cba.attention_target_zone_id AS attention_target_zone_id,
+        z.name AS zone_name,
+        z.coords AS coords,
+        MIN(cbe.`timestamp`) AS first_event_date,
+        cbe.age AS age,
+        cbe.gender AS gender,
+        COUNT(*) AS visit_count
+    FROM customer_behavior_event cbe
+    LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+    LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+    WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+        AND NOT has({exclude_dates:Array(String)}, toString(cbe.date))
+        AND cbe.event_type = 0  -- 응시
+        AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+        AND z.name IS NOT NULL
+    GROUP BY
+        cbe.person_seq,
+        cbe.age,
+        cbe.gender,
+        cba.attention_target_zone_id,
+        z.name,
+        z.coords
+),
+pickup_df AS (
+    SELECT
+        person_seq,
+        attention_target_zone_id,
+        zone_name,
+        coords,
+        first_event_date,
+        age,
+        gender,
+        visit_count,
+        ROW_NUMBER() OVER (
+            PARTITION BY person_seq
+            ORDER BY first_event_date
+        ) AS pickup_order
+    FROM pickup_visit_counts
+),
+gaze_df AS (
+    SELECT
+        person_seq,
+        attention_target_zone_id,
+        zone_name,
+        coords,
+        first_event_date,
+        age,
+        gender,
+        visit_count,
+        ROW_NUMBER() OVER (
+            PARTITION BY person_seq
+            ORDER BY first_event_date
+        ) AS gaze_order
+    FROM gaze_visit_counts
+    WHERE visit_count >= 3
+),
+combined_events AS (
+    -- 픽업 이벤트 (모든 방문)
+    SELECT 
+        person_seq,
+        first_event_date,
+        zone_name,
+        coords,
+        age,
+        gender,
+        'P' as event_type_label  -- P for Pickup
+    FROM pickup_df
+    UNION ALL
+    -- 응시 이벤트 (3회 이상 방문한 존만)
+    SELECT 
+        person_seq,
+        first_event_date,
+        zone_name,
+        coords,
+        age,
+        gender,
+        'G' as event_type_label  -- G for Gaze
+    FROM gaze_df
+),
+integrated_routes AS (
+    SELECT
+        person_seq,
+        multiIf(
+            age >= 60, '60대 이상',
+            age >= 50, '50대',
+            age >= 40, '40대',
+            age >= 30, '30대',
+            age >= 20, '20대',
+            age >= 10, '10대',
+            age IS NULL, '미상',
+            '10세 미만'
+        ) AS age_group,
+        multiIf(
+            gender = 0, '남자',
+            gender = 1, '여자',
+            '미상'
+        ) AS gender_label,
+        -- 시간순으로 정렬된 통합 경로 (이벤트 타입 포함)
+        arrayStringConcat(
+            arrayMap(x -> concat(x.2, '(', x.4, ')'), arraySort(
+                groupArray((first_event_date, zone_name, coords, event_type_label))
+            )), ' → '
+        ) AS integrated_route,
+        -- 시간순 존 이름들
+        arrayMap(x -> x.2,
+            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+        ) AS zone_names,
+        -- 시간순 좌표들
+        arrayMap(x -> x.3,
+            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+        ) AS zone_coords,
+        -- 시간순 이벤트 발생시간들
+        arrayMap(x -> x.1,
+            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+        ) AS event_timestamps,
+        -- 시간순 이벤트 타입들
+        arrayMap(x -> x.4,
+            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
+        ) AS event_types,
+        -- 첫 번째 픽업 전 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
+        multiIf(
+            arrayFirstIndex(x -> x = 'P', 
+                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+            ) = 0, 0,
+            arrayCount(x -> x = 'G', 
+                arraySlice(
+                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    1,
+                    arrayFirstIndex(x -> x = 'P', 
+                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                    ) - 1
+                )
+            )
+        ) AS gaze_count_before_first_pickup,
+        -- 첫 번째 픽업 직후 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
+        multiIf(
+            arrayFirstIndex(x -> x = 'P', 
+                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+            ) = 0, 0,
+            arrayCount(x -> x = 'G',
+                arraySlice(
+                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayFirstIndex(x -> x = 'P', 
+                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                    ) + 1,
+                    length(arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            )
+        ) AS gaze_count_after_first_pickup,
+        -- 첫 번째 픽업한 매대 이름
+        arrayElement(
+            arrayMap(x -> x.2,
+                arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+            ), 1
+        ) AS first_pickup_zone,
+        -- 첫 번째 픽업 시간
+        arrayElement(
+            arrayMap(x -> x.1,
+                arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+            ), 1
+        ) AS first_pickup_time,
+        -- 픽업 전 응시 매대 경로 (시간순)
+        arrayStringConcat(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    1,
+                    arrayFirstIndex(x -> x = 'P', 
+                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                    ) - 1
+                )
+            ), ' → '
+        ) AS gaze_route_before_first_pickup,
+        -- 픽업 직전 1번째 응시 매대 (가장 마지막)
+        arrayElement(
+            arrayReverse(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ), 1
+        ) AS before_pickup_gaze_1st,
+        -- 픽업 직전 2번째 응시 매대
+        arrayElement(
+            arrayReverse(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ), 2
+        ) AS before_pickup_gaze_2nd,
+        -- 픽업 직전 3번째 응시 매대
+        arrayElement(
+            arrayReverse(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ), 3
+        ) AS before_pickup_gaze_3rd,
+        -- 픽업 직전 4번째 응시 매대
+        arrayElement(
+            arrayReverse(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ), 4
+        ) AS before_pickup_gaze_4th,
+        -- 픽업 직전 5번째 응시 매대
+        arrayElement(
+            arrayReverse(
+                arrayMap(x -> x.2,
+                    arraySlice(
+                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                        1,
+                        arrayFirstIndex(x -> x = 'P', 
+                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                        ) - 1
+                    )
+                )
+            ), 5
+        ) AS before_pickup_gaze_5th,
+        -- 픽업 후 응시 매대 경로 (시간순)
+        arrayStringConcat(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), ' → '
+        ) AS gaze_route_after_first_pickup,
+        -- 픽업 후 1번째 응시 매대
+        arrayElement(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), 1
+        ) AS after_pickup_gaze_1st,
+        -- 픽업 후 2번째 응시 매대
+        arrayElement(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), 2
+        ) AS after_pickup_gaze_2nd,
+        -- 픽업 후 3번째 응시 매대
+        arrayElement(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), 3
+        ) AS after_pickup_gaze_3rd,
+        -- 픽업 후 4번째 응시 매대
+        arrayElement(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), 4
+        ) AS after_pickup_gaze_4th,
+        -- 픽업 후 5번째 응시 매대
+        arrayElement(
+            arrayMap(x -> x.2,
+                arraySlice(
+                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                    arrayCount(x -> x = 'G', 
+                        arraySlice(
+                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
+                            1,
+                            arrayFirstIndex(x -> x = 'P', 
+                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
+                            ) - 1
+                        )
+                    ) + 1,
+                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
+                )
+            ), 5
+        ) AS after_pickup_gaze_5th
+    FROM combined_events
+    GROUP BY person_seq, age, gender
+)
+, pivot as (
+SELECT
+    person_seq,
+    age_group,
+    gender_label,
+    integrated_route,      -- 픽업과 응시가 시간순으로 통합된 경로
+    zone_names,            -- 시간순 존 이름 배열
+    zone_coords,           -- 시간순 좌표 배열
+    event_timestamps,      -- 시간순 이벤트 발생시간 배열
+    event_types,           -- 시간순 이벤트 타입 배열 (P: 픽업, G: 응시)
+    gaze_count_before_first_pickup,  -- 첫 번째 픽업 전 응시 매대 수
+    gaze_count_after_first_pickup,   -- 첫 번째 픽업 후 응시 매대 수
+    first_pickup_zone,               -- 첫 번째 픽업한 매대 이름
+    first_pickup_time,               -- 첫 번째 픽업 시간
+    gaze_route_before_first_pickup,  -- 픽업 전 응시 매대 경로
+    gaze_route_after_first_pickup,   -- 픽업 후 응시 매대 경로
+    before_pickup_gaze_1st,          -- 픽업 직전 1번째 응시 매대 (가장 마지막)
+    before_pickup_gaze_2nd,          -- 픽업 직전 2번째 응시 매대
+    before_pickup_gaze_3rd,          -- 픽업 직전 3번째 응시 매대
+    before_pickup_gaze_4th,          -- 픽업 직전 4번째 응시 매대
+    before_pickup_gaze_5th,          -- 픽업 직전 5번째 응시 매대
+    after_pickup_gaze_1st,           -- 픽업 후 1번째 응시 매대
+    after_pickup_gaze_2nd,           -- 픽업 후 2번째 응시 매대
+    after_pickup_gaze_3rd,           -- 픽업 후 3번째 응시 매대
+    after_pickup_gaze_4th,           -- 픽업 후 4번째 응시 매대
+    after_pickup_gaze_5th            -- 픽업 후 5번째 응시 매대
+FROM integrated_routes
+ORDER BY person_seq
+)
+select  age_group, gender_label, avg(gaze_count_before_first_pickup), avg(gaze_count_after_first_pickup)
+from   pivot
+group by age_group, gender_label
+""")
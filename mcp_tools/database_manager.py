@@ -8,13 +8,22 @@ site_db_connection_config 테이블에서 가져온 연결 정보를 통해
 
 import os
 import sys
+import json
+import time
+import atexit
+import asyncio
 import logging
+import threading
 import clickhouse_connect
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Callable, Awaitable
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import datetime
 
+from tunnel_manager import get_tunnel_port, make_tunnel_key, touch_tunnel
+
 load_dotenv()
 
 # 컨테이너 환경에서만 로그 파일 생성
@@ -75,6 +84,9 @@ def debug_print(message: str):
     sys.stderr.flush()
     logger.error(message)  # ERROR 레벨로 강제 출력
 
+# 매장(또는 중앙 DB)별로 마지막으로 사용한 터널 키 (풀에서 클라이언트 재사용 시 터널 사용 시각 갱신용)
+_site_tunnel_keys: Dict[str, Any] = {}
+
 def _create_config_client() -> Optional[Any]:
     """설정 데이터베이스 클라이언트 생성 (SSH 터널링 지원)"""
     debug_print(f"🔧 [DEBUG] 설정 DB 연결 시도:")
@@ -92,59 +104,24 @@ def _create_config_client() -> Optional[Any]:
         ssh_host = os.getenv("SSH_HOST") 
         if ssh_host:
             try:
-                # Paramiko 환경 디버깅 및 호환성 처리
-                import paramiko
-                print(f"🔍 Paramiko 버전: {paramiko.__version__}")
-                print(f"🔍 Paramiko 경로: {paramiko.__file__}")
-                print(f"🔍 DSSKey 존재: {hasattr(paramiko, 'DSSKey')}")
-                
-                # 사용 가능한 키 타입들 출력
-                key_types = [attr for attr in dir(paramiko) if 'Key' in attr and not attr.startswith('_')]
-                print(f"🔍 사용 가능한 키 타입들: {key_types}")
-                
-                # DSSKey 속성이 없으면 더미 클래스 추가
-                if not hasattr(paramiko, 'DSSKey'):
-                    print("⚠️ Paramiko DSSKey 호환성 문제 감지, 더미 클래스 생성")
-                    # 더미 DSSKey 클래스 생성
-                    class DummyDSSKey:
-                        def __init__(self, *args, **kwargs):
-                            raise NotImplementedError("DSS keys are not supported in this paramiko version")
-                        
-                        @classmethod
-                        def from_private_key_file(cls, *args, **kwargs):
-                            raise NotImplementedError("DSS keys are not supported in this paramiko version")
-                    
-                    paramiko.DSSKey = DummyDSSKey
-                    print("✅ DSSKey 더미 클래스 생성 완료")
-                
-                from sshtunnel import SSHTunnelForwarder
-                
-                # SSH 터널 설정 - 호환성 강화
-                ssh_tunnel = SSHTunnelForwarder(
-                    (ssh_host, int(os.getenv("SSH_PORT", "22"))),
-                    ssh_username=os.getenv("SSH_USERNAME"),
-                    ssh_password=os.getenv("SSH_PASSWORD"),
-                    remote_bind_address=(os.getenv("CONFIG_DB_HOST", "localhost"), int(os.getenv("CONFIG_DB_PORT", "8123"))),
-                    local_bind_address=("localhost", 0),
-                    # 호환성을 위한 추가 옵션
-                    ssh_config_file=None,
-                    allow_agent=False,
-                    host_pkey_directories=None,
-                    # 키 타입 제한
-                    ssh_pkey=None
-                )
-                ssh_tunnel.start()
-                print(f"설정 DB SSH 터널 생성: localhost:{ssh_tunnel.local_bind_port}")
+                remote_host = os.getenv("CONFIG_DB_HOST", "localhost")
+                remote_port = int(os.getenv("CONFIG_DB_PORT", "8123"))
+                ssh_port = int(os.getenv("SSH_PORT", "22"))
+
+                # 공유 터널 레지스트리에서 터널 재사용 (없거나 끊어졌으면 새로 생성)
+                local_port = get_tunnel_port(ssh_host, ssh_port, remote_host, remote_port)
+                _site_tunnel_keys[CONFIG_POOL_SITE] = make_tunnel_key(ssh_host, ssh_port, remote_host, remote_port)
+                print(f"설정 DB SSH 터널 사용: localhost:{local_port}")
                 
                 # SSH 터널 성공 로그
                 log_connection_attempt("CONFIG_DB_SSH_TUNNEL_SUCCESS", details={
-                    "local_port": ssh_tunnel.local_bind_port,
-                    "remote_host": os.getenv("CONFIG_DB_HOST", "localhost"),
-                    "remote_port": os.getenv("CONFIG_DB_PORT", "8123")
+                    "local_port": local_port,
+                    "remote_host": remote_host,
+                    "remote_port": remote_port
                 })
                 
                 host = "localhost"
-                port = ssh_tunnel.local_bind_port
+                port = local_port
                 
             except Exception as e:
                 print(f"설정 DB SSH 터널 생성 실패: {e}, 직접 연결 시도")
@@ -204,32 +181,9 @@ def _create_config_client() -> Optional[Any]:
         return None
 
 def get_site_connection_info(site: str) -> Optional[Dict[str, Any]]:
-    """site_db_connection_config 테이블에서 매장 연결 정보 조회"""
+    """매장 연결 정보 조회 (site_db_connection_config 캐시 레지스트리 사용)"""
     try:
-        # 설정 DB에 연결
-        config_client = _create_config_client()
-        if not config_client:
-            return None
-        
-        query = f"""
-        SELECT ssh_host, ssh_port, db_host, db_port, db_name
-        FROM site_db_connection_config
-        WHERE site = '{site}'
-        """
-        
-        result = config_client.query(query)
-        config_client.close()
-        
-        if result.result_rows:
-            row = result.result_rows[0]
-            return {
-                "ssh_host": row[0],
-                "ssh_port": row[1] or 22,
-                "db_host": row[2],
-                "db_port": row[3],
-                "db_name": row[4] or "plusinsight"
-            }
-        return None
+        return _site_registry.get(site)
     except Exception as e:
         print(f"매장 '{site}' 연결 정보 조회 실패: {e}")
         return None
@@ -278,36 +232,26 @@ def get_site_client(site: str, database: str = 'plusinsight') -> Optional[Any]:
         print(f"  - 원격 DB: {conn_info['db_host']}:{conn_info['db_port']}")
         
         try:
-            # Paramiko 호환성 문제 해결
-            import paramiko
-            if not hasattr(paramiko, 'DSSKey'):
-                print("⚠️ Paramiko DSSKey 호환성 문제 감지, RSA 키만 사용")
-            
-            from sshtunnel import SSHTunnelForwarder
-            
-            ssh_tunnel = SSHTunnelForwarder(
-                (conn_info["ssh_host"], int(conn_info["ssh_port"])),
-                ssh_username=os.getenv("SSH_USERNAME"),
-                ssh_password=os.getenv("SSH_PASSWORD"),
-                remote_bind_address=(conn_info["db_host"], int(conn_info["db_port"])),
-                local_bind_address=("localhost", 0),
-                # 호환성을 위한 추가 옵션
-                ssh_config_file=None,
-                allow_agent=False,
-                host_pkey_directories=None
+            # 공유 터널 레지스트리에서 터널 재사용 (없거나 끊어졌으면 새로 생성)
+            local_port = get_tunnel_port(
+                conn_info["ssh_host"], conn_info["ssh_port"],
+                conn_info["db_host"], conn_info["db_port"]
+            )
+            _site_tunnel_keys[site] = make_tunnel_key(
+                conn_info["ssh_host"], conn_info["ssh_port"],
+                conn_info["db_host"], conn_info["db_port"]
             )
-            ssh_tunnel.start()
-            print(f"✅ [SUCCESS] SSH 터널 생성: {site} -> localhost:{ssh_tunnel.local_bind_port}")
+            print(f"✅ [SUCCESS] SSH 터널 사용: {site} -> localhost:{local_port}")
             
             # SSH 터널 성공 로그
             log_connection_attempt("SITE_SSH_TUNNEL_SUCCESS", site=site, details={
-                "local_port": ssh_tunnel.local_bind_port,
+                "local_port": local_port,
                 "remote_host": conn_info["db_host"],
                 "remote_port": conn_info["db_port"]
             })
             
             host = "localhost"
-            port = ssh_tunnel.local_bind_port
+            port = local_port
             
         except Exception as e:
             print(f"❌ [ERROR] SSH 터널 생성 실패: {e}")
@@ -370,17 +314,598 @@ def get_site_client(site: str, database: str = 'plusinsight') -> Optional[Any]:
         
         return None
 
+def get_env_client(database: str = 'plusinsight') -> Optional[Any]:
+    """환경 변수(CLICKHOUSE_HOST/PORT) 기반 기본 ClickHouse 클라이언트 생성 (폴백용)"""
+    host = os.getenv("CLICKHOUSE_HOST")
+    port = int(os.getenv("CLICKHOUSE_PORT", "8123"))
+    ssh_host = os.getenv("SSH_HOST")
+
+    if ssh_host:
+        try:
+            port = get_tunnel_port(ssh_host, os.getenv("SSH_PORT", "22"), host, port)
+            host = "localhost"
+        except Exception as e:
+            print(f"SSH 터널 생성 실패: {e}, 직접 연결 시도")
+
+    try:
+        client = clickhouse_connect.get_client(
+            host=host,
+            port=port,
+            username=os.getenv("CLICKHOUSE_USER"),
+            password=os.getenv("CLICKHOUSE_PASSWORD"),
+            database=database,
+            connect_timeout=10,
+            send_receive_timeout=30
+        )
+        print(f"ClickHouse 연결 성공: {host}:{port}, db={database}")
+        return client
+    except Exception as e:
+        print(f"ClickHouse 연결 실패: {e}")
+        return None
+
+# =============================================================================
+# 클라이언트 풀
+# =============================================================================
+
+# 풀 설정 (환경 변수로 조정 가능)
+POOL_MAX_PER_SITE = int(os.getenv("CLICKHOUSE_POOL_MAX_PER_SITE", "4"))
+POOL_IDLE_TIMEOUT = float(os.getenv("CLICKHOUSE_POOL_IDLE_TIMEOUT", "300"))
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("CLICKHOUSE_POOL_HEALTH_CHECK_AFTER", "30"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("CLICKHOUSE_POOL_ACQUIRE_TIMEOUT", "60"))
+
+# cu_base는 모든 매장이 공유하는 중앙 DB이므로 하나의 키로 묶어서 관리
+CONFIG_POOL_SITE = "__config__"
+
+
+class _PooledClient:
+    """풀에서 관리되는 클라이언트와 메타데이터"""
+
+    __slots__ = ("client", "key", "created_at", "last_used")
+
+    def __init__(self, client: Any, key: Tuple[str, str]):
+        self.client = client
+        self.key = key
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ClientPool:
+    """(site, database) 단위로 ClickHouse 클라이언트를 재사용하는 스레드 안전 풀
+
+    - 매장별 최대 클라이언트 수 제한 (초과 시 반납될 때까지 대기)
+    - 유휴 시간이 긴 클라이언트는 자동으로 정리
+    - 일정 시간 이상 유휴 상태였던 클라이언트만 대여 시 SELECT 1 헬스 체크
+    """
+
+    def __init__(
+        self,
+        max_per_site: int = POOL_MAX_PER_SITE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        health_check_after: float = POOL_HEALTH_CHECK_AFTER,
+        acquire_timeout: float = POOL_ACQUIRE_TIMEOUT,
+    ):
+        self.max_per_site = max(1, max_per_site)
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle: Dict[Tuple[str, str], List[_PooledClient]] = {}
+        self._open_count: Dict[str, int] = {}
+        self._stats = {"created": 0, "reused": 0, "health_check_failed": 0, "evicted": 0, "discarded": 0}
+
+    @staticmethod
+    def _make_key(site: str, database: str) -> Tuple[str, str]:
+        if database == 'cu_base':
+            return (CONFIG_POOL_SITE, database)
+        return (site, database)
+
+    def _evict_idle_locked(self) -> List[_PooledClient]:
+        """유휴 시간이 초과된 클라이언트를 풀에서 제거 (lock 보유 상태에서 호출)"""
+        now = time.monotonic()
+        expired = []
+        for key, entries in self._idle.items():
+            keep = []
+            for entry in entries:
+                if now - entry.last_used > self.idle_timeout:
+                    expired.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle[key] = keep
+        for entry in expired:
+            self._open_count[entry.key[0]] -= 1
+        self._stats["evicted"] += len(expired)
+        return expired
+
+    def _steal_idle_locked(self, site: str) -> Optional[_PooledClient]:
+        """같은 매장의 다른 database용 유휴 클라이언트를 하나 꺼냄 (자리 확보용)"""
+        for key, entries in self._idle.items():
+            if key[0] == site and entries:
+                entry = entries.pop(0)
+                self._open_count[site] -= 1
+                self._stats["evicted"] += 1
+                return entry
+        return None
+
+    @staticmethod
+    def _close_quietly(entries: List[_PooledClient]):
+        for entry in entries:
+            try:
+                entry.client.close()
+            except Exception:
+                pass
+
+    def _is_healthy(self, entry: _PooledClient) -> bool:
+        try:
+            entry.client.query("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ 풀 클라이언트 헬스 체크 실패 ({entry.key[0]}/{entry.key[1]}): {e}")
+            return False
+
+    def acquire(self, site: str, database: str = 'plusinsight') -> Optional[_PooledClient]:
+        """클라이언트 대여. 생성에 실패하면 None 반환"""
+        key = self._make_key(site, database)
+        pool_site = key[0]
+        deadline = time.monotonic() + self.acquire_timeout
+        entry = None
+        to_close: List[_PooledClient] = []
+
+        with self._cond:
+            while True:
+                to_close.extend(self._evict_idle_locked())
+                idle = self._idle.get(key)
+                if idle:
+                    entry = idle.pop()  # 가장 최근에 반납된 클라이언트 우선
+                    break
+                if self._open_count.get(pool_site, 0) < self.max_per_site:
+                    self._open_count[pool_site] = self._open_count.get(pool_site, 0) + 1
+                    break
+                stolen = self._steal_idle_locked(pool_site)
+                if stolen:
+                    to_close.append(stolen)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"매장 '{site}' 클라이언트 대기 시간 초과 ({self.acquire_timeout}s)")
+                self._cond.wait(remaining)
+
+        self._close_quietly(to_close)
+
+        if entry is not None:
+            if time.monotonic() - entry.last_used <= self.health_check_after or self._is_healthy(entry):
+                with self._cond:
+                    self._stats["reused"] += 1
+                return entry
+            # 헬스 체크 실패: 자리를 유지한 채 새 클라이언트로 교체
+            self._close_quietly([entry])
+            with self._cond:
+                self._stats["health_check_failed"] += 1
+
+        try:
+            client = get_site_client(site, database)
+        except Exception as e:
+            logger.error(f"❌ 풀 클라이언트 생성 중 오류 ({site}/{database}): {e}")
+            client = None
+
+        if client is None:
+            with self._cond:
+                self._open_count[pool_site] -= 1
+                self._cond.notify()
+            return None
+
+        with self._cond:
+            self._stats["created"] += 1
+        return _PooledClient(client, key)
+
+    def release(self, entry: _PooledClient, discard: bool = False):
+        """클라이언트 반납. discard=True이면 재사용하지 않고 닫음"""
+        with self._cond:
+            if discard:
+                self._open_count[entry.key[0]] -= 1
+                self._stats["discarded"] += 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.setdefault(entry.key, []).append(entry)
+                tunnel_key = _site_tunnel_keys.get(entry.key[0])
+                if tunnel_key:
+                    touch_tunnel(tunnel_key)
+            expired = self._evict_idle_locked()
+            self._cond.notify()
+        if discard:
+            expired.append(entry)
+        self._close_quietly(expired)
+
+    def close_all(self):
+        """유휴 클라이언트를 모두 닫음 (대여 중인 클라이언트는 반납 시 정리)"""
+        with self._cond:
+            entries = [entry for idle in self._idle.values() for entry in idle]
+            for entry in entries:
+                self._open_count[entry.key[0]] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_quietly(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """풀 상태 조회"""
+        with self._cond:
+            return {
+                **self._stats,
+                "open": dict(self._open_count),
+                "idle": {f"{site}/{db}": len(entries) for (site, db), entries in self._idle.items() if entries},
+            }
+
+
+_client_pool = ClientPool()
+atexit.register(_client_pool.close_all)
+
+
+@contextmanager
+def site_client(site: str, database: str = 'plusinsight') -> Iterator[Optional[Any]]:
+    """풀에서 매장 클라이언트를 빌려 쓰고 자동으로 반납하는 컨텍스트 매니저
+
+    연결에 실패하면 None을 yield 합니다. 블록 안에서 예외가 발생한 클라이언트는
+    상태를 신뢰할 수 없으므로 풀로 돌려보내지 않고 닫습니다.
+
+    사용 예:
+        with site_client(site) as client:
+            if not client:
+                return f"❌ {site}: 연결 실패"
+            result = client.query(query)
+    """
+    entry = _client_pool.acquire(site, database)
+    if entry is None:
+        yield None
+        return
+
+    discard = False
+    try:
+        yield entry.client
+    except BaseException:
+        discard = True
+        raise
+    finally:
+        _client_pool.release(entry, discard=discard)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """클라이언트 풀 통계 조회"""
+    return _client_pool.stats()
+
+
+def close_client_pool():
+    """풀에 남아있는 클라이언트 정리"""
+    _client_pool.close_all()
+
+# =============================================================================
+# 비동기 쿼리 파사드
+# =============================================================================
+
+# 비동기 실행 설정 (환경 변수로 조정 가능)
+ASYNC_QUERY_WORKERS = int(os.getenv("CLICKHOUSE_ASYNC_WORKERS", "16"))
+ASYNC_SITE_CONCURRENCY = int(os.getenv("CLICKHOUSE_SITE_CONCURRENCY", str(POOL_MAX_PER_SITE)))
+
+
+class AsyncQueryFacade:
+    """블로킹 clickhouse_connect 호출을 스레드 풀에서 실행하는 비동기 파사드
+
+    FastMCP 이벤트 루프를 막지 않도록 쿼리는 전용 스레드 풀에서 실행하고,
+    한 매장에 동시에 몰리는 쿼리 수는 매장별 세마포어로 제한합니다.
+    """
+
+    def __init__(self, max_workers: int = ASYNC_QUERY_WORKERS, per_site_limit: int = ASYNC_SITE_CONCURRENCY):
+        self.per_site_limit = max(1, per_site_limit)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="clickhouse-query")
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, site: str, database: str) -> asyncio.Semaphore:
+        pool_site = ClientPool._make_key(site, database)[0]
+        semaphore = self._semaphores.get(pool_site)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_site_limit)
+            self._semaphores[pool_site] = semaphore
+        return semaphore
+
+    @staticmethod
+    def _run_blocking(site: str, database: str, fn: Callable[[Any], Any]) -> Any:
+        with site_client(site, database) as client:
+            if not client:
+                return None
+            return fn(client)
+
+    async def run(self, site: str, database: str, fn: Callable[[Any], Any]) -> Any:
+        """풀에서 빌린 클라이언트로 fn(client)를 스레드 풀에서 실행. 연결 실패 시 None"""
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(site, database):
+            return await loop.run_in_executor(self._executor, self._run_blocking, site, database, fn)
+
+    async def query(
+        self,
+        site: str,
+        query: str,
+        database: str = 'plusinsight',
+        parameters: Optional[Dict[str, Any]] = None,
+        settings: Optional[Dict[str, Any]] = None,
+        column_oriented: bool = False,
+    ) -> Any:
+        """쿼리 실행 후 QueryResult 반환. 연결 실패 시 None"""
+        return await self.run(
+            site, database,
+            lambda client: client.query(
+                query, parameters=parameters, settings=settings, column_oriented=column_oriented
+            )
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_query_facade = AsyncQueryFacade()
+atexit.register(_query_facade.shutdown)
+
+
+async def query_async(
+    site: str,
+    query: str,
+    database: str = 'plusinsight',
+    parameters: Optional[Dict[str, Any]] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    column_oriented: bool = False,
+) -> Any:
+    """비동기 쿼리 실행 (연결 실패 시 None 반환)
+
+    column_oriented=True이면 행 튜플을 만들지 않고 컬럼 단위로 받아 result.result_columns로 사용합니다.
+
+    사용 예:
+        result = await query_async(site, query)
+        if result is None:
+            return f"❌ {site}: 연결 실패"
+    """
+    return await _query_facade.query(site, query, database, parameters, settings, column_oriented)
+
+
+async def query_template_async(
+    site: str,
+    template: Any,
+    database: str = 'plusinsight',
+    *,
+    column_oriented: bool = False,
+    **params,
+) -> Any:
+    """쿼리 템플릿(query_templates.QueryTemplate)을 서버 사이드 파라미터로 실행 (연결 실패 시 None 반환)
+
+    파라미터 검증에 실패하면 ValueError가 발생합니다.
+    """
+    return await _query_facade.query(site, template.sql, database, template.bind(**params), None, column_oriented)
+
+
+async def run_with_client_async(site: str, fn: Callable[[Any], Any], database: str = 'plusinsight') -> Any:
+    """풀 클라이언트로 임의의 블로킹 함수 fn(client)를 비동기 실행 (연결 실패 시 None 반환)"""
+    return await _query_facade.run(site, database, fn)
+
+# =============================================================================
+# 다중 매장 팬아웃
+# =============================================================================
+
+# 여러 매장을 한 번에 조회할 때 동시에 실행할 매장 수
+SITE_FAN_OUT_CONCURRENCY = int(os.getenv("SITE_FAN_OUT_CONCURRENCY", "8"))
+
+# (매장명, 결과, 오류 메시지) - 오류가 없으면 오류 메시지는 None
+SiteOutcome = Tuple[str, Any, Optional[str]]
+
+
+def resolve_sites(site: str = "", sites: Optional[List[str]] = None) -> List[str]:
+    """site/sites 인자를 실제 조회할 매장 목록으로 변환
+
+    site 또는 sites에 "*"가 있으면 등록된 전체 매장을 반환합니다.
+    """
+    requested = ([site] if site else []) + list(sites or [])
+    if "*" in requested:
+        return get_all_sites()
+
+    resolved = []
+    for name in requested:
+        name = name.strip()
+        if name and name not in resolved:
+            resolved.append(name)
+    return resolved
+
+
+async def fan_out_sites(
+    sites: List[str],
+    worker: Callable[[str], Awaitable[Any]],
+    concurrency: int = SITE_FAN_OUT_CONCURRENCY,
+) -> List[SiteOutcome]:
+    """매장별 비동기 작업을 동시 실행 수를 제한해서 실행
+
+    한 매장의 오류는 다른 매장에 영향을 주지 않으며, 결과는 입력 매장 순서대로 반환됩니다.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(site: str) -> SiteOutcome:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await worker(site)
+                logger.info(f"✅ {site} 조회 완료 ({time.perf_counter() - started:.2f}s)")
+                return site, result, None
+            except Exception as e:
+                logger.error(f"❌ {site} 조회 실패 ({time.perf_counter() - started:.2f}s): {e}")
+                return site, None, str(e) or type(e).__name__
+
+    return list(await asyncio.gather(*(run_one(site) for site in sites)))
+
+# =============================================================================
+# 매장 연결 정보 레지스트리
+# =============================================================================
+
+# 레지스트리 설정 (환경 변수로 조정 가능)
+SITE_REGISTRY_TTL = float(os.getenv("SITE_REGISTRY_TTL", "600"))
+SITE_REGISTRY_NEGATIVE_TTL = float(os.getenv("SITE_REGISTRY_NEGATIVE_TTL", "60"))
+SITE_REGISTRY_SNAPSHOT = os.getenv("SITE_REGISTRY_SNAPSHOT", "")  # 빈 값이면 디스크 스냅샷 사용 안 함
+
+
+class SiteRegistry:
+    """site_db_connection_config 테이블을 통째로 메모리에 올려두는 레지스트리
+
+    - 테이블 전체를 한 번의 SELECT로 로드하고 TTL이 지나면 다시 로드
+    - 없는 매장은 NEGATIVE TTL 동안 기억해서 반복 조회를 막음
+    - 스냅샷 경로가 지정되면 디스크에 저장해 두었다가 콜드 스타트 시 사용
+    """
+
+    def __init__(
+        self,
+        ttl: float = SITE_REGISTRY_TTL,
+        negative_ttl: float = SITE_REGISTRY_NEGATIVE_TTL,
+        snapshot_path: str = SITE_REGISTRY_SNAPSHOT,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+
+        self._lock = threading.RLock()
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at: Optional[float] = None   # time.time() 기준 (스냅샷과 공유)
+        self._last_attempt: Optional[float] = None  # 마지막 DB 로드 시도 시각 (time.monotonic)
+        self._missing: Dict[str, float] = {}      # 매장명 -> 부정 캐시 만료 시각 (time.monotonic)
+
+    def _load_from_db(self) -> Dict[str, Dict[str, Any]]:
+        query = """
+        SELECT site, ssh_host, ssh_port, db_host, db_port, db_name
+        FROM site_db_connection_config
+        ORDER BY site
+        """
+        with site_client(CONFIG_POOL_SITE, 'cu_base') as client:
+            if not client:
+                raise ConnectionError("설정 DB 연결 실패")
+            result = client.query(query)
+
+        sites: Dict[str, Dict[str, Any]] = {}
+        for site, ssh_host, ssh_port, db_host, db_port, db_name in result.result_rows:
+            # 같은 매장이 여러 행이면 첫 번째 행 사용
+            sites.setdefault(site, {
+                "ssh_host": ssh_host,
+                "ssh_port": ssh_port or 22,
+                "db_host": db_host,
+                "db_port": db_port,
+                "db_name": db_name or "plusinsight"
+            })
+        return sites
+
+    def _load_snapshot(self) -> Optional[Tuple[float, Dict[str, Dict[str, Any]]]]:
+        if not self.snapshot_path or not self.snapshot_path.exists():
+            return None
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return float(data["loaded_at"]), data["sites"]
+        except Exception as e:
+            print(f"⚠️ 매장 레지스트리 스냅샷 읽기 실패: {e}")
+            return None
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(self.snapshot_path.suffix + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"loaded_at": self._loaded_at, "sites": self._sites}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f"⚠️ 매장 레지스트리 스냅샷 저장 실패: {e}")
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.time() - self._loaded_at < self.ttl
+
+    def _attempted_recently(self) -> bool:
+        """negative_ttl 안에 DB 로드를 시도했는지 (설정 DB 장애 시 요청마다 재시도하지 않도록)"""
+        return self._last_attempt is not None and time.monotonic() - self._last_attempt < self.negative_ttl
+
+    def refresh(self) -> bool:
+        """설정 DB에서 전체 매장 정보를 다시 로드. 실패 시 기존 정보 유지"""
+        with self._lock:
+            self._last_attempt = time.monotonic()
+            try:
+                sites = self._load_from_db()
+            except Exception as e:
+                print(f"❌ 매장 레지스트리 로드 실패: {e}")
+                log_connection_attempt("SITE_REGISTRY_LOAD_FAILED", details={"error": str(e)})
+                if self._loaded_at is None:
+                    # 콜드 스타트에서 DB 실패 시 오래된 스냅샷이라도 사용
+                    snapshot = self._load_snapshot()
+                    if snapshot:
+                        self._loaded_at, self._sites = snapshot
+                return False
+
+            self._sites = sites
+            self._loaded_at = time.time()
+            self._missing.clear()
+            log_connection_attempt("SITE_REGISTRY_LOADED", details={"site_count": len(sites)})
+            self._save_snapshot()
+            return True
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._is_fresh():
+                return
+            if self._loaded_at is None:
+                snapshot = self._load_snapshot()
+                if snapshot and time.time() - snapshot[0] < self.ttl:
+                    self._loaded_at, self._sites = snapshot
+                    return
+            if self._attempted_recently():
+                # 최근 로드가 실패했으면 다음 시도 전까지 기존(오래된) 정보 사용
+                return
+            self.refresh()
+
+    def get(self, site: str) -> Optional[Dict[str, Any]]:
+        """매장 연결 정보 조회 (없으면 None)"""
+        with self._lock:
+            self._ensure_loaded()
+            info = self._sites.get(site)
+            if info is not None:
+                return dict(info)
+
+            now = time.monotonic()
+            expires = self._missing.get(site)
+            if expires is not None and now < expires:
+                return None
+
+            # 새로 등록된 매장일 수 있으므로 최근에 로드하지 않았다면 한 번 더 로드
+            if not self._attempted_recently():
+                self.refresh()
+                info = self._sites.get(site)
+                if info is not None:
+                    return dict(info)
+
+            self._missing[site] = now + self.negative_ttl
+            return None
+
+    def sites(self) -> List[str]:
+        """등록된 매장 목록 (정렬됨)"""
+        with self._lock:
+            self._ensure_loaded()
+            return sorted(self._sites)
+
+
+_site_registry = SiteRegistry()
+
+
+def refresh_site_registry() -> bool:
+    """매장 레지스트리 즉시 갱신"""
+    return _site_registry.refresh()
+
+
+def is_known_site(site: str) -> bool:
+    """등록된 매장인지 확인 (부정 캐시 적용)"""
+    return _site_registry.get(site) is not None
+
+
 def get_all_sites() -> List[str]:
     """모든 매장 목록 조회"""
     try:
-        config_client = _create_config_client()
-        if not config_client:
-            return []
-        
-        result = config_client.query("SELECT DISTINCT site FROM site_db_connection_config ORDER BY site")
-        sites = [row[0] for row in result.result_rows]
-        config_client.close()
-        
+        sites = _site_registry.sites()
         print(f"사용 가능한 매장: {sites}")
         return sites
     except Exception as e:
@@ -0,0 +1,520 @@
+"""
+Event Sequence Cache
+====================
+
+고객 행동 이벤트(customer_behavior_event)의 로컬 컬럼 캐시
+
+pickup_transition, shopper_path_markov, 진열대 분석(get_shelf_analysis_flexible, pickup_gaze_summary)은
+매번 전체 기간에 대해 고객별 이벤트 배열을 다시 만듭니다. 이 모듈은 (매장, 날짜) 단위로 이벤트를
+Parquet 파일로 저장해 두고, 마지막으로 받은 날짜(high-water mark) 이후의 날짜와 빠진 날짜만
+ClickHouse에서 가져옵니다. 고객별 정렬/필터/집계는 읽은 뒤 pyarrow.compute로 계산합니다.
+
+데이터셋 (파일은 날짜별, 행은 이벤트 또는 집계 단위로 평평하게 저장):
+- pickup: 직원이 아닌 고객의 픽업(event_type=1) 이벤트 (pickup_transition, shopper_path_markov)
+- shelf:  고객-구역-이벤트 종류(응시/픽업)별 첫 이벤트 시각과 횟수 (진열대 분석)
+
+SQL 경로와 같은 결과를 내도록 고객은 기간 전체에서 person_seq로 묶고(날짜 경계에서 나누지 않음),
+pickup_transition은 SQL과 같이 timestamp 기준 기간(종료일 0시까지)으로 다시 자릅니다.
+
+- 저장 위치: {EVENT_CACHE_DIR}/{database}/{site}/{dataset}/date=YYYY-MM-DD.parquet + manifest.json
+- 오늘을 포함해 아직 데이터가 쌓이는 날짜(EVENT_CACHE_SETTLE_DAYS)는 저장하지 않고 매번 조회
+- 기본은 비활성화 (EVENT_CACHE_ENABLED=true로 사용), pyarrow가 없으면 항상 기존 SQL 경로 사용
+
+캐시 미리 채우기:
+    python event_sequence_cache.py 매장명 [start_date] [end_date]
+    python event_sequence_cache.py "*"          # 전체 매장, 최근 EVENT_CACHE_BACKFILL_DAYS일
+    python event_sequence_cache.py clear [매장명]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from database_manager import site_client, get_all_sites
+from query_templates import QueryTemplate
+
+logger = logging.getLogger(__name__)
+
+# 캐시 설정 (환경 변수로 조정 가능)
+EVENT_CACHE_ENABLED = os.getenv("EVENT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+EVENT_CACHE_DIR = os.getenv(
+    "EVENT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chat", "event_cache"),
+)
+EVENT_CACHE_SETTLE_DAYS = int(os.getenv("EVENT_CACHE_SETTLE_DAYS", "1"))        # 오늘로부터 이 일수 이내는 저장하지 않음
+EVENT_CACHE_BACKFILL_DAYS = int(os.getenv("EVENT_CACHE_BACKFILL_DAYS", "30"))   # CLI에서 기간 미지정 시 채울 최근 일수
+
+# 저장 형식이 바뀌면 올려서 이전 파일을 무시
+SCHEMA_VERSION = 2
+
+# 날짜별 픽업 이벤트 (insight.pickup_transition / insight.zone_sequences와 같은 직원/이벤트 조건)
+PICKUP_EVENTS_QUERY = QueryTemplate("events.pickup_events", """
+SELECT
+    toString(e.date)                        AS date,
+    toString(e.person_seq)                  AS person_seq,
+    CAST(e.age AS Nullable(Int32))          AS age,
+    CAST(e.gender AS Nullable(Int8))        AS gender,
+    e.timestamp                             AS timestamp,
+    toUInt8(toHour(e.timestamp))            AS hour,
+    z.name                                  AS zone_name
+FROM customer_behavior_event e
+INNER JOIN customer_behavior_area a
+    ON e.customer_behavior_area_id = a.id
+INNER JOIN zone z
+    ON a.attention_target_zone_id = z.id
+WHERE
+    e.is_staff = false
+    AND e.event_type = 1
+    AND e.date BETWEEN {start_date:String} AND {end_date:String}
+ORDER BY date, person_seq, timestamp""")
+
+# 날짜별 고객-구역-이벤트 종류 집계 (shelf_engine.PERSON_ROUTES_CTE의 visit_counts를 날짜 단위로 나눈 것)
+SHELF_EVENTS_QUERY = QueryTemplate("events.shelf_events", """
+SELECT
+    toString(cbe.date)                          AS date,
+    toString(cbe.person_seq)                    AS person_seq,
+    CAST(cbe.age AS Nullable(Int32))            AS age,
+    CAST(cbe.gender AS Nullable(Int8))          AS gender,
+    toInt8(cbe.event_type)                      AS event_type,
+    toString(cba.attention_target_zone_id)      AS zone_id,
+    z.name                                      AS zone_name,
+    MIN(cbe.`timestamp`)                        AS first_event_at,
+    toUInt32(COUNT(*))                          AS visit_count
+FROM customer_behavior_event cbe
+LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+    AND cbe.event_type IN (0, 1)
+    AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+    AND z.name IS NOT NULL
+GROUP BY
+    cbe.date,
+    cbe.person_seq,
+    cbe.age,
+    cbe.gender,
+    cbe.event_type,
+    cba.attention_target_zone_id,
+    z.name
+ORDER BY date, person_seq""")
+
+
+class Dataset(NamedTuple):
+    name: str
+    query: QueryTemplate
+    columns: Tuple[Tuple[str, Any], ...]  # (컬럼명, pyarrow 타입)
+
+    def schema(self) -> "pa.Schema":
+        return pa.schema(list(self.columns))
+
+
+if PYARROW_AVAILABLE:
+    PICKUP = Dataset("pickup", PICKUP_EVENTS_QUERY, (
+        ("date", pa.string()),
+        ("person_seq", pa.string()),
+        ("age", pa.int32()),
+        ("gender", pa.int8()),
+        ("timestamp", pa.timestamp("s")),
+        ("hour", pa.uint8()),
+        ("zone_name", pa.string()),
+    ))
+    SHELF = Dataset("shelf", SHELF_EVENTS_QUERY, (
+        ("date", pa.string()),
+        ("person_seq", pa.string()),
+        ("age", pa.int32()),
+        ("gender", pa.int8()),
+        ("event_type", pa.int8()),
+        ("zone_id", pa.string()),
+        ("zone_name", pa.string()),
+        ("first_event_at", pa.timestamp("s")),
+        ("visit_count", pa.uint32()),
+    ))
+    DATASETS = {dataset.name: dataset for dataset in (PICKUP, SHELF)}
+else:
+    DATASETS = {}
+
+_site_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+_site_locks_guard = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """캐시 사용 가능 여부 (환경 변수 + pyarrow 설치 여부)"""
+    return EVENT_CACHE_ENABLED and PYARROW_AVAILABLE
+
+
+def _site_lock(site: str, database: str, dataset: "Dataset") -> threading.Lock:
+    with _site_locks_guard:
+        return _site_locks.setdefault((site, database, dataset.name), threading.Lock())
+
+
+def _site_dir(site: str, database: str) -> str:
+    # 매장명에 경로 구분자가 들어가도 한 디렉터리에 머물도록 치환
+    safe_site = re.sub(r'[\\/:*?"<>|]', "_", site)
+    return os.path.join(EVENT_CACHE_DIR, database, safe_site)
+
+
+def _dataset_dir(site: str, database: str, dataset: "Dataset") -> str:
+    return os.path.join(_site_dir(site, database), dataset.name)
+
+
+def _day_path(site: str, database: str, dataset: "Dataset", day: date) -> str:
+    return os.path.join(_dataset_dir(site, database, dataset), f"date={day.isoformat()}.parquet")
+
+
+def _read_manifest(site: str, database: str, dataset: "Dataset") -> Dict[str, Any]:
+    path = os.path.join(_dataset_dir(site, database, dataset), "manifest.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("schema_version") != SCHEMA_VERSION:
+        return {"schema_version": SCHEMA_VERSION, "high_water_mark": None, "dates": []}
+    return manifest
+
+
+def _write_manifest(site: str, database: str, dataset: "Dataset", manifest: Dict[str, Any]):
+    path = os.path.join(_dataset_dir(site, database, dataset), "manifest.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _date_range(start_date: str, end_date: str) -> List[date]:
+    start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _group_ranges(days: List[date]) -> List[Tuple[date, date]]:
+    """날짜 목록을 연속 구간으로 묶기"""
+    ranges: List[Tuple[date, date]] = []
+    for day in days:
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _fetch_range(client: Any, dataset: "Dataset", start: date, end: date) -> "pa.Table":
+    """ClickHouse에서 기간의 이벤트를 받아 Arrow 테이블로 변환"""
+    params = dataset.query.bind(start_date=start.isoformat(), end_date=end.isoformat())
+    result = client.query(dataset.query.sql, parameters=params, column_oriented=True)
+    names = [name for name, _ in dataset.columns]
+    columns = result.result_columns or [[] for _ in names]
+    return pa.table(dict(zip(names, columns)), schema=dataset.schema())
+
+
+def _write_days(site: str, database: str, dataset: "Dataset", table: "pa.Table", days: List[date]):
+    """기간 테이블을 날짜별 파일로 나눠 저장 (데이터 없는 날짜는 파일 없이 manifest에만 기록)"""
+    os.makedirs(_dataset_dir(site, database, dataset), exist_ok=True)
+    for day in days:
+        path = _day_path(site, database, dataset, day)
+        day_table = table.filter(pc.equal(table.column("date"), day.isoformat()))
+        if day_table.num_rows == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(day_table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+
+
+def _ensure_cached(client: Any, site: str, database: str, dataset: "Dataset", days: List[date]) -> Dict[str, Any]:
+    """저장되지 않은 확정 날짜를 받아 저장하고 manifest 갱신"""
+    manifest = _read_manifest(site, database, dataset)
+    done = set(manifest["dates"])
+    last_settled = date.today() - timedelta(days=EVENT_CACHE_SETTLE_DAYS)
+    missing = [day for day in days if day <= last_settled and day.isoformat() not in done]
+
+    for range_start, range_end in _group_ranges(missing):
+        started = time.perf_counter()
+        table = _fetch_range(client, dataset, range_start, range_end)
+        range_days = [day for day in missing if range_start <= day <= range_end]
+        _write_days(site, database, dataset, table, range_days)
+        # 파일을 다 쓴 뒤에 manifest에 기록 (중간 실패 시 다음 호출에서 다시 받음)
+        done.update(day.isoformat() for day in range_days)
+        manifest["dates"] = sorted(done)
+        manifest["high_water_mark"] = manifest["dates"][-1]
+        _write_manifest(site, database, dataset, manifest)
+        logger.info(
+            f"📦 {site}: {dataset.name} 이벤트 캐시 {range_start} ~ {range_end} "
+            f"({table.num_rows:,}행, {time.perf_counter() - started:.2f}초)"
+        )
+    return manifest
+
+
+def load_events(
+    site: str,
+    start_date: str,
+    end_date: str,
+    database: str = 'plusinsight',
+    dataset: str = "pickup",
+) -> Optional["pa.Table"]:
+    """기간(날짜 단위)의 이벤트를 Arrow 테이블로 반환 (연결 실패 시 None)
+
+    확정된 날짜는 로컬 Parquet에서 읽고, 빠진 날짜만 ClickHouse에서 받아 저장합니다.
+    아직 확정되지 않은 최근 날짜는 저장하지 않고 매번 조회합니다.
+    """
+    if not is_enabled():
+        raise RuntimeError("이벤트 시퀀스 캐시를 사용할 수 없습니다 (EVENT_CACHE_ENABLED 또는 pyarrow 확인)")
+
+    spec = DATASETS[dataset]
+    days = _date_range(start_date, end_date)
+    last_settled = date.today() - timedelta(days=EVENT_CACHE_SETTLE_DAYS)
+    live_days = [day for day in days if day > last_settled]
+
+    with _site_lock(site, database, spec):
+        manifest = _read_manifest(site, database, spec)
+        done = set(manifest["dates"])
+        needs_fetch = live_days or any(day <= last_settled and day.isoformat() not in done for day in days)
+
+        tables = []
+        if needs_fetch:
+            with site_client(site, database) as client:
+                if not client:
+                    return None
+                manifest = _ensure_cached(client, site, database, spec, days)
+                for range_start, range_end in _group_ranges(live_days):
+                    tables.append(_fetch_range(client, spec, range_start, range_end))
+
+        done = set(manifest["dates"])
+        paths = [
+            _day_path(site, database, spec, day) for day in days
+            if day <= last_settled and day.isoformat() in done and os.path.exists(_day_path(site, database, spec, day))
+        ]
+
+    if paths:
+        tables[:0] = [pq.read_table(path, schema=spec.schema()) for path in paths]
+    if not tables:
+        return spec.schema().empty_table()
+    return pa.concat_tables(tables)
+
+
+async def load_events_async(
+    site: str,
+    start_date: str,
+    end_date: str,
+    database: str = 'plusinsight',
+    dataset: str = "pickup",
+) -> Optional["pa.Table"]:
+    """load_events()를 스레드에서 실행"""
+    return await asyncio.to_thread(load_events, site, start_date, end_date, database, dataset)
+
+
+def age_group_labels(ages: "pa.Array") -> "pa.Array":
+    """shelf.analysis_flexible / insight.zone_sequences와 같은 연령대 라벨"""
+    labels = pc.if_else(pc.is_valid(ages), "10세 미만", pa.scalar(None, pa.string()))
+    for threshold, label in ((10, '10대'), (20, '20대'), (30, '30대'), (40, '40대'), (50, '50대'), (60, '60대 이상')):
+        labels = pc.if_else(pc.greater_equal(ages, threshold), label, labels)
+    return pc.fill_null(labels, '미상')
+
+
+def gender_labels_of(genders: "pa.Array") -> "pa.Array":
+    labels = pc.if_else(pc.equal(genders, 0), '남자', pc.if_else(pc.equal(genders, 1), '여자', '미상'))
+    return pc.fill_null(labels, '미상')
+
+
+def _timestamp_bound(value: str) -> datetime:
+    """ClickHouse가 DateTime과 비교할 때처럼 'YYYY-MM-DD'는 0시로 해석"""
+    return datetime.fromisoformat(value) if len(value) > 10 else datetime.fromisoformat(value[:10])
+
+
+def _person_starts(person_seq: "pa.Array") -> "np.ndarray":
+    """person_seq로 정렬된 배열에서 고객이 바뀌는 위치 (첫 위치 포함)"""
+    keys = person_seq.to_numpy(zero_copy_only=False)
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def pickup_events(
+    table: "pa.Table",
+    start_hour: int = 0,
+    end_hour: int = 23,
+    age_groups: Optional[Sequence[str]] = None,
+    gender_labels: Optional[Sequence[str]] = None,
+    exclude_keyword: str = "시식대",
+    timestamp_range: Optional[Tuple[str, str]] = None,
+) -> "pa.Table":
+    """픽업 이벤트 필터 후 (person_seq, timestamp) 순으로 정렬한 (person_seq, zone_name) 테이블
+
+    날짜 파일 경계와 관계없이 기간 전체에서 person_seq로 묶습니다 (SQL의 GROUP BY e.person_seq).
+    timestamp_range를 주면 SQL의 e.timestamp BETWEEN start AND end와 같은 조건으로 자릅니다.
+    """
+    mask = pc.and_(
+        pc.greater_equal(table.column("hour"), start_hour),
+        pc.less_equal(table.column("hour"), end_hour),
+    )
+    if exclude_keyword:
+        mask = pc.and_(mask, pc.invert(pc.match_substring(table.column("zone_name"), exclude_keyword)))
+    if age_groups:
+        mask = pc.and_(mask, pc.is_in(age_group_labels(table.column("age")), value_set=pa.array(list(age_groups))))
+    if gender_labels:
+        mask = pc.and_(
+            mask, pc.is_in(gender_labels_of(table.column("gender")), value_set=pa.array(list(gender_labels)))
+        )
+    if timestamp_range:
+        start, end = (pa.scalar(_timestamp_bound(value), pa.timestamp("s")) for value in timestamp_range)
+        mask = pc.and_(mask, pc.and_(
+            pc.greater_equal(table.column("timestamp"), start),
+            pc.less_equal(table.column("timestamp"), end),
+        ))
+    filtered = table.filter(mask).select(["person_seq", "timestamp", "zone_name"])
+    return filtered.sort_by([("person_seq", "ascending"), ("timestamp", "ascending")]).select(["person_seq", "zone_name"])
+
+
+def zone_sequences(events: "pa.Table") -> List[List[str]]:
+    """pickup_events() 결과를 고객별 구역 순서 목록으로 변환"""
+    starts = _person_starts(events.column("person_seq").combine_chunks())
+    offsets = pa.array(np.append(starts, events.num_rows).astype(np.int32))
+    return pa.ListArray.from_arrays(offsets, events.column("zone_name").combine_chunks()).to_pylist()
+
+
+def zone_transitions(events: "pa.Table") -> "pa.Table":
+    """pickup_events() 결과에서 구역 전환 횟수 (같은 고객 안, 같은 구역 반복 제외) - 횟수 내림차순"""
+    persons = events.column("person_seq").combine_chunks()
+    zones = events.column("zone_name").combine_chunks()
+    if len(zones) < 2:
+        return pa.table({"from_zone": pa.array([], pa.string()), "to_zone": pa.array([], pa.string()),
+                         "transition_count": pa.array([], pa.int64())})
+    from_zone, to_zone = zones.slice(0, len(zones) - 1), zones.slice(1)
+    valid = pc.and_(
+        pc.equal(persons.slice(0, len(persons) - 1), persons.slice(1)),
+        pc.not_equal(from_zone, to_zone),
+    )
+    pairs = pa.table({"from_zone": from_zone, "to_zone": to_zone}).filter(valid)
+    counts = pairs.group_by(["from_zone", "to_zone"]).aggregate([("from_zone", "count")])
+    counts = counts.rename_columns(["from_zone", "to_zone", "transition_count"])
+    return counts.sort_by([("transition_count", "descending")])
+
+
+def shelf_route_arrays(
+    table: "pa.Table",
+    age_order: Sequence[str],
+    gender_order: Sequence[str],
+    exclude_dates: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """shelf 데이터셋에서 shelf_engine.ShelfRoutes 생성 인자 계산 (PERSON_ROUTES_CTE와 같은 규칙)
+
+    날짜별 집계를 기간 전체의 고객-구역-이벤트 종류별로 다시 합치고 (첫 시각은 min, 횟수는 sum),
+    픽업은 모두, 응시는 3회 이상인 구역만 남겨 고객별로 (첫 시각, 구역명, 종류) 순으로 정렬합니다.
+
+    Returns:
+        {"zones", "zone_codes", "event_masks", "offsets", "age_codes", "gender_codes"}
+        (연령대/성별 코드는 age_order / gender_order의 인덱스)
+    """
+    if exclude_dates:
+        table = table.filter(pc.invert(pc.is_in(table.column("date"), value_set=pa.array(list(exclude_dates)))))
+    # NULL 나이/성별도 하나의 그룹으로 묶이도록 채워서 집계
+    keyed = table.set_column(2, "age", pc.fill_null(table.column("age"), -1))
+    keyed = keyed.set_column(3, "gender", pc.fill_null(keyed.column("gender"), -1))
+    grouped = keyed.group_by(["person_seq", "age", "gender", "event_type", "zone_id", "zone_name"]).aggregate([
+        ("first_event_at", "min"),
+        ("visit_count", "sum"),
+    ])
+    grouped = grouped.filter(pc.or_(
+        pc.equal(grouped.column("event_type"), 1),
+        pc.greater_equal(grouped.column("visit_count_sum"), 3),
+    ))
+    # 픽업 'P'가 응시 'G'보다 뒤에 정렬되도록 (SQL arraySort의 튜플 정렬과 같은 동률 처리)
+    label = pc.if_else(pc.equal(grouped.column("event_type"), 1), "P", "G")
+    grouped = grouped.append_column("label", label).sort_by([
+        ("person_seq", "ascending"), ("age", "ascending"), ("gender", "ascending"),
+        ("first_event_at_min", "ascending"), ("zone_name", "ascending"), ("label", "ascending"),
+    ])
+
+    n = grouped.num_rows
+    person_columns = [grouped.column(name).combine_chunks().to_numpy(zero_copy_only=False)
+                      for name in ("person_seq", "age", "gender")]
+    changed = np.zeros(n, dtype=bool)
+    if n:
+        changed[0] = True
+        for values in person_columns:
+            changed[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(changed)
+
+    encoded = pc.dictionary_encode(grouped.column("zone_name").combine_chunks())
+    first_rows = grouped.take(pa.array(starts, pa.int64()))
+    ages = pc.if_else(pc.equal(first_rows.column("age"), -1), pa.scalar(None, pa.int32()), first_rows.column("age"))
+    genders = pc.if_else(
+        pc.equal(first_rows.column("gender"), -1), pa.scalar(None, pa.int8()), first_rows.column("gender")
+    )
+    age_codes = pc.index_in(age_group_labels(ages), value_set=pa.array(list(age_order)))
+    gender_codes = pc.index_in(gender_labels_of(genders), value_set=pa.array(list(gender_order)))
+    return {
+        "zones": encoded.dictionary.to_pylist(),
+        "zone_codes": encoded.indices.to_numpy().astype(np.int32),
+        "event_masks": np.where(grouped.column("event_type").to_numpy() == 1, 1, 2).astype(np.uint8),
+        "offsets": np.append(starts, n).astype(np.int64),
+        "age_codes": age_codes.to_numpy(zero_copy_only=False).astype(np.int8),
+        "gender_codes": gender_codes.to_numpy(zero_copy_only=False).astype(np.int8),
+    }
+
+
+def clear_event_cache(site: Optional[str] = None, database: str = 'plusinsight') -> int:
+    """캐시 파일 삭제 (site가 없으면 해당 DB 전체) -> 삭제한 매장 디렉터리 수"""
+    base = os.path.join(EVENT_CACHE_DIR, database)
+    targets = [_site_dir(site, database)] if site else (
+        [os.path.join(base, name) for name in os.listdir(base)] if os.path.isdir(base) else []
+    )
+    removed = 0
+    for target in targets:
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    if not args:
+        print("사용법: python event_sequence_cache.py <매장명|*> [start_date] [end_date]")
+        print("        python event_sequence_cache.py clear [매장명]")
+        sys.exit(1)
+
+    if args[0] == "clear":
+        print(f"🧹 삭제한 매장 캐시: {clear_event_cache(args[1] if len(args) > 1 else None)}개")
+        sys.exit(0)
+
+    if not PYARROW_AVAILABLE:
+        print("❌ 이벤트 시퀀스 캐시를 사용할 수 없습니다 (pyarrow 확인)")
+        sys.exit(1)
+    # CLI로 미리 채울 때는 환경 변수와 관계없이 캐시 사용
+    EVENT_CACHE_ENABLED = True
+
+    last_settled = date.today() - timedelta(days=EVENT_CACHE_SETTLE_DAYS)
+    end_arg = args[2] if len(args) > 2 else last_settled.isoformat()
+    start_arg = args[1] if len(args) > 1 else (last_settled - timedelta(days=EVENT_CACHE_BACKFILL_DAYS - 1)).isoformat()
+
+    target_sites = get_all_sites() if args[0] == "*" else [args[0]]
+    for target in target_sites:
+        for name in DATASETS:
+            try:
+                started = time.perf_counter()
+                loaded = load_events(target, start_arg, end_arg, dataset=name)
+                if loaded is None:
+                    print({"site": target, "dataset": name, "error": "연결 실패"})
+                else:
+                    print({"site": target, "dataset": name, "rows": loaded.num_rows,
+                           "elapsed_sec": round(time.perf_counter() - started, 2)})
+            except Exception as e:
+                print({"site": target, "dataset": name, "error": str(e)})
@@ -0,0 +1,301 @@
+"""
+Markov Shopper Path Model
+=========================
+
+customer_behavior_event 픽업 시퀀스로 매장/세그먼트/시간대별 구역 전이 확률 행렬을 만들고
+경로 질문(정상 분포, 기대 방문 횟수, k단계 내 도달 확률)에 행렬-벡터 곱으로 답합니다.
+
+- 전이 횟수는 utils.build_transition_matrix (NumPy bincount)로 계산
+- 구역 수가 수십~수백 개라 전이 확률 행렬은 NumPy 밀집 행렬로 보관
+- 만들어진 모델은 (매장, DB, 기간, 시간대, 세그먼트) 단위로 메모리에 캐시
+  (기간이 오늘 이전에 끝나면 긴 TTL, 오늘을 포함하면 짧은 TTL - result_cache와 동일 기준)
+
+사용법:
+    model = await get_markov_model(site, "plusinsight", "2025-06-01", "2025-06-30")
+    model.reach_probability(model.match_zones("빵"), steps=3)
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database_manager import query_template_async
+from query_templates import QueryTemplate
+from result_cache import ttl_for_arguments
+from utils import build_transition_matrix
+import event_sequence_cache
+
+MARKOV_CACHE_MAX_MODELS = int(os.getenv("MARKOV_CACHE_MAX_MODELS", "64"))
+# 정상 분포 거듭제곱법 수렴 기준
+MARKOV_STATIONARY_TOL = float(os.getenv("MARKOV_STATIONARY_TOL", "1e-10"))
+MARKOV_STATIONARY_MAX_ITER = int(os.getenv("MARKOV_STATIONARY_MAX_ITER", "1000"))
+
+# 고객별 시간순 픽업 구역 시퀀스 (연령대/성별 라벨은 shelf.analysis_flexible과 동일)
+ZONE_SEQUENCE_QUERY = QueryTemplate("insight.zone_sequences", """
+SELECT
+    arrayMap(x -> x.2, arraySort(x -> x.1, groupArray((e.timestamp, z.name)))) AS visited_zones_in_order
+FROM customer_behavior_event e
+INNER JOIN customer_behavior_area a
+    ON e.customer_behavior_area_id = a.id
+INNER JOIN zone z
+    ON a.attention_target_zone_id = z.id
+WHERE
+    e.is_staff = false
+    AND e.event_type = 1
+    AND z.name NOT LIKE '%시식대%'
+    AND e.date BETWEEN {start_date:String} AND {end_date:String}
+    AND toHour(e.timestamp) BETWEEN {start_hour:UInt8} AND {end_hour:UInt8}
+    AND (empty({age_groups:Array(String)}) OR has({age_groups:Array(String)}, multiIf(
+        e.age >= 60, '60대 이상',
+        e.age >= 50, '50대',
+        e.age >= 40, '40대',
+        e.age >= 30, '30대',
+        e.age >= 20, '20대',
+        e.age >= 10, '10대',
+        e.age IS NULL, '미상',
+        '10세 미만'
+    )))
+    AND (empty({gender_labels:Array(String)}) OR has({gender_labels:Array(String)}, multiIf(
+        e.gender = 0, '남자',
+        e.gender = 1, '여자',
+        '미상'
+    )))
+GROUP BY e.person_seq
+HAVING length(visited_zones_in_order) >= 1""")
+
+
+class MarkovModel:
+    """구역 전이 확률 행렬 P (행 정규화)와 시작 구역 분포
+
+    마지막 픽업 이후(나가는 전이가 없는 구역)는 쇼핑 종료로 보고 확률 질량이 빠져나갑니다.
+    정상 분포에서는 종료된 질량이 시작 구역 분포로 다시 들어오는 것으로 봅니다.
+    """
+
+    __slots__ = ("zones", "counts", "entry", "shoppers", "_p", "_pt", "_index")
+
+    def __init__(self, zones: List[str], counts: np.ndarray, entry: np.ndarray, shoppers: int):
+        self.zones = zones
+        self.counts = counts
+        self.entry = entry
+        self.shoppers = shoppers
+        self._index = {zone: i for i, zone in enumerate(zones)}
+
+        row_sums = counts.sum(axis=1, keepdims=True).astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self._p = np.where(row_sums > 0, counts / row_sums, 0.0)
+        # 행 벡터 x에 대해 x @ P 대신 P^T @ x 로 계산 (연속 메모리로 한 번만 전치)
+        self._pt = np.ascontiguousarray(self._p.T)
+
+    @classmethod
+    def from_sequences(cls, sequences: Sequence[Sequence[str]]) -> "MarkovModel":
+        matrix = build_transition_matrix(sequences)
+        index = matrix.index()
+        entry = np.zeros(matrix.size)
+        for sequence in sequences:
+            if len(sequence) > 0:
+                entry[index[sequence[0]]] += 1
+        if entry.sum() > 0:
+            entry /= entry.sum()
+        return cls(matrix.zones, matrix.counts, entry, len(sequences))
+
+    @property
+    def size(self) -> int:
+        return len(self.zones)
+
+    @property
+    def transitions(self) -> int:
+        return int(self.counts.sum())
+
+    def match_zones(self, keyword: str) -> List[int]:
+        """구역 이름이 정확히 같으면 그 구역, 아니면 keyword를 포함하는 모든 구역"""
+        keyword = keyword.strip()
+        if keyword in self._index:
+            return [self._index[keyword]]
+        return [i for i, zone in enumerate(self.zones) if keyword and keyword in zone]
+
+    def _start_vector(self, start: Sequence[int]) -> np.ndarray:
+        """시작 구역들의 분포 (여러 구역이면 각 구역의 유입 비중으로 가중)"""
+        x = np.zeros(self.size)
+        weights = self.counts.sum(axis=0)[list(start)].astype(float) + self.entry[list(start)] * self.shoppers
+        if weights.sum() == 0:
+            weights = np.ones(len(start))
+        x[list(start)] = weights / weights.sum()
+        return x
+
+    def _step(self, x: np.ndarray) -> np.ndarray:
+        """x @ P"""
+        return self._pt @ x
+
+    def step_distribution(self, start: Sequence[int], steps: int) -> np.ndarray:
+        """시작 구역에서 정확히 steps번 이동한 뒤의 위치 분포 (합 < 1이면 나머지는 쇼핑 종료)"""
+        x = self._start_vector(start)
+        for _ in range(steps):
+            x = self._step(x)
+        return x
+
+    def expected_visits(self, start: Sequence[int], steps: int) -> np.ndarray:
+        """시작 구역 이후 steps번 이동 동안 각 구역의 기대 방문(픽업) 횟수 = Σ_{t=1..k} x P^t"""
+        x = self._start_vector(start)
+        total = np.zeros(self.size)
+        for _ in range(steps):
+            x = self._step(x)
+            total += x
+        return total
+
+    def reach_probability(self, start: Sequence[int], steps: int) -> np.ndarray:
+        """시작 구역 이후 steps번 이동 안에 각 구역을 한 번이라도 방문할 확률
+
+        목표 구역 j마다 "아직 j에 가지 않은" 확률 질량을 한 행씩 두고 (N×N)
+        한 단계마다 P를 곱한 뒤 j에 도착한 질량을 누적하고 제거합니다.
+        """
+        n = self.size
+        x = self._start_vector(start)
+        # mass[j] = 아직 j를 방문하지 않은 경로의 위치 분포
+        mass = np.tile(x, (n, 1))
+        reached = np.zeros(n)
+        diagonal = np.arange(n)
+        # 시작 구역 자체는 도달로 보지 않음
+        mass[diagonal, diagonal] = 0.0
+        for _ in range(steps):
+            mass = (self._pt @ mass.T).T
+            reached += mass[diagonal, diagonal]
+            mass[diagonal, diagonal] = 0.0
+        return reached
+
+    def stationary_distribution(self) -> np.ndarray:
+        """장기적으로 고객이 각 구역에 머무는 비율 (종료된 질량은 시작 구역 분포로 재유입)"""
+        if self.size == 0:
+            return np.zeros(0)
+        x = self.entry.copy() if self.entry.sum() > 0 else np.full(self.size, 1.0 / self.size)
+        for _ in range(MARKOV_STATIONARY_MAX_ITER):
+            nxt = self._step(x)
+            nxt += (1.0 - nxt.sum()) * self.entry
+            if np.abs(nxt - x).sum() < MARKOV_STATIONARY_TOL:
+                x = nxt
+                break
+            x = nxt
+        return x / x.sum()
+
+    def top(self, values: np.ndarray, top_n: int, exclude: Sequence[int] = ()) -> List[Tuple[str, float]]:
+        """값이 큰 순서대로 (구역, 값) 목록"""
+        order = np.argsort(-values, kind="stable")
+        excluded = set(exclude)
+        result = []
+        for i in order.tolist():
+            if i in excluded or values[i] <= 0:
+                continue
+            result.append((self.zones[i], float(values[i])))
+            if len(result) >= top_n:
+                break
+        return result
+
+
+# (site, database, start_date, end_date, start_hour, end_hour, age_groups, gender_labels) -> (만료 시각, 모델)
+_models: "OrderedDict[Tuple, Tuple[float, MarkovModel]]" = OrderedDict()
+_models_lock = threading.Lock()
+_build_locks: Dict[Tuple, asyncio.Lock] = {}
+
+
+def _cached_model(key: Tuple) -> Optional[MarkovModel]:
+    with _models_lock:
+        entry = _models.get(key)
+        if entry is None:
+            return None
+        expires_at, model = entry
+        if expires_at < time.monotonic():
+            del _models[key]
+            return None
+        _models.move_to_end(key)
+        return model
+
+
+def _store_model(key: Tuple, model: MarkovModel, ttl: float):
+    with _models_lock:
+        _models[key] = (time.monotonic() + ttl, model)
+        _models.move_to_end(key)
+        while len(_models) > MARKOV_CACHE_MAX_MODELS:
+            _models.popitem(last=False)
+
+
+async def get_markov_model(
+    site: str,
+    database: str,
+    start_date: str,
+    end_date: str,
+    start_hour: int = 0,
+    end_hour: int = 23,
+    age_groups: Optional[List[str]] = None,
+    gender_labels: Optional[List[str]] = None,
+) -> Optional[MarkovModel]:
+    """캐시된 모델 반환 (없으면 이벤트 시퀀스를 조회해 생성, 연결 실패 시 None)"""
+    age_groups = sorted(set(age_groups or []))
+    gender_labels = sorted(set(gender_labels or []))
+    key = (site, database, start_date, end_date, start_hour, end_hour, tuple(age_groups), tuple(gender_labels))
+
+    model = _cached_model(key)
+    if model is not None:
+        return model
+
+    # 같은 조건의 동시 요청은 한 번만 조회
+    lock = _build_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        try:
+            return await _build_model(key, site, database, start_date, end_date,
+                                      start_hour, end_hour, age_groups, gender_labels)
+        finally:
+            # 락을 쥔 채로 정리해야 기다리던 요청과 새 요청이 같은 모델을 다시 만들지 않음
+            if _build_locks.get(key) is lock:
+                del _build_locks[key]
+
+
+async def _build_model(
+    key: Tuple,
+    site: str,
+    database: str,
+    start_date: str,
+    end_date: str,
+    start_hour: int,
+    end_hour: int,
+    age_groups: List[str],
+    gender_labels: List[str],
+) -> Optional[MarkovModel]:
+    """모델 생성 후 캐시에 저장 (get_markov_model의 빌드 락 안에서 호출)"""
+    model = _cached_model(key)
+    if model is not None:
+        return model
+
+    if event_sequence_cache.is_enabled():
+        # 로컬 이벤트 캐시에서 읽고 빠진 날짜만 ClickHouse에서 받음
+        table = await event_sequence_cache.load_events_async(site, start_date, end_date, database)
+        if table is None:
+            return None
+        events = event_sequence_cache.pickup_events(table, start_hour, end_hour, age_groups, gender_labels)
+        sequences = event_sequence_cache.zone_sequences(events)
+    else:
+        result = await query_template_async(
+            site, ZONE_SEQUENCE_QUERY, database, column_oriented=True,
+            start_date=start_date, end_date=end_date,
+            start_hour=start_hour, end_hour=end_hour,
+            age_groups=age_groups, gender_labels=gender_labels,
+        )
+        if result is None:
+            return None
+        sequences = result.result_columns[0] if result.result_columns else []
+
+    model = await asyncio.to_thread(MarkovModel.from_sequences, sequences)
+    _store_model(key, model, ttl_for_arguments({"start_date": start_date, "end_date": end_date}))
+    return model
+
+
+def invalidate_markov_models(site: Optional[str] = None) -> int:
+    """캐시된 모델 삭제 (site가 없으면 전체) -> 삭제된 모델 수"""
+    with _models_lock:
+        keys = [key for key in _models if site is None or key[0] == site]
+        for key in keys:
+            del _models[key]
+    return len(keys)
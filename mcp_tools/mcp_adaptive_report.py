@@ -29,7 +29,8 @@ from pathlib import Path
 from typing import Any, Dict, List, Union, Optional, Literal
 
 # 새로운 데이터베이스 매니저 import
-from database_manager import get_site_client
+from database_manager import query_async
+import report_store
 import re
 
 from fastmcp import FastMCP
@@ -51,6 +52,16 @@ def _load_css_file():
         .data-table td { padding: 12px 15px; border-bottom: 1px solid #e9ecef; }
         """
 
+# CSV 보고서에 넣을 최대 행 수 (전체 행 수는 업로드 사이드카에서 확인)
+CSV_REPORT_MAX_ROWS = int(os.getenv("CSV_REPORT_MAX_ROWS", "10000"))
+
+def _load_upload_meta(file_path: str) -> Optional[Dict[str, Any]]:
+    """백엔드 업로드 시 저장한 사이드카 메타데이터 ("{파일}.meta.json", 없으면 None)"""
+    try:
+        return json.loads(Path(f"{file_path}.meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
 CHART_JS_CDN = """
         <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
 """
@@ -679,7 +690,6 @@ def create_html_report(
     data: Union[Dict, List, str],
     title: str = "자동 생성 보고서",
     description: str = "",
-    output_dir: str = "report",
     include_charts: bool = False,
     theme: str = "light",
     custom_template: Optional[str] = None,
@@ -713,8 +723,6 @@ def create_html_report(
         보고서 제목
     description : str, default=""
         보고서 설명/부제목
-    output_dir : str, default="report"
-        HTML 파일을 저장할 디렉토리
     include_charts : bool, default=False
         차트/그래프 포함 여부 (Chart.js 사용)
     theme : str, default="light"
@@ -754,37 +762,39 @@ def create_html_report(
             except json.JSONDecodeError:
                 return f"❌ 오류: 파일을 찾을 수 없습니다: {data}"
         
-        # 보고서 생성
-        builder = AdaptiveReportBuilder(theme=theme)
-        html, file_path = builder.generate(
-            data,
-            title=title,
-            description=description,
-            output_dir=output_dir,
-            save=True,
-            include_charts=include_charts,
-            custom_template=custom_template,
-        )
-        
-        if not file_path:
-            return "❌ 보고서 생성 실패"
-        
-        # 웹 접근 가능한 URL 생성 (chat 디렉토리에도 복사)
-        filename = Path(file_path).name
-        chat_report_dir = Path("../chat/report")
-        chat_report_dir.mkdir(parents=True, exist_ok=True)
-        
-        chat_file_path = chat_report_dir / filename
-        chat_file_path.write_text(html, encoding="utf-8")
-        
-        web_url = f"/reports/{filename}"
+        # 같은 데이터/옵션으로 만든 보고서가 이미 있으면 렌더링 없이 기존 URL 사용
+        # (파일 경로는 내용이 바뀌면 다른 보고서가 되도록 수정 시각과 크기를 함께 반영)
+        source = data
+        if isinstance(data, str):
+            stat = Path(data).stat()
+            source = {"path": str(Path(data).resolve()), "mtime": stat.st_mtime, "size": stat.st_size}
+        data_fingerprint = report_store.fingerprint({
+            "data": source,
+            "title": title,
+            "description": description,
+            "include_charts": include_charts,
+            "theme": theme,
+            "custom_template": custom_template,
+        })
+        web_url = report_store.find("adaptive_report", [site], "", data_fingerprint)
+        if web_url is None:
+            builder = AdaptiveReportBuilder(theme=theme)
+            html, _ = builder.generate(
+                data,
+                title=title,
+                description=description,
+                save=False,
+                include_charts=include_charts,
+                custom_template=custom_template,
+            )
+            # 보고서 저장소에 한 번만 저장 (gzip/brotli 압축본 포함, 백엔드 /reports 에서 서빙)
+            web_url = report_store.put("adaptive_report", [site], "", data_fingerprint, html, prefix="report")
         
         return f"""📊 **적응형 HTML 보고서 생성 완료!**
 
 🔗 **[웹에서 보기]({web_url})**
 
 📁 **파일 정보:**
-- 로컬 경로: `{file_path}`
 - 웹 경로: `{web_url}`
 - 테마: {theme}
 - 차트 포함: {'✅' if include_charts else '❌'}
@@ -904,7 +914,7 @@ def analyze_data_structure(
         return f"❌ 데이터 분석 중 오류 발생: {str(e)}"
 
 @mcp.tool()
-def create_report_from_clickhouse(
+async def create_report_from_clickhouse(
     *,
     query: str,
     title: str = "ClickHouse 쿼리 결과 보고서",
@@ -938,32 +948,10 @@ def create_report_from_clickhouse(
     """
     
     try:
-        # ClickHouse 클라이언트 생성 (기존 워크플로우 로직 재사용)
-        import clickhouse_connect
-        from dotenv import load_dotenv
-        
-        load_dotenv()
-        
-        # 환경변수 로드
-        CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST")
-        CLICKHOUSE_PORT = os.getenv("CLICKHOUSE_PORT")
-        CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER")
-        CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD")
-        
-        if not all([CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD]):
-            return "❌ ClickHouse 연결 정보가 설정되지 않았습니다. 환경변수를 확인해주세요."
-        
-        # 클라이언트 생성
-        client = clickhouse_connect.get_client(
-            host=CLICKHOUSE_HOST,
-            port=int(CLICKHOUSE_PORT),
-            username=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD,
-            database=database,
-        )
-        
-        # 쿼리 실행
-        result = client.query(query)
+        # 매장 클라이언트 풀을 통해 비동기 쿼리 실행
+        result = await query_async(site, query, database)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
         
         if not result.result_rows:
             return "❌ 쿼리 결과가 없습니다."
@@ -974,26 +962,26 @@ def create_report_from_clickhouse(
         for row in result.result_rows:
             data.append(dict(zip(columns, row)))
         
-        # 보고서 생성
-        html, file_path = generate_report(
-            data,
-            title=title,
-            description=f"{description}\n\n**실행된 쿼리:**\n```sql\n{query}\n```" if description else f"**실행된 쿼리:**\n```sql\n{query}\n```",
-            include_charts=include_charts,
-        )
-        
-        if not file_path:
-            return "❌ 보고서 생성 실패"
-        
-        # 웹 접근 가능한 URL 생성
-        filename = Path(file_path).name
-        chat_report_dir = Path("../chat/report")
-        chat_report_dir.mkdir(parents=True, exist_ok=True)
-        
-        chat_file_path = chat_report_dir / filename
-        chat_file_path.write_text(html, encoding="utf-8")
-        
-        web_url = f"/reports/{filename}"
+        # 같은 쿼리/결과로 만든 보고서가 이미 있으면 렌더링 없이 기존 URL 사용
+        data_fingerprint = report_store.fingerprint({
+            "database": database,
+            "query": query,
+            "title": title,
+            "description": description,
+            "include_charts": include_charts,
+            "rows": data,
+        })
+        web_url = report_store.find("clickhouse_report", [site], "", data_fingerprint)
+        if web_url is None:
+            html, _ = generate_report(
+                data,
+                title=title,
+                description=f"{description}\n\n**실행된 쿼리:**\n```sql\n{query}\n```" if description else f"**실행된 쿼리:**\n```sql\n{query}\n```",
+                include_charts=include_charts,
+                save=False,
+            )
+            # 보고서 저장소에 한 번만 저장 (gzip/brotli 압축본 포함, 백엔드 /reports 에서 서빙)
+            web_url = report_store.put("clickhouse_report", [site], "", data_fingerprint, html, prefix="report")
         
         return f"""📊 **ClickHouse 쿼리 결과 보고서 생성 완료!**
 
@@ -1044,36 +1032,59 @@ def create_report_from_csv(
         if not Path(csv_path).exists():
             return f"❌ CSV 파일을 찾을 수 없습니다: {csv_path}"
         
-        # CSV 파일 읽기
+        # 업로드 시 파악한 구조(인코딩, 구분자, 행 수)가 있으면 파일을 다시 훑지 않고 사용
+        meta = _load_upload_meta(csv_path)
+        csv_info = (meta or {}).get("csv")
+        delimiter = ","
+        if csv_info:
+            if csv_info["row_count"] == 0:
+                return "❌ CSV 파일이 비어있습니다."
+            delimiter = csv_info["delimiter"]
+            if encoding == "utf-8":
+                encoding = csv_info["encoding"]
+        
+        # 같은 파일/옵션으로 만든 보고서가 있으면 다시 읽지 않고 기존 URL 사용
+        data_fingerprint = report_store.fingerprint({
+            "source": meta["sha256"] if meta else [csv_path, Path(csv_path).stat().st_mtime_ns],
+            "title": title,
+            "description": description,
+            "include_charts": include_charts,
+            "encoding": encoding,
+            "max_rows": CSV_REPORT_MAX_ROWS,
+        })
+        web_url = report_store.find("csv_report", [site], "", data_fingerprint)
+        
+        # CSV 파일 읽기 (보고서에는 앞의 CSV_REPORT_MAX_ROWS행까지만)
         import csv
+        from itertools import islice
         data = []
-        with open(csv_path, 'r', encoding=encoding) as f:
-            reader = csv.DictReader(f)
-            data = list(reader)
-        
-        if not data:
-            return "❌ CSV 파일이 비어있습니다."
-        
-        # 보고서 생성
-        html, file_path = generate_report(
-            data,
-            title=title,
-            description=f"{description}\n\n**소스 파일:** `{csv_path}`" if description else f"**소스 파일:** `{csv_path}`",
-            include_charts=include_charts,
-        )
-        
-        if not file_path:
-            return "❌ 보고서 생성 실패"
-        
-        # 웹 접근
-        filename = Path(file_path).name
-        chat_report_dir = Path("../chat/report")
-        chat_report_dir.mkdir(parents=True, exist_ok=True)
-        
-        chat_file_path = chat_report_dir / filename
-        chat_file_path.write_text(html, encoding="utf-8")
-        
-        web_url = f"/reports/{filename}"
+        if web_url is None or not csv_info:
+            with open(csv_path, 'r', encoding=encoding, newline='') as f:
+                data = list(islice(csv.DictReader(f, delimiter=delimiter), CSV_REPORT_MAX_ROWS))
+        columns = csv_info["columns"] if csv_info else (list(data[0].keys()) if data else [])
+        
+        if web_url is None:
+            if not data:
+                return "❌ CSV 파일이 비어있습니다."
+            
+            # 보고서 생성
+            html, _ = generate_report(
+                data,
+                title=title,
+                description=f"{description}\n\n**소스 파일:** `{csv_path}`" if description else f"**소스 파일:** `{csv_path}`",
+                include_charts=include_charts,
+                save=False,
+            )
+            # 보고서 저장소에 한 번만 저장 (백엔드 /reports 에서 서빙)
+            web_url = report_store.put("csv_report", [site], "", data_fingerprint, html, prefix="report")
+        
+        if csv_info:
+            total_rows = csv_info["row_count"]
+            row_summary = f"{total_rows:,}행 데이터"
+            if total_rows > CSV_REPORT_MAX_ROWS:
+                row_summary += f" (보고서에는 앞 {CSV_REPORT_MAX_ROWS:,}행)"
+        else:
+            row_summary = f"{len(data):,}행{' 이상' if len(data) >= CSV_REPORT_MAX_ROWS else ''} 데이터"
         
         return f"""📊 **CSV 보고서 생성 완료!**
 
@@ -1081,8 +1092,8 @@ def create_report_from_csv(
 
 📁 **파일 정보:**
 - 소스: `{csv_path}`
-- 총 {len(data):,}행 데이터
-- {len(data[0])}개 컬럼: {', '.join(data[0].keys())}
+- 총 {row_summary}
+- {len(columns)}개 컬럼: {', '.join(columns)}
 
 💡 보고서를 클릭하여 새 탭에서 확인하세요!"""
         
@@ -7,7 +7,7 @@ MCP Agent Helper 도구
 """
 
 from fastmcp import FastMCP
-from database_manager import get_all_sites
+from database_manager import get_all_sites, is_known_site, refresh_site_registry
 
 mcp = FastMCP("agent_helper")
 
@@ -49,15 +49,32 @@ def validate_site(site: str) -> str:
         str: 검증 결과 메시지
     """
     try:
-        sites = get_all_sites()
-        if site in sites:
+        if is_known_site(site):
             return f"✅ '{site}' 매장이 존재합니다."
         else:
+            sites = get_all_sites()
             available_sites = ", ".join(sites[:5])  # 처음 5개만 표시
             more_text = f" 외 {len(sites)-5}개" if len(sites) > 5 else ""
             return f"❌ '{site}' 매장을 찾을 수 없습니다.\n사용 가능한 매장: {available_sites}{more_text}"
     except Exception as e:
         return f"매장 검증 실패: {e}"
 
+@mcp.tool()
+def refresh_sites() -> str:
+    """
+    매장 목록을 설정 DB에서 다시 불러옵니다.
+    
+    매장이 새로 등록되었는데 목록에 보이지 않을 때 사용합니다.
+    
+    Returns:
+        str: 갱신 결과 메시지
+    """
+    try:
+        if refresh_site_registry():
+            return f"✅ 매장 목록을 갱신했습니다. (총 {len(get_all_sites())}개)"
+        return "❌ 매장 목록 갱신 실패: 설정 DB에 연결할 수 없습니다."
+    except Exception as e:
+        return f"매장 목록 갱신 실패: {e}"
+
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
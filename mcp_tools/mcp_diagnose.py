@@ -1,4 +1,5 @@
 from fastmcp import FastMCP
+import asyncio
 import clickhouse_connect
 import os
 from dotenv import load_dotenv
@@ -9,9 +10,12 @@ from pathlib import Path
 
 from utils import create_transition_data
 from map_config import item2zone
-from database_manager import get_site_client, get_site_connection_info
-from mcp_utils import is_token_limit_exceeded, DEFAULT_MODEL
-from typing import Optional
+from database_manager import query_template_async, get_site_connection_info, resolve_sites, fan_out_sites
+from query_templates import QueryTemplate
+from visitor_base import AVG_IN_QUERY, AVG_IN_SUMMARY_QUERY, choose_template_async
+from mcp_utils import TokenBudget, format_site_table
+from result_cache import cached_tool
+from typing import Optional, List, Callable, Awaitable, Sequence, Any
 
 # SSH 터널링 관련 import
 try:
@@ -54,11 +58,55 @@ os.environ["FASTMCP_LOG_LEVEL"] = "DEBUG"
 
 mcp = FastMCP("diagnose")
 
+# 시간대 명칭 매핑
+TIME_RANGE_NAMES = {
+    '22-01': '심야',
+    '02-05': '새벽',
+    '06-09': '아침',
+    '10-13': '낮',
+    '14-17': '오후',
+    '18-21': '저녁'
+}
+
+def _use_multi_sites(site: str, sites: List[str]) -> bool:
+    """sites가 지정되었거나 site가 "*"이면 다중 매장 모드"""
+    return bool(sites) or site == "*"
+
+async def _diagnose_sites(
+    tool_name: str,
+    site: str,
+    sites: List[str],
+    fetch_rows: Callable[[str], Awaitable[List[Sequence[Any]]]],
+    columns: List[str],
+    title: str,
+    empty_message: str = "⚠️ 데이터 없음",
+) -> str:
+    """여러 매장을 동시에 진단하고 하나의 표로 합쳐서 반환"""
+    target_sites = await asyncio.to_thread(resolve_sites, site, sites)
+    if not target_sites:
+        return "❌ 진단할 매장이 없습니다."
+
+    logger.info(f"{tool_name} 다중 매장 진단 시작: {len(target_sites)}개 매장")
+    outcomes = await fan_out_sites(target_sites, fetch_rows)
+    # 토큰 제한에 닿으면 나머지 행은 생략하고 생략 행 수를 표시
+    answer = format_site_table(title, columns, outcomes, empty_message, budget=TokenBudget())
+
+    logger.info(f"{tool_name} 답변: {answer}")
+    return answer
+
+async def _query_rows(site: str, template: QueryTemplate, database: str = 'plusinsight', **params) -> List[Sequence[Any]]:
+    """쿼리 템플릿 실행 결과 행 목록 반환 (연결 실패 시 예외)"""
+    result = await query_template_async(site, template, database, **params)
+    if result is None:
+        raise ConnectionError("연결 실패")
+    return result.result_rows
+
 @mcp.tool()
-def get_db_name(site: str) -> str:
+async def get_db_name(site: str) -> str:
     """특정 매장의 데이터베이스명 조회"""
     try:
-        connection_info = get_site_connection_info(site)
+        # 레지스트리 갱신 시 설정 DB 조회가 일어날 수 있으므로 스레드에서 실행
+        connection_info = await asyncio.to_thread(get_site_connection_info, site)
         if not connection_info:
             return f"❌ {site} 매장 정보를 찾을 수 없습니다."
         
@@ -67,8 +115,41 @@ def get_db_name(site: str) -> str:
     except Exception as e:
         return f"❌ {site} 매장 DB명 조회 실패: {e}"
 
+AVG_IN_COLUMNS = ["일평균", "평일", "주말", "남성", "여성", "연령대 Top3", "평일 피크", "주말 피크"]
+
+async def _avg_in_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    """diagnose_avg_in 결과를 매장당 한 행으로 요약"""
+    template = await choose_template_async(site, start_date, end_date, AVG_IN_SUMMARY_QUERY, AVG_IN_QUERY)
+    rows = await _query_rows(site, template, start_date=start_date, end_date=end_date)
+    if not rows:
+        return []
+
+    daily = {}
+    gender = {}
+    ages = []
+    peaks = {}
+    for section, label, value_cnt, value_pct in rows:
+        if section == '일평균':
+            daily[label] = f"{value_cnt}명"
+        elif section == '성별경향':
+            gender[label] = f"{value_pct}%"
+        elif section == '연령대경향':
+            ages.append(f"{label.split('위_')[1]}({value_pct}%)")
+        elif section == '시간대경향':
+            day_type, rank, time_range = label.split('_')
+            if rank == '1':
+                peaks[day_type] = f"{TIME_RANGE_NAMES.get(time_range, time_range)}({time_range}) {value_pct}%"
+
+    return [(
+        daily.get('전체', '-'), daily.get('평일', '-'), daily.get('주말', '-'),
+        gender.get('남성', '-'), gender.get('여성', '-'),
+        ", ".join(ages) or '-',
+        peaks.get('평일', '-'), peaks.get('주말', '-'),
+    )]
+
 @mcp.tool()
-def diagnose_avg_in(start_date: str, end_date: str, site: str) -> str:
+@cached_tool
+async def diagnose_avg_in(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
     """일평균 방문객 수 진단
     
     👥 CUSTOMER BEHAVIOR DATABASE TOOL (plusinsight only)
@@ -82,135 +163,30 @@ def diagnose_avg_in(start_date: str, end_date: str, site: str) -> str:
     Args:
         start_date: 시작 날짜 (YYYY-MM-DD)
         end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수) - 해당 매장의 plusinsight DB에 연결
+        site: 매장명 (sites 미지정 시 필수) - 해당 매장의 plusinsight DB에 연결
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
         
     Returns:
-        일평균 방문객 수, 성별/연령/시간대별 분석 결과
+        일평균 방문객 수, 성별/연령/시간대별 분석 결과 (다중 매장이면 매장별 요약 표)
         
     🔄 조합 사용법: POS 분석과 함께 사용하려면 diagnose_purchase_conversion_rate 사용
     """
     # 파라미터 기록
-    param_log = f"diagnose_avg_in 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
+    param_log = f"diagnose_avg_in 호출됨: start_date={start_date}, end_date={end_date}, site={site}, sites={sites}"
     logger.info(param_log)
-    
-    query = f"""
-        WITH
-df AS (
-    SELECT
-        li.date AS visit_date,
-        li.timestamp,
-        li.person_seq AS visitor_id,
-        if(toDayOfWeek(li.date) IN (1,2,3,4,5), 'weekday', 'weekend')                     AS day_type,
-        multiIf(
-            toHour(li.timestamp) IN (22,23,0,1), '22-01',
-            toHour(li.timestamp) BETWEEN 2  AND 5 , '02-05',
-            toHour(li.timestamp) BETWEEN 6  AND 9 , '06-09',
-            toHour(li.timestamp) BETWEEN 10 AND 13, '10-13',
-            toHour(li.timestamp) BETWEEN 14 AND 17, '14-17',
-            '18-21'
-        ) AS time_range,
-        multiIf(
-            dt.age BETWEEN 0  AND  9 , '10대 미만',
-            dt.age BETWEEN 10 AND 19, '10대',
-            dt.age BETWEEN 20 AND 29, '20대',
-            dt.age BETWEEN 30 AND 39, '30대',
-            dt.age BETWEEN 40 AND 49, '40대',
-            dt.age BETWEEN 50 AND 59, '50대',
-            dt.age >= 60           , '60대 이상',
-            'Unknown'
-        ) AS age_group,
-        if(dt.gender = '0', '남성', if(dt.gender='1','여성','Unknown'))                   AS gender
-    FROM line_in_out_individual li
-    LEFT JOIN detected_time dt ON li.person_seq = dt.person_seq
-    LEFT JOIN line          l  ON li.triggered_line_id = l.id
-    WHERE li.date BETWEEN '{start_date}' AND '{end_date}'
-      AND li.is_staff = 0
-      AND li.in_out   = 'IN'
-      AND l.entrance  = 1
-),
-daily_all     AS (SELECT visit_date, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date),
-avg_all       AS (SELECT toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_all),
-daily_dayType AS (SELECT visit_date, day_type, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, day_type),
-avg_dayType   AS (SELECT day_type, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_dayType GROUP BY day_type),
-daily_gender  AS (SELECT visit_date, gender, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, gender),
-avg_gender    AS (SELECT gender, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_gender GROUP BY gender),
-daily_age     AS (SELECT visit_date, age_group, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, age_group),
-avg_age       AS (SELECT age_group, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_age GROUP BY age_group),
-rank_age      AS (SELECT *, row_number() OVER (ORDER BY avg_cnt DESC) AS rk FROM avg_age),
-overall_cnt   AS (SELECT avg_cnt AS cnt FROM avg_all),
-range_cnt AS (
-    SELECT day_type, time_range, uniqExact(visitor_id) AS visit_cnt
-    FROM df GROUP BY day_type, time_range
-),
-tot_cnt   AS (SELECT day_type, sum(visit_cnt) AS total_cnt FROM range_cnt GROUP BY day_type),
-range_pct AS (
-    SELECT r.day_type, r.time_range, r.visit_cnt,
-           toUInt64(round(
-               CASE 
-                   WHEN t.total_cnt > 0 THEN r.visit_cnt / t.total_cnt * 100
-                   ELSE 0
-               END
-           )) AS pct
-    FROM range_cnt r JOIN tot_cnt t USING(day_type)
-),
-rank_slot AS (
-    SELECT *, row_number() OVER (PARTITION BY day_type ORDER BY pct DESC) AS rk
-    FROM range_pct
-),
-final AS (
-    SELECT '일평균' AS section, '전체' AS label,
-           avg_cnt AS value_cnt, CAST(NULL AS Nullable(UInt64)) AS value_pct, 0 AS ord
-    FROM avg_all
-    UNION ALL
-    SELECT '일평균', '평일', avg_cnt, CAST(NULL AS Nullable(UInt64)), 1
-    FROM avg_dayType WHERE day_type='weekday'
-    UNION ALL
-    SELECT '일평균', '주말', avg_cnt, CAST(NULL AS Nullable(UInt64)), 2
-    FROM avg_dayType WHERE day_type='weekend'
-    UNION ALL
-    SELECT '성별경향', gender, avg_cnt,
-           toUInt64(round(
-               CASE 
-                   WHEN (SELECT cnt FROM overall_cnt) > 0 THEN avg_cnt / (SELECT cnt FROM overall_cnt) * 100
-                   ELSE 0
-               END
-           )) AS value_pct,
-           10 + if(gender='남성',0,1) AS ord
-    FROM avg_gender WHERE gender IN ('남성','여성')
-    UNION ALL
-    SELECT '연령대경향',
-           concat(toString(rk),'위_',age_group)                         AS label,
-           avg_cnt,
-           toUInt64(round(
-               CASE 
-                   WHEN (SELECT cnt FROM overall_cnt) > 0 THEN avg_cnt / (SELECT cnt FROM overall_cnt) * 100
-                   ELSE 0
-               END
-           )) AS value_pct,
-           20 + rk AS ord
-    FROM rank_age WHERE rk<=3
-    UNION ALL
-    SELECT '시간대경향',
-           concat('평일_',toString(rk),'_',time_range)                 AS label,
-           visit_cnt, pct, 30 + rk
-    FROM rank_slot WHERE day_type='weekday' AND rk<=3
-    UNION ALL
-    SELECT '시간대경향',
-           concat('주말_',toString(rk),'_',time_range),
-           visit_cnt, pct, 40 + rk
-    FROM rank_slot WHERE day_type='weekend' AND rk<=3
-)
-SELECT section, label, value_cnt, value_pct
-FROM final
-ORDER BY ord
-"""
 
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "diagnose_avg_in", site, sites,
+            lambda s: _avg_in_rows(s, start_date, end_date),
+            AVG_IN_COLUMNS, f"일평균 방문객 진단 ({start_date} ~ {end_date})"
+        )
+    
     try:
-        client = get_site_client(site)
-        if not client:
+        template = await choose_template_async(site, start_date, end_date, AVG_IN_SUMMARY_QUERY, AVG_IN_QUERY)
+        result = await query_template_async(site, template, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query)
 
         if len(result.result_rows) > 0:
             # 섹션별로 데이터 분류
@@ -289,18 +265,10 @@ ORDER BY ord
 
 # diagnose_avg_sales 함수는 mcp_pos.py의 pos_daily_sales_stats로 이동됨
 
-@mcp.tool()
-def check_zero_visits(start_date: str, end_date: str, site: str) -> str:
-    """방문객수 데이터 이상 조회
-    
-    Args:
-        start_date: 시작 날짜 (YYYY-MM-DD)
-        end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수)
-    """
-    query = f"""WITH
-start_date AS (SELECT toDate('{start_date}') AS value),
-end_date AS (SELECT toDate('{end_date}') AS value),
+# 기간 내 날짜 목록 (방문 기록이 없는 날짜도 찾기 위함)
+_ZERO_VISITS_HEAD = """WITH
+start_date AS (SELECT toDate({start_date:String}) AS value),
+end_date AS (SELECT toDate({end_date:String}) AS value),
 date_range AS (
     SELECT addDays((SELECT value FROM start_date), number) AS date
     FROM numbers(
@@ -309,32 +277,10 @@ date_range AS (
         ))
     )
 ),
-daily_visits AS (
-    SELECT
-        li.date,
-        COUNT(DISTINCT li.person_seq) AS visitor_count
-    FROM line_in_out_individual li
-    LEFT JOIN line l ON li.triggered_line_id = l.id
-    WHERE li.date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
-      AND li.is_staff = false
-      AND l.entrance = 1
-      AND li.in_out = 'IN'
-    GROUP BY li.date
-),
-hourly_visits AS (
-    SELECT
-        li.date,
-        intDiv(toHour(li.timestamp), 3) * 3 AS hour,
-        COUNT(DISTINCT li.person_seq) AS visitor_count
-    FROM line_in_out_individual li
-    LEFT JOIN line l ON li.triggered_line_id = l.id
-    WHERE li.date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
-      AND li.is_staff = false
-      AND l.entrance = 1
-      AND li.in_out = 'IN'
-    GROUP BY li.date, intDiv(toHour(li.timestamp), 3)
-),
-date_hour_grid AS (
+"""
+
+# 일별/3시간 단위 방문자 수를 받아 0명인 날짜와 시간대를 찾는 공통 부분
+_ZERO_VISITS_TAIL = """date_hour_grid AS (
     SELECT d.date, h.number * 3 AS hour
     FROM date_range d
     CROSS JOIN numbers(8) h -- 0~7 * 3 → 0,3,6,9,12,15,18,21
@@ -370,13 +316,81 @@ SELECT *
 FROM final_zero_dates
 ORDER BY date"""
 
+ZERO_VISITS_QUERY = QueryTemplate("diagnose.zero_visits", _ZERO_VISITS_HEAD + """daily_visits AS (
+    SELECT
+        li.date,
+        COUNT(DISTINCT li.person_seq) AS visitor_count
+    FROM line_in_out_individual li
+    LEFT JOIN line l ON li.triggered_line_id = l.id
+    WHERE li.date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
+      AND li.is_staff = false
+      AND l.entrance = 1
+      AND li.in_out = 'IN'
+    GROUP BY li.date
+),
+hourly_visits AS (
+    SELECT
+        li.date,
+        intDiv(toHour(li.timestamp), 3) * 3 AS hour,
+        COUNT(DISTINCT li.person_seq) AS visitor_count
+    FROM line_in_out_individual li
+    LEFT JOIN line l ON li.triggered_line_id = l.id
+    WHERE li.date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
+      AND li.is_staff = false
+      AND l.entrance = 1
+      AND li.in_out = 'IN'
+    GROUP BY li.date, intDiv(toHour(li.timestamp), 3)
+),
+""" + _ZERO_VISITS_TAIL)
+
+ZERO_VISITS_SUMMARY_QUERY = QueryTemplate("diagnose.zero_visits_summary", _ZERO_VISITS_HEAD + """daily_visits AS (
+    SELECT
+        visit_date AS date,
+        uniqExactMerge(visitors) AS visitor_count
+    FROM visitor_base_daily
+    WHERE visit_date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
+    GROUP BY visit_date
+),
+hourly_visits AS (
+    SELECT
+        visit_date AS date,
+        intDiv(visit_hour, 3) * 3 AS hour,
+        uniqExactMerge(visitors) AS visitor_count
+    FROM visitor_base_daily
+    WHERE visit_date BETWEEN (SELECT value FROM start_date) AND (SELECT value FROM end_date)
+    GROUP BY visit_date, intDiv(visit_hour, 3)
+),
+""" + _ZERO_VISITS_TAIL)
+
+async def _zero_visits_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    template = await choose_template_async(site, start_date, end_date, ZERO_VISITS_SUMMARY_QUERY, ZERO_VISITS_QUERY)
+    rows = await _query_rows(site, template, start_date=start_date, end_date=end_date)
+    return [(str(row[0]), row[1]) for row in rows]
+
+@mcp.tool()
+@cached_tool
+async def check_zero_visits(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """방문객수 데이터 이상 조회
+    
+    Args:
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)  
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
+    """
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "check_zero_visits", site, sites,
+            lambda s: _zero_visits_rows(s, start_date, end_date),
+            ["날짜", "내용"], f"방문객수 데이터 이상 ({start_date} ~ {end_date})",
+            empty_message="✅ 이상 없음"
+        )
+
     try:
-        client = get_site_client(site)
-        if not client:
+        template = await choose_template_async(site, start_date, end_date, ZERO_VISITS_SUMMARY_QUERY, ZERO_VISITS_QUERY)
+        result = await query_template_async(site, template, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query)
-        client.close()
 
         if len(result.result_rows) > 0:
             answer = f"🚨 **{site}** 방문객수 데이터 이상한 날:"
@@ -394,43 +408,13 @@ ORDER BY date"""
 
     return answer
 
-@mcp.tool()
-def diagnose_purchase_conversion_rate(start_date: str, end_date: str, site: str) -> str:
-    """구매전환율 진단 (크로스 DB 분석)
-    
-    🔄 CROSS-DATABASE ANALYSIS TOOL
-    - 데이터베이스 1: plusinsight (매장별) → 방문객 데이터 (line_in_out_individual)
-    - 데이터베이스 2: cu_base (중앙) → POS 매출 데이터 (cu_revenue_total)
-    - 결합 분석: 방문객 수 대비 구매 건수로 전환율 계산
-    
-    ⚠️ WARNING: 이 툴은 두 개의 서로 다른 데이터베이스를 자동으로 연결합니다.
-    다른 POS 툴이나 행동 분석 툴과 함께 사용할 때 데이터베이스 접근 순서에 주의하세요.
-    
-    Args:
-        start_date: 시작 날짜 (YYYY-MM-DD)
-        end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수)
-        
-    Returns:
-        구매전환율 분석 결과 (방문객 수, 판매 건수, 전환율, 평가)
-    """
-    # 파라미터 기록
-    param_log = f"diagnose_purchase_conversion_rate 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
-    logger.info(param_log)
-    
-    try:
-        # 1. 방문객 데이터 조회 (plusinsight)
-        visitor_client = get_site_client(site)
-        if not visitor_client:
-            return f"❌ {site}: 방문객 데이터 연결 실패"
-            
-        visitor_query = f"""
+CONVERSION_VISITOR_QUERY = QueryTemplate("diagnose.conversion_visitor", """
         WITH df AS (
             SELECT li.person_seq                      AS visitor_id,
                    li.date                           AS visit_date
             FROM line_in_out_individual li
             LEFT JOIN line l ON li.triggered_line_id = l.id
-            WHERE li.date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE li.date BETWEEN {start_date:String} AND {end_date:String}
               AND li.is_staff = 0
               AND li.in_out = 'IN'
               AND l.entrance = 1
@@ -438,26 +422,28 @@ def diagnose_purchase_conversion_rate(start_date: str, end_date: str, site: str)
         daily_visitors AS (SELECT visit_date, uniqExact(visitor_id) AS daily_count FROM df GROUP BY visit_date)
         SELECT toUInt64(round(CASE WHEN isFinite(avg(daily_count)) THEN avg(daily_count) ELSE 0 END)) AS avg_visitors
         FROM daily_visitors
-        """
-        
-        visitor_result = visitor_client.query(visitor_query)
-        visitor_client.close()
-        
-        avg_visitors = visitor_result.result_rows[0][0] if visitor_result.result_rows else 0
-        
-        # 2. POS 판매 데이터 조회 (cu_base)
-        pos_client = get_site_client(site, database='cu_base')
-        if not pos_client:
-            return f"❌ {site}: POS 데이터 연결 실패"
-            
-        pos_query = f"""
+        """)
+
+CONVERSION_VISITOR_SUMMARY_QUERY = QueryTemplate("diagnose.conversion_visitor_summary", """
+        WITH daily_visitors AS (
+            SELECT visit_date, uniqExactMerge(visitors) AS daily_count
+            FROM visitor_base_daily
+            WHERE visit_date BETWEEN {start_date:String} AND {end_date:String}
+            GROUP BY visit_date
+        )
+        SELECT toUInt64(round(CASE WHEN isFinite(avg(daily_count)) THEN avg(daily_count) ELSE 0 END)) AS avg_visitors
+        FROM daily_visitors
+        """)
+
+CONVERSION_POS_QUERY = QueryTemplate("diagnose.conversion_pos", """
         WITH daily_sales AS (
             SELECT 
                 store_nm,
                 tran_ymd,
                 COUNT(DISTINCT (pos_no, tran_no)) as daily_receipt_count
             FROM cu_revenue_total
-            WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
+            WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+              AND store_nm = {site:String}
             GROUP BY store_nm, tran_ymd
         ),
         avg_sales AS (
@@ -469,11 +455,74 @@ def diagnose_purchase_conversion_rate(start_date: str, end_date: str, site: str)
         )
         SELECT avg_sales
         FROM avg_sales
-        WHERE store_nm = '{site}'
-        """
+        """)
+
+async def _conversion_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    visitor_template = await choose_template_async(
+        site, start_date, end_date, CONVERSION_VISITOR_SUMMARY_QUERY, CONVERSION_VISITOR_QUERY
+    )
+    visitor_rows, pos_rows = await asyncio.gather(
+        _query_rows(site, visitor_template, start_date=start_date, end_date=end_date),
+        _query_rows(site, CONVERSION_POS_QUERY, 'cu_base', start_date=start_date, end_date=end_date, site=site),
+    )
+    avg_visitors = visitor_rows[0][0] if visitor_rows else 0
+    avg_sales = pos_rows[0][0] if pos_rows else 0
+    if avg_visitors <= 0:
+        return []
+    conversion_rate = (avg_sales / avg_visitors) * 100
+    return [(f"{avg_visitors:,}명", f"{avg_sales:,}건", f"{conversion_rate:.1f}%")]
+
+@mcp.tool()
+@cached_tool
+async def diagnose_purchase_conversion_rate(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """구매전환율 진단 (크로스 DB 분석)
+    
+    🔄 CROSS-DATABASE ANALYSIS TOOL
+    - 데이터베이스 1: plusinsight (매장별) → 방문객 데이터 (line_in_out_individual)
+    - 데이터베이스 2: cu_base (중앙) → POS 매출 데이터 (cu_revenue_total)
+    - 결합 분석: 방문객 수 대비 구매 건수로 전환율 계산
+    
+    ⚠️ WARNING: 이 툴은 두 개의 서로 다른 데이터베이스를 자동으로 연결합니다.
+    다른 POS 툴이나 행동 분석 툴과 함께 사용할 때 데이터베이스 접근 순서에 주의하세요.
+    
+    Args:
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)  
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
         
-        pos_result = pos_client.query(pos_query)
-        pos_client.close()
+    Returns:
+        구매전환율 분석 결과 (방문객 수, 판매 건수, 전환율, 평가)
+    """
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "diagnose_purchase_conversion_rate", site, sites,
+            lambda s: _conversion_rows(s, start_date, end_date),
+            ["일평균 방문객", "일평균 판매 건수", "구매전환율"],
+            f"구매전환율 ({start_date} ~ {end_date})"
+        )
+
+    # 파라미터 기록
+    param_log = f"diagnose_purchase_conversion_rate 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
+    logger.info(param_log)
+    
+    try:
+        # 1. 방문객 데이터 조회 (plusinsight)
+        visitor_template = await choose_template_async(
+            site, start_date, end_date, CONVERSION_VISITOR_SUMMARY_QUERY, CONVERSION_VISITOR_QUERY
+        )
+        visitor_result = await query_template_async(site, visitor_template, start_date=start_date, end_date=end_date)
+        if visitor_result is None:
+            return f"❌ {site}: 방문객 데이터 연결 실패"
+        
+        avg_visitors = visitor_result.result_rows[0][0] if visitor_result.result_rows else 0
+        
+        # 2. POS 판매 데이터 조회 (cu_base)
+        pos_result = await query_template_async(
+            site, CONVERSION_POS_QUERY, 'cu_base', start_date=start_date, end_date=end_date, site=site
+        )
+        if pos_result is None:
+            return f"❌ {site}: POS 데이터 연결 실패"
         
         avg_sales = pos_result.result_rows[0][0] if pos_result.result_rows else 0
         
@@ -507,27 +556,36 @@ def diagnose_purchase_conversion_rate(start_date: str, end_date: str, site: str)
     
     return answer
 
-@mcp.tool()
-def diagnose_exploratory_tendency(start_date: str, end_date: str, site: str) -> str:
-    """탐색 경향성 진단
-    
-    Args:
-        start_date: 시작 날짜 (YYYY-MM-DD)
-        end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수)
-    """
-
-    query = f"""WITH sales_funnel AS (
+# 진열대별 방문/노출/픽업 합계
+_EXPLORATORY_HEAD = """WITH sales_funnel AS (
     SELECT
         shelf_name
         , sum(visit) AS visit_count
         , sum(gaze1) AS exposed_count
         , sum(pickup) AS pickup_count
     FROM sales_funnel
-    WHERE date BETWEEN '{start_date}' AND '{end_date}'
+    WHERE date BETWEEN {start_date:String} AND {end_date:String}
     GROUP BY shelf_name
     ),
-    visitor_count AS (
+"""
+
+# 1인당 방문/노출/픽업 비율 계산
+_EXPLORATORY_TAIL = """    total_sales AS (
+        SELECT
+            sum(visit_count) AS total_visit_count
+            , sum(exposed_count) AS total_exposed_count
+            , sum(pickup_count) AS total_pickup_count
+        FROM sales_funnel
+    )
+    SELECT
+        ROUND(ts.total_visit_count / vc.total_unique_visitors, 2) AS ratio_visit_count,
+        ROUND(ts.total_exposed_count / vc.total_unique_visitors, 2) AS ratio_exposed_count,
+        ROUND(ts.total_pickup_count / vc.total_unique_visitors, 2) AS ratio_pickup_count
+    FROM total_sales ts
+    CROSS JOIN visitor_count vc
+    """
+
+EXPLORATORY_QUERY = QueryTemplate("diagnose.exploratory", _EXPLORATORY_HEAD + """    visitor_count AS (
         SELECT 
             COUNT(*) AS total_unique_visitors
         FROM 
@@ -539,7 +597,7 @@ def diagnose_exploratory_tendency(start_date: str, end_date: str, site: str) ->
             LEFT JOIN 
                 line l ON li.triggered_line_id = l.id
             WHERE
-                li.date BETWEEN '{start_date}' AND '{end_date}'
+                li.date BETWEEN {start_date:String} AND {end_date:String}
                 AND li.is_staff = false
                 AND l.entrance = 1
                 AND li.in_out = 'IN'
@@ -547,28 +605,45 @@ def diagnose_exploratory_tendency(start_date: str, end_date: str, site: str) ->
                 li.person_seq
         )
     ),
-    total_sales AS (
-        SELECT
-            sum(visit_count) AS total_visit_count
-            , sum(exposed_count) AS total_exposed_count
-            , sum(pickup_count) AS total_pickup_count
-        FROM sales_funnel
-    )
-    SELECT
-        ROUND(ts.total_visit_count / vc.total_unique_visitors, 2) AS ratio_visit_count,
-        ROUND(ts.total_exposed_count / vc.total_unique_visitors, 2) AS ratio_exposed_count,
-        ROUND(ts.total_pickup_count / vc.total_unique_visitors, 2) AS ratio_pickup_count
-    FROM total_sales ts
-    CROSS JOIN visitor_count vc
+""" + _EXPLORATORY_TAIL)
+
+EXPLORATORY_SUMMARY_QUERY = QueryTemplate("diagnose.exploratory_summary", _EXPLORATORY_HEAD + """    visitor_count AS (
+        SELECT uniqExactMerge(visitors) AS total_unique_visitors
+        FROM visitor_base_daily
+        WHERE visit_date BETWEEN {start_date:String} AND {end_date:String}
+    ),
+""" + _EXPLORATORY_TAIL)
+
+async def _exploratory_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    template = await choose_template_async(site, start_date, end_date, EXPLORATORY_SUMMARY_QUERY, EXPLORATORY_QUERY)
+    rows = await _query_rows(site, template, start_date=start_date, end_date=end_date)
+    return [tuple(row[:3]) for row in rows]
+
+@mcp.tool()
+@cached_tool
+async def diagnose_exploratory_tendency(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """탐색 경향성 진단
+    
+    Args:
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)  
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
     """
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "diagnose_exploratory_tendency", site, sites,
+            lambda s: _exploratory_rows(s, start_date, end_date),
+            ["1인당 진열대 방문", "1인당 진열대 노출", "1인당 진열대 픽업"],
+            f"탐색 경향성 ({start_date} ~ {end_date})"
+        )
+
 
     try:
-        client = get_site_client(site)
-        if not client:
+        template = await choose_template_async(site, start_date, end_date, EXPLORATORY_SUMMARY_QUERY, EXPLORATORY_QUERY)
+        result = await query_template_async(site, template, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query.strip())
-        client.close()
 
         if len(result.result_rows) > 0:
             answer = f"📊 **{site}** 탐색 경향성:"
@@ -582,16 +657,7 @@ def diagnose_exploratory_tendency(start_date: str, end_date: str, site: str) ->
 
     return answer
 
-@mcp.tool()
-def diagnose_shelf(start_date: str, end_date: str, site: str) -> str:
-    """진열대 진단
-    
-    Args:
-        start_date: 시작 날짜 (YYYY-MM-DD)
-        end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수)
-    """
-    query = f"""WITH base AS (
+SHELF_QUERY = QueryTemplate("diagnose.shelf", """WITH base AS (
 SELECT
     shelf_name,
     sum(visit) AS visit_count,
@@ -600,7 +666,7 @@ SELECT
     floor(sum(sales_funnel.gaze1)/sum(visit), 2) AS gaze_rate,
     floor(sum(sales_funnel.pickup)/sum(gaze1), 2) AS pickup_rate
 FROM sales_funnel
-WHERE date BETWEEN '{start_date}' AND '{end_date}'
+WHERE date BETWEEN {start_date:String} AND {end_date:String}
 AND shelf_name NOT LIKE '%시식대%'
 GROUP BY shelf_name
 )
@@ -686,15 +752,35 @@ CASE metric
     WHEN 'gaze_rate_cold' THEN 8
     WHEN 'pickup_rate_hot' THEN 9
     WHEN 'pickup_rate_cold' THEN 10
-END"""
+END""")
+
+async def _shelf_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    rows = await _query_rows(site, SHELF_QUERY, start_date=start_date, end_date=end_date)
+    return [tuple(row[:5]) for row in rows]
+
+@mcp.tool()
+@cached_tool
+async def diagnose_shelf(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """진열대 진단
+    
+    Args:
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)  
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
+    """
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "diagnose_shelf", site, sites,
+            lambda s: _shelf_rows(s, start_date, end_date),
+            ["구분", "진열대", "방문", "노출", "픽업"],
+            f"진열대 진단 ({start_date} ~ {end_date}, hot=관심많음, cold=관심적음)"
+        )
 
     try:
-        client = get_site_client(site)
-        if not client:
+        result = await query_template_async(site, SHELF_QUERY, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query)
-        client.close()
 
         if len(result.result_rows) > 0:
             answer = f"🛍️ **{site}** 진열대 진단 (hot=관심많음, cold=관심적음):"
@@ -712,17 +798,7 @@ END"""
     return answer
         
 
-@mcp.tool()
-def diagnose_table_occupancy(start_date: str, end_date: str, site: str) -> str:
-    """시식대 혼잡도 진단
-    
-    Args:
-        start_date: 시작 날짜 (YYYY-MM-DD)
-        end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수)
-    """
-
-    query = f"""
+TABLE_OCCUPANCY_QUERY = QueryTemplate("diagnose.table_occupancy", """
 WITH minute_data AS (
     SELECT
         zone_id,
@@ -734,7 +810,7 @@ WITH minute_data AS (
     WHERE
         zone.name LIKE '%시식대%'
         AND occupancy_count > 0
-        AND date BETWEEN '{start_date}' AND '{end_date}'
+        AND date BETWEEN {start_date:String} AND {end_date:String}
     GROUP BY zone_id, zone_name
 ),
 session_data AS (
@@ -761,15 +837,36 @@ SELECT
 FROM minute_data m
 ALL LEFT JOIN session_data s ON m.zone_id = s.zone_id
 ORDER BY zone_name ASC
-"""
+""")
+
+async def _table_occupancy_rows(site: str, start_date: str, end_date: str) -> List[Sequence[Any]]:
+    rows = await _query_rows(site, TABLE_OCCUPANCY_QUERY, start_date=start_date, end_date=end_date)
+    return [tuple(row[:5]) for row in rows]
+
+@mcp.tool()
+@cached_tool
+async def diagnose_table_occupancy(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """시식대 혼잡도 진단
+    
+    Args:
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)  
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 진단할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
+    """
+    if _use_multi_sites(site, sites):
+        return await _diagnose_sites(
+            "diagnose_table_occupancy", site, sites,
+            lambda s: _table_occupancy_rows(s, start_date, end_date),
+            ["시식대", "평균 점유", "최대 점유", "세션", "평균 시간"],
+            f"시식대 혼잡도 ({start_date} ~ {end_date})"
+        )
+
 
     try:
-        client = get_site_client(site)
-        if not client:
+        result = await query_template_async(site, TABLE_OCCUPANCY_QUERY, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query)
-        client.close()
 
         if len(result.result_rows) > 0:
             answer = f"🍽️ **{site}** 시식대 혼잡도:"
@@ -2,19 +2,25 @@ from fastmcp import FastMCP
 from typing import List
 
 # 데이터베이스 매니저 및 공통 유틸리티 import
-from database_manager import get_site_client
-from mcp_utils import is_token_limit_exceeded, DEFAULT_MODEL
+from database_manager import query_template_async
+from query_templates import QueryTemplate
+from mcp_utils import TokenBudget, format_columnar_result
+from result_cache import cached_tool
 
 from utils import create_transition_data
 from map_config import item2zone
 
+try:
+    from markov_model import get_markov_model
+    MARKOV_AVAILABLE = True
+except ImportError:
+    MARKOV_AVAILABLE = False
+
+import event_sequence_cache
+
 mcp = FastMCP("insight")
 
-@mcp.tool()
-def pickup_transition(database: str, start_date: str, end_date: str, site: str) -> str:
-    """픽업 구역 전환 데이터 조회"""
-    try:
-        query = f"""WITH transitions AS 
+PICKUP_TRANSITION_QUERY = QueryTemplate("insight.pickup_transition", """WITH transitions AS 
     (
         SELECT
             arrayZip(
@@ -47,7 +53,7 @@ def pickup_transition(database: str, start_date: str, end_date: str, site: str)
                     e.is_staff = false
                     AND e.event_type = 1
                     AND z.name NOT LIKE '%시식대%'
-                    AND e.timestamp BETWEEN '{start_date}' AND '{end_date}'
+                    AND e.timestamp BETWEEN {start_date:String} AND {end_date:String}
                 GROUP BY
                     e.person_seq
             )
@@ -64,69 +70,69 @@ def pickup_transition(database: str, start_date: str, end_date: str, site: str)
         from_zone,
         to_zone
     ORDER BY
-        transition_count DESC"""
+        transition_count DESC""")
 
-        client = get_site_client(site, database)
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
-
-        result = client.query(query)
-        
-        answer = "픽업 발생 구역간 전환 데이터"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row[0]} -> {row[1]} : {row[2]}"
-        else:
-            answer = "데이터가 없습니다."
+@mcp.tool()
+@cached_tool
+async def pickup_transition(database: str, start_date: str, end_date: str, site: str) -> str:
+    """픽업 구역 전환 데이터 조회"""
+    try:
+        if event_sequence_cache.is_enabled():
+            # 로컬 이벤트 캐시에서 읽고 빠진 날짜만 ClickHouse에서 받음 (SQL과 같은 timestamp 기간으로 자름)
+            table = await event_sequence_cache.load_events_async(site, start_date, end_date, database)
+            if table is None:
+                return f"❌ {site} 매장 연결 실패"
+            events = event_sequence_cache.pickup_events(table, timestamp_range=(start_date, end_date))
+            transitions = event_sequence_cache.zone_transitions(events)
+            return format_columnar_result(
+                "픽업 발생 구역간 전환 데이터 (from_zone -> to_zone : transition_count)",
+                transitions.column_names, transitions.columns
+            )
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
+        result = await query_template_async(
+            site, PICKUP_TRANSITION_QUERY, database, column_oriented=True, start_date=start_date, end_date=end_date
+        )
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
 
-        return answer
+        # 구역 쌍이 많을 수 있으므로 행 튜플 대신 컬럼 단위로 직렬화
+        return format_columnar_result(
+            "픽업 발생 구역간 전환 데이터 (from_zone -> to_zone : transition_count)",
+            result.column_names, result.result_columns
+        )
     except Exception as e:
         return f"❌ {site} 매장 오류: {e}"
 
-@mcp.tool()
-def sales_funnel(database: str, start_date: str, end_date: str, site: str) -> str:
-    """sales_funnel: 방문, 노출, 픽업의 전환율 조회"""
-    try:
-        query = f"""SELECT
+SALES_FUNNEL_QUERY = QueryTemplate("insight.sales_funnel", """SELECT
         shelf_name
         , sum(visit) AS visit_count
         , sum(gaze1) AS exposed_count
         , sum(pickup) AS pickup_count
         , floor(sum(sales_funnel.pickup )/sum(gaze1), 2) AS pickup_rate
     FROM sales_funnel
-    WHERE date BETWEEN '{start_date}' AND '{end_date}'
+    WHERE date BETWEEN {start_date:String} AND {end_date:String}
     GROUP BY shelf_name
-    ORDER BY pickup_rate DESC"""
+    ORDER BY pickup_rate DESC""")
 
-        # 클라이언트 생성
-        db = get_site_client(site, database)
-        if not db:
+@mcp.tool()
+@cached_tool
+async def sales_funnel(database: str, start_date: str, end_date: str, site: str) -> str:
+    """sales_funnel: 방문, 노출, 픽업의 전환율 조회"""
+    try:
+        result = await query_template_async(
+            site, SALES_FUNNEL_QUERY, database, column_oriented=True, start_date=start_date, end_date=end_date
+        )
+        if result is None:
             return f"❌ {site} 매장 연결 실패"
 
-        result = db.query(query.strip())
-
-        answer = f"{result.column_names}\n"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"{row}\n"
-        else:
-            answer = "데이터가 없습니다."
-
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
-        return answer
+        return format_columnar_result(
+            f"{start_date} ~ {end_date} 진열대별 방문/노출/픽업 전환율:",
+            result.column_names, result.result_columns
+        )
     except Exception as e:
         return f"❌ {site} 매장 오류: {e}"
 
-@mcp.tool()
-def representative_movement(database: str, start_date: str, end_date: str, site: str, limit: int = 20) -> str:
-    """대표적인 이동 경로 리스트 조회"""
-    try:
-        query = f"""
+REPRESENTATIVE_MOVEMENT_QUERY = QueryTemplate("insight.representative_movement", """
 SELECT
     CASE 
         WHEN gender = 0 THEN 'male'
@@ -138,13 +144,13 @@ SELECT
     z2.name AS zone2_name,
     z3.name AS zone3_name,
     SUM(tsf.num_people) AS total_people,
-    toString(round(SUM(tsf.num_people) / (SELECT SUM(num_people) FROM two_step_flow WHERE date BETWEEN '{start_date}' AND '{end_date}') * 100, 2)) || '%' AS percentage
+    toString(round(SUM(tsf.num_people) / (SELECT SUM(num_people) FROM two_step_flow WHERE date BETWEEN {start_date:String} AND {end_date:String}) * 100, 2)) || '%' AS percentage
 FROM
     two_step_flow tsf
 INNER JOIN zone z1 ON tsf.zone1_id = z1.id
 INNER JOIN zone z2 ON tsf.zone2_id = z2.id
 INNER JOIN zone z3 ON tsf.zone3_id = z3.id
-WHERE date BETWEEN '{start_date}' AND '{end_date}'
+WHERE date BETWEEN {start_date:String} AND {end_date:String}
 GROUP BY
     gender,
     age_group,
@@ -153,20 +159,9 @@ GROUP BY
     z3.name
 ORDER BY
     total_people DESC
-LIMIT {limit}"""
-
-        client = get_site_client(site, database)
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
+LIMIT {limit:UInt32}""")
 
-        result = client.query(query)
-
-        answer = f"대표 이동 동선 리스트:\n{result.column_names}\n"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"{row}\n"
-
-            query = f"""WITH tsf_zones AS (SELECT DISTINCT z.name AS zone_name
+REPRESENTATIVE_ZONES_QUERY = QueryTemplate("insight.representative_zones", """WITH tsf_zones AS (SELECT DISTINCT z.name AS zone_name
 FROM 
 (
     SELECT zone1_id AS zone_id FROM two_step_flow
@@ -222,30 +217,38 @@ SELECT
     cz.closest_5_zones
 FROM tsf_zones tz
 LEFT JOIN closest_zones cz ON tz.zone_name = cz.from_zone
-"""
-            result = client.query(query)
-
-            answer += f"구역과 가장 가까운 진열대 목록:\n{result.column_names}\n"
-            if len(result.result_rows) > 0:
-                for row in result.result_rows:
-                    answer += f"{row}\n"
-            else:
-                answer = "데이터가 없습니다."
-        else:
-            answer = "데이터가 없습니다."
+""")
+
+@mcp.tool()
+@cached_tool
+async def representative_movement(database: str, start_date: str, end_date: str, site: str, limit: int = 20) -> str:
+    """대표적인 이동 경로 리스트 조회"""
+    try:
+        result = await query_template_async(
+            site, REPRESENTATIVE_MOVEMENT_QUERY, database, column_oriented=True,
+            start_date=start_date, end_date=end_date, limit=limit
+        )
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if not result.result_columns or len(result.result_columns[0]) == 0:
+            return "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
+        answer = format_columnar_result(
+            "대표 이동 동선 리스트:", result.column_names, result.result_columns
+        )
 
+        result = await query_template_async(site, REPRESENTATIVE_ZONES_QUERY, database, column_oriented=True)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+
+        answer += "\n" + format_columnar_result(
+            "구역과 가장 가까운 진열대 목록:", result.column_names, result.result_columns
+        )
         return answer
     except Exception as e:
         return f"❌ {site} 매장 오류: {e}"
 
-@mcp.tool()
-def inflow_by_entrance_line(database: str, start_date: str, end_date: str, site: str) -> str:
-    """유입률 분석"""
-    try:
-        query = f"""
+INFLOW_BY_ENTRANCE_LINE_QUERY = QueryTemplate("insight.inflow_by_entrance_line", """
 SELECT
     -- UTC 시(hour)와 타임존 오프셋을 문자열로 결합
     -- formatDateTime(timestamp, '%H')
@@ -273,7 +276,7 @@ INNER JOIN line AS l
     ON l.id = lioi.triggered_line_id
 WHERE
     -- 기간
-    date BETWEEN '{start_date}' AND '{end_date}'
+    date BETWEEN {start_date:String} AND {end_date:String}
     -- setting_general에 따라
     AND age >= 1
     -- 스태프 제외
@@ -291,36 +294,135 @@ HAVING
     AND traffic_count > 0
 ORDER BY
     visitor_count DESC,
-    traffic_count DESC"""
+    traffic_count DESC""")
 
-        client = get_site_client(site, database)
-        if not client:
+@mcp.tool()
+@cached_tool
+async def inflow_by_entrance_line(database: str, start_date: str, end_date: str, site: str) -> str:
+    """유입률 분석"""
+    try:
+        result = await query_template_async(site, INFLOW_BY_ENTRANCE_LINE_QUERY, database, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site} 매장 연결 실패"
-
-        result = client.query(query)
         
         # 결과 형식화
         answer = f"{start_date} ~ {end_date} 방문자 수와 유동인구 수 비교:\n"
         answer += "성별, 연령대, 방문자 수, 유동인구 수, 유입률(방문자 수 / 유동인구 수)\n"
         
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
+        rows = result.result_rows
+        if len(rows) > 0:
+            def format_row(row):
                 gender, age, visitor_count, traffic_count = row
                 
                 # 성별 변환
                 gender_str = "남성" if gender == 0 else "여성"
                 
-                answer += f"{gender_str}, {age}, {visitor_count}, {traffic_count}, {visitor_count / traffic_count * 100}%\n"
+                return f"{gender_str}, {age}, {visitor_count}, {traffic_count}, {visitor_count / traffic_count * 100}%\n"
+
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((format_row(row) for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
+        return answer
+    except Exception as e:
+        return f"❌ {site} 매장 오류: {e}"
+
+
+@mcp.tool()
+async def shopper_path_markov(
+    database: str,
+    start_date: str,
+    end_date: str,
+    site: str,
+    question: str = "reach",
+    zone: str = "",
+    steps: int = 3,
+    age_groups: List[str] = [],
+    gender_labels: List[str] = [],
+    start_hour: int = 0,
+    end_hour: int = 23,
+    top_n: int = 10,
+) -> str:
+    """픽업 시퀀스 기반 마르코프 동선 분석 (예: 빵 픽업 고객이 3단계 안에 가는 구역)
+
+    매장/기간/시간대/세그먼트별 구역 전이 확률 행렬을 한 번 만들어 캐시하고
+    같은 조건의 질문은 이벤트를 다시 조회하지 않고 행렬 곱으로 답합니다.
+
+    Args:
+        database: 데이터베이스 이름
+        start_date: 시작 날짜 (YYYY-MM-DD)
+        end_date: 종료 날짜 (YYYY-MM-DD)
+        site: 매장명 (필수)
+        question: reach(steps 안에 방문할 확률), visits(steps 동안 기대 방문 횟수),
+                  next(정확히 steps번째 이동 위치 분포), stationary(장기 체류 비율)
+        zone: 시작 구역 이름 또는 포함 키워드 (stationary 제외 필수)
+        steps: 이동 단계 수 (1~20)
+        age_groups: 연령대 필터 (예: ["20대", "30대"]), 비우면 전체
+        gender_labels: 성별 필터 (예: ["남자"]), 비우면 전체
+        start_hour: 시작 시각 (0~23)
+        end_hour: 종료 시각 (0~23)
+        top_n: 표시할 구역 수
+    """
+    if not MARKOV_AVAILABLE:
+        return "❌ 마르코프 동선 분석에는 numpy가 필요합니다."
+    if question not in ("reach", "visits", "next", "stationary"):
+        return "❌ question은 reach, visits, next, stationary 중 하나여야 합니다."
+    if not 1 <= steps <= 20:
+        return "❌ steps는 1~20 사이여야 합니다."
+    if not (0 <= start_hour <= end_hour <= 23):
+        return "❌ 시간대는 0 <= start_hour <= end_hour <= 23 이어야 합니다."
+
+    try:
+        model = await get_markov_model(
+            site, database, start_date, end_date, start_hour, end_hour, age_groups, gender_labels
+        )
+        if model is None:
+            return f"❌ {site} 매장 연결 실패"
+        if model.transitions == 0:
+            return "데이터가 없습니다."
 
+        segment = ", ".join(age_groups + gender_labels) or "전체 고객"
+        answer = (
+            f"🧭 **{site} 마르코프 동선 분석** ({start_date} ~ {end_date}, {start_hour}~{end_hour}시, {segment})\n"
+            f"고객 {model.shoppers:,}명 / 구역 {model.size}개 / 전이 {model.transitions:,}건\n"
+        )
+
+        if question == "stationary":
+            answer += "\n장기 체류 비율 (정상 분포):"
+            for name, value in model.top(model.stationary_distribution(), top_n):
+                answer += f"\n  - {name}: {value * 100:.1f}%"
+            return answer
+
+        start = model.match_zones(zone)
+        if not start:
+            return f"❌ '{zone}'에 해당하는 구역이 없습니다. (구역 예시: {', '.join(model.zones[:10])})"
+        start_names = ", ".join(model.zones[i] for i in start)
+
+        if question == "reach":
+            values = model.reach_probability(start, steps)
+            answer += f"\n[{start_names}] 픽업 후 {steps}단계 안에 방문할 확률:"
+            fmt = lambda v: f"{v * 100:.1f}%"
+        elif question == "visits":
+            values = model.expected_visits(start, steps)
+            answer += f"\n[{start_names}] 픽업 후 {steps}단계 동안 기대 방문 횟수:"
+            fmt = lambda v: f"{v:.3f}회"
+        else:
+            values = model.step_distribution(start, steps)
+            answer += f"\n[{start_names}] 픽업 후 정확히 {steps}번째 이동 위치:"
+            fmt = lambda v: f"{v * 100:.1f}%"
+
+        ranked = model.top(values, top_n, exclude=start)
+        if not ranked:
+            answer += "\n  (이후 이동 데이터 없음)"
+        for name, value in ranked:
+            answer += f"\n  - {name}: {fmt(value)}"
         return answer
     except Exception as e:
         return f"❌ {site} 매장 오류: {e}"
-            
+
 # get_available_sites 기능은 mcp_agent_helper.py로 분리됨
 
 if __name__ == "__main__":
@@ -1,13 +1,16 @@
 from fastmcp import FastMCP
 import logging
+import re
 import sys
 import time
 from pathlib import Path
-from typing import List
+from typing import List, Tuple, Sequence, Any, Dict, NamedTuple, Optional
 
 # 데이터베이스 매니저 및 공통 유틸리티 import
-from database_manager import get_site_client
-from mcp_utils import is_token_limit_exceeded, DEFAULT_MODEL
+from database_manager import query_template_async
+from query_templates import QueryTemplate
+from mcp_utils import TokenBudget, format_site_table
+from result_cache import cached_tool
 
 from utils import create_transition_data
 from map_config import item2zone
@@ -43,8 +46,72 @@ logger.info(f"=== 새 세션 시작: {time.strftime('%Y-%m-%d %H:%M:%S')} ===")
 
 mcp = FastMCP("pos")
 
+RANKING_COLUMNS = ["1위", "2위", "3위", "4위", "5위"]
+
+# 매장 필터 줄 (전체 매장 템플릿에서는 이 줄을 빼서 조건 없이 스캔)
+_STORE_FILTER_LINE = re.compile(r"^[ \t]*AND store_nm IN \{stores:Array\(String\)\}[ \t]*\n", re.MULTILINE)
+
+class StoreScopedQuery(NamedTuple):
+    """매장 필터가 있는 템플릿과 없는 템플릿 쌍
+
+    `({all} = 1 OR has(...))`처럼 런타임 파라미터와 OR로 묶으면 ClickHouse가 store_nm으로
+    인덱스를 거르지 못하므로, 매장을 지정한 요청에만 `store_nm IN {stores}` 조건을 넣습니다.
+    """
+    selected: QueryTemplate
+    all_stores: QueryTemplate
+
+    @classmethod
+    def build(cls, name: str, sql: str) -> "StoreScopedQuery":
+        return cls(QueryTemplate(name, sql), QueryTemplate(f"{name}.all_stores", _STORE_FILTER_LINE.sub("", sql)))
+
+    def scope(self, store_filter: Optional[List[str]]) -> Tuple[QueryTemplate, Dict[str, Any]]:
+        """(실행할 템플릿, 매장 파라미터). store_filter가 None이면 전체 매장"""
+        if store_filter is None:
+            return self.all_stores, {}
+        return self.selected, {"stores": store_filter}
+
+def _store_scope(site: str, sites: List[str]) -> Tuple[Optional[List[str]], List[str], bool]:
+    """site/sites 인자를 cu_revenue_total 매장 필터로 변환
+
+    cu_revenue_total은 중앙 DB의 단일 테이블이므로 여러 매장도 한 번의 스캔으로 조회합니다.
+
+    Returns:
+        (매장 필터, 매장 목록, 다중 매장 여부). "*"이면 매장 필터는 None(전체 매장), 매장 목록은 빈 리스트
+    """
+    requested = ([site] if site else []) + list(sites or [])
+    if "*" in requested:
+        return None, [], True
+
+    stores = []
+    for name in requested:
+        name = name.strip()
+        if name and name not in stores:
+            stores.append(name)
+    return stores, stores, bool(sites) or len(stores) > 1
+
+def _format_store_table(
+    tool_name: str,
+    title: str,
+    columns: List[str],
+    rows: List[Sequence[Any]],
+    stores: List[str],
+) -> str:
+    """첫 컬럼이 store_nm인 결과 행을 매장별 표로 변환"""
+    rows_by_store = {}
+    for row in rows:
+        rows_by_store.setdefault(row[0], []).append(tuple(row[1:]))
+    # 요청한 매장 순서 유지 ("*"이면 결과 순서), 데이터 없는 매장도 표시
+    ordered = stores or list(rows_by_store)
+    outcomes = [(store, rows_by_store.get(store, []), None) for store in ordered]
+
+    # 토큰 제한에 닿으면 나머지 행은 생략하고 생략 행 수를 표시
+    answer = format_site_table(title, columns, outcomes, budget=TokenBudget())
+
+    logger.info(f"{tool_name} 답변: {answer}")
+    return answer
+
 @mcp.tool()
-def sales_statistics(start_date: str, end_date: str, site: str) -> str:
+async def sales_statistics(start_date: str, end_date: str, site: str) -> str:
     """
     POS 데이터 기반 매출 통계 요약
     매장명이 지정되지 않으면 모든 매장의 통계를 조회합니다.
@@ -67,33 +134,14 @@ start_date: 시작 날짜
         logger.error(error_msg)
         return error_msg
 
-@mcp.tool()
-def receipt_ranking(start_date: str, end_date: str, site: str) -> str:
-    """
-    특정 매장의 POS 데이터 기반 영수증 건수 비중 Top 5 조회
-    
-    Args:
-start_date: 시작 날짜
-        end_date: 종료 날짜
-        site: 매장명 (필수)
-    """
-    # 파라미터 기록
-    param_log = f"receipt_ranking 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
-    logger.info(param_log)
-    
-    try:
-        client = get_site_client(site, 'cu_base')
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
-
-        query = f"""
+RECEIPT_RANKING_QUERY = StoreScopedQuery.build("pos.receipt_ranking", """
 WITH receipt_total AS (
     SELECT 
         store_nm,
         COUNT(DISTINCT (tran_ymd, pos_no, tran_no)) as total_receipts
     FROM cu_revenue_total
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm
 ),
 small_category_receipts AS (
@@ -104,8 +152,8 @@ small_category_receipts AS (
         ROUND(COUNT(DISTINCT (tran_ymd, pos_no, tran_no)) * 100.0 / rt.total_receipts, 2) as receipt_ratio
     FROM cu_revenue_total
     JOIN receipt_total rt USING(store_nm)
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm, small_nm, rt.total_receipts
 ),
 ranked_categories AS (
@@ -127,21 +175,47 @@ SELECT
 FROM ranked_categories
 GROUP BY store_nm
 ORDER BY store_nm
-"""
+""")
 
-        result = client.query(query)
+@mcp.tool()
+@cached_tool
+async def receipt_ranking(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """
+    특정 매장의 POS 데이터 기반 영수증 건수 비중 Top 5 조회
+    
+    Args:
+start_date: 시작 날짜
+        end_date: 종료 날짜
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 조회할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장)
+    """
+    # 파라미터 기록
+    param_log = f"receipt_ranking 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
+    logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
+    
+    try:
+        template, store_params = RECEIPT_RANKING_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "receipt_ranking", f"영수증 건수 비중 Top 5 ({start_date} ~ {end_date})",
+                RANKING_COLUMNS, result.result_rows, stores
+            )
         
         answer = f"🏪 **{site} 매장 영수증 랭킹 ({start_date} ~ {end_date}):**\n\n"
         answer += "(지점, 1위, 2위, 3위, 4위, 5위)"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row}"
+        rows = result.result_rows
+        if len(rows) > 0:
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer += "\n데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
         # 로그 기록
         logger.info(f"receipt_ranking 답변: {answer}")
             
@@ -151,26 +225,14 @@ ORDER BY store_nm
         logger.error(error_msg)
         return error_msg
 
-@mcp.tool()
-def sales_ranking(start_date: str, end_date: str, site: str) -> str:
-    """POS 데이터 기반 총 매출 비중 Top 5 조회"""
-    # 파라미터 기록
-    param_log = f"sales_ranking 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
-    logger.info(param_log)
-    
-    try:
-        client = get_site_client(site, 'cu_base')
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
-
-        query = f"""
+SALES_RANKING_QUERY = StoreScopedQuery.build("pos.sales_ranking", """
 WITH store_total AS (
     SELECT 
         store_nm,
         SUM(sale_amt) as total_sales
     FROM cu_revenue_total
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm
 ),
 small_category_sales AS (
@@ -181,8 +243,8 @@ small_category_sales AS (
         ROUND(SUM(sale_amt) * 100.0 / st.total_sales, 2) as sales_ratio
     FROM cu_revenue_total
     JOIN store_total st USING(store_nm)
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm, small_nm, st.total_sales
 ),
 ranked_categories AS (
@@ -204,20 +266,38 @@ SELECT
 FROM ranked_categories
 GROUP BY store_nm
 ORDER BY store_nm
-"""
+""")
 
-        result = client.query(query)
+@mcp.tool()
+@cached_tool
+async def sales_ranking(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """POS 데이터 기반 총 매출 비중 Top 5 조회"""
+    # 파라미터 기록
+    param_log = f"sales_ranking 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
+    logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
+    
+    try:
+        template, store_params = SALES_RANKING_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "sales_ranking", f"총 매출 비중 Top 5 ({start_date} ~ {end_date})",
+                RANKING_COLUMNS, result.result_rows, stores
+            )
         
         answer = "(지점, 1위, 2위, 3위, 4위, 5위)"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row}"
+        rows = result.result_rows
+        if len(rows) > 0:
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
         # 로그 기록
         logger.info(f"sales_ranking 답변: {answer}")
             
@@ -227,24 +307,14 @@ ORDER BY store_nm
         logger.error(error_msg)
         return error_msg
 
-@mcp.tool()
-def volume_ranking(start_date: str, end_date: str, site: str) -> str:
-    """POS 데이터 기반 총 판매량 비중 Top 5 조회"""
-    # 파라미터 기록
-    param_log = f"volume_ranking 호출됨: start_date={start_date}, end_date={end_date}"
-    logger.info(param_log)
-    
-    try:
-        client = get_site_client(site, 'cu_base')
-
-        query = f"""
+VOLUME_RANKING_QUERY = StoreScopedQuery.build("pos.volume_ranking", """
 WITH store_total AS (
     SELECT 
         store_nm,
         SUM(sale_qty) as total_qty
     FROM cu_revenue_total
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm
 ),
 small_category_qty AS (
@@ -255,8 +325,8 @@ small_category_qty AS (
         ROUND(SUM(sale_qty) * 100.0 / st.total_qty, 2) as qty_ratio
     FROM cu_revenue_total
     JOIN store_total st USING(store_nm)
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm, small_nm, st.total_qty
 ),
 ranked_categories AS (
@@ -278,20 +348,38 @@ SELECT
 FROM ranked_categories
 GROUP BY store_nm
 ORDER BY store_nm
-"""
+""")
 
-        result = client.query(query)
+@mcp.tool()
+@cached_tool
+async def volume_ranking(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """POS 데이터 기반 총 판매량 비중 Top 5 조회"""
+    # 파라미터 기록
+    param_log = f"volume_ranking 호출됨: start_date={start_date}, end_date={end_date}"
+    logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
+    
+    try:
+        template, store_params = VOLUME_RANKING_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "volume_ranking", f"총 판매량 비중 Top 5 ({start_date} ~ {end_date})",
+                RANKING_COLUMNS, result.result_rows, stores
+            )
         
         answer = "(지점, 1위, 2위, 3위, 4위, 5위)"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row}"
+        rows = result.result_rows
+        if len(rows) > 0:
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
         # 로그 기록
         logger.info(f"volume_ranking 답변: {answer}")
             
@@ -301,27 +389,15 @@ ORDER BY store_nm
         logger.error(error_msg)
         return error_msg
 
-@mcp.tool()
-def event_product_analysis(start_date: str, end_date: str, site: str) -> str:
-    """POS 데이터 기반 행사 상품 분석 (매출 비중, SKU 비중)"""
-    # 파라미터 기록
-    param_log = f"event_product_analysis 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
-    logger.info(param_log)
-    
-    try:
-        client = get_site_client(site, 'cu_base')
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
-
-        query = f"""
+EVENT_PRODUCT_ANALYSIS_QUERY = StoreScopedQuery.build("pos.event_product_analysis", """
 WITH store_metrics AS (
     SELECT 
         store_nm,
         SUM(sale_amt) as total_sales,
         COUNT(DISTINCT item_cd) as total_sku_count
     FROM cu_revenue_total
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm
 ),
 event_metrics AS (
@@ -330,8 +406,8 @@ event_metrics AS (
         SUM(sale_amt) as event_sales,
         COUNT(DISTINCT item_cd) as event_sku_count
     FROM cu_revenue_total
-    WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-      AND store_nm = '{site}'
+    WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+      AND store_nm IN {stores:Array(String)}
       AND evt_nm != ''
     GROUP BY store_nm
 )
@@ -342,20 +418,38 @@ SELECT
 FROM store_metrics sm
 JOIN event_metrics em USING(store_nm)
 ORDER BY sm.store_nm
-"""
+""")
 
-        result = client.query(query)
+@mcp.tool()
+@cached_tool
+async def event_product_analysis(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """POS 데이터 기반 행사 상품 분석 (매출 비중, SKU 비중)"""
+    # 파라미터 기록
+    param_log = f"event_product_analysis 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
+    logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
+    
+    try:
+        template, store_params = EVENT_PRODUCT_ANALYSIS_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "event_product_analysis", f"행사 상품 분석 ({start_date} ~ {end_date})",
+                ["매출 비중(%)", "SKU 비중(%)"], result.result_rows, stores
+            )
         
         answer = "(지점, 매출 비중(%), SKU 비중(%))"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row}"
+        rows = result.result_rows
+        if len(rows) > 0:
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
         # 로그 기록
         logger.info(f"event_product_analysis 답변: {answer}")
             
@@ -366,14 +460,7 @@ ORDER BY sm.store_nm
         return error_msg
 
 
-@mcp.tool()
-def ranking_event_product(site: str) -> str:
-    """지점별 행사 상품 분석 (매장명, 행사명, 총 판매수량, 거래 횟수, 총 판매금액, 순위)"""
-    # 함수 호출 기록
-    logger.info("ranking_event_product 호출됨")
-    
-    try:
-        query = f"""
+RANKING_EVENT_PRODUCT_QUERY = StoreScopedQuery.build("pos.ranking_event_product", """
 WITH event_popularity AS (
     SELECT 
         store_nm,
@@ -383,7 +470,7 @@ WITH event_popularity AS (
         SUM(sale_amt) AS total_sales
     FROM cu_revenue_total
     WHERE evt_nm != ''
-      AND store_nm = '{site}'
+      AND store_nm IN {stores:Array(String)}
     GROUP BY store_nm, evt_nm
 ),
 ranked_events AS (
@@ -406,23 +493,37 @@ SELECT
 FROM ranked_events
 WHERE rank <= 5
 ORDER BY store_nm, rank
-"""
-        client = get_site_client(site, 'cu_base')
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
+""")
 
-        result = client.query(query)
+@mcp.tool()
+@cached_tool
+async def ranking_event_product(site: str = "", sites: List[str] = []) -> str:
+    """지점별 행사 상품 분석 (매장명, 행사명, 총 판매수량, 거래 횟수, 총 판매금액, 순위)"""
+    # 함수 호출 기록
+    logger.info("ranking_event_product 호출됨")
+    store_filter, stores, multi_store = _store_scope(site, sites)
+    
+    try:
+        template, store_params = RANKING_EVENT_PRODUCT_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "ranking_event_product", "행사 상품 Top 5",
+                ["행사명", "총 판매수량", "거래 횟수", "총 판매금액", "순위"], result.result_rows, stores
+            )
 
         answer = "매장명, 행사명, 총 판매수량, 거래 횟수, 총 판매금액, 순위"
-        if len(result.result_rows) > 0:
-            for row in result.result_rows:
-                answer += f"\n{row}"
+        rows = result.result_rows
+        if len(rows) > 0:
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = "데이터가 없습니다."
 
-        if is_token_limit_exceeded(answer, DEFAULT_MODEL):
-            return "토큰 제한을 초과했습니다. 쿼리를 줄여서 다시 시도해주세요."
-
         # 로그 기록
         logger.info(f"ranking_event_product 답변: {answer}")
             
@@ -432,14 +533,7 @@ ORDER BY store_nm, rank
         logger.error(error_msg)
         return error_msg
 
-@mcp.tool()
-def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
-    """지점별 / 시간대별 연관 구매 경향성"""
-    # 파라미터 기록
-    param_log = f"co_purchase_trend 호출됨: start_date={start_date}, end_date={end_date}"
-    logger.info(param_log)
-
-    query = f"""
+CO_PURCHASE_TREND_QUERY = StoreScopedQuery.build("pos.co_purchase_trend", """
     WITH receipt_items AS (
         -- 각 영수증에 포함된 상품 추출
         SELECT
@@ -461,8 +555,8 @@ def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
             mid_nm
         FROM cu_revenue_total
         WHERE tran_timestamp IS NOT NULL
-        AND store_nm = '{site}'
-        AND tran_ymd BETWEEN '{start_date}' AND '{end_date}'
+        AND store_nm IN {stores:Array(String)}
+        AND tran_ymd BETWEEN {start_date:String} AND {end_date:String}
     ),
     item_pairs AS (
         -- 같은 영수증 내에서 함께 구매된 상품 쌍 생성
@@ -518,7 +612,7 @@ def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
         -- 시간대별 순위 부여
         SELECT
             *,
-            ROW_NUMBER() OVER (PARTITION BY time_period ORDER BY total_pair_count DESC) AS rank
+            ROW_NUMBER() OVER (PARTITION BY store_nm, time_period ORDER BY total_pair_count DESC) AS rank
         FROM aggregated_pairs
     )
     -- 시간대별 상위 5개만 선택
@@ -534,6 +628,7 @@ def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
     FROM ranked_pairs
     WHERE rank <= 5
     ORDER BY
+        store_nm,
         CASE 
             WHEN time_period = '아침(06-11)' THEN 1
             WHEN time_period = '점심(11-14)' THEN 2
@@ -542,21 +637,38 @@ def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
             WHEN time_period = '심야(22-06)' THEN 5
         END,
         rank
-    """
+    """)
+
+@mcp.tool()
+@cached_tool
+async def co_purchase_trend(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
+    """지점별 / 시간대별 연관 구매 경향성"""
+    # 파라미터 기록
+    param_log = f"co_purchase_trend 호출됨: start_date={start_date}, end_date={end_date}"
+    logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
 
     try:
-        client = get_site_client(site, 'cu_base')
-        if not client:
-            return f"❌ {site} 매장 연결 실패"
-        
         logger.info(f"co_purchase_trend 호출됨: {site}, {start_date}, {end_date}")
 
-        result = client.query(query)
+        template, store_params = CO_PURCHASE_TREND_QUERY.scope(store_filter)
 
-        if len(result.result_rows) > 0:
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
+            return f"❌ {site} 매장 연결 실패"
+        if multi_store:
+            return _format_store_table(
+                "co_purchase_trend", f"시간대별 연관 구매 경향성 ({start_date} ~ {end_date})",
+                ["시간대", "상품1", "상품1 분류", "상품2", "상품2 분류", "동시 구매", "비율"], result.result_rows, stores
+            )
+
+        rows = result.result_rows
+        if len(rows) > 0:
             answer = f"🛒 **{site}** 연관 구매 경향성:"
-            for row in result.result_rows:
-                answer += f"\n{row}"
+            budget = TokenBudget()
+            budget.charge(answer)
+            answer += "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+            answer += budget.footer()
         else:
             answer = f"⚠️ {site}: 데이터가 없습니다."
 
@@ -571,14 +683,38 @@ def co_purchase_trend(start_date: str, end_date: str, site: str) -> str:
 
 # get_available_sites 기능은 mcp_agent_helper.py로 분리됨
 
+POS_DAILY_SALES_STATS_QUERY = StoreScopedQuery.build("pos.pos_daily_sales_stats", """
+    WITH daily_sales AS (
+        SELECT 
+            store_nm,
+            tran_ymd,
+            COUNT(DISTINCT (pos_no, tran_no)) as daily_receipt_count
+        FROM cu_revenue_total
+        WHERE tran_ymd BETWEEN {start_date:String} AND {end_date:String}
+          AND store_nm IN {stores:Array(String)}
+        GROUP BY store_nm, tran_ymd
+    ),
+    avg_sales AS (
+        SELECT 
+            store_nm,
+            CONCAT(toString(toInt32(AVG(daily_receipt_count))), '건') as avg_daily_sales
+        FROM daily_sales
+        GROUP BY store_nm
+    )
+    SELECT *
+    FROM avg_sales
+    ORDER BY store_nm
+    """)
+
 @mcp.tool()
-def pos_daily_sales_stats(start_date: str, end_date: str, site: str) -> str:
+@cached_tool
+async def pos_daily_sales_stats(start_date: str, end_date: str, site: str = "", sites: List[str] = []) -> str:
     """POS 데이터 기반 일평균 판매 건수 통계
     
     🏪 POS DATABASE TOOL (cu_base only)
     - 데이터베이스: cu_base (중앙 단일 DB) 
     - 테이블: cu_revenue_total (모든 매장 POS 데이터)
-    - 필터링: store_nm = '{site}' 로 특정 매장만 조회
+    - 필터링: store_nm IN (...) 로 요청한 매장만 한 번에 조회
     
     ⚠️ IMPORTANT: cu_revenue_total은 중앙 cu_base DB에만 존재합니다.
     plusinsight DB에서는 접근할 수 없습니다.
@@ -586,7 +722,8 @@ def pos_daily_sales_stats(start_date: str, end_date: str, site: str) -> str:
     Args:
         start_date: 시작 날짜 (YYYY-MM-DD)
         end_date: 종료 날짜 (YYYY-MM-DD)  
-        site: 매장명 (필수) - store_nm 컬럼과 매칭
+        site: 매장명 (sites 미지정 시 필수)
+        sites: 여러 매장을 한 번에 조회할 때 매장 목록 (["*"] 또는 site="*"이면 전체 매장) - store_nm 컬럼과 매칭
         
     Returns:
         일평균 판매 건수 통계 결과
@@ -594,37 +731,18 @@ def pos_daily_sales_stats(start_date: str, end_date: str, site: str) -> str:
     # 파라미터 기록
     param_log = f"pos_daily_sales_stats 호출됨: start_date={start_date}, end_date={end_date}, site={site}"
     logger.info(param_log)
+    store_filter, stores, multi_store = _store_scope(site, sites)
     
-    query = f"""
-    WITH daily_sales AS (
-        SELECT 
-            store_nm,
-            tran_ymd,
-            COUNT(DISTINCT (pos_no, tran_no)) as daily_receipt_count
-        FROM cu_revenue_total
-        WHERE tran_ymd BETWEEN '{start_date}' AND '{end_date}'
-          AND store_nm = '{site}'
-        GROUP BY store_nm, tran_ymd
-    ),
-    avg_sales AS (
-        SELECT 
-            store_nm,
-            CONCAT(toString(toInt32(AVG(daily_receipt_count))), '건') as avg_daily_sales
-        FROM daily_sales
-        GROUP BY store_nm
-    )
-    SELECT *
-    FROM avg_sales
-    ORDER BY store_nm
-    """
-
     try:
-        client = get_site_client(site, database='cu_base')
-        if not client:
+        template, store_params = POS_DAILY_SALES_STATS_QUERY.scope(store_filter)
+        result = await query_template_async(site, template, 'cu_base', **store_params, start_date=start_date, end_date=end_date)
+        if result is None:
             return f"❌ {site}: 연결 실패"
-            
-        result = client.query(query)
-        client.close()
+        if multi_store:
+            return _format_store_table(
+                "pos_daily_sales_stats", f"일평균 판매 건수 ({start_date} ~ {end_date})",
+                ["일평균 판매 건수"], result.result_rows, stores
+            )
 
         if len(result.result_rows) > 0:
             answer = f"📊 **{site}** 일평균 판매 건수:"
@@ -6,12 +6,14 @@
 - 매대별 고객 동선 패턴 분석
 """
 
-import os
 import sys
 from typing import Dict, Any, List, Union, Optional
 
 # 새로운 데이터베이스 매니저 import
-from database_manager import get_site_client
+from database_manager import query_template_async, get_env_client
+from query_templates import QueryTemplate
+from result_cache import cached_tool
+from shelf_engine import PERSON_ROUTES_CTE, ENGINE_AVAILABLE, get_shelf_routes
 from fastmcp import FastMCP
 from dotenv import load_dotenv
 
@@ -22,66 +24,87 @@ load_dotenv()
 mcp = FastMCP("shelf_optimization")
 
 def _create_clickhouse_client(database="plusinsight"):
-    """ClickHouse 클라이언트 생성"""
-    import clickhouse_connect
-    
-    # 환경변수 로드
-    CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST")
-    CLICKHOUSE_PORT = os.getenv("CLICKHOUSE_PORT")
-    CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER")
-    CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD")
-    SSH_HOST = os.getenv("SSH_HOST")
-    SSH_PORT = int(os.getenv("SSH_PORT", "22"))
-    SSH_USERNAME = os.getenv("SSH_USERNAME")
-    SSH_PASSWORD = os.getenv("SSH_PASSWORD")
-    
-    # SSH 터널링이 필요한 경우
-    try:
-        from sshtunnel import SSHTunnelForwarder
-        SSH_AVAILABLE = True
-    except ImportError:
-        SSH_AVAILABLE = False
-        
-    if SSH_AVAILABLE and SSH_HOST:
-        try:
-            ssh_tunnel = SSHTunnelForwarder(
-                (SSH_HOST, SSH_PORT),
-                ssh_username=SSH_USERNAME,
-                ssh_password=SSH_PASSWORD,
-                remote_bind_address=(CLICKHOUSE_HOST, int(CLICKHOUSE_PORT)),
-                local_bind_address=("localhost", 0),
-            )
-            ssh_tunnel.start()
-            print(f"SSH 터널 생성: localhost:{ssh_tunnel.local_bind_port}")
-            
-            host = "localhost"
-            port = ssh_tunnel.local_bind_port
-            
-        except Exception as e:
-            print(f"SSH 터널 생성 실패: {e}, 직접 연결 시도")
-            host = CLICKHOUSE_HOST
-            port = int(CLICKHOUSE_PORT)
-    else:
-        # 직접 연결
-        host = CLICKHOUSE_HOST
-        port = int(CLICKHOUSE_PORT)
-    
-    try:
-        client = clickhouse_connect.get_client(
-            host=host,
-            port=port,
-            username=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD,
-            database=database,
-        )
-        print(f"ClickHouse 연결 성공: {host}:{port}, db={database}")
-        return client
-    except Exception as e:
-        print(f"ClickHouse 연결 실패: {e}")
-        return None
+    """ClickHouse 클라이언트 생성 (환경변수 기반, 공유 SSH 터널 사용)"""
+    return get_env_client(database)
+
+# 고객별 첫 픽업 전후 응시 진열대 분석 쿼리 (초기에 조건 필터링 하지 않고 person_routes에서 필터링)
+# 픽업 직전/직후 1~depth번째 응시 매대별 Top N (depth=1이면 기존 1번째 응시 매대 분석과 동일)
+SHELF_ANALYSIS_QUERY = QueryTemplate("shelf.analysis_flexible", PERSON_ROUTES_CTE + """
+    , filtered_routes AS (
+        SELECT *
+        FROM person_routes
+        WHERE first_pickup_index > 0  -- 픽업이 있는 고객만
+            AND (empty({target_shelves:Array(String)}) OR has({target_shelves:Array(String)}, first_pickup_zone))
+            AND (empty({age_groups:Array(String)}) OR has({age_groups:Array(String)}, age_group))
+            AND (empty({gender_labels:Array(String)}) OR has({gender_labels:Array(String)}, gender_label))
+    )
+    , shelf_analysis AS (
+        -- 픽업 직전 1~depth번째 응시매대 (없으면 진열대없음, 계산대 제외)
+        SELECT
+            'before' AS period,
+            position,
+            if(shelf = '', '진열대없음', shelf) AS shelf_name
+        FROM filtered_routes
+        ARRAY JOIN
+            arrayResize(gazes_before, {depth:UInt8}, '') AS shelf,
+            range(1, {depth:UInt8} + 1) AS position
+        WHERE shelf_name != '계산대'
+            AND NOT has({exclude_shelves:Array(String)}, shelf_name)
+
+        UNION ALL
+
+        -- 픽업 후 1~depth번째 응시매대 (없으면 진열대없음, 계산대 제외)
+        SELECT
+            'after' AS period,
+            position,
+            if(shelf = '', '진열대없음', shelf) AS shelf_name
+        FROM filtered_routes
+        ARRAY JOIN
+            arrayResize(gazes_after, {depth:UInt8}, '') AS shelf,
+            range(1, {depth:UInt8} + 1) AS position
+        WHERE shelf_name != '계산대'
+            AND NOT has({exclude_shelves:Array(String)}, shelf_name)
+    ),
+
+    -- 진열대별 집계 및 비율 계산 (기간/순번별)
+    aggregated AS (
+        SELECT
+            period,
+            position,
+            shelf_name,
+            COUNT(*) AS visit_count,
+            ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (PARTITION BY period, position)) AS percentage
+        FROM shelf_analysis
+        GROUP BY period, position, shelf_name
+    ),
+
+    -- 기간/순번별 순위 매기기
+    ranked AS (
+        SELECT
+            period,
+            position,
+            shelf_name,
+            percentage,
+            ROW_NUMBER() OVER (PARTITION BY period, position ORDER BY percentage DESC) AS rank
+        FROM aggregated
+        WHERE percentage > 0  -- 0% 제외
+    )
+
+    -- 최종 결과 (픽업 전/후, 순번별 Top N)
+    SELECT
+        if(period = 'before', 'BEFORE', 'AFTER') AS analysis_type,
+        position,
+        rank AS no,
+        shelf_name,
+        CONCAT(CAST(percentage AS String), '%') AS pct
+    FROM ranked
+    WHERE rank <= {top_n:UInt32}
+    ORDER BY analysis_type, position, no
+    """)
 
 @mcp.tool()
-def get_shelf_analysis_flexible(
+@cached_tool
+async def get_shelf_analysis_flexible(
     site: str,
     start_date: str = "2025-06-12",
     end_date: str = "2025-07-12",
@@ -92,7 +115,9 @@ def get_shelf_analysis_flexible(
     gender_labels: List[str] = [],
     top_n: int = 5,
     exclude_from_top: List[str] = [],
-    period: str = "both"
+    period: str = "both",
+    depth: int = 1,
+    mode: str = "memory"
 ):
     """
     고객별 첫 픽업 전후 진열대 방문 패턴 분석 도구
@@ -105,8 +130,11 @@ def get_shelf_analysis_flexible(
     - gender_labels: 성별 필터 (예: ['여자'])
     - exclude_shelves: 제외할 진열대 (예: ['진열대없음', '전자렌지'])
     - start_date, end_date: 분석 기간 (YYYY-MM-DD 형식)
+    - top_n: 순번별 상위 진열대 수
+    - depth: 픽업 직전/직후 몇 번째 응시 매대까지 볼지 (1이면 바로 직전/직후만)
+    - mode: "memory"(기본)는 기간별 고객 경로를 한 번만 조회해 조건 조합을 메모리에서 계산, "sql"은 매번 ClickHouse에서 계산
     
-    반환값: [('BEFORE'/'AFTER', 순위, 진열대명, 비율%)] 형식의 리스트
+    반환값: [('BEFORE'/'AFTER', 순번, 순위, 진열대명, 비율%)] 형식의 리스트
     
     사용 예시:
     get_shelf_analysis_flexible(
@@ -125,12 +153,8 @@ def get_shelf_analysis_flexible(
     print(f"  gender_labels: {gender_labels}")
     print(f"  exclude_dates: {exclude_dates}")
     print(f"  top_n: {top_n}")
-    
-    client = get_site_client(site, "plusinsight")
-    if not client:
-        return f"❌ {site} 매장 연결 실패"
-    if not client:
-        return {"error": "ClickHouse 연결 실패"}
+    print(f"  depth: {depth}")
+    print(f"  mode: {mode}")
     
     # 안전장치: 너무 넓은 범위 쿼리 방지
     if not target_shelves and not age_groups and not gender_labels:
@@ -146,588 +170,8 @@ def get_shelf_analysis_flexible(
         exclude_shelves = []
     if not exclude_from_top:
         exclude_from_top = []
-    
-    # 날짜 조건
-    exclude_dates_str = "', '".join(exclude_dates)
-    date_condition = f"AND cbe.date NOT IN ('{exclude_dates_str}')"
-    
-    # 연령대 조건 (실제 age 컬럼 기반)
-    age_condition = ""
-    if age_groups:
-        age_conditions = []
-        for age_group in age_groups:
-            if age_group == '10대':
-                age_conditions.append("(cbe.age >= 10 AND cbe.age < 20)")
-            elif age_group == '20대':
-                age_conditions.append("(cbe.age >= 20 AND cbe.age < 30)")
-            elif age_group == '30대':
-                age_conditions.append("(cbe.age >= 30 AND cbe.age < 40)")
-            elif age_group == '40대':
-                age_conditions.append("(cbe.age >= 40 AND cbe.age < 50)")
-            elif age_group == '50대':
-                age_conditions.append("(cbe.age >= 50 AND cbe.age < 60)")
-            elif age_group == '60대 이상':
-                age_conditions.append("(cbe.age >= 60)")
-            elif age_group == '미상':
-                age_conditions.append("(cbe.age IS NULL)")
-        if age_conditions:
-            age_condition = f"AND ({' OR '.join(age_conditions)})"
-    
-    # 성별 조건 (실제 gender 컬럼 기반: 0=남자, 1=여자)
-    gender_condition = ""
-    if gender_labels:
-        gender_conditions = []
-        for gender_label in gender_labels:
-            if gender_label == '남자':
-                gender_conditions.append("cbe.gender = 0")
-            elif gender_label == '여자':
-                gender_conditions.append("cbe.gender = 1")
-            elif gender_label == '미상':
-                gender_conditions.append("cbe.gender IS NULL")
-        if gender_conditions:
-            gender_condition = f"AND ({' OR '.join(gender_conditions)})"
-    
-    # pivot 테이블 필터링 조건들 (리버스 엔지니어링으로 발견한 올바른 방식)
-    target_shelf_filter = "1=1"  # 기본값
-    if target_shelves:
-        target_shelves_str = "', '".join(target_shelves)
-        target_shelf_filter = f"first_pickup_zone IN ('{target_shelves_str}')"
-    
-    age_filter = "1=1"  # 기본값
-    if age_groups:
-        age_filters = []
-        for age_group in age_groups:
-            age_filters.append(f"age_group = '{age_group}'")
-        if age_filters:
-            age_filter = f"({' OR '.join(age_filters)})"
-    
-    gender_filter = "1=1"  # 기본값
-    if gender_labels:
-        gender_filters = []
-        for gender_label in gender_labels:
-            gender_filters.append(f"gender_label = '{gender_label}'")
-        if gender_filters:
-            gender_filter = f"({' OR '.join(gender_filters)})"
-    
-    exclude_shelf_condition = ""
-    if exclude_shelves:
-        exclude_shelves_str = "', '".join(exclude_shelves)
-        exclude_shelf_condition = f"AND COALESCE(NULLIF(shelf_name, ''), '진열대없음') NOT IN ('{exclude_shelves_str}')"
-    
-    exclude_from_top_condition = ""
-    if exclude_from_top:
-        exclude_from_top_str = "', '".join(exclude_from_top)
-        exclude_from_top_condition = f"AND shelf_name NOT IN ('{exclude_from_top_str}')"
-    
-    # 기간 조건
-    period_condition = ""
-    if period == "before":
-        period_condition = "AND period = 'before'"
-    elif period == "after":
-        period_condition = "AND period = 'after'"
-    
-    # 올바른 분석 쿼리 - 초기에 조건 필터링 하지 않고 나중에 pivot에서 필터링
-    analysis_query = f"""
-    WITH pickup_visit_counts AS (
-        SELECT
-            cbe.person_seq AS person_seq,
-            cba.attention_target_zone_id AS attention_target_zone_id,
-            z.name AS zone_name,
-            z.coords AS coords,
-            MIN(cbe.`timestamp`) AS first_event_date,
-            cbe.age AS age,
-            cbe.gender AS gender,
-            COUNT(*) AS visit_count
-        FROM customer_behavior_event cbe
-        LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
-        LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
-        WHERE cbe.date BETWEEN '{start_date}' AND '{end_date}'
-            {date_condition}
-            AND cbe.event_type = 1  -- 픽업
-            AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
-            AND z.name IS NOT NULL
-            -- 초기 필터링 제거: age_condition, gender_condition, target_shelf_condition
-        GROUP BY
-            cbe.person_seq,
-            cbe.age,
-            cbe.gender,
-            cba.attention_target_zone_id,
-            z.name,
-            z.coords
-    ),
-    gaze_visit_counts AS (
-        SELECT
-            cbe.person_seq AS person_seq,
-            cba.attention_target_zone_id AS attention_target_zone_id,
-            z.name AS zone_name,
-            z.coords AS coords,
-            MIN(cbe.`timestamp`) AS first_event_date,
-            cbe.age AS age,
-            cbe.gender AS gender,
-            COUNT(*) AS visit_count
-        FROM customer_behavior_event cbe
-        LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
-        LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
-        WHERE cbe.date BETWEEN '{start_date}' AND '{end_date}'
-            {date_condition}
-            AND cbe.event_type = 0  -- 응시
-            AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
-            AND z.name IS NOT NULL
-            -- 초기 필터링 제거: age_condition, gender_condition
-        GROUP BY
-            cbe.person_seq,
-            cbe.age,
-            cbe.gender,
-            cba.attention_target_zone_id,
-            z.name,
-            z.coords
-    ),
-    pickup_df AS (
-        SELECT
-            person_seq,
-            attention_target_zone_id,
-            zone_name,
-            coords,
-            first_event_date,
-            age,
-            gender,
-            visit_count,
-            ROW_NUMBER() OVER (
-                PARTITION BY person_seq
-                ORDER BY first_event_date
-            ) AS pickup_order
-        FROM pickup_visit_counts
-    ),
-    gaze_df AS (
-        SELECT
-            person_seq,
-            attention_target_zone_id,
-            zone_name,
-            coords,
-            first_event_date,
-            age,
-            gender,
-            visit_count,
-            ROW_NUMBER() OVER (
-                PARTITION BY person_seq
-                ORDER BY first_event_date
-            ) AS gaze_order
-        FROM gaze_visit_counts
-        WHERE visit_count >= 3
-    ),
-    combined_events AS (
-        -- 픽업 이벤트 (모든 방문)
-        SELECT 
-            person_seq,
-            first_event_date,
-            zone_name,
-            coords,
-            age,
-            gender,
-            'P' as event_type_label  -- P for Pickup
-        FROM pickup_df
-        UNION ALL
-        -- 응시 이벤트 (3회 이상 방문한 존만)
-        SELECT 
-            person_seq,
-            first_event_date,
-            zone_name,
-            coords,
-            age,
-            gender,
-            'G' as event_type_label  -- G for Gaze
-        FROM gaze_df
-    ),
-    integrated_routes AS (
-        SELECT
-            person_seq,
-            multiIf(
-                age >= 60, '60대 이상',
-                age >= 50, '50대',
-                age >= 40, '40대',
-                age >= 30, '30대',
-                age >= 20, '20대',
-                age >= 10, '10대',
-                age IS NULL, '미상',
-                '10세 미만'
-            ) AS age_group,
-            multiIf(
-                gender = 0, '남자',
-                gender = 1, '여자',
-                '미상'
-            ) AS gender_label,
-            -- 시간순으로 정렬된 통합 경로 (이벤트 타입 포함)
-            arrayStringConcat(
-                arrayMap(x -> concat(x.2, '(', x.4, ')'), arraySort(
-                    groupArray((first_event_date, zone_name, coords, event_type_label))
-                )), ' → '
-            ) AS integrated_route,
-            -- 시간순 존 이름들
-            arrayMap(x -> x.2,
-                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-            ) AS zone_names,
-            -- 시간순 좌표들
-            arrayMap(x -> x.3,
-                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-            ) AS zone_coords,
-            -- 시간순 이벤트 발생시간들
-            arrayMap(x -> x.1,
-                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-            ) AS event_timestamps,
-            -- 시간순 이벤트 타입들
-            arrayMap(x -> x.4,
-                arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-            ) AS event_types,
-            -- 첫 번째 픽업 전 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
-            multiIf(
-                arrayFirstIndex(x -> x = 'P', 
-                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                ) = 0, 0,
-                arrayCount(x -> x = 'G', 
-                    arraySlice(
-                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ) AS gaze_count_before_first_pickup,
-            -- 첫 번째 픽업 직후 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
-            multiIf(
-                arrayFirstIndex(x -> x = 'P', 
-                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                ) = 0, 0,
-                arrayCount(x -> x = 'G',
-                    arraySlice(
-                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) + 1,
-                        length(arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                )
-            ) AS gaze_count_after_first_pickup,
-            -- 첫 번째 픽업한 매대 이름
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                ), 1
-            ) AS first_pickup_zone,
-            -- 첫 번째 픽업 시간
-            arrayElement(
-                arrayMap(x -> x.1,
-                    arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                ), 1
-            ) AS first_pickup_time,
-            -- 픽업 전 응시 매대 경로 (시간순)
-            arrayStringConcat(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                ), ' → '
-            ) AS gaze_route_before_first_pickup,
-            -- 픽업 직전 1번째 응시 매대 (가장 마지막)
-            arrayElement(
-                arrayReverse(
-                    arrayMap(x -> x.2,
-                        arraySlice(
-                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    )
-                ), 1
-            ) AS before_pickup_gaze_1st,
-            -- 픽업 직전 2번째 응시 매대
-            arrayElement(
-                arrayReverse(
-                    arrayMap(x -> x.2,
-                        arraySlice(
-                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    )
-                ), 2
-            ) AS before_pickup_gaze_2nd,
-            -- 픽업 직전 3번째 응시 매대
-            arrayElement(
-                arrayReverse(
-                    arrayMap(x -> x.2,
-                        arraySlice(
-                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    )
-                ), 3
-            ) AS before_pickup_gaze_3rd,
-            -- 픽업 직전 4번째 응시 매대
-            arrayElement(
-                arrayReverse(
-                    arrayMap(x -> x.2,
-                        arraySlice(
-                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    )
-                ), 4
-            ) AS before_pickup_gaze_4th,
-            -- 픽업 직전 5번째 응시 매대
-            arrayElement(
-                arrayReverse(
-                    arrayMap(x -> x.2,
-                        arraySlice(
-                            arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    )
-                ), 5
-            ) AS before_pickup_gaze_5th,
-            -- 픽업 후 응시 매대 경로 (시간순)
-            arrayStringConcat(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), ' → '
-            ) AS gaze_route_after_first_pickup,
-            -- 픽업 후 1번째 응시 매대
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), 1
-            ) AS after_pickup_gaze_1st,
-            -- 픽업 후 2번째 응시 매대
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), 2
-            ) AS after_pickup_gaze_2nd,
-            -- 픽업 후 3번째 응시 매대
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), 3
-            ) AS after_pickup_gaze_3rd,
-            -- 픽업 후 4번째 응시 매대
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), 4
-            ) AS after_pickup_gaze_4th,
-            -- 픽업 후 5번째 응시 매대
-            arrayElement(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        arrayCount(x -> x = 'G', 
-                            arraySlice(
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                                1,
-                                arrayFirstIndex(x -> x = 'P', 
-                                    arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                                ) - 1
-                            )
-                        ) + 1,
-                        length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                    )
-                ), 5
-            ) AS after_pickup_gaze_5th
-        FROM combined_events
-        GROUP BY person_seq, age, gender
-    )
-    , pivot as (
-    SELECT
-        person_seq,
-        age_group,
-        gender_label,
-        integrated_route,      -- 픽업과 응시가 시간순으로 통합된 경로
-        zone_names,            -- 시간순 존 이름 배열
-        zone_coords,           -- 시간순 좌표 배열
-        event_timestamps,      -- 시간순 이벤트 발생시간 배열
-        event_types,           -- 시간순 이벤트 타입 배열 (P: 픽업, G: 응시)
-        gaze_count_before_first_pickup,  -- 첫 번째 픽업 전 응시 매대 수
-        gaze_count_after_first_pickup,   -- 첫 번째 픽업 후 응시 매대 수
-        first_pickup_zone,               -- 첫 번째 픽업한 매대 이름
-        first_pickup_time,               -- 첫 번째 픽업 시간
-        gaze_route_before_first_pickup,  -- 픽업 전 응시 매대 경로
-        gaze_route_after_first_pickup,   -- 픽업 후 응시 매대 경로
-        before_pickup_gaze_1st,          -- 픽업 직전 1번째 응시 매대 (가장 마지막)
-        before_pickup_gaze_2nd,          -- 픽업 직전 2번째 응시 매대
-        before_pickup_gaze_3rd,          -- 픽업 직전 3번째 응시 매대
-        before_pickup_gaze_4th,          -- 픽업 직전 4번째 응시 매대
-        before_pickup_gaze_5th,          -- 픽업 직전 5번째 응시 매대
-        after_pickup_gaze_1st,           -- 픽업 후 1번째 응시 매대
-        after_pickup_gaze_2nd,           -- 픽업 후 2번째 응시 매대
-        after_pickup_gaze_3rd,           -- 픽업 후 3번째 응시 매대
-        after_pickup_gaze_4th,           -- 픽업 후 4번째 응시 매대
-        after_pickup_gaze_5th            -- 픽업 후 5번째 응시 매대
-    FROM integrated_routes
-    ORDER BY person_seq
-    )
-    , filtered_pivot AS (
-        -- pivot 테이블에서 조건 필터링 (리버스 엔지니어링으로 발견한 올바른 방식)
-        SELECT *
-        FROM pivot
-        WHERE first_pickup_zone IS NOT NULL  -- 픽업이 있는 고객만
-            AND ({target_shelf_filter})
-            AND ({age_filter})
-            AND ({gender_filter})
-    )
-    , shelf_analysis AS (
-        -- 픽업 직전 마지막 응시매대 (1st만, 계산대 제외)
-        SELECT 
-            'before' as period,
-            COALESCE(NULLIF(before_pickup_gaze_1st, ''), '진열대없음') as shelf_name
-        FROM filtered_pivot
-        WHERE COALESCE(NULLIF(before_pickup_gaze_1st, ''), '진열대없음') != '계산대'
-            {exclude_shelf_condition}
-        
-        UNION ALL
-        
-        -- 픽업 후 첫 번째 응시매대 (1st만, 계산대 제외)
-        SELECT 
-            'after' as period,
-            COALESCE(NULLIF(after_pickup_gaze_1st, ''), '진열대없음') as shelf_name
-        FROM filtered_pivot
-        WHERE COALESCE(NULLIF(after_pickup_gaze_1st, ''), '진열대없음') != '계산대'
-            {exclude_shelf_condition}
-    ),
-    
-    -- 진열대별 집계 및 비율 계산
-    aggregated AS (
-        SELECT 
-            period,
-            shelf_name,
-            COUNT(*) as visit_count,
-            ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (PARTITION BY period)) as percentage
-        FROM shelf_analysis
-        GROUP BY period, shelf_name
-    ),
-    
-    -- 기간별 Top 5 순위 매기기
-    ranked AS (
-        SELECT 
-            period,
-            shelf_name,
-            percentage,
-            ROW_NUMBER() OVER (PARTITION BY period ORDER BY percentage DESC) as rank
-        FROM aggregated
-        WHERE percentage > 0  -- 0% 제외z 
-    ),
-    
-    -- Top 5만 필터링
-    top5 AS (
-        SELECT *
-        FROM ranked
-        WHERE rank <= 5
-    ),
-    
-    -- 픽업 전 Top5 결과
-    before_results AS (
-        SELECT 
-            'BEFORE' as analysis_type,
-            rank as no,
-            shelf_name,
-            CONCAT(CAST(percentage as String), '%') as pct
-        FROM top5 
-        WHERE period = 'before'
-    ),
-    
-    -- 픽업 후 Top5 결과
-    after_results AS (
-        SELECT 
-            'AFTER' as analysis_type,
-            rank as no,
-            shelf_name,
-            CONCAT(CAST(percentage as String), '%') as pct
-        FROM top5 
-        WHERE period = 'after'
-    )
-    
-    -- 최종 결과 (픽업 전/후 별도 테이블)
-    SELECT * FROM before_results
-    UNION ALL
-    SELECT * FROM after_results
-    ORDER BY analysis_type, no
-    """
+    if not 1 <= depth <= 20:
+        return {"error": "depth는 1~20 사이여야 합니다."}
     
     try:
         print(f"🔍 [DEBUG] 쿼리 실행 시작 - 예상 조건:")
@@ -736,25 +180,49 @@ def get_shelf_analysis_flexible(
         print(f"  연령대: {age_groups}")
         print(f"  성별: {gender_labels}")
         
-        result = client.query(analysis_query)
-        print(f"✅ 진열대 분석 완료: {len(result.result_rows):,}행")
-        client.close()
+        if mode == "memory" and ENGINE_AVAILABLE:
+            # 같은 기간의 고객 경로는 한 번만 조회하고 조건 조합은 메모리에서 계산
+            routes = await get_shelf_routes(site, "plusinsight", start_date, end_date, exclude_dates)
+            if routes is None:
+                return f"❌ {site} 매장 연결 실패"
+            rows = routes.analyze(target_shelves, age_groups, gender_labels, exclude_shelves, top_n, depth)
+        else:
+            result = await query_template_async(
+                site, SHELF_ANALYSIS_QUERY, "plusinsight",
+                start_date=start_date,
+                end_date=end_date,
+                exclude_dates=exclude_dates,
+                target_shelves=target_shelves,
+                age_groups=age_groups,
+                gender_labels=gender_labels,
+                exclude_shelves=exclude_shelves,
+                top_n=top_n,
+                depth=depth,
+            )
+            if result is None:
+                return f"❌ {site} 매장 연결 실패"
+            rows = result.result_rows
+        print(f"✅ 진열대 분석 완료: {len(rows):,}행")
         
-        if result.result_rows:
+        if rows:
             # 데이터를 포맷팅하여 문자열로 반환
             answer = f"📊 **{site}** 진열대 분석 결과:\n"
-            for row in result.result_rows:
+            for row in rows:
                 period = row[0]  # 'BEFORE' or 'AFTER'
-                rank = row[1]
-                shelf_name = row[2]
-                percentage = row[3]
-                answer += f"  {period} - {rank}위: {shelf_name} ({percentage})\n"
+                position = row[1]  # 픽업 직전/직후 몇 번째 응시 매대인지
+                rank = row[2]
+                shelf_name = row[3]
+                percentage = row[4]
+                if depth == 1:
+                    answer += f"  {period} - {rank}위: {shelf_name} ({percentage})\n"
+                else:
+                    answer += f"  {period} {position}번째 - {rank}위: {shelf_name} ({percentage})\n"
             return answer
         else:
             return f"⚠️ {site}: 분석할 데이터가 없습니다."
     except Exception as e:
         print(f"❌ 쿼리 실행 실패: {e}")
-        print(f"🔍 [DEBUG] 쿼리 길이: {len(analysis_query)} 문자")
+        print(f"🔍 [DEBUG] 쿼리 길이: {len(SHELF_ANALYSIS_QUERY.sql)} 문자")
         
         # 구문 오류 위치 정보 추출
         error_str = str(e)
@@ -767,8 +235,8 @@ def get_shelf_analysis_flexible(
                 
                 # 오류 위치 주변 텍스트 표시
                 start = max(0, position - 100)
-                end = min(len(analysis_query), position + 100)
-                context = analysis_query[start:end]
+                end = min(len(SHELF_ANALYSIS_QUERY.sql), position + 100)
+                context = SHELF_ANALYSIS_QUERY.sql[start:end]
                 print(f"🔍 [DEBUG] 오류 위치 주변:")
                 print(f"'{context}'")
         
@@ -776,15 +244,30 @@ def get_shelf_analysis_flexible(
 
 # NEW TOOL: 픽업-응시 요약 분석
 
+# 첫 픽업 전후 응시 매대 개수 요약 쿼리
+PICKUP_GAZE_SUMMARY_QUERY = QueryTemplate("shelf.pickup_gaze_summary", PERSON_ROUTES_CTE + """
+    SELECT
+        age_group,
+        gender_label,
+        avg(length(gazes_before)) AS avg_gaze_before,  -- 첫 번째 픽업 전 응시 매대 수 (픽업이 없으면 0)
+        avg(length(gazes_after)) AS avg_gaze_after     -- 첫 번째 픽업 후 응시 매대 수 (픽업이 없으면 0)
+    FROM person_routes
+    GROUP BY age_group, gender_label
+    """)
+
 @mcp.tool()
-def pickup_gaze_summary(
+@cached_tool
+async def pickup_gaze_summary(
     site: str,
     start_date: str = "2025-06-12",
     end_date: str = "2025-07-12",
     exclude_dates: List[str] = ["2025-06-22"],
+    mode: str = "memory",
 ) -> str:
     """첫 픽업 전 후 응시 매대 개수 평균을 연령 성별별로 요약
 
+    mode: "memory"(기본)는 get_shelf_analysis_flexible과 같은 기간의 고객 경로를 재사용, "sql"은 ClickHouse에서 계산
+
     반환 컬럼:
         age_group, gender_label, avg_gaze_before, avg_gaze_after
     """
@@ -792,446 +275,26 @@ def pickup_gaze_summary(
     print(f"  start_date: {start_date} ~ {end_date}")
     print(f"  exclude_dates: {exclude_dates}")
 
-    client = get_site_client(site, "plusinsight")
-    if not client:
-        return f"❌ {site} 매장 연결 실패"
-    if not client:
-        return {"error": "ClickHouse 연결 실패"}
-
-    # 날짜 조건 문자열 생성
-    exclude_condition = ""
-    if exclude_dates:
-        exclude_str = "', '".join(exclude_dates)
-        exclude_condition = f"AND cbe.date NOT IN ('{exclude_str}')"
-
-    # 원본 쿼리 그대로 사용 (f-string으로 날짜/제외조건만 삽입)
-    query_filled = f"""
-WITH pickup_visit_counts AS (
-    SELECT
-        cbe.person_seq AS person_seq,
-        cba.attention_target_zone_id AS attention_target_zone_id,
-        z.name AS zone_name,
-        z.coords AS coords,
-        MIN(cbe.`timestamp`) AS first_event_date,
-        cbe.age AS age,
-        cbe.gender AS gender,
-        COUNT(*) AS visit_count
-    FROM customer_behavior_event cbe
-    LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
-    LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
-    WHERE cbe.date BETWEEN '{start_date}' AND '{end_date}'
-        {exclude_condition}
-        AND cbe.event_type = 1  -- 픽업
-        AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
-        AND z.name IS NOT NULL
-    GROUP BY
-        cbe.person_seq,
-        cbe.age,
-        cbe.gender,
-        cba.attention_target_zone_id,
-        z.name,
-        z.coords
-),
-gaze_visit_counts AS (
-    SELECT
-        cbe.person_seq AS person_seq,
-        cba.attention_target_zone_id AS attention_target_zone_id,
-        z.name AS zone_name,
-        z.coords AS coords,
-        MIN(cbe.`timestamp`) AS first_event_date,
-        cbe.age AS age,
-        cbe.gender AS gender,
-        COUNT(*) AS visit_count
-    FROM customer_behavior_event cbe
-    LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
-    LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
-    WHERE cbe.date BETWEEN '{start_date}' AND '{end_date}'
-        {exclude_condition}
-        AND cbe.event_type = 0  -- 응시
-        AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
-        AND z.name IS NOT NULL
-    GROUP BY
-        cbe.person_seq,
-        cbe.age,
-        cbe.gender,
-        cba.attention_target_zone_id,
-        z.name,
-        z.coords
-),
-pickup_df AS (
-    SELECT
-        person_seq,
-        attention_target_zone_id,
-        zone_name,
-        coords,
-        first_event_date,
-        age,
-        gender,
-        visit_count,
-        ROW_NUMBER() OVER (
-            PARTITION BY person_seq
-            ORDER BY first_event_date
-        ) AS pickup_order
-    FROM pickup_visit_counts
-),
-gaze_df AS (
-    SELECT
-        person_seq,
-        attention_target_zone_id,
-        zone_name,
-        coords,
-        first_event_date,
-        age,
-        gender,
-        visit_count,
-        ROW_NUMBER() OVER (
-            PARTITION BY person_seq
-            ORDER BY first_event_date
-        ) AS gaze_order
-    FROM gaze_visit_counts
-    WHERE visit_count >= 3
-),
-combined_events AS (
-    -- 픽업 이벤트 (모든 방문)
-    SELECT 
-        person_seq,
-        first_event_date,
-        zone_name,
-        coords,
-        age,
-        gender,
-        'P' as event_type_label  -- P for Pickup
-    FROM pickup_df
-    UNION ALL
-    -- 응시 이벤트 (3회 이상 방문한 존만)
-    SELECT 
-        person_seq,
-        first_event_date,
-        zone_name,
-        coords,
-        age,
-        gender,
-        'G' as event_type_label  -- G for Gaze
-    FROM gaze_df
-),
-integrated_routes AS (
-    SELECT
-        person_seq,
-        multiIf(
-            age >= 60, '60대 이상',
-            age >= 50, '50대',
-            age >= 40, '40대',
-            age >= 30, '30대',
-            age >= 20, '20대',
-            age >= 10, '10대',
-            age IS NULL, '미상',
-            '10세 미만'
-        ) AS age_group,
-        multiIf(
-            gender = 0, '남자',
-            gender = 1, '여자',
-            '미상'
-        ) AS gender_label,
-        -- 시간순으로 정렬된 통합 경로 (이벤트 타입 포함)
-        arrayStringConcat(
-            arrayMap(x -> concat(x.2, '(', x.4, ')'), arraySort(
-                groupArray((first_event_date, zone_name, coords, event_type_label))
-            )), ' → '
-        ) AS integrated_route,
-        -- 시간순 존 이름들
-        arrayMap(x -> x.2,
-            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-        ) AS zone_names,
-        -- 시간순 좌표들
-        arrayMap(x -> x.3,
-            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-        ) AS zone_coords,
-        -- 시간순 이벤트 발생시간들
-        arrayMap(x -> x.1,
-            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-        ) AS event_timestamps,
-        -- 시간순 이벤트 타입들
-        arrayMap(x -> x.4,
-            arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))
-        ) AS event_types,
-        -- 첫 번째 픽업 전 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
-        multiIf(
-            arrayFirstIndex(x -> x = 'P', 
-                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-            ) = 0, 0,
-            arrayCount(x -> x = 'G', 
-                arraySlice(
-                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    1,
-                    arrayFirstIndex(x -> x = 'P', 
-                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                    ) - 1
-                )
-            )
-        ) AS gaze_count_before_first_pickup,
-        -- 첫 번째 픽업 직후 매대 방문 수 (응시 이벤트만) - 픽업이 없으면 0
-        multiIf(
-            arrayFirstIndex(x -> x = 'P', 
-                arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-            ) = 0, 0,
-            arrayCount(x -> x = 'G',
-                arraySlice(
-                    arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayFirstIndex(x -> x = 'P', 
-                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                    ) + 1,
-                    length(arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            )
-        ) AS gaze_count_after_first_pickup,
-        -- 첫 번째 픽업한 매대 이름
-        arrayElement(
-            arrayMap(x -> x.2,
-                arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-            ), 1
-        ) AS first_pickup_zone,
-        -- 첫 번째 픽업 시간
-        arrayElement(
-            arrayMap(x -> x.1,
-                arrayFilter(y -> y.4 = 'P', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-            ), 1
-        ) AS first_pickup_time,
-        -- 픽업 전 응시 매대 경로 (시간순)
-        arrayStringConcat(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    1,
-                    arrayFirstIndex(x -> x = 'P', 
-                        arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                    ) - 1
-                )
-            ), ' → '
-        ) AS gaze_route_before_first_pickup,
-        -- 픽업 직전 1번째 응시 매대 (가장 마지막)
-        arrayElement(
-            arrayReverse(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ), 1
-        ) AS before_pickup_gaze_1st,
-        -- 픽업 직전 2번째 응시 매대
-        arrayElement(
-            arrayReverse(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ), 2
-        ) AS before_pickup_gaze_2nd,
-        -- 픽업 직전 3번째 응시 매대
-        arrayElement(
-            arrayReverse(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ), 3
-        ) AS before_pickup_gaze_3rd,
-        -- 픽업 직전 4번째 응시 매대
-        arrayElement(
-            arrayReverse(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ), 4
-        ) AS before_pickup_gaze_4th,
-        -- 픽업 직전 5번째 응시 매대
-        arrayElement(
-            arrayReverse(
-                arrayMap(x -> x.2,
-                    arraySlice(
-                        arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                        1,
-                        arrayFirstIndex(x -> x = 'P', 
-                            arrayMap(x -> x.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                        ) - 1
-                    )
-                )
-            ), 5
-        ) AS before_pickup_gaze_5th,
-        -- 픽업 후 응시 매대 경로 (시간순)
-        arrayStringConcat(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), ' → '
-        ) AS gaze_route_after_first_pickup,
-        -- 픽업 후 1번째 응시 매대
-        arrayElement(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), 1
-        ) AS after_pickup_gaze_1st,
-        -- 픽업 후 2번째 응시 매대
-        arrayElement(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), 2
-        ) AS after_pickup_gaze_2nd,
-        -- 픽업 후 3번째 응시 매대
-        arrayElement(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), 3
-        ) AS after_pickup_gaze_3rd,
-        -- 픽업 후 4번째 응시 매대
-        arrayElement(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), 4
-        ) AS after_pickup_gaze_4th,
-        -- 픽업 후 5번째 응시 매대
-        arrayElement(
-            arrayMap(x -> x.2,
-                arraySlice(
-                    arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                    arrayCount(x -> x = 'G', 
-                        arraySlice(
-                            arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))),
-                            1,
-                            arrayFirstIndex(x -> x = 'P', 
-                                arrayMap(z -> z.4, arraySort(groupArray((first_event_date, zone_name, coords, event_type_label))))
-                            ) - 1
-                        )
-                    ) + 1,
-                    length(arrayFilter(y -> y.4 = 'G', arraySort(groupArray((first_event_date, zone_name, coords, event_type_label)))))
-                )
-            ), 5
-        ) AS after_pickup_gaze_5th
-    FROM combined_events
-    GROUP BY person_seq, age, gender
-)
-, pivot as (
-SELECT
-    person_seq,
-    age_group,
-    gender_label,
-    integrated_route,      -- 픽업과 응시가 시간순으로 통합된 경로
-    zone_names,            -- 시간순 존 이름 배열
-    zone_coords,           -- 시간순 좌표 배열
-    event_timestamps,      -- 시간순 이벤트 발생시간 배열
-    event_types,           -- 시간순 이벤트 타입 배열 (P: 픽업, G: 응시)
-    gaze_count_before_first_pickup,  -- 첫 번째 픽업 전 응시 매대 수
-    gaze_count_after_first_pickup,   -- 첫 번째 픽업 후 응시 매대 수
-    first_pickup_zone,               -- 첫 번째 픽업한 매대 이름
-    first_pickup_time,               -- 첫 번째 픽업 시간
-    gaze_route_before_first_pickup,  -- 픽업 전 응시 매대 경로
-    gaze_route_after_first_pickup,   -- 픽업 후 응시 매대 경로
-    before_pickup_gaze_1st,          -- 픽업 직전 1번째 응시 매대 (가장 마지막)
-    before_pickup_gaze_2nd,          -- 픽업 직전 2번째 응시 매대
-    before_pickup_gaze_3rd,          -- 픽업 직전 3번째 응시 매대
-    before_pickup_gaze_4th,          -- 픽업 직전 4번째 응시 매대
-    before_pickup_gaze_5th,          -- 픽업 직전 5번째 응시 매대
-    after_pickup_gaze_1st,           -- 픽업 후 1번째 응시 매대
-    after_pickup_gaze_2nd,           -- 픽업 후 2번째 응시 매대
-    after_pickup_gaze_3rd,           -- 픽업 후 3번째 응시 매대
-    after_pickup_gaze_4th,           -- 픽업 후 4번째 응시 매대
-    after_pickup_gaze_5th            -- 픽업 후 5번째 응시 매대
-FROM integrated_routes
-ORDER BY person_seq
-)
-select  age_group, gender_label, avg(gaze_count_before_first_pickup), avg(gaze_count_after_first_pickup)
-from   pivot
-group by age_group, gender_label
-"""
-
     try:
-        result = client.query(query_filled)
-        print(f"✅ 요약 분석 완료: {len(result.result_rows):,}행")
-        client.close()
+        if mode == "memory" and ENGINE_AVAILABLE:
+            routes = await get_shelf_routes(site, "plusinsight", start_date, end_date, list(exclude_dates or []))
+            if routes is None:
+                return f"❌ {site} 매장 연결 실패"
+            rows = routes.gaze_summary()
+        else:
+            result = await query_template_async(
+                site, PICKUP_GAZE_SUMMARY_QUERY, "plusinsight",
+                start_date=start_date, end_date=end_date, exclude_dates=list(exclude_dates or []),
+            )
+            if result is None:
+                return f"❌ {site} 매장 연결 실패"
+            rows = result.result_rows
+        print(f"✅ 요약 분석 완료: {len(rows):,}행")
         
-        if result.result_rows:
+        if rows:
             # 데이터를 포맷팅하여 문자열로 반환
             answer = f"📊 **{site}** 탐색 경향성:\n"
-            for row in result.result_rows:
+            for row in rows:
                 age_group = row[0]
                 gender_label = row[1]
                 avg_gaze_before = round(row[2], 2)
@@ -5,12 +5,20 @@ MCP Utils
 MCP 툴들에서 공통으로 사용하는 유틸리티 함수들
 """
 
+import os
+import json
+import threading
 import tiktoken
-from typing import Dict
+from typing import Dict, List, Sequence, Any, Optional, Tuple, Iterable
 
 # 기본 모델 설정
 DEFAULT_MODEL = "gpt-4o"
 
+# 컬럼 단위 결과 전달 설정
+# 직렬화한 결과가 이 길이를 넘으면 에이전트에게는 앞부분 미리보기만 보냄
+RESULT_INLINE_MAX_CHARS = int(os.getenv("MCP_RESULT_INLINE_MAX_CHARS", "20000"))
+RESULT_PREVIEW_ROWS = int(os.getenv("MCP_RESULT_PREVIEW_ROWS", "20"))
+
 # 모델별 최대 토큰 수
 MODEL_MAX_TOKENS: Dict[str, int] = {
     "gpt-4o": 128000,
@@ -18,20 +26,222 @@ MODEL_MAX_TOKENS: Dict[str, int] = {
     "gpt-3.5-turbo": 4096,
 }
 
+# 모델별 tiktoken 인코더 캐시 (encoding_for_model은 호출마다 인코더를 찾으므로 한 번만 생성)
+_ENCODERS: Dict[str, Any] = {}
+_ENCODERS_LOCK = threading.Lock()
+
+def get_encoding(model: str = DEFAULT_MODEL):
+    """모델의 tiktoken 인코더 반환 (프로세스 내에서 재사용)"""
+    encoding = _ENCODERS.get(model)
+    if encoding is not None:
+        return encoding
+
+    with _ENCODERS_LOCK:
+        encoding = _ENCODERS.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except Exception:
+                # 모델을 찾을 수 없는 경우 기본 인코딩 사용
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _ENCODERS[model] = encoding
+    return encoding
+
 def num_tokens_from_string(string: str, model: str = DEFAULT_MODEL) -> int:
     """문자열의 토큰 수를 계산합니다."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
-    except Exception as e:
-        # 모델을 찾을 수 없는 경우 기본 인코딩 사용
-        encoding = tiktoken.get_encoding("cl100k_base")
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
+    return len(get_encoding(model).encode(string))
 
 def is_token_limit_exceeded(text: str, model: str = DEFAULT_MODEL, reserved_tokens: int = 1000) -> bool:
     """텍스트가 토큰 제한을 초과하는지 확인합니다."""
     token_count = num_tokens_from_string(text, model)
     max_tokens = MODEL_MAX_TOKENS.get(model, 4096)  # 기본값 4096
-    return token_count > (max_tokens - reserved_tokens)
\ No newline at end of file
+    return token_count > (max_tokens - reserved_tokens)
+
+
+class TokenBudget:
+    """행 단위로 토큰을 누적하며 제한에 닿으면 나머지 행을 생략하는 예산
+
+    답변 전체를 만든 뒤 한 번에 검사하는 대신, 행을 포맷할 때마다 토큰 수를 더해
+    제한을 넘는 순간 포맷을 멈추고 "N개 행 생략" 문구를 붙입니다.
+
+    사용법:
+        budget = TokenBudget()
+        budget.charge(header)
+        answer = header + "".join(budget.take((f"\n{row}" for row in rows), len(rows)))
+        answer += budget.footer()
+    """
+
+    __slots__ = ("limit", "used", "omitted", "_encoding")
+
+    def __init__(self, model: str = DEFAULT_MODEL, reserved_tokens: int = 1000, max_tokens: Optional[int] = None):
+        # reserved_tokens는 생략 문구와 에이전트 프롬프트 여유분
+        self.limit = (max_tokens or MODEL_MAX_TOKENS.get(model, 4096)) - reserved_tokens
+        self.used = 0
+        self.omitted = 0
+        self._encoding = get_encoding(model)
+
+    @property
+    def exhausted(self) -> bool:
+        """이미 생략된 행이 있으면 True (이후 행은 추가하지 않음)"""
+        return self.omitted > 0
+
+    def charge(self, text: str) -> None:
+        """제목/헤더처럼 항상 포함되는 텍스트의 토큰을 차감"""
+        self.used += len(self._encoding.encode(text))
+
+    def add(self, text: str) -> bool:
+        """예산 안에 들어가면 토큰을 차감하고 True, 넘으면 생략 수만 늘리고 False"""
+        if self.exhausted:
+            self.omitted += 1
+            return False
+        tokens = len(self._encoding.encode(text))
+        if self.used + tokens > self.limit:
+            self.omitted += 1
+            return False
+        self.used += tokens
+        return True
+
+    def take(self, lines: Iterable[str], total: Optional[int] = None) -> List[str]:
+        """예산 안에 들어가는 앞부분 행만 반환
+
+        lines는 제너레이터로 넘기면 제한에 닿은 뒤의 행은 포맷하지 않습니다.
+        total(전체 행 수)을 주면 포맷하지 않은 행도 생략 수에 포함합니다.
+        """
+        accepted = []
+        for line in lines:
+            if not self.add(line):
+                break
+            accepted.append(line)
+        if self.exhausted and total is not None:
+            self.omitted = max(self.omitted, total - len(accepted))
+        return accepted
+
+    def footer(self, unit: str = "행") -> str:
+        """생략된 행이 있으면 안내 문구 반환 (없으면 빈 문자열)"""
+        if not self.omitted:
+            return ""
+        return f"\n... 토큰 제한으로 {self.omitted:,}개 {unit} 생략"
+
+def format_site_table(
+    title: str,
+    columns: Sequence[str],
+    outcomes: List[Tuple[str, Optional[List[Sequence[Any]]], Optional[str]]],
+    empty_message: str = "⚠️ 데이터 없음",
+    budget: Optional[TokenBudget] = None,
+) -> str:
+    """여러 매장의 결과를 하나의 표로 합칩니다.
+
+    Args:
+        title: 표 제목
+        columns: 매장 컬럼을 제외한 컬럼명 목록
+        outcomes: (매장명, 행 목록, 오류 메시지) 목록. 오류가 있으면 행 목록은 무시
+        empty_message: 행이 없는 매장 목록 앞에 붙일 문구
+        budget: 지정하면 토큰 제한에 닿은 뒤의 행은 생략하고 생략 행 수를 표시
+
+    Returns:
+        마크다운 표 형식의 문자열 (데이터 없는 매장/오류 매장은 표 아래에 따로 표시)
+    """
+    header = ["매장"] + list(columns)
+    lines = [
+        f"📊 **{title}** ({len(outcomes)}개 매장)",
+        "",
+        "| " + " | ".join(header) + " |",
+        "|" + "|".join(["---"] * len(header)) + "|",
+    ]
+    if budget is not None:
+        budget.charge("\n".join(lines))
+
+    empty_sites = []
+    errors = []
+    for site, rows, error in outcomes:
+        if error is not None:
+            errors.append((site, error))
+        elif not rows:
+            empty_sites.append(site)
+        else:
+            for row in rows:
+                if budget is not None and budget.exhausted:
+                    budget.omitted += 1
+                    continue
+                cells = [site] + ["" if value is None else str(value) for value in row]
+                line = "| " + " | ".join(cells) + " |"
+                if budget is not None and not budget.add(line):
+                    continue
+                lines.append(line)
+
+    if empty_sites:
+        lines.append("")
+        lines.append(f"{empty_message}: {', '.join(empty_sites)}")
+    if errors:
+        lines.append("")
+        lines.append("❌ 조회 실패:")
+        for site, error in errors:
+            lines.append(f"  - {site}: {error}")
+    if budget is not None and budget.omitted:
+        lines.append(budget.footer().lstrip("\n"))
+
+    return "\n".join(lines)
+
+
+def _column_values(column: Any) -> Any:
+    """json.dumps가 바로 직렬화할 수 있는 값 목록 (list/tuple은 복사 없이 그대로, numpy/pyarrow 배열은 한 번에 변환)"""
+    if isinstance(column, (list, tuple)):
+        return column
+    if hasattr(column, "to_pylist"):
+        return column.to_pylist()
+    if hasattr(column, "tolist"):
+        return column.tolist()
+    return list(column)
+
+
+def _columns_json(
+    column_names: Sequence[str],
+    columns: Sequence[Sequence[Any]],
+    limit: Optional[int] = None,
+    max_chars: Optional[int] = None,
+) -> Optional[str]:
+    """컬럼 단위 결과를 {"columns": [...], "rows": N, "data": [[컬럼1 값...], ...]} 형식의 JSON으로 직렬화
+
+    컬럼마다 한 번씩 json.dumps로 직렬화하고, max_chars를 넘는 순간 나머지 컬럼은 건너뛰고 None을 반환합니다.
+    """
+    row_count = len(columns[0]) if columns else 0
+    head = json.dumps({"columns": list(column_names), "rows": row_count}, ensure_ascii=False, separators=(",", ":"))
+    parts = []
+    size = len(head)
+    for column in columns:
+        if limit is not None:
+            column = column[:limit]
+        encoded = json.dumps(_column_values(column), ensure_ascii=False, separators=(",", ":"), default=str)
+        size += len(encoded) + 1
+        if max_chars is not None and size > max_chars:
+            return None
+        parts.append(encoded)
+    return f'{head[:-1]},"data":[{",".join(parts)}]}}'
+
+
+def format_columnar_result(
+    title: str,
+    column_names: Sequence[str],
+    columns: Sequence[Sequence[Any]],
+    empty_message: str = "데이터가 없습니다.",
+) -> str:
+    """컬럼 단위 쿼리 결과(QueryResult.result_columns, numpy/pyarrow 배열도 가능)를 컬럼 지향 JSON으로 변환
+
+    행마다 문자열을 이어 붙이지 않고 컬럼 배열을 한 번에 직렬화합니다.
+    결과가 RESULT_INLINE_MAX_CHARS보다 크면 직렬화를 멈추고 앞부분 미리보기와 전체 행 수만 반환합니다.
+    """
+    row_count = len(columns[0]) if columns else 0
+    if row_count == 0:
+        return f"{title}\n{empty_message}"
+
+    payload = _columns_json(column_names, columns, max_chars=RESULT_INLINE_MAX_CHARS)
+    if payload is not None:
+        return f"{title}\n{payload}"
+
+    preview = _columns_json(column_names, columns, limit=RESULT_PREVIEW_ROWS)
+    return (
+        f"{title}\n"
+        f"⚠️ 결과가 커서({row_count:,}행) 앞 {min(row_count, RESULT_PREVIEW_ROWS)}행만 전달합니다. "
+        f"전체가 필요하면 기간/조건을 좁히거나 집계해서 다시 조회하세요.\n"
+        f"미리보기:\n{preview}"
+    )
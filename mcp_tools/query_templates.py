@@ -0,0 +1,131 @@
+"""
+Query Templates
+===============
+
+ClickHouse 서버 사이드 파라미터(`{name:Type}`)를 사용하는 쿼리 템플릿
+
+- 템플릿은 모듈 import 시 한 번만 파싱 (파라미터 이름/타입 추출)
+- 값은 SQL 문자열에 끼워 넣지 않고 clickhouse-connect 파라미터로 바인딩
+- 바인딩 시 누락/미지원 파라미터와 값 타입을 검증
+- 템플릿 텍스트의 해시(digest)를 결과 캐시 키에 사용
+
+사용법:
+    AVG_IN_QUERY = QueryTemplate("diagnose.avg_in", \"\"\"
+        SELECT ... WHERE date BETWEEN {start_date:String} AND {end_date:String}
+    \"\"\")
+
+    result = await query_template_async(site, AVG_IN_QUERY, start_date=start_date, end_date=end_date)
+"""
+
+import re
+import hashlib
+import textwrap
+import threading
+from datetime import date, datetime
+from typing import Dict, Any, List
+
+# {name:Type} 형식의 서버 사이드 파라미터
+_PLACEHOLDER = re.compile(r"\{(\w+):([^{}]+)\}")
+_DATE_VALUE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, "QueryTemplate"] = {}
+
+
+def _check_value(name: str, type_name: str, value: Any):
+    """ClickHouse 타입에 맞는 Python 값인지 검증 (맞지 않으면 ValueError)"""
+    type_name = type_name.strip()
+
+    if type_name.startswith("Nullable(") and type_name.endswith(")"):
+        if value is None:
+            return
+        type_name = type_name[len("Nullable("):-1]
+
+    if type_name.startswith("Array(") and type_name.endswith(")"):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"{name}: {type_name} 파라미터에는 리스트가 필요합니다 ({type(value).__name__})")
+        inner = type_name[len("Array("):-1]
+        for item in value:
+            _check_value(name, inner, item)
+        return
+
+    if type_name == "String":
+        ok = isinstance(value, str)
+    elif type_name == "Date":
+        ok = isinstance(value, date) or (isinstance(value, str) and bool(_DATE_VALUE.match(value)))
+    elif type_name.startswith("DateTime"):
+        ok = isinstance(value, (datetime, str))
+    elif type_name.startswith(("UInt", "Int")):
+        ok = isinstance(value, int) and not isinstance(value, bool)
+        if ok and type_name.startswith("UInt") and value < 0:
+            ok = False
+    elif type_name.startswith("Float"):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif type_name == "Bool":
+        ok = isinstance(value, bool)
+    else:
+        # 그 외 타입은 ClickHouse 서버 검증에 맡김
+        ok = True
+
+    if not ok:
+        raise ValueError(f"{name}: {type_name} 타입에 맞지 않는 값입니다 ({value!r})")
+
+
+class QueryTemplate:
+    """서버 사이드 파라미터를 사용하는 쿼리 템플릿 (import 시 한 번 파싱)"""
+
+    __slots__ = ("name", "sql", "params", "digest")
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = textwrap.dedent(sql).strip()
+        self.params: Dict[str, str] = {}
+        for param, type_name in _PLACEHOLDER.findall(self.sql):
+            type_name = type_name.strip()
+            if self.params.setdefault(param, type_name) != type_name:
+                raise ValueError(f"{name}: 파라미터 {param}의 타입이 일치하지 않습니다 ({self.params[param]} / {type_name})")
+        self.digest = hashlib.sha1(self.sql.encode("utf-8")).hexdigest()[:16]
+
+        with _registry_lock:
+            existing = _registry.get(name)
+            if existing is not None and existing.digest != self.digest:
+                raise ValueError(f"같은 이름의 다른 쿼리 템플릿이 이미 등록되어 있습니다: {name}")
+            _registry[name] = self
+
+    def bind(self, **values) -> Dict[str, Any]:
+        """파라미터 검증 후 clickhouse-connect parameters 딕셔너리 반환"""
+        missing = [param for param in self.params if param not in values]
+        if missing:
+            raise ValueError(f"{self.name}: 누락된 파라미터 {', '.join(missing)}")
+        unknown = [param for param in values if param not in self.params]
+        if unknown:
+            raise ValueError(f"{self.name}: 템플릿에 없는 파라미터 {', '.join(unknown)}")
+
+        for param, type_name in self.params.items():
+            _check_value(param, type_name, values[param])
+        return dict(values)
+
+    def __repr__(self) -> str:
+        return f"QueryTemplate({self.name!r}, params={list(self.params)}, digest={self.digest})"
+
+
+def get_template(name: str) -> QueryTemplate:
+    """이름으로 등록된 템플릿 조회"""
+    with _registry_lock:
+        return _registry[name]
+
+
+def list_templates() -> List[Dict[str, Any]]:
+    """등록된 템플릿 목록 (이름, 파라미터, digest)"""
+    with _registry_lock:
+        return [
+            {"name": t.name, "params": dict(t.params), "digest": t.digest}
+            for t in sorted(_registry.values(), key=lambda t: t.name)
+        ]
+
+
+def templates_digest() -> str:
+    """현재 프로세스에 등록된 모든 템플릿의 통합 해시 (쿼리가 바뀌면 결과 캐시 키도 바뀜)"""
+    with _registry_lock:
+        joined = "|".join(f"{name}:{t.digest}" for name, t in sorted(_registry.items()))
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,219 @@
+"""
+Report Store
+============
+
+HTML 보고서를 내용 주소(content-addressed) 방식으로 한 번만 저장하는 저장소
+
+- 키: (워크플로우, 매장 목록, 기간, 데이터 fingerprint)의 sha256
+  같은 데이터로 다시 요청하면 렌더링/저장 없이 기존 URL을 반환
+- 기간이 오늘 이전에 끝난 요청은 (워크플로우, 매장, 기간) 참조 파일로 데이터 조회 전에 바로 찾음
+  (일부 매장 조회 실패 등 불완전한 보고서는 remember=False로 저장해 참조 파일을 남기지 않음)
+- 저장 시 원본과 함께 gzip(.gz), brotli(.br, 패키지가 있을 때)로 미리 압축
+  백엔드 /reports 라우트가 Accept-Encoding에 맞는 파일을 ETag/Cache-Control과 함께 서빙
+- 저장 후 보관 기간(REPORT_STORE_MAX_AGE_DAYS)과 전체 크기(REPORT_STORE_MAX_BYTES) 기준으로 오래된 보고서 삭제
+
+사용법:
+    url = report_store.lookup("visitor_diagnose", stores, period)
+    if url is None:
+        url = report_store.put("visitor_diagnose", stores, period, fingerprint, html, prefix="방문객진단")
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 백엔드(chat/backend.py)의 /reports 마운트와 같은 디렉토리
+REPORT_STORE_DIR = os.getenv(
+    "REPORT_STORE_DIR", str(Path(__file__).resolve().parent.parent / "chat" / "report")
+)
+REPORT_STORE_MAX_BYTES = int(os.getenv("REPORT_STORE_MAX_BYTES", str(500 * 1024 * 1024)))
+REPORT_STORE_MAX_AGE_DAYS = float(os.getenv("REPORT_STORE_MAX_AGE_DAYS", "30"))
+REPORT_URL_PREFIX = "/reports"
+
+# 요청 키 -> 보고서 파일명 참조 디렉토리 (REPORT_STORE_DIR 아래, 서빙 대상 아님)
+_REF_DIR = ".refs"
+_COMPRESSED_SUFFIXES = (".gz", ".br")
+
+_lock = threading.Lock()
+
+
+def _digest(payload: Any) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fingerprint(data: Any) -> str:
+    """보고서에 들어가는 데이터의 fingerprint (JSON 직렬화 후 sha256)"""
+    return _digest(data)
+
+
+def _request_key(workflow: str, stores: Sequence[str], period: str) -> str:
+    return _digest({"workflow": workflow, "stores": list(stores), "period": period})
+
+
+def report_key(workflow: str, stores: Sequence[str], period: str, data_fingerprint: str) -> str:
+    """보고서 내용 키 (파일명에 사용하는 앞 20자리)"""
+    return _digest({
+        "workflow": workflow,
+        "stores": list(stores),
+        "period": period,
+        "data": data_fingerprint,
+    })[:20]
+
+
+def _root() -> Path:
+    root = Path(REPORT_STORE_DIR)
+    (root / _REF_DIR).mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def _url(filename: str) -> str:
+    return f"{REPORT_URL_PREFIX}/{filename}"
+
+
+def _period_closed(period: str) -> bool:
+    """'YYYY-MM-DD~YYYY-MM-DD' 기간이 오늘 이전에 끝났는지 (데이터가 더 바뀌지 않는 기간)"""
+    try:
+        end = period.split("~")[-1].strip()
+        return date.fromisoformat(end) < date.today()
+    except ValueError:
+        return False
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def lookup(workflow: str, stores: Sequence[str], period: str) -> Optional[str]:
+    """기간이 끝난 요청이면 이전에 저장한 보고서 URL (없거나 기간이 열려 있으면 None)"""
+    if not _period_closed(period):
+        return None
+    ref = _root() / _REF_DIR / _request_key(workflow, stores, period)
+    try:
+        filename = ref.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if not (_root() / filename).exists():
+        return None
+    logger.info(f"♻️ 보고서 재사용: {filename}")
+    return _url(filename)
+
+
+def _filename(workflow: str, stores: Sequence[str], period: str, data_fingerprint: str, prefix: str) -> str:
+    return f"{prefix}_{report_key(workflow, stores, period, data_fingerprint)}.html"
+
+
+def find(
+    workflow: str,
+    stores: Sequence[str],
+    period: str,
+    data_fingerprint: str,
+    prefix: str = "report",
+) -> Optional[str]:
+    """같은 데이터로 저장한 보고서가 있으면 URL (렌더링 전에 확인용)"""
+    filename = _filename(workflow, stores, period, data_fingerprint, prefix)
+    if not (_root() / filename).exists():
+        return None
+    logger.info(f"♻️ 같은 데이터의 보고서가 이미 있음: {filename}")
+    return _url(filename)
+
+
+def put(
+    workflow: str,
+    stores: Sequence[str],
+    period: str,
+    data_fingerprint: str,
+    html: str,
+    prefix: str = "report",
+    remember: bool = True,
+) -> str:
+    """보고서 저장 후 URL 반환 (같은 키의 보고서가 이미 있으면 쓰지 않고 기존 URL 반환)
+
+    remember=False면 요청 참조 파일을 쓰지 않아 lookup()이 이 보고서를 돌려주지 않음
+    """
+    root = _root()
+    filename = _filename(workflow, stores, period, data_fingerprint, prefix)
+    path = root / filename
+
+    if path.exists():
+        logger.info(f"♻️ 같은 데이터의 보고서가 이미 있음: {filename}")
+    else:
+        raw = html.encode("utf-8")
+        # 압축본을 먼저 쓰고 원본을 마지막에 써서, 원본이 보이면 압축본도 준비된 상태가 되도록 함
+        _write_atomic(path.with_name(filename + ".gz"), gzip.compress(raw, compresslevel=9, mtime=0))
+        if BROTLI_AVAILABLE:
+            _write_atomic(path.with_name(filename + ".br"), brotli.compress(raw, quality=11))
+        _write_atomic(path, raw)
+        logger.info(f"💾 보고서 저장: {filename} ({len(raw):,} bytes)")
+
+    if remember:
+        _write_atomic(root / _REF_DIR / _request_key(workflow, stores, period), filename.encode("utf-8"))
+    evict()
+    return _url(filename)
+
+
+def _report_groups(root: Path) -> List[tuple]:
+    """[(생성 시각, 전체 크기, [원본 + 압축본 경로])] - 오래된 순"""
+    groups = []
+    for path in root.glob("*.html"):
+        files = [path] + [path.with_name(path.name + suffix) for suffix in _COMPRESSED_SUFFIXES]
+        files = [f for f in files if f.exists()]
+        try:
+            created = path.stat().st_mtime
+            size = sum(f.stat().st_size for f in files)
+        except OSError:
+            continue
+        groups.append((created, size, files))
+    groups.sort(key=lambda group: group[0])
+    return groups
+
+
+def evict(max_bytes: Optional[int] = None, max_age_days: Optional[float] = None) -> int:
+    """보관 기간이 지났거나 전체 크기를 넘는 오래된 보고서 삭제 -> 삭제한 보고서 수"""
+    max_bytes = REPORT_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age_days = REPORT_STORE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    root = _root()
+
+    with _lock:
+        groups = _report_groups(root)
+        total = sum(size for _, size, _ in groups)
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for created, size, files in groups:
+            if created >= cutoff and total <= max_bytes:
+                break
+            for f in files:
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        # 가리키는 보고서가 사라진 참조 정리
+        if removed:
+            for ref in (root / _REF_DIR).iterdir():
+                try:
+                    if not (root / ref.read_text(encoding="utf-8").strip()).exists():
+                        ref.unlink()
+                except OSError:
+                    pass
+            logger.info(f"🧹 오래된 보고서 {removed}개 삭제")
+    return removed
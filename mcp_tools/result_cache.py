@@ -0,0 +1,512 @@
+"""
+Result Cache
+============
+
+MCP 도구 결과 캐시 (프로세스 내 LRU + 선택적 SQLite 디스크 계층)
+
+- 키: 도구 이름 + 정규화된 인자 (기본값 적용, 위치/키워드 인자 구분 없음) + 쿼리 템플릿 digest
+- 오늘 이전에 끝나는 기간은 결과가 바뀌지 않으므로 길게, 오늘을 포함하는 기간은 짧게 캐시
+- 오류/연결 실패/부분 실패 결과는 캐시하지 않고, 데이터가 없다는 결과는 짧은 TTL로만 캐시
+- 적중/미스 통계와 명시적 무효화 API 제공
+  (매장 단위 무효화는 site/sites에 그 매장이 포함된 결과와 전체 매장("*") 결과를 함께 삭제)
+- 관리용 훅: 실행 중인 MCP 서버마다 메모리 계층이 따로 있으므로
+  무효화 요청은 RESULT_CACHE_ADMIN_DIR/control.jsonl에 한 줄씩 기록하고 각 프로세스가 다음 조회 때 반영
+  각 프로세스는 통계를 RESULT_CACHE_ADMIN_DIR/stats/에 주기적으로 기록 (CLI에서 모아서 출력)
+
+사용법:
+    @mcp.tool()
+    @cached_tool
+    async def diagnose_avg_in(start_date: str, end_date: str, site: str = "") -> str:
+        ...
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+import functools
+from datetime import date
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
+
+from query_templates import templates_digest
+
+logger = logging.getLogger(__name__)
+
+# 캐시 설정 (환경 변수로 조정 가능)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "512"))
+RESULT_CACHE_CLOSED_TTL = float(os.getenv("RESULT_CACHE_CLOSED_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_OPEN_TTL = float(os.getenv("RESULT_CACHE_OPEN_TTL", "300"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")  # 비어 있으면 디스크 계층 비활성화
+RESULT_CACHE_ADMIN_DIR = os.getenv(
+    "RESULT_CACHE_ADMIN_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chat", "data", "result_cache"),
+)
+RESULT_CACHE_STATS_INTERVAL = float(os.getenv("RESULT_CACHE_STATS_INTERVAL", "60"))  # 프로세스별 통계 기록 주기 (초)
+
+ALL_SITES = "*"
+_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_FAILURE_PREFIXES = ("오류", "토큰 제한")
+# 빈 결과 문구 (format_columnar_result, 각 도구의 "데이터가 없습니다", format_site_table의 "데이터 없음")
+_EMPTY_MARKERS = ("데이터가 없", "데이터 없음")
+
+
+def _normalize(value: Any) -> Any:
+    """캐시 키 생성을 위한 인자 정규화"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    return value
+
+
+def _latest_date(arguments: Dict[str, Any]) -> Optional[date]:
+    """인자에 포함된 날짜 중 가장 늦은 날짜"""
+    latest = None
+    for value in arguments.values():
+        if isinstance(value, str) and _DATE_PATTERN.match(value):
+            try:
+                parsed = date.fromisoformat(value[:10])
+            except ValueError:
+                continue
+            if latest is None or parsed > latest:
+                latest = parsed
+    return latest
+
+
+def ttl_for_arguments(arguments: Dict[str, Any]) -> float:
+    """기간이 오늘 이전에 끝나면 긴 TTL, 오늘을 포함하거나 날짜가 없으면 짧은 TTL"""
+    latest = _latest_date(arguments)
+    if latest is not None and latest < date.today():
+        return RESULT_CACHE_CLOSED_TTL
+    return RESULT_CACHE_OPEN_TTL
+
+
+def is_cacheable(result: Any) -> bool:
+    """오류/실패가 섞인 결과는 캐시하지 않음"""
+    if not isinstance(result, str) or not result:
+        return False
+    if "❌" in result:
+        return False
+    return not result.startswith(_FAILURE_PREFIXES)
+
+
+def sites_of_arguments(arguments: Dict[str, Any]) -> Tuple[str, ...]:
+    """도구 인자의 site/sites를 정렬된 매장 목록으로 (전체 매장 요청이면 ("*",))"""
+    names = [arguments.get("site")]
+    sites = arguments.get("sites")
+    if isinstance(sites, (list, tuple)):
+        names.extend(sites)
+    names = {name.strip() for name in names if isinstance(name, str) and name.strip()}
+    if ALL_SITES in names:
+        return (ALL_SITES,)
+    return tuple(sorted(names))
+
+
+def is_empty_result(result: Any) -> bool:
+    """데이터가 없다는 결과 (적재가 늦은 매장일 수 있으므로 오래 캐시하지 않음)"""
+    return isinstance(result, str) and any(marker in result for marker in _EMPTY_MARKERS)
+
+
+class _DiskTier:
+    """SQLite 기반 디스크 캐시 (MCP 서버 프로세스 간 공유)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                site TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_tool ON result_cache (tool, site)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    @staticmethod
+    def _encode_sites(sites: Tuple[str, ...]) -> str:
+        # 매장 목록을 "\n매장1\n매장2\n" 형태로 저장해 instr()로 포함 여부를 검사
+        return "\n" + "\n".join(sites) + "\n" if sites else ""
+
+    def set(self, key: str, tool: str, sites: Tuple[str, ...], value: str, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, tool, site, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, tool, self._encode_sites(sites), value, time.time() + ttl),
+            )
+
+    def invalidate(self, tool: Optional[str], site: Optional[str]) -> int:
+        conditions, params = [], []
+        if tool:
+            conditions.append("tool = ?")
+            params.append(tool)
+        if site:
+            # 해당 매장을 포함한 여러 매장 결과와 전체 매장("*") 결과도 함께 삭제 (site = ?는 이전 형식 행)
+            conditions.append("(instr(site, ?) > 0 OR instr(site, ?) > 0 OR site = ?)")
+            params.extend([self._encode_sites((site,)), self._encode_sites((ALL_SITES,)), site])
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM result_cache{where}", params)
+            return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+
+
+class _CacheEntry:
+    __slots__ = ("tool", "sites", "value", "expires_at")
+
+    def __init__(self, tool: str, sites: Tuple[str, ...], value: str, expires_at: float):
+        self.tool = tool
+        self.sites = sites
+        self.value = value
+        self.expires_at = expires_at
+
+    def matches(self, tool: Optional[str], site: Optional[str]) -> bool:
+        """무효화 조건에 맞는지 (매장 조건은 결과에 그 매장이 포함되거나 전체 매장 결과이면 일치)"""
+        if tool and self.tool != tool:
+            return False
+        return not site or site in self.sites or ALL_SITES in self.sites
+
+
+class ResultCache:
+    """도구 결과 캐시 (LRU 메모리 계층 + 선택적 디스크 계층)"""
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        db_path: str = RESULT_CACHE_DB,
+        admin_dir: str = RESULT_CACHE_ADMIN_DIR,
+    ):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "skipped": 0, "evictions": 0}
+        self._per_tool: Dict[str, Dict[str, int]] = {}
+
+        # 관리용 훅: 시작 이전의 무효화 기록은 메모리 계층이 비어 있으므로 건너뜀
+        self._control_path = os.path.join(admin_dir, "control.jsonl") if admin_dir else ""
+        self._stats_path = (
+            os.path.join(admin_dir, "stats", f"{os.path.basename(sys.argv[0]) or 'python'}-{os.getpid()}.json")
+            if admin_dir else ""
+        )
+        self._control_lock = threading.Lock()
+        self._control_offset = self._control_size()
+        self._stats_written_at = 0.0
+
+        self._disk: Optional[_DiskTier] = None
+        if db_path:
+            try:
+                self._disk = _DiskTier(db_path)
+                logger.info(f"💾 결과 캐시 디스크 계층 사용: {db_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ 결과 캐시 디스크 계층 초기화 실패, 메모리 캐시만 사용: {e}")
+
+    @property
+    def persistent(self) -> bool:
+        """디스크 계층 사용 여부"""
+        return self._disk is not None
+
+    @staticmethod
+    def make_key(tool: str, arguments: Dict[str, Any], version: str = "") -> str:
+        """version에는 쿼리 템플릿 digest를 넣어 SQL이 바뀌면 이전 결과를 쓰지 않도록 함"""
+        payload = json.dumps(_normalize(arguments), ensure_ascii=False, sort_keys=True, default=str)
+        return f"{tool}:{hashlib.sha1((version + payload).encode('utf-8')).hexdigest()}"
+
+    def _count(self, tool: str, field: str):
+        self._stats[field] += 1
+        tool_stats = self._per_tool.setdefault(tool, {"hits": 0, "misses": 0})
+        if field in tool_stats:
+            tool_stats[field] += 1
+
+    def _control_size(self) -> int:
+        try:
+            return os.path.getsize(self._control_path) if self._control_path else 0
+        except OSError:
+            return 0
+
+    def poll_control(self):
+        """다른 프로세스(CLI 등)가 기록한 무효화 요청을 메모리 계층에 반영 (파일 크기가 그대로면 stat 한 번)"""
+        size = self._control_size()
+        if size == self._control_offset:
+            return
+        with self._control_lock:
+            if size < self._control_offset:
+                # 파일을 비웠으면 처음부터 다시 읽음
+                self._control_offset = 0
+            try:
+                with open(self._control_path, "rb") as f:
+                    f.seek(self._control_offset)
+                    chunk = f.read(size - self._control_offset)
+            except OSError:
+                return
+            # 쓰는 중인 마지막 줄은 다음 조회 때 읽음
+            complete = chunk[:chunk.rfind(b"\n") + 1]
+            self._control_offset += len(complete)
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            try:
+                command = json.loads(line)
+            except ValueError:
+                continue
+            if command.get("command") == "invalidate":
+                removed = self._invalidate_memory(command.get("tool"), command.get("site"))
+                logger.info(
+                    f"🧹 관리 요청으로 결과 캐시 무효화: tool={command.get('tool') or '*'}, "
+                    f"site={command.get('site') or '*'}, {removed}건"
+                )
+
+    def write_stats(self, force: bool = False):
+        """프로세스 통계를 stats/ 디렉터리에 기록 (RESULT_CACHE_STATS_INTERVAL마다 한 번)"""
+        now = time.time()
+        if not self._stats_path or (not force and now - self._stats_written_at < RESULT_CACHE_STATS_INTERVAL):
+            return
+        self._stats_written_at = now
+        snapshot = dict(self.stats(), pid=os.getpid(), process=sys.argv[0], updated_at=now)
+        try:
+            os.makedirs(os.path.dirname(self._stats_path), exist_ok=True)
+            tmp_path = f"{self._stats_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self._stats_path)
+        except OSError as e:
+            logger.warning(f"⚠️ 결과 캐시 통계 기록 실패: {e}")
+
+    def get(self, tool: str, key: str) -> Optional[str]:
+        self.poll_control()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._count(tool, "hits")
+                    return entry.value
+                del self._entries[key]
+
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ 디스크 캐시 조회 실패: {e}")
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._count(tool, "hits")
+                return value
+
+        with self._lock:
+            self._count(tool, "misses")
+        return None
+
+    def set(self, tool: str, sites: Tuple[str, ...], key: str, value: Any, ttl: float):
+        if not is_cacheable(value) or ttl <= 0:
+            with self._lock:
+                self._stats["skipped"] += 1
+            return
+
+        with self._lock:
+            self._entries[key] = _CacheEntry(tool, sites, value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+        if self._disk is not None:
+            try:
+                self._disk.set(key, tool, sites, value, ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ 디스크 캐시 저장 실패: {e}")
+
+    def _invalidate_memory(self, tool: Optional[str], site: Optional[str]) -> int:
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.matches(tool, site)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def _broadcast(self, command: Dict[str, Any]):
+        """관리 요청을 control.jsonl에 추가 (모든 MCP 서버 프로세스가 다음 조회 때 반영)"""
+        if not self._control_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._control_path), exist_ok=True)
+            line = json.dumps(dict(command, at=time.time()), ensure_ascii=False) + "\n"
+            # O_APPEND 한 번의 write라 여러 프로세스가 동시에 써도 줄이 섞이지 않음
+            fd = os.open(self._control_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode("utf-8"))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"⚠️ 결과 캐시 관리 요청 기록 실패: {e}")
+
+    def invalidate(self, tool: Optional[str] = None, site: Optional[str] = None) -> int:
+        """조건에 맞는 캐시 항목 삭제. 삭제한 개수 반환 (조건이 없으면 전체 삭제)
+
+        실행 중인 다른 MCP 서버 프로세스의 메모리 계층도 다음 조회 때 같은 조건으로 비워집니다.
+        """
+        removed = self._invalidate_memory(tool, site)
+        self._broadcast({"command": "invalidate", "tool": tool, "site": site})
+
+        if self._disk is not None:
+            try:
+                removed += self._disk.invalidate(tool, site)
+            except Exception as e:
+                logger.warning(f"⚠️ 디스크 캐시 삭제 실패: {e}")
+
+        logger.info(f"🧹 결과 캐시 무효화: tool={tool or '*'}, site={site or '*'}, {removed}건")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            stats = {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                "tools": {name: dict(values) for name, values in self._per_tool.items()},
+            }
+        if self._disk is not None:
+            try:
+                stats["disk_entries"] = self._disk.count()
+                stats["disk_path"] = self._disk.path
+            except Exception as e:
+                stats["disk_error"] = str(e)
+        return stats
+
+
+_result_cache = ResultCache()
+
+
+def cached_tool(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """async MCP 도구의 결과를 캐시하는 데코레이터
+
+    FastMCP가 원래 시그니처를 읽을 수 있도록 functools.wraps로 감싸며, `@mcp.tool()` 바로 아래에 적용합니다.
+    """
+    signature = inspect.signature(fn)
+    tool_name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not RESULT_CACHE_ENABLED:
+            return await fn(*args, **kwargs)
+
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+        except TypeError:
+            return await fn(*args, **kwargs)
+
+        key = ResultCache.make_key(tool_name, arguments, templates_digest())
+        # 디스크 계층은 SQLite I/O가 있으므로 이벤트 루프 밖에서 처리
+        if _result_cache.persistent:
+            cached = await asyncio.to_thread(_result_cache.get, tool_name, key)
+        else:
+            cached = _result_cache.get(tool_name, key)
+        if cached is not None:
+            logger.info(f"⚡ 결과 캐시 적중: {tool_name}")
+            return cached
+
+        result = await fn(*args, **kwargs)
+        sites = sites_of_arguments(arguments)
+        ttl = ttl_for_arguments(arguments)
+        if is_empty_result(result):
+            ttl = min(ttl, RESULT_CACHE_OPEN_TTL)
+        if _result_cache.persistent:
+            await asyncio.to_thread(_result_cache.set, tool_name, sites, key, result, ttl)
+        else:
+            _result_cache.set(tool_name, sites, key, result, ttl)
+        await asyncio.to_thread(_result_cache.write_stats)
+        return result
+
+    return wrapper
+
+
+def invalidate_results(tool: Optional[str] = None, site: Optional[str] = None) -> int:
+    """결과 캐시 무효화 (tool/site 미지정 시 전체). 삭제한 개수 반환"""
+    return _result_cache.invalidate(tool, site)
+
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    """결과 캐시 적중/미스 통계 (현재 프로세스)"""
+    return _result_cache.stats()
+
+
+def collect_process_stats(admin_dir: str = RESULT_CACHE_ADMIN_DIR, max_age: float = 86400) -> Dict[str, Any]:
+    """MCP 서버 프로세스들이 기록한 통계 모음 (max_age보다 오래된 기록은 종료된 프로세스로 보고 삭제)"""
+    stats_dir = os.path.join(admin_dir, "stats")
+    collected: Dict[str, Any] = {}
+    if not os.path.isdir(stats_dir):
+        return collected
+    for name in sorted(os.listdir(stats_dir)):
+        path = os.path.join(stats_dir, name)
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if time.time() - snapshot.get("updated_at", 0) > max_age:
+            os.remove(path)
+            continue
+        collected[name[:-len(".json")]] = snapshot
+    return collected
+
+
+if __name__ == "__main__":
+    # 결과 캐시 관리 CLI (실행 중인 MCP 서버 프로세스에는 관리용 훅으로 전달)
+    # python result_cache.py stats
+    # python result_cache.py clear [tool] [site]
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "clear":
+        tool = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != "*" else None
+        site = sys.argv[3] if len(sys.argv) > 3 else None
+        removed = invalidate_results(tool, site)
+        print(f"🧹 디스크 {removed}건 삭제, 실행 중인 MCP 서버의 메모리 캐시는 다음 조회 때 비워집니다.")
+    elif command == "purge" and _result_cache.persistent:
+        print(f"🧹 만료 항목 {_result_cache._disk.purge_expired()}건 삭제")
+    else:
+        report = {"processes": collect_process_stats()}
+        if _result_cache.persistent:
+            report["disk"] = {key: value for key, value in get_result_cache_stats().items() if key.startswith(("disk_entries", "disk_path", "disk_error"))}
+        print(json.dumps(report, ensure_ascii=False, indent=2))
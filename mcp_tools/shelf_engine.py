@@ -0,0 +1,420 @@
+"""
+Shelf Route Engine
+==================
+
+진열대 분석(get_shelf_analysis_flexible, pickup_gaze_summary)을 메모리에서 계산하는 엔진
+
+(매장, 기간) 단위로 고객별 시간순 통합 경로(픽업 P + 3회 이상 응시 G)를 한 번만 조회해
+NumPy 배열(구역 코드, 이벤트 종류 비트마스크, 고객별 offset)로 보관하고,
+target_shelves / age_groups / gender_labels 조합, Top N, 직전/직후 비율은 벡터 마스크로 계산합니다.
+에이전트가 조건을 바꿔 가며 여러 번 호출해도 ClickHouse 스캔은 한 번입니다.
+
+- 기간이 오늘 이전에 끝나면 긴 TTL, 오늘을 포함하면 짧은 TTL (result_cache와 동일 기준)
+- EVENT_CACHE_ENABLED이면 ClickHouse 대신 event_sequence_cache의 날짜별 로컬 캐시(shelf 데이터셋)로 경로 생성
+- numpy가 없으면 ENGINE_AVAILABLE=False (도구는 SQL 모드로 동작)
+
+사용법:
+    routes = await get_shelf_routes(site, "plusinsight", "2025-06-01", "2025-06-30", ["2025-06-22"])
+    rows = routes.analyze(target_shelves=["빵"], top_n=5, depth=2)
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    ENGINE_AVAILABLE = True
+except ImportError:
+    ENGINE_AVAILABLE = False
+
+from database_manager import query_template_async
+from query_templates import QueryTemplate
+from result_cache import ttl_for_arguments
+import event_sequence_cache
+
+logger = logging.getLogger(__name__)
+
+SHELF_ENGINE_MAX_ROUTES = int(os.getenv("SHELF_ENGINE_MAX_ROUTES", "16"))
+
+# 이벤트 종류 비트마스크
+PICKUP = 1
+GAZE = 2
+
+# person_routes의 연령대/성별 라벨 (코드 = 리스트 인덱스)
+AGE_GROUPS = ["60대 이상", "50대", "40대", "30대", "20대", "10대", "미상", "10세 미만"]
+GENDER_LABELS = ["남자", "여자", "미상"]
+
+NO_SHELF = "진열대없음"
+CHECKOUT = "계산대"
+
+# 고객별 시간순 이벤트 배열 (픽업 P + 3회 이상 응시한 매대 G)
+# 고객마다 groupArray + arraySort는 person_routes에서 한 번만 수행하고,
+# 첫 픽업 위치(arrayFirstIndex) 하나로 직전/직후 응시 매대 배열을 나눕니다.
+PERSON_ROUTES_CTE = """
+    WITH visit_counts AS (
+        -- 픽업/응시 이벤트를 한 번만 스캔해서 고객-존-이벤트 종류별로 집계
+        SELECT
+            cbe.person_seq AS person_seq,
+            cbe.age AS age,
+            cbe.gender AS gender,
+            cbe.event_type AS event_type,
+            z.name AS zone_name,
+            MIN(cbe.`timestamp`) AS first_event_date,
+            COUNT(*) AS visit_count
+        FROM customer_behavior_event cbe
+        LEFT JOIN customer_behavior_area cba ON cbe.customer_behavior_area_id = cba.id
+        LEFT JOIN zone z ON cba.attention_target_zone_id = z.id
+        WHERE cbe.date BETWEEN {start_date:String} AND {end_date:String}
+            AND NOT has({exclude_dates:Array(String)}, toString(cbe.date))
+            AND cbe.event_type IN (0, 1)  -- 응시, 픽업
+            AND (cbe.is_staff IS NULL OR cbe.is_staff != 1)
+            AND z.name IS NOT NULL
+        GROUP BY
+            cbe.person_seq,
+            cbe.age,
+            cbe.gender,
+            cbe.event_type,
+            cba.attention_target_zone_id,
+            z.name
+    ),
+    combined_events AS (
+        -- 픽업 이벤트는 모든 방문, 응시 이벤트는 3회 이상 방문한 존만
+        SELECT person_seq, first_event_date, zone_name, age, gender, if(event_type = 1, 'P', 'G') AS event_type_label
+        FROM visit_counts
+        WHERE event_type = 1 OR visit_count >= 3
+    ),
+    person_routes AS (
+        SELECT
+            person_seq,
+            multiIf(
+                age >= 60, '60대 이상',
+                age >= 50, '50대',
+                age >= 40, '40대',
+                age >= 30, '30대',
+                age >= 20, '20대',
+                age >= 10, '10대',
+                age IS NULL, '미상',
+                '10세 미만'
+            ) AS age_group,
+            multiIf(
+                gender = 0, '남자',
+                gender = 1, '여자',
+                '미상'
+            ) AS gender_label,
+            -- 고객별 이벤트 배열 정렬은 여기서 한 번만
+            arraySort(groupArray((first_event_date, zone_name, event_type_label))) AS events,
+            arrayMap(x -> x.2, events) AS zone_names,
+            arrayMap(x -> x.3, events) AS event_types,
+            -- 첫 번째 픽업 위치 (픽업이 없으면 0)
+            arrayFirstIndex(x -> x = 'P', event_types) AS first_pickup_index,
+            if(first_pickup_index = 0, '', zone_names[first_pickup_index]) AS first_pickup_zone,
+            -- 첫 픽업 직전 응시 매대 (픽업에 가까운 순서: 1번째가 가장 마지막 응시)
+            arrayReverse(arrayFilter(
+                (name, type, i) -> type = 'G' AND i < first_pickup_index,
+                zone_names, event_types, arrayEnumerate(event_types)
+            )) AS gazes_before,
+            -- 첫 픽업 이후 응시 매대 (시간순)
+            if(first_pickup_index = 0, [], arrayFilter(
+                (name, type, i) -> type = 'G' AND i > first_pickup_index,
+                zone_names, event_types, arrayEnumerate(event_types)
+            )) AS gazes_after
+        FROM combined_events
+        GROUP BY person_seq, age, gender
+    )"""
+
+# 고객별 통합 경로 (이벤트 종류는 비트마스크로 전달)
+SHELF_ROUTES_QUERY = QueryTemplate("shelf.person_routes", PERSON_ROUTES_CTE + """
+    SELECT
+        age_group,
+        gender_label,
+        zone_names,
+        arrayMap(t -> if(t = 'P', 1, 2), event_types) AS event_masks
+    FROM person_routes
+    """)
+
+
+class ShelfRoutes:
+    """고객별 통합 경로를 CSR 형태로 담은 배열 묶음
+
+    i번 고객의 이벤트는 zone_codes[offsets[i]:offsets[i + 1]] (시간순)이며,
+    첫 픽업 위치와 각 응시 이벤트가 첫 픽업 직전/직후 몇 번째인지는 생성 시 한 번만 계산합니다.
+    """
+
+    __slots__ = (
+        "zones", "zone_codes", "event_masks", "offsets", "age_codes", "gender_codes",
+        "first_pickup", "gazes_before", "gazes_after", "event_person", "gaze_period", "gaze_position",
+    )
+
+    def __init__(
+        self,
+        zones: List[str],
+        zone_codes: "np.ndarray",
+        event_masks: "np.ndarray",
+        offsets: "np.ndarray",
+        age_codes: "np.ndarray",
+        gender_codes: "np.ndarray",
+    ):
+        self.zones = zones
+        self.zone_codes = zone_codes
+        self.event_masks = event_masks
+        self.offsets = offsets
+        self.age_codes = age_codes
+        self.gender_codes = gender_codes
+
+        persons = len(offsets) - 1
+        events = len(zone_codes)
+        lengths = np.diff(offsets)
+        starts = offsets[:-1]
+        self.event_person = np.repeat(np.arange(persons, dtype=np.int32), lengths)
+
+        # 첫 픽업의 전체 배열 내 위치 (픽업이 없으면 -1)
+        if persons:
+            candidates = np.where(event_masks & PICKUP, np.arange(events), events)
+            first = np.minimum.reduceat(candidates, starts)
+            self.first_pickup = np.where(first < offsets[1:], first, -1)
+        else:
+            self.first_pickup = np.empty(0, dtype=np.int64)
+        has_pickup = self.first_pickup >= 0
+
+        # 고객 안에서의 누적 응시 수 (자기 자신 포함)
+        is_gaze = (event_masks & GAZE) > 0
+        cumulative = np.cumsum(is_gaze, dtype=np.int64)
+        base = cumulative[starts] - is_gaze[starts] if persons else np.empty(0, dtype=np.int64)
+        local = cumulative - base[self.event_person]
+        total = cumulative[offsets[1:] - 1] - base if persons else np.empty(0, dtype=np.int64)
+
+        # 픽업이 없으면 직전/직후 응시 모두 0 (person_routes의 gazes_before / gazes_after와 동일)
+        self.gazes_before = np.where(has_pickup, local[np.maximum(self.first_pickup, 0)], 0) if events else total
+        self.gazes_after = np.where(has_pickup, total - self.gazes_before, 0)
+
+        # 응시 이벤트별 구간(1: 직전, 2: 직후, 0: 해당 없음)과 순번 (직전은 픽업에 가까운 순서)
+        pickup_at = self.first_pickup[self.event_person]
+        before = is_gaze & (np.arange(events) < pickup_at)
+        after = is_gaze & (pickup_at >= 0) & (np.arange(events) > pickup_at)
+        before_count = self.gazes_before[self.event_person]
+        self.gaze_period = np.where(before, 1, np.where(after, 2, 0)).astype(np.uint8)
+        self.gaze_position = np.where(before, before_count - local + 1, np.where(after, local - before_count, 0))
+
+    @classmethod
+    def from_columns(
+        cls,
+        age_groups: Sequence[str],
+        gender_labels: Sequence[str],
+        zone_names: Sequence[Sequence[str]],
+        event_masks: Sequence[Sequence[int]],
+    ) -> "ShelfRoutes":
+        """SHELF_ROUTES_QUERY의 컬럼 단위 결과에서 생성"""
+        lengths = np.fromiter((len(names) for names in zone_names), dtype=np.int64, count=len(zone_names))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        total = int(offsets[-1])
+
+        # 구역 이름 -> 정수 코드 (처음 등장한 순서로 한 번만 인코딩)
+        zone_ids: Dict[str, int] = {}
+        zone_codes = np.fromiter(
+            (zone_ids.setdefault(name, len(zone_ids)) for name in itertools.chain.from_iterable(zone_names)),
+            dtype=np.int32, count=total,
+        )
+        masks = np.fromiter(itertools.chain.from_iterable(event_masks), dtype=np.uint8, count=total)
+
+        age_index = {label: i for i, label in enumerate(AGE_GROUPS)}
+        gender_index = {label: i for i, label in enumerate(GENDER_LABELS)}
+        age_codes = np.fromiter((age_index[label] for label in age_groups), dtype=np.int8, count=len(age_groups))
+        gender_codes = np.fromiter(
+            (gender_index[label] for label in gender_labels), dtype=np.int8, count=len(gender_labels)
+        )
+        return cls(list(zone_ids), zone_codes, masks, offsets, age_codes, gender_codes)
+
+    @property
+    def persons(self) -> int:
+        return len(self.offsets) - 1
+
+    def _person_mask(
+        self,
+        target_shelves: Sequence[str],
+        age_groups: Sequence[str],
+        gender_labels: Sequence[str],
+    ) -> "np.ndarray":
+        """filtered_routes 조건: 픽업이 있고 첫 픽업 진열대/연령대/성별이 조건에 맞는 고객"""
+        mask = self.first_pickup >= 0
+        if target_shelves:
+            targets = np.isin(np.array(self.zones, dtype=object), list(target_shelves))
+            mask &= targets[self.zone_codes[np.maximum(self.first_pickup, 0)]]
+        if age_groups:
+            codes = [i for i, label in enumerate(AGE_GROUPS) if label in age_groups]
+            mask &= np.isin(self.age_codes, codes)
+        if gender_labels:
+            codes = [i for i, label in enumerate(GENDER_LABELS) if label in gender_labels]
+            mask &= np.isin(self.gender_codes, codes)
+        return mask
+
+    def analyze(
+        self,
+        target_shelves: Sequence[str] = (),
+        age_groups: Sequence[str] = (),
+        gender_labels: Sequence[str] = (),
+        exclude_shelves: Sequence[str] = (),
+        top_n: int = 5,
+        depth: int = 1,
+    ) -> List[Tuple[str, int, int, str, str]]:
+        """SHELF_ANALYSIS_QUERY와 같은 형식의 [(BEFORE/AFTER, 순번, 순위, 진열대, 비율%)] 목록"""
+        selected = self._person_mask(target_shelves, age_groups, gender_labels)
+        selected_count = int(selected.sum())
+        if selected_count == 0:
+            return []
+
+        n_zones = len(self.zones)
+        # 마지막 열은 진열대없음 (k번째 응시 매대가 없는 고객)
+        names = self.zones + [NO_SHELF]
+        excluded = np.isin(np.array(names, dtype=object), [CHECKOUT, *exclude_shelves])
+        event_selected = selected[self.event_person] & (self.gaze_position <= depth)
+        # 동률 순서는 구역 코드(인코딩 순서)와 무관하게 진열대 이름 순 (SQL 경로와 캐시 경로가 같은 결과)
+        name_rank = np.argsort(np.argsort(np.array(names, dtype=object), kind="stable"), kind="stable")
+
+        rows = []
+        for label, period, window in (("AFTER", 2, self.gazes_after), ("BEFORE", 1, self.gazes_before)):
+            events = event_selected & (self.gaze_period == period)
+            codes = (self.gaze_position[events] - 1) * (n_zones + 1) + self.zone_codes[events]
+            counts = np.bincount(codes, minlength=depth * (n_zones + 1)).reshape(depth, n_zones + 1)
+            # k번째 응시 매대가 없는 고객 수 = 응시 수가 k 미만인 고객 수
+            reached = np.bincount(np.minimum(window[selected], depth), minlength=depth + 1)
+            counts[:, n_zones] = np.cumsum(reached)[:-1]
+            counts[:, excluded] = 0
+
+            totals = counts.sum(axis=1, keepdims=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # ClickHouse ROUND와 같은 half-to-even 반올림
+                percentages = np.where(totals > 0, np.round(counts * 100.0 / totals), 0.0)
+            for position in range(depth):
+                values = percentages[position]
+                # 비율 내림차순, 동률은 건수 내림차순 -> 진열대 이름 순 (0%는 제외)
+                order = np.lexsort((name_rank, -counts[position], -values))
+                order = order[values[order] > 0][:top_n]
+                for rank, column in enumerate(order.tolist(), start=1):
+                    rows.append((label, position + 1, rank, names[column], f"{int(values[column])}%"))
+        return rows
+
+    def gaze_summary(self) -> List[Tuple[str, str, float, float]]:
+        """PICKUP_GAZE_SUMMARY_QUERY와 같은 형식의 [(연령대, 성별, 픽업 전 평균 응시 수, 픽업 후 평균 응시 수)]"""
+        if self.persons == 0:
+            return []
+        groups = self.age_codes.astype(np.int64) * len(GENDER_LABELS) + self.gender_codes
+        size = len(AGE_GROUPS) * len(GENDER_LABELS)
+        persons = np.bincount(groups, minlength=size)
+        before = np.bincount(groups, weights=self.gazes_before, minlength=size)
+        after = np.bincount(groups, weights=self.gazes_after, minlength=size)
+        rows = []
+        for group in np.flatnonzero(persons).tolist():
+            age_code, gender_code = divmod(group, len(GENDER_LABELS))
+            rows.append((
+                AGE_GROUPS[age_code], GENDER_LABELS[gender_code],
+                float(before[group] / persons[group]), float(after[group] / persons[group]),
+            ))
+        return rows
+
+    def __repr__(self) -> str:
+        return f"ShelfRoutes(persons={self.persons}, events={len(self.zone_codes)}, zones={len(self.zones)})"
+
+
+# (site, database, start_date, end_date, exclude_dates) -> (만료 시각, 경로)
+_routes: "OrderedDict[Tuple, Tuple[float, ShelfRoutes]]" = OrderedDict()
+_routes_lock = threading.Lock()
+_build_locks: Dict[Tuple, asyncio.Lock] = {}
+
+
+def _cached_routes(key: Tuple) -> Optional[ShelfRoutes]:
+    with _routes_lock:
+        entry = _routes.get(key)
+        if entry is None:
+            return None
+        expires_at, routes = entry
+        if expires_at < time.monotonic():
+            del _routes[key]
+            return None
+        _routes.move_to_end(key)
+        return routes
+
+
+def _store_routes(key: Tuple, routes: ShelfRoutes, ttl: float):
+    with _routes_lock:
+        _routes[key] = (time.monotonic() + ttl, routes)
+        _routes.move_to_end(key)
+        while len(_routes) > SHELF_ENGINE_MAX_ROUTES:
+            _routes.popitem(last=False)
+
+
+async def get_shelf_routes(
+    site: str,
+    database: str,
+    start_date: str,
+    end_date: str,
+    exclude_dates: Optional[List[str]] = None,
+) -> Optional[ShelfRoutes]:
+    """캐시된 고객별 경로 반환 (없으면 한 번 조회해 생성, 연결 실패 시 None)"""
+    exclude_dates = sorted(set(exclude_dates or []))
+    key = (site, database, start_date, end_date, tuple(exclude_dates))
+
+    routes = _cached_routes(key)
+    if routes is not None:
+        return routes
+
+    # 같은 기간의 동시 요청은 한 번만 조회
+    lock = _build_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        try:
+            return await _build_routes(key, site, database, start_date, end_date, exclude_dates)
+        finally:
+            # 락을 쥔 채로 정리해야 기다리던 요청과 새 요청이 같은 경로를 다시 만들지 않음
+            if _build_locks.get(key) is lock:
+                del _build_locks[key]
+
+
+async def _build_routes(
+    key: Tuple,
+    site: str,
+    database: str,
+    start_date: str,
+    end_date: str,
+    exclude_dates: List[str],
+) -> Optional[ShelfRoutes]:
+    """경로 생성 후 캐시에 저장 (get_shelf_routes의 빌드 락 안에서 호출)"""
+    routes = _cached_routes(key)
+    if routes is not None:
+        return routes
+
+    if event_sequence_cache.is_enabled():
+        # 로컬 이벤트 캐시의 날짜별 집계를 기간 전체로 합쳐서 생성 (빠진 날짜만 ClickHouse에서 받음)
+        table = await event_sequence_cache.load_events_async(site, start_date, end_date, database, "shelf")
+        if table is None:
+            return None
+        arrays = await asyncio.to_thread(
+            event_sequence_cache.shelf_route_arrays, table, AGE_GROUPS, GENDER_LABELS, exclude_dates
+        )
+        routes = ShelfRoutes(**arrays)
+    else:
+        result = await query_template_async(
+            site, SHELF_ROUTES_QUERY, database, column_oriented=True,
+            start_date=start_date, end_date=end_date, exclude_dates=exclude_dates,
+        )
+        if result is None:
+            return None
+        columns = result.result_columns or [[], [], [], []]
+        routes = await asyncio.to_thread(ShelfRoutes.from_columns, *columns)
+    logger.info(f"🧮 {site} 진열대 경로 생성: {routes}")
+    _store_routes(key, routes, ttl_for_arguments({"start_date": start_date, "end_date": end_date}))
+    return routes
+
+
+def invalidate_shelf_routes(site: Optional[str] = None) -> int:
+    """캐시된 경로 삭제 (site가 없으면 전체) -> 삭제된 경로 수"""
+    with _routes_lock:
+        keys = [key for key in _routes if site is None or key[0] == site]
+        for key in keys:
+            del _routes[key]
+    return len(keys)
@@ -0,0 +1,308 @@
+"""
+SSH Tunnel Manager
+==================
+
+(ssh_host, ssh_port, remote_host, remote_port) 단위로 SSH 터널을 재사용하는 레지스트리입니다.
+
+- 살아있는 터널은 그대로 재사용하고, 끊어진 터널은 투명하게 재시작
+- 일정 시간(IDLE TTL) 동안 사용되지 않은 터널은 백그라운드에서 정리
+- 터널 개수와 열기/닫기 지연시간 통계 제공
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+# SSH 터널링 관련 import
+try:
+    import paramiko
+
+    # 최신 paramiko에는 DSSKey가 없어 sshtunnel import 시 오류가 발생하므로 더미 클래스로 대체
+    if not hasattr(paramiko, 'DSSKey'):
+        class DummyDSSKey:
+            def __init__(self, *args, **kwargs):
+                raise NotImplementedError("DSS keys are not supported in this paramiko version")
+
+            @classmethod
+            def from_private_key_file(cls, *args, **kwargs):
+                raise NotImplementedError("DSS keys are not supported in this paramiko version")
+
+        paramiko.DSSKey = DummyDSSKey
+
+    from sshtunnel import SSHTunnelForwarder
+    SSH_AVAILABLE = True
+except ImportError:
+    SSH_AVAILABLE = False
+    logging.warning("sshtunnel 패키지가 설치되어 있지 않습니다.")
+
+logger = logging.getLogger(__name__)
+
+# 터널 설정 (환경 변수로 조정 가능)
+TUNNEL_IDLE_TTL = float(os.getenv("SSH_TUNNEL_IDLE_TTL", "900"))
+TUNNEL_REAP_INTERVAL = float(os.getenv("SSH_TUNNEL_REAP_INTERVAL", "60"))
+
+TunnelKey = Tuple[str, int, str, int]
+
+
+class _TunnelEntry:
+    """레지스트리에 등록된 터널과 메타데이터"""
+
+    __slots__ = ("forwarder", "key", "opened_at", "last_used")
+
+    def __init__(self, forwarder: Any, key: TunnelKey):
+        self.forwarder = forwarder
+        self.key = key
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+
+    @property
+    def local_port(self) -> int:
+        return self.forwarder.local_bind_port
+
+
+class TunnelRegistry:
+    """프로세스 전체에서 공유하는 SSH 터널 레지스트리"""
+
+    def __init__(self, idle_ttl: float = TUNNEL_IDLE_TTL, reap_interval: float = TUNNEL_REAP_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+
+        self._lock = threading.Lock()
+        self._tunnels: Dict[TunnelKey, _TunnelEntry] = {}
+        # 같은 키의 터널을 동시에 여러 개 열지 않도록 키별 lock 사용 (다른 키는 병렬로 열림)
+        # [lock, 사용 중인 스레드 수] - 터널이 없고 아무도 쓰지 않는 키의 lock은 삭제
+        self._key_locks: Dict[TunnelKey, list] = {}
+        self._stats = {"opened": 0, "reused": 0, "restarted": 0, "closed": 0, "open_failed": 0}
+        self._open_latency_ms = []
+        self._close_latency_ms = []
+
+        self._reaper: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def make_key(ssh_host: str, ssh_port: Any, remote_host: str, remote_port: Any) -> TunnelKey:
+        return (ssh_host, int(ssh_port or 22), remote_host, int(remote_port))
+
+    @staticmethod
+    def _is_alive(entry: _TunnelEntry) -> bool:
+        try:
+            return bool(entry.forwarder.is_active)
+        except Exception:
+            return False
+
+    def _record_latency(self, bucket: list, started: float):
+        bucket.append((time.perf_counter() - started) * 1000)
+        # 최근 값만 유지
+        if len(bucket) > 100:
+            del bucket[0]
+
+    def _open(self, key: TunnelKey, username: Optional[str], password: Optional[str]) -> _TunnelEntry:
+        ssh_host, ssh_port, remote_host, remote_port = key
+        started = time.perf_counter()
+        forwarder = SSHTunnelForwarder(
+            (ssh_host, ssh_port),
+            ssh_username=username,
+            ssh_password=password,
+            remote_bind_address=(remote_host, remote_port),
+            local_bind_address=("localhost", 0),
+            # 호환성을 위한 추가 옵션
+            ssh_config_file=None,
+            allow_agent=False,
+            host_pkey_directories=None,
+            ssh_pkey=None,
+        )
+        forwarder.start()
+        with self._lock:
+            self._record_latency(self._open_latency_ms, started)
+        return _TunnelEntry(forwarder, key)
+
+    def _close(self, entry: _TunnelEntry):
+        started = time.perf_counter()
+        try:
+            entry.forwarder.stop()
+        except Exception as e:
+            logger.warning(f"⚠️ SSH 터널 종료 중 오류 ({entry.key[0]} -> {entry.key[2]}:{entry.key[3]}): {e}")
+        with self._lock:
+            self._stats["closed"] += 1
+            self._record_latency(self._close_latency_ms, started)
+
+    def get_local_port(
+        self,
+        ssh_host: str,
+        ssh_port: Any,
+        remote_host: str,
+        remote_port: Any,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> int:
+        """터널을 재사용하거나 새로 열고 로컬 포트를 반환. 실패 시 예외 발생"""
+        if not SSH_AVAILABLE:
+            raise RuntimeError("sshtunnel 패키지가 설치되어 있지 않습니다.")
+
+        key = self.make_key(ssh_host, ssh_port, remote_host, remote_port)
+        if username is None:
+            username = os.getenv("SSH_USERNAME")
+        if password is None:
+            password = os.getenv("SSH_PASSWORD")
+
+        with self._lock:
+            slot = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+
+        try:
+            entry = self._get_or_open(slot[0], key, username, password)
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                self._drop_key_lock_locked(key)
+
+        self._ensure_reaper()
+        return entry.local_port
+
+    def _drop_key_lock_locked(self, key: TunnelKey):
+        """터널이 없고 기다리는 스레드도 없는 키의 lock 삭제 (self._lock을 잡은 상태에서 호출)"""
+        slot = self._key_locks.get(key)
+        if slot is not None and slot[1] == 0 and key not in self._tunnels:
+            del self._key_locks[key]
+
+    def _get_or_open(
+        self, key_lock: threading.Lock, key: TunnelKey, username: Optional[str], password: Optional[str]
+    ) -> _TunnelEntry:
+        ssh_host, _, remote_host, _ = key
+        with key_lock:
+            with self._lock:
+                entry = self._tunnels.get(key)
+
+            if entry is not None:
+                if self._is_alive(entry):
+                    entry.last_used = time.monotonic()
+                    with self._lock:
+                        self._stats["reused"] += 1
+                    return entry
+
+                # 끊어진 터널은 정리 후 재시작
+                logger.warning(f"🔄 SSH 터널 재시작: {ssh_host}:{key[1]} -> {remote_host}:{key[3]}")
+                with self._lock:
+                    self._tunnels.pop(key, None)
+                    self._stats["restarted"] += 1
+                self._close(entry)
+
+            try:
+                entry = self._open(key, username, password)
+            except Exception:
+                with self._lock:
+                    self._stats["open_failed"] += 1
+                raise
+
+            with self._lock:
+                self._tunnels[key] = entry
+                self._stats["opened"] += 1
+
+        logger.info(f"🚇 SSH 터널 생성: {ssh_host}:{key[1]} -> {remote_host}:{key[3]} (localhost:{entry.local_port})")
+        return entry
+
+    def touch(self, key: TunnelKey):
+        """터널 사용 시각 갱신 (풀에서 클라이언트를 재사용할 때 호출)"""
+        with self._lock:
+            entry = self._tunnels.get(key)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+
+    def reap_idle(self) -> int:
+        """IDLE TTL을 넘긴 터널 정리. 정리한 개수 반환"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [entry for entry in self._tunnels.values() if now - entry.last_used > self.idle_ttl]
+            for entry in expired:
+                self._tunnels.pop(entry.key, None)
+                self._drop_key_lock_locked(entry.key)
+        for entry in expired:
+            logger.info(f"🧹 유휴 SSH 터널 종료: {entry.key[0]} -> {entry.key[2]}:{entry.key[3]}")
+            self._close(entry)
+        return len(expired)
+
+    def _reap_loop(self):
+        while not self._stop_event.wait(self.reap_interval):
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.error(f"❌ SSH 터널 정리 중 오류: {e}")
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="ssh-tunnel-reaper", daemon=True)
+            self._reaper.start()
+
+    def close_all(self):
+        """모든 터널 종료"""
+        self._stop_event.set()
+        with self._lock:
+            entries = list(self._tunnels.values())
+            self._tunnels.clear()
+            for key in list(self._key_locks):
+                self._drop_key_lock_locked(key)
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """터널 개수 및 열기/닫기 지연시간 통계"""
+        with self._lock:
+            open_ms = list(self._open_latency_ms)
+            close_ms = list(self._close_latency_ms)
+            return {
+                **self._stats,
+                "active": len(self._tunnels),
+                "tunnels": [
+                    {
+                        "ssh": f"{key[0]}:{key[1]}",
+                        "remote": f"{key[2]}:{key[3]}",
+                        "local_port": entry.local_port,
+                        "idle_sec": round(time.monotonic() - entry.last_used, 1),
+                    }
+                    for key, entry in self._tunnels.items()
+                ],
+                "avg_open_ms": round(sum(open_ms) / len(open_ms), 1) if open_ms else None,
+                "max_open_ms": round(max(open_ms), 1) if open_ms else None,
+                "avg_close_ms": round(sum(close_ms) / len(close_ms), 1) if close_ms else None,
+            }
+
+
+_registry = TunnelRegistry()
+atexit.register(_registry.close_all)
+
+
+def get_tunnel_port(
+    ssh_host: str,
+    ssh_port: Any,
+    remote_host: str,
+    remote_port: Any,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+) -> int:
+    """공유 레지스트리에서 터널의 로컬 포트 조회 (없거나 끊어졌으면 새로 열기)"""
+    return _registry.get_local_port(ssh_host, ssh_port, remote_host, remote_port, username, password)
+
+
+def touch_tunnel(key: TunnelKey):
+    """터널 사용 시각 갱신"""
+    _registry.touch(key)
+
+
+def make_tunnel_key(ssh_host: str, ssh_port: Any, remote_host: str, remote_port: Any) -> TunnelKey:
+    """레지스트리 키 생성"""
+    return TunnelRegistry.make_key(ssh_host, ssh_port, remote_host, remote_port)
+
+
+def get_tunnel_stats() -> Dict[str, Any]:
+    """터널 통계 조회"""
+    return _registry.stats()
+
+
+def close_all_tunnels():
+    """모든 터널 종료"""
+    _registry.close_all()
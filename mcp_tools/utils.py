@@ -1,38 +1,145 @@
+import itertools
+from typing import Any, Dict, Hashable, List, Optional, Sequence
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 
-def create_transition_data(zone_visits_list):
+
+class TransitionMatrix:
+    """구역 전이 횟수 행렬 (N×N, 행: from_zone, 열: to_zone)
+
+    zones[i]가 i번 행/열의 구역 이름이며, 자기 자신으로의 전이는 항상 0입니다.
+    top_k()는 create_transition_data와 같은 형식(횟수 내림차순, 동률은 처음 등장한 순서)을 반환하고
+    probabilities()는 행 정규화된 전이 확률 행렬로 마르코프 체인 분석에 사용할 수 있습니다.
     """
-    방문 구역 목록에서 전이 데이터를 생성합니다.
-    
+
+    __slots__ = ("zones", "counts", "_pair_order")
+
+    def __init__(self, zones: List[Hashable], counts: "np.ndarray", pair_order: "np.ndarray"):
+        self.zones = zones
+        self.counts = counts
+        # 전이 쌍 코드(from * N + to)를 처음 등장한 순서로 나열한 배열 (동률 정렬 기준)
+        self._pair_order = pair_order
+
+    @property
+    def size(self) -> int:
+        """구역 수 N"""
+        return len(self.zones)
+
+    @property
+    def total(self) -> int:
+        """전체 전이 횟수"""
+        return int(self.counts.sum())
+
+    def index(self) -> Dict[Hashable, int]:
+        """구역 이름 -> 행/열 번호"""
+        return {zone: i for i, zone in enumerate(self.zones)}
+
+    def top_k(self, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """전이 횟수 상위 k개 (k가 None이면 전체)를 딕셔너리 리스트로 반환"""
+        n = self.size
+        if len(self._pair_order) == 0:
+            return []
+
+        pair_counts = self.counts.ravel()[self._pair_order]
+        # 안정 정렬이므로 동률은 처음 등장한 순서 유지 (기존 dict + list.sort 결과와 동일)
+        order = np.argsort(-pair_counts, kind="stable")
+        if k is not None:
+            order = order[:k]
+
+        result = []
+        for code, count in zip(self._pair_order[order].tolist(), pair_counts[order].tolist()):
+            from_id, to_id = divmod(code, n)
+            result.append({
+                'from_zone': self.zones[from_id],
+                'to_zone': self.zones[to_id],
+                'transition_count': count
+            })
+        return result
+
+    def probabilities(self) -> "np.ndarray":
+        """행 정규화된 전이 확률 행렬 (나가는 전이가 없는 구역의 행은 0)"""
+        row_sums = self.counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            probs = np.where(row_sums > 0, self.counts / row_sums, 0.0)
+        return probs
+
+    def __repr__(self) -> str:
+        return f"TransitionMatrix(zones={self.size}, transitions={self.total})"
+
+
+def build_transition_matrix(zone_visits_list: Sequence[Sequence[Hashable]]) -> TransitionMatrix:
+    """
+    방문 구역 목록에서 구역 전이 행렬을 만듭니다. (numpy 필요)
+
+    구역 이름은 처음 등장한 순서대로 한 번만 정수 id로 바꾸고,
+    연속 구간은 배열 슬라이싱, 횟수는 bincount(from * N + to)로 계산합니다.
+
     Args:
         zone_visits_list: 리스트의 리스트 형태로, 각 내부 리스트는 한 고객의 방문 순서를 담고 있음
-    
+
     Returns:
-        전이 카운트를 담은 딕셔너리 리스트 (from_zone, to_zone, transition_count)
+        TransitionMatrix
     """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("build_transition_matrix에는 numpy가 필요합니다")
+
+    # 구역 이름 -> 정수 id (처음 등장한 순서로 한 번만 인코딩)
+    zone_ids: Dict[Hashable, int] = {}
+    lengths = [len(zone_visits) for zone_visits in zone_visits_list]
+    ids = np.fromiter(
+        (zone_ids.setdefault(zone, len(zone_ids)) for zone in itertools.chain.from_iterable(zone_visits_list)),
+        dtype=np.int64, count=sum(lengths),
+    )
+    zones = list(zone_ids)
+    n = len(zones)
+    if len(ids) < 2:
+        return TransitionMatrix(zones, np.zeros((n, n), dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    # 한 고객의 방문 내에서만 연속 구간을 만들고, 자기 자신과의 전이는 제외
+    visitor = np.repeat(np.arange(len(lengths)), lengths)
+    from_ids = ids[:-1]
+    to_ids = ids[1:]
+    valid = (visitor[:-1] == visitor[1:]) & (from_ids != to_ids)
+    codes = from_ids[valid] * n + to_ids[valid]
+
+    counts = np.bincount(codes, minlength=n * n).reshape(n, n)
+
+    # 동률 정렬용: 전이 쌍을 처음 등장한 순서로 정리
+    unique_codes, first_index = np.unique(codes, return_index=True)
+    pair_order = unique_codes[np.argsort(first_index, kind="stable")]
+
+    return TransitionMatrix(zones, counts, pair_order)
+
+
+def _create_transition_data_python(zone_visits_list):
+    """numpy가 없을 때 사용하는 순수 Python 구현"""
     # 전이 카운트를 저장할 딕셔너리
     transition_counts = {}
-    
+
     # 모든 고객의 방문 데이터를 처리
     for zone_visits in zone_visits_list:
         # 연속된 구역 간의 전이를 추출 (한 고객의 방문 내에서만)
         for i in range(len(zone_visits) - 1):
             from_zone = zone_visits[i]
             to_zone = zone_visits[i + 1]
-            
+
             # 자기 자신과의 전이는 제외
             if from_zone == to_zone:
                 continue
-                
+
             # 키 생성 (from_zone -> to_zone)
             key = (from_zone, to_zone)
-            
+
             # 카운트 증가
             if key in transition_counts:
                 transition_counts[key] += 1
             else:
                 transition_counts[key] = 1
-    
+
     # 결과를 딕셔너리 리스트 형태로 변환
     result = []
     for (from_zone, to_zone), count in transition_counts.items():
@@ -41,8 +148,23 @@ def create_transition_data(zone_visits_list):
             'to_zone': to_zone,
             'transition_count': count
         })
-    
+
     # 전이 횟수 기준으로 내림차순 정렬
     result.sort(key=lambda x: x['transition_count'], reverse=True)
-    
-    return result
\ No newline at end of file
+
+    return result
+
+
+def create_transition_data(zone_visits_list):
+    """
+    방문 구역 목록에서 전이 데이터를 생성합니다.
+
+    Args:
+        zone_visits_list: 리스트의 리스트 형태로, 각 내부 리스트는 한 고객의 방문 순서를 담고 있음
+
+    Returns:
+        전이 카운트를 담은 딕셔너리 리스트 (from_zone, to_zone, transition_count)
+    """
+    if not NUMPY_AVAILABLE:
+        return _create_transition_data_python(zone_visits_list)
+    return build_transition_matrix(zone_visits_list).top_k()
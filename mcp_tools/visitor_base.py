@@ -0,0 +1,441 @@
+"""
+Visitor Base
+============
+
+방문객 일별 사전 집계(visitor base) 관리
+
+`line_in_out_individual` + `detected_time` + `line` 조인은 diagnose_avg_in, check_zero_visits,
+diagnose_purchase_conversion_rate, diagnose_exploratory_tendency, 방문객 진단 워크플로우에서 반복됩니다.
+매장 DB에 (날짜, 시간, 평일/주말, 연령대, 성별) 단위의 uniqExact 상태를 저장해 두고,
+요청 기간이 모두 집계되어 있으면 요약 테이블을, 아니면 원본 테이블을 조회합니다.
+
+- visitor_base_daily: AggregatingMergeTree, 방문자 수는 uniqExactState(cityHash64(person_seq))
+- visitor_base_log: 집계가 끝난 날짜 목록 (커버리지 판단용)
+- 오늘을 포함해 아직 데이터가 쌓이는 날짜(VISITOR_BASE_SETTLE_DAYS)는 집계하지 않음
+
+집계 갱신:
+    python visitor_base.py 매장명 [start_date] [end_date] [--force]
+    python visitor_base.py "*"        # 전체 매장, 최근 VISITOR_BASE_BACKFILL_DAYS일
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Optional, Dict, Any, List, Tuple, FrozenSet
+
+from database_manager import site_client, run_with_client_async, get_all_sites
+from query_templates import QueryTemplate
+
+logger = logging.getLogger(__name__)
+
+# 사전 집계 설정 (환경 변수로 조정 가능)
+VISITOR_BASE_ENABLED = os.getenv("VISITOR_BASE_ENABLED", "true").lower() not in ("0", "false", "no")
+VISITOR_BASE_SETTLE_DAYS = int(os.getenv("VISITOR_BASE_SETTLE_DAYS", "1"))        # 오늘로부터 이 일수 이내는 집계하지 않음
+VISITOR_BASE_BACKFILL_DAYS = int(os.getenv("VISITOR_BASE_BACKFILL_DAYS", "90"))   # 기간 미지정 시 집계할 최근 일수
+VISITOR_BASE_COVERAGE_TTL = float(os.getenv("VISITOR_BASE_COVERAGE_TTL", "300"))  # 집계 날짜 목록 캐시 시간 (초)
+
+SUMMARY_TABLE = "visitor_base_daily"
+LOG_TABLE = "visitor_base_log"
+
+CREATE_SUMMARY_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE}
+(
+    visit_date  Date,
+    visit_hour  UInt8,
+    day_type    LowCardinality(String),
+    age_group   LowCardinality(String),
+    gender      LowCardinality(String),
+    visitors    AggregateFunction(uniqExact, UInt64)
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(visit_date)
+ORDER BY (visit_date, visit_hour, day_type, age_group, gender)
+"""
+
+CREATE_LOG_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {LOG_TABLE}
+(
+    visit_date       Date,
+    materialized_at  DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(materialized_at)
+ORDER BY visit_date
+"""
+
+MATERIALIZE_QUERY = QueryTemplate("visitor_base.materialize", f"""
+INSERT INTO {SUMMARY_TABLE}
+SELECT
+    li.date                                                            AS visit_date,
+    toUInt8(toHour(li.timestamp))                                      AS visit_hour,
+    if(toDayOfWeek(li.date) IN (1,2,3,4,5), 'weekday', 'weekend')      AS day_type,
+    multiIf(
+        dt.age BETWEEN 0  AND  9 , '10대 미만',
+        dt.age BETWEEN 10 AND 19, '10대',
+        dt.age BETWEEN 20 AND 29, '20대',
+        dt.age BETWEEN 30 AND 39, '30대',
+        dt.age BETWEEN 40 AND 49, '40대',
+        dt.age BETWEEN 50 AND 59, '50대',
+        dt.age >= 60           , '60대 이상',
+        'Unknown'
+    )                                                                  AS age_group,
+    if(dt.gender = '0', '남성', if(dt.gender='1','여성','Unknown'))    AS gender,
+    uniqExactState(cityHash64(li.person_seq))                          AS visitors
+FROM line_in_out_individual li
+LEFT JOIN detected_time dt ON li.person_seq = dt.person_seq
+LEFT JOIN line          l  ON li.triggered_line_id = l.id
+WHERE li.date BETWEEN {{start_date:String}} AND {{end_date:String}}
+  AND li.is_staff = 0
+  AND li.in_out   = 'IN'
+  AND l.entrance  = 1
+GROUP BY visit_date, visit_hour, day_type, age_group, gender
+""")
+
+MARK_LOG_QUERY = QueryTemplate("visitor_base.mark_log", f"""
+INSERT INTO {LOG_TABLE} (visit_date)
+SELECT addDays(toDate({{start_date:String}}), number)
+FROM numbers(toUInt64(dateDiff('day', toDate({{start_date:String}}), toDate({{end_date:String}})) + 1))
+""")
+
+CLEAR_RANGE_QUERY = QueryTemplate("visitor_base.clear_range", f"""
+ALTER TABLE {SUMMARY_TABLE} DELETE
+WHERE visit_date BETWEEN {{start_date:String}} AND {{end_date:String}}
+SETTINGS mutations_sync = 1
+""")
+
+# =============================================================================
+# diagnose_avg_in 쿼리 (원본 / 요약 테이블)
+# =============================================================================
+
+# 일별·차원별 방문자 수(daily_*)와 평일/주말 시간대별 방문자 수(range_cnt)를 받아 최종 섹션을 만드는 공통 부분
+_AVG_IN_TAIL = """avg_all       AS (SELECT toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_all),
+avg_dayType   AS (SELECT day_type, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_dayType GROUP BY day_type),
+avg_gender    AS (SELECT gender, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_gender GROUP BY gender),
+avg_age       AS (SELECT age_group, toUInt64(round(CASE WHEN isFinite(avg(ucnt)) THEN avg(ucnt) ELSE 0 END)) AS avg_cnt FROM daily_age GROUP BY age_group),
+rank_age      AS (SELECT *, row_number() OVER (ORDER BY avg_cnt DESC) AS rk FROM avg_age),
+overall_cnt   AS (SELECT avg_cnt AS cnt FROM avg_all),
+tot_cnt   AS (SELECT day_type, sum(visit_cnt) AS total_cnt FROM range_cnt GROUP BY day_type),
+range_pct AS (
+    SELECT r.day_type, r.time_range, r.visit_cnt,
+           toUInt64(round(
+               CASE 
+                   WHEN t.total_cnt > 0 THEN r.visit_cnt / t.total_cnt * 100
+                   ELSE 0
+               END
+           )) AS pct
+    FROM range_cnt r JOIN tot_cnt t USING(day_type)
+),
+rank_slot AS (
+    SELECT *, row_number() OVER (PARTITION BY day_type ORDER BY pct DESC) AS rk
+    FROM range_pct
+),
+final AS (
+    SELECT '일평균' AS section, '전체' AS label,
+           avg_cnt AS value_cnt, CAST(NULL AS Nullable(UInt64)) AS value_pct, 0 AS ord
+    FROM avg_all
+    UNION ALL
+    SELECT '일평균', '평일', avg_cnt, CAST(NULL AS Nullable(UInt64)), 1
+    FROM avg_dayType WHERE day_type='weekday'
+    UNION ALL
+    SELECT '일평균', '주말', avg_cnt, CAST(NULL AS Nullable(UInt64)), 2
+    FROM avg_dayType WHERE day_type='weekend'
+    UNION ALL
+    SELECT '성별경향', gender, avg_cnt,
+           toUInt64(round(
+               CASE 
+                   WHEN (SELECT cnt FROM overall_cnt) > 0 THEN avg_cnt / (SELECT cnt FROM overall_cnt) * 100
+                   ELSE 0
+               END
+           )) AS value_pct,
+           10 + if(gender='남성',0,1) AS ord
+    FROM avg_gender WHERE gender IN ('남성','여성')
+    UNION ALL
+    SELECT '연령대경향',
+           concat(toString(rk),'위_',age_group)                         AS label,
+           avg_cnt,
+           toUInt64(round(
+               CASE 
+                   WHEN (SELECT cnt FROM overall_cnt) > 0 THEN avg_cnt / (SELECT cnt FROM overall_cnt) * 100
+                   ELSE 0
+               END
+           )) AS value_pct,
+           20 + rk AS ord
+    FROM rank_age WHERE rk<=3
+    UNION ALL
+    SELECT '시간대경향',
+           concat('평일_',toString(rk),'_',time_range)                 AS label,
+           visit_cnt, pct, 30 + rk
+    FROM rank_slot WHERE day_type='weekday' AND rk<=3
+    UNION ALL
+    SELECT '시간대경향',
+           concat('주말_',toString(rk),'_',time_range),
+           visit_cnt, pct, 40 + rk
+    FROM rank_slot WHERE day_type='weekend' AND rk<=3
+)
+SELECT section, label, value_cnt, value_pct
+FROM final
+ORDER BY ord
+"""
+
+AVG_IN_QUERY = QueryTemplate("diagnose.avg_in", """
+WITH
+df AS (
+    SELECT
+        li.date AS visit_date,
+        li.timestamp,
+        li.person_seq AS visitor_id,
+        if(toDayOfWeek(li.date) IN (1,2,3,4,5), 'weekday', 'weekend')                     AS day_type,
+        multiIf(
+            toHour(li.timestamp) IN (22,23,0,1), '22-01',
+            toHour(li.timestamp) BETWEEN 2  AND 5 , '02-05',
+            toHour(li.timestamp) BETWEEN 6  AND 9 , '06-09',
+            toHour(li.timestamp) BETWEEN 10 AND 13, '10-13',
+            toHour(li.timestamp) BETWEEN 14 AND 17, '14-17',
+            '18-21'
+        ) AS time_range,
+        multiIf(
+            dt.age BETWEEN 0  AND  9 , '10대 미만',
+            dt.age BETWEEN 10 AND 19, '10대',
+            dt.age BETWEEN 20 AND 29, '20대',
+            dt.age BETWEEN 30 AND 39, '30대',
+            dt.age BETWEEN 40 AND 49, '40대',
+            dt.age BETWEEN 50 AND 59, '50대',
+            dt.age >= 60           , '60대 이상',
+            'Unknown'
+        ) AS age_group,
+        if(dt.gender = '0', '남성', if(dt.gender='1','여성','Unknown'))                   AS gender
+    FROM line_in_out_individual li
+    LEFT JOIN detected_time dt ON li.person_seq = dt.person_seq
+    LEFT JOIN line          l  ON li.triggered_line_id = l.id
+    WHERE li.date BETWEEN {start_date:String} AND {end_date:String}
+      AND li.is_staff = 0
+      AND li.in_out   = 'IN'
+      AND l.entrance  = 1
+),
+daily_all     AS (SELECT visit_date, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date),
+daily_dayType AS (SELECT visit_date, day_type, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, day_type),
+daily_gender  AS (SELECT visit_date, gender, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, gender),
+daily_age     AS (SELECT visit_date, age_group, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, age_group),
+range_cnt AS (
+    SELECT day_type, time_range, uniqExact(visitor_id) AS visit_cnt
+    FROM df GROUP BY day_type, time_range
+),
+""" + _AVG_IN_TAIL)
+
+AVG_IN_SUMMARY_QUERY = QueryTemplate("diagnose.avg_in_summary", f"""
+WITH
+base AS (
+    SELECT visit_date, visit_hour, day_type, age_group, gender, visitors
+    FROM {SUMMARY_TABLE}
+    WHERE visit_date BETWEEN {{start_date:String}} AND {{end_date:String}}
+),
+daily_all     AS (SELECT visit_date, uniqExactMerge(visitors) AS ucnt FROM base GROUP BY visit_date),
+daily_dayType AS (SELECT visit_date, day_type, uniqExactMerge(visitors) AS ucnt FROM base GROUP BY visit_date, day_type),
+daily_gender  AS (SELECT visit_date, gender, uniqExactMerge(visitors) AS ucnt FROM base GROUP BY visit_date, gender),
+daily_age     AS (SELECT visit_date, age_group, uniqExactMerge(visitors) AS ucnt FROM base GROUP BY visit_date, age_group),
+range_cnt AS (
+    SELECT
+        day_type,
+        multiIf(
+            visit_hour IN (22,23,0,1), '22-01',
+            visit_hour BETWEEN 2  AND 5 , '02-05',
+            visit_hour BETWEEN 6  AND 9 , '06-09',
+            visit_hour BETWEEN 10 AND 13, '10-13',
+            visit_hour BETWEEN 14 AND 17, '14-17',
+            '18-21'
+        ) AS time_range,
+        uniqExactMerge(visitors) AS visit_cnt
+    FROM base GROUP BY day_type, time_range
+),
+""" + _AVG_IN_TAIL)
+
+# =============================================================================
+# 커버리지 (요약 테이블로 요청 기간을 모두 대신할 수 있는지)
+# =============================================================================
+
+_coverage_lock = threading.Lock()
+_coverage_cache: Dict[Tuple[str, str], Tuple[float, FrozenSet[date]]] = {}
+
+
+def _fetch_materialized_dates(client: Any) -> FrozenSet[date]:
+    """집계가 끝난 날짜 목록 조회 (요약 테이블이 없으면 빈 집합)"""
+    try:
+        result = client.query(f"SELECT DISTINCT visit_date FROM {LOG_TABLE}")
+        return frozenset(row[0] for row in result.result_rows)
+    except Exception as e:
+        logger.info(f"ℹ️ 방문객 사전 집계 없음, 원본 테이블 사용: {e}")
+        return frozenset()
+
+
+def _cached_dates(site: str, database: str) -> Optional[FrozenSet[date]]:
+    with _coverage_lock:
+        cached = _coverage_cache.get((site, database))
+    if cached is not None and time.monotonic() - cached[0] < VISITOR_BASE_COVERAGE_TTL:
+        return cached[1]
+    return None
+
+
+def _store_dates(site: str, database: str, dates: FrozenSet[date]):
+    with _coverage_lock:
+        _coverage_cache[(site, database)] = (time.monotonic(), dates)
+
+
+def _invalidate_coverage(site: str, database: str):
+    with _coverage_lock:
+        _coverage_cache.pop((site, database), None)
+
+
+def _date_range(start_date: str, end_date: str) -> List[date]:
+    start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _is_covered(dates: FrozenSet[date], start_date: str, end_date: str) -> bool:
+    try:
+        days = _date_range(start_date, end_date)
+    except ValueError:
+        return False
+    return bool(days) and all(day in dates for day in days)
+
+
+def covers(site: str, start_date: str, end_date: str, database: str = 'plusinsight', client: Any = None) -> bool:
+    """요청 기간이 모두 요약 테이블에 집계되어 있는지 확인 (동기)
+
+    client를 넘기면 그 연결로 조회하고, 없으면 풀에서 빌려 씁니다.
+    """
+    if not VISITOR_BASE_ENABLED:
+        return False
+
+    dates = _cached_dates(site, database)
+    if dates is None:
+        if client is not None:
+            dates = _fetch_materialized_dates(client)
+        else:
+            with site_client(site, database) as pooled:
+                if not pooled:
+                    return False
+                dates = _fetch_materialized_dates(pooled)
+        _store_dates(site, database, dates)
+    return _is_covered(dates, start_date, end_date)
+
+
+async def covers_async(site: str, start_date: str, end_date: str, database: str = 'plusinsight') -> bool:
+    """covers()의 비동기 버전"""
+    if not VISITOR_BASE_ENABLED:
+        return False
+
+    dates = _cached_dates(site, database)
+    if dates is None:
+        dates = await run_with_client_async(site, _fetch_materialized_dates, database)
+        if dates is None:
+            return False
+        _store_dates(site, database, dates)
+    return _is_covered(dates, start_date, end_date)
+
+
+async def choose_template_async(
+    site: str,
+    start_date: str,
+    end_date: str,
+    summary: QueryTemplate,
+    raw: QueryTemplate,
+    database: str = 'plusinsight',
+) -> QueryTemplate:
+    """기간이 모두 집계되어 있으면 요약 테이블 쿼리, 아니면 원본 테이블 쿼리 반환"""
+    if await covers_async(site, start_date, end_date, database):
+        logger.info(f"⚡ {site}: 방문객 사전 집계 사용 ({summary.name}, {start_date} ~ {end_date})")
+        return summary
+    return raw
+
+# =============================================================================
+# 집계 갱신
+# =============================================================================
+
+def _missing_ranges(days: List[date], done: FrozenSet[date]) -> List[Tuple[date, date]]:
+    """집계되지 않은 날짜를 연속 구간으로 묶기"""
+    ranges: List[Tuple[date, date]] = []
+    for day in days:
+        if day in done:
+            continue
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def refresh_visitor_base(
+    site: str,
+    start_date: str = "",
+    end_date: str = "",
+    force: bool = False,
+    database: str = 'plusinsight',
+) -> Dict[str, Any]:
+    """매장의 방문객 사전 집계 갱신
+
+    기간 미지정 시 최근 VISITOR_BASE_BACKFILL_DAYS일을 대상으로 하며, 아직 데이터가 쌓이는
+    최근 VISITOR_BASE_SETTLE_DAYS일은 집계하지 않습니다. 이미 집계된 날짜는 force=True일 때만 다시 집계합니다.
+
+    Returns:
+        {"site", "materialized_days", "ranges", "skipped_days", "elapsed_sec"} 또는 {"site", "error"}
+    """
+    started = time.perf_counter()
+    last_settled = date.today() - timedelta(days=VISITOR_BASE_SETTLE_DAYS)
+    end = min(date.fromisoformat(end_date), last_settled) if end_date else last_settled
+    start = date.fromisoformat(start_date) if start_date else end - timedelta(days=VISITOR_BASE_BACKFILL_DAYS - 1)
+    if start > end:
+        return {"site": site, "materialized_days": 0, "ranges": [], "skipped_days": 0, "elapsed_sec": 0.0}
+
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    with site_client(site, database) as client:
+        if not client:
+            return {"site": site, "error": "연결 실패"}
+
+        client.command(CREATE_SUMMARY_TABLE)
+        client.command(CREATE_LOG_TABLE)
+
+        done = frozenset() if force else _fetch_materialized_dates(client)
+        ranges = _missing_ranges(days, done)
+
+        for range_start, range_end in ranges:
+            params = {"start_date": range_start.isoformat(), "end_date": range_end.isoformat()}
+            if force:
+                client.command(CLEAR_RANGE_QUERY.sql, parameters=CLEAR_RANGE_QUERY.bind(**params))
+            client.command(MATERIALIZE_QUERY.sql, parameters=MATERIALIZE_QUERY.bind(**params))
+            # 요약 데이터가 다 들어간 뒤에 집계 완료 표시 (중간 실패 시 원본 테이블 사용)
+            client.command(MARK_LOG_QUERY.sql, parameters=MARK_LOG_QUERY.bind(**params))
+            logger.info(f"📦 {site}: 방문객 사전 집계 {range_start} ~ {range_end}")
+
+    _invalidate_coverage(site, database)
+    materialized = sum((e - s).days + 1 for s, e in ranges)
+    return {
+        "site": site,
+        "materialized_days": materialized,
+        "ranges": [f"{s} ~ {e}" for s, e in ranges],
+        "skipped_days": len(days) - materialized,
+        "elapsed_sec": round(time.perf_counter() - started, 2),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if arg != "--force"]
+    if not args:
+        print("사용법: python visitor_base.py <매장명|*> [start_date] [end_date] [--force]")
+        sys.exit(1)
+
+    target_sites = get_all_sites() if args[0] == "*" else [args[0]]
+    for target in target_sites:
+        try:
+            outcome = refresh_visitor_base(
+                target,
+                args[1] if len(args) > 1 else "",
+                args[2] if len(args) > 2 else "",
+                force="--force" in sys.argv,
+            )
+        except Exception as e:
+            outcome = {"site": target, "error": str(e)}
+        print(outcome)
@@ -24,17 +24,174 @@
 
 import json
 import os
+import hashlib
 import sys
-from typing import Dict, Any, List, Union
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
 from fastmcp import FastMCP  # FastMCP 툴 서버용
 
 from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from langchain.schema import BaseOutputParser
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END, START
 
+import report_store
 from base_workflow import BaseWorkflow, BaseState
-from database_manager import get_site_client
+from database_manager import site_client, get_env_client
+from visitor_base import AVG_IN_QUERY, AVG_IN_SUMMARY_QUERY, covers
+
+# 여러 매장 보고서 생성 시 동시에 조회할 매장 수와 매장별 제한 시간(초)
+VISITOR_DIAGNOSE_WORKERS = int(os.getenv("VISITOR_DIAGNOSE_WORKERS", "8"))
+VISITOR_DIAGNOSE_STORE_TIMEOUT = float(os.getenv("VISITOR_DIAGNOSE_STORE_TIMEOUT", "120"))
+
+# 시간대 명칭 매핑
+TIME_NAMES = {
+    '22-01': '심야',
+    '02-05': '새벽',
+    '06-09': '아침',
+    '10-13': '낮',
+    '14-17': '오후',
+    '18-21': '저녁'
+}
+
+
+@dataclass(slots=True)
+class StoreMetrics:
+    """매장별 방문객 진단 지표 (fetch 노드가 쿼리 결과에서 바로 생성)
+
+    키 형식:
+        daily_avg  {'전체'|'평일'|'주말': 명}
+        gender     {'남성'|'여성': %}
+        age_rank   {'1위_20대': %}
+        time_slots {'평일'|'주말': {'1위_낮_10-13': %}}
+    """
+    store: str
+    daily_avg: Dict[str, int] = field(default_factory=dict)
+    gender: Dict[str, int] = field(default_factory=dict)
+    age_rank: Dict[str, int] = field(default_factory=dict)
+    time_slots: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+    @classmethod
+    def from_rows(cls, store: str, rows: Sequence[Tuple[str, str, Any, Any]]) -> "StoreMetrics":
+        """diagnose_avg_in 쿼리 결과 (section, label, value_cnt, value_pct) 행에서 생성"""
+        metrics = cls(store)
+        for section, label, value_cnt, value_pct in rows:
+            if section == '일평균':
+                metrics.daily_avg[label] = int(value_cnt or 0)
+            elif section == '성별경향':
+                metrics.gender['남성' if label == '남성' else '여성'] = int(value_pct or 0)
+            elif section == '연령대경향':
+                # label: '1위_20대'
+                metrics.age_rank[label] = int(value_pct or 0)
+            elif section == '시간대경향':
+                # label: '평일_1_10-13'
+                day_type, rank, time_range = label.split('_', 2)
+                slot = f"{rank}위_{TIME_NAMES.get(time_range, time_range)}_{time_range}"
+                metrics.time_slots.setdefault(day_type, {})[slot] = int(value_pct or 0)
+        return metrics
+
+    @staticmethod
+    def _ranked(values: Dict[str, int], rank: int) -> Optional[Tuple[str, int]]:
+        """'{rank}위_' 로 시작하는 항목 (키, 값)"""
+        for key, value in values.items():
+            if key.startswith(f"{rank}위_"):
+                return key, value
+        return None
+
+    def age_at(self, rank: int) -> Optional[Tuple[str, int]]:
+        """rank위 연령대 (연령대, %)"""
+        item = self._ranked(self.age_rank, rank)
+        return (item[0].split('위_', 1)[1], item[1]) if item else None
+
+    def time_slot_at(self, day_type: str, rank: int) -> Optional[Tuple[str, str, int]]:
+        """평일/주말 rank위 시간대 (명칭, 범위, %)"""
+        item = self._ranked(self.time_slots.get(day_type, {}), rank)
+        if not item:
+            return None
+        _, time_name, time_range = item[0].split('_', 2)
+        return time_name, time_range, item[1]
+
+    def render(self) -> str:
+        """LLM 입력용 텍스트"""
+        daily = self.daily_avg
+        lines = [
+            f"[{self.store}]",
+            f"일평균 방문객수: 전체 {daily.get('전체', 0)}명, 평일 {daily.get('평일', 0)}명, 주말 {daily.get('주말', 0)}명",
+            f"성별 경향: 남성 {self.gender.get('남성', 0)}%, 여성 {self.gender.get('여성', 0)}%",
+        ]
+        ages = [f"{i}위: {age[0]} ({age[1]}%)" for i in range(1, 4) if (age := self.age_at(i))]
+        lines.append(f"연령대 순위: {', '.join(ages)}")
+        for day_type in ['평일', '주말']:
+            slots = [
+                f"{i}위: {slot[0]}({slot[1]}) {slot[2]}%"
+                for i in range(1, 4) if (slot := self.time_slot_at(day_type, i))
+            ]
+            lines.append(f"{day_type} 시간대: {', '.join(slots)}")
+        return "\n".join(lines)
+
+
+# HTML 보고서 템플릿 (프로세스 시작 시 한 번만 컴파일)
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+_template_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html", "html.j2"]),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+REPORT_TEMPLATE = _template_env.get_template("visitor_diagnose_report.html.j2")
+# 템플릿이 바뀌면 같은 데이터라도 새 보고서를 만들도록 보고서 fingerprint에 포함
+with open(REPORT_TEMPLATE.filename, "rb") as _f:
+    TEMPLATE_DIGEST = hashlib.sha256(_f.read()).hexdigest()
+
+HIGHLIGHT_COLORS = ("red", "blue")
+
+
+def render_report(
+    metric_dict: Dict[str, StoreMetrics],
+    period: str,
+    highlights: Sequence[Dict[str, Any]] = (),
+) -> str:
+    """매장별 지표를 HTML 보고서로 렌더링
+
+    highlights: [{"metric": "방문객수"|"성별경향"|"연령대순위"|"시간대경향", "store": 매장명, "color": "red"}]
+    하이라이트는 렌더링 후 치환하지 않고 템플릿에 CSS 클래스로 전달합니다.
+    """
+    classes = {}
+    for item in highlights:
+        color = item.get("color", "red")
+        classes[(item.get("store", ""), item.get("metric", ""))] = (
+            f" highlight-{color if color in HIGHLIGHT_COLORS else 'red'}"
+        )
+
+    def highlight(store: str, metric: str) -> str:
+        return classes.get((store, metric), "")
+
+    return "".join(REPORT_TEMPLATE.generate(
+        stores=list(metric_dict.values()),
+        period=period,
+        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        highlight=highlight,
+    ))
+
+
+def _split_store_names(store_name: Union[str, List[str]]) -> List[str]:
+    """쉼표로 구분된 매장 문자열(또는 리스트) -> 매장 목록"""
+    if isinstance(store_name, str):
+        return [name.strip() for name in store_name.split(',')]
+    return list(store_name)
+
+
+def _report_result(web_url: str) -> str:
+    """에이전트에 반환할 보고서 링크 (코드블록 없이 한 줄 텍스트)"""
+    return (
+        "📊 HTML 보고서 생성 완료!\n\n"
+        f"🔗 [웹에서 보기]({web_url})\n\n"
+        "보고서를 클릭하여 새 탭에서 확인하세요!"
+    )
 
 
 class VisitorDiagnoseState(BaseState):
@@ -42,8 +199,8 @@ class VisitorDiagnoseState(BaseState):
     store_name: str  # 단일 매장명
     period: str
     visitor_data: Dict[str, Any]  # 단일 매장 데이터
-    raw_answer: str  # diagnose_avg_in의 원시 응답
-    metric_dict: Dict[str, Any]  # 파싱된 메트릭 데이터
+    metric_dict: Dict[str, StoreMetrics]  # 매장별 메트릭 데이터 (fetch 노드에서 생성)
+    fetch_errors: List[str]  # 연결 실패/데이터 없음/시간 초과 매장 안내
     placements: List[Dict[str, Any]]  # 엑셀 셀 배치 정보
     final_result: str  # 최종 결과
     design_spec: List[Dict[str, Any]]  # 디자인 스타일 placements
@@ -136,13 +293,18 @@ class VisitorDiagnoseWorkflow(BaseWorkflow[VisitorDiagnoseState]):
         """Agent가 호출하는 방문객 진단 워크플로우 실행"""
         self.logger.info(f"워크플로우 실행: {store_name} ({start_date}~{end_date})")
         
+        # 이미 끝난 기간의 같은 요청이면 데이터 조회 없이 저장된 보고서 반환
+        web_url = report_store.lookup(self.workflow_name, _split_store_names(store_name), f"{start_date}~{end_date}")
+        if web_url:
+            return _report_result(web_url)
+        
         # 초기 상태 설정
         initial_state = VisitorDiagnoseState(
             store_name=store_name,
             period=f"{start_date}~{end_date}",
             visitor_data={},
-            raw_answer="",
             metric_dict={},
+            fetch_errors=[],
             placements=[],
             final_result="",
             design_spec=[]
@@ -159,982 +321,198 @@ class VisitorDiagnoseWorkflow(BaseWorkflow[VisitorDiagnoseState]):
         
         # 노드 추가 - HTML 출력으로 변경
         builder.add_node("fetch", self._query_db_node)
-        builder.add_node("parse", self._parse_node)
         builder.add_node("generate_html", self._generate_html_node)
         builder.add_node("highlight", self._highlight_node)
         builder.add_node("save_html", self._save_html_node)
         
         # 엣지 추가 (순차 실행) - 하이라이트 노드 비활성화
         builder.add_edge(START, "fetch")
-        builder.add_edge("fetch", "parse")
-        builder.add_edge("parse", "generate_html")
-        # builder.add_edge("generate_html", "highlight")  # 하이라이트 노드 비활성화
-        # builder.add_edge("highlight", "save_html")
-        builder.add_edge("generate_html", "save_html")  # 직접 save_html로 연결
+        # 하이라이트는 렌더링 전에 데이터로 전달 (fetch -> highlight -> generate_html)
+        # builder.add_edge("fetch", "highlight")  # 하이라이트 노드 비활성화
+        # builder.add_edge("highlight", "generate_html")
+        builder.add_edge("fetch", "generate_html")  # 직접 generate_html로 연결
+        builder.add_edge("generate_html", "save_html")
         builder.add_edge("save_html", END)
         
         return builder.compile()
 
     # ----------------- 노드 구현 -----------------
     def _query_db_node(self, state: VisitorDiagnoseState) -> VisitorDiagnoseState:
-        """diagnose_avg_in 로직을 직접 구현하여 DB에서 데이터 조회"""
-        start, end = state["period"].split("~")
-            
-        # mcp_diagnose.py의 diagnose_avg_in 쿼리를 그대로 사용
-        query = f"""
-        WITH
-df AS (
-    SELECT
-        li.date AS visit_date,
-        li.timestamp,
-        li.person_seq AS visitor_id,
-        if(toDayOfWeek(li.date) IN (1,2,3,4,5), 'weekday', 'weekend')                     AS day_type,
-        multiIf(
-            toHour(li.timestamp) IN (22,23,0,1), '22-01',
-            toHour(li.timestamp) BETWEEN 2  AND 5 , '02-05',
-            toHour(li.timestamp) BETWEEN 6  AND 9 , '06-09',
-            toHour(li.timestamp) BETWEEN 10 AND 13, '10-13',
-            toHour(li.timestamp) BETWEEN 14 AND 17, '14-17',
-            '18-21'
-        ) AS time_range,
-        multiIf(
-            dt.age BETWEEN 0  AND  9 , '10대 미만',
-            dt.age BETWEEN 10 AND 19, '10대',
-            dt.age BETWEEN 20 AND 29, '20대',
-            dt.age BETWEEN 30 AND 39, '30대',
-            dt.age BETWEEN 40 AND 49, '40대',
-            dt.age BETWEEN 50 AND 59, '50대',
-            dt.age >= 60           , '60대 이상',
-            'Unknown'
-        ) AS age_group,
-        if(dt.gender = '0', '남성', if(dt.gender='1','여성','Unknown'))                   AS gender
-    FROM line_in_out_individual li
-    LEFT JOIN detected_time dt ON li.person_seq = dt.person_seq
-    LEFT JOIN line          l  ON li.triggered_line_id = l.id
-    WHERE li.date BETWEEN '{start}' AND '{end}'
-      AND li.is_staff = 0
-      AND li.in_out   = 'IN'
-      AND l.entrance  = 1
-),
-daily_all     AS (SELECT visit_date, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date),
-avg_all       AS (SELECT toUInt64(round(avg(ucnt))) AS avg_cnt FROM daily_all),
-daily_dayType AS (SELECT visit_date, day_type, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, day_type),
-avg_dayType   AS (SELECT day_type, toUInt64(round(avg(ucnt))) AS avg_cnt FROM daily_dayType GROUP BY day_type),
-daily_gender  AS (SELECT visit_date, gender, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, gender),
-avg_gender    AS (SELECT gender, toUInt64(round(avg(ucnt))) AS avg_cnt FROM daily_gender GROUP BY gender),
-daily_age     AS (SELECT visit_date, age_group, uniqExact(visitor_id) AS ucnt FROM df GROUP BY visit_date, age_group),
-avg_age       AS (SELECT age_group, toUInt64(round(avg(ucnt))) AS avg_cnt FROM daily_age GROUP BY age_group),
-rank_age      AS (SELECT *, row_number() OVER (ORDER BY avg_cnt DESC) AS rk FROM avg_age),
-overall_cnt   AS (SELECT avg_cnt AS cnt FROM avg_all),
-range_cnt AS (
-    SELECT day_type, time_range, uniqExact(visitor_id) AS visit_cnt
-    FROM df GROUP BY day_type, time_range
-),
-tot_cnt   AS (SELECT day_type, sum(visit_cnt) AS total_cnt FROM range_cnt GROUP BY day_type),
-range_pct AS (
-    SELECT r.day_type, r.time_range, r.visit_cnt,
-           toUInt64(round(r.visit_cnt / t.total_cnt * 100)) AS pct
-    FROM range_cnt r JOIN tot_cnt t USING(day_type)
-),
-rank_slot AS (
-    SELECT *, row_number() OVER (PARTITION BY day_type ORDER BY pct DESC) AS rk
-    FROM range_pct
-),
-final AS (
-    SELECT '일평균' AS section, '전체' AS label,
-           avg_cnt AS value_cnt, CAST(NULL AS Nullable(UInt64)) AS value_pct, 0 AS ord
-    FROM avg_all
-    UNION ALL
-    SELECT '일평균', '평일', avg_cnt, CAST(NULL AS Nullable(UInt64)), 1
-    FROM avg_dayType WHERE day_type='weekday'
-    UNION ALL
-    SELECT '일평균', '주말', avg_cnt, CAST(NULL AS Nullable(UInt64)), 2
-    FROM avg_dayType WHERE day_type='weekend'
-    UNION ALL
-    SELECT '성별경향', gender, avg_cnt,
-           toUInt64(round(avg_cnt / (SELECT cnt FROM overall_cnt) * 100)) AS value_pct,
-           10 + if(gender='남성',0,1) AS ord
-    FROM avg_gender WHERE gender IN ('남성','여성')
-    UNION ALL
-    SELECT '연령대경향',
-           concat(toString(rk),'위_',age_group)                         AS label,
-           avg_cnt,
-           toUInt64(round(avg_cnt / (SELECT cnt FROM overall_cnt) * 100)) AS value_pct,
-           20 + rk AS ord
-    FROM rank_age WHERE rk<=3
-    UNION ALL
-    SELECT '시간대경향',
-           concat('평일_',toString(rk),'_',time_range)                 AS label,
-           visit_cnt, pct, 30 + rk
-    FROM rank_slot WHERE day_type='weekday' AND rk<=3
-    UNION ALL
-    SELECT '시간대경향',
-           concat('주말_',toString(rk),'_',time_range),
-           visit_cnt, pct, 40 + rk
-    FROM rank_slot WHERE day_type='weekend' AND rk<=3
-)
-SELECT section, label, value_cnt, value_pct
-FROM final
-ORDER BY ord
-"""
+        """diagnose_avg_in 쿼리로 DB에서 데이터 조회 (매장별 동시 조회)"""
+        start, end = [part.strip() for part in state["period"].split("~")]
 
-        answer = ""
         # 요청된 매장들 처리 (더미데이터 포함)
-        if isinstance(state["store_name"], str):
-            # 쉼표로 구분된 문자열을 분리
-            store_names = [name.strip() for name in state["store_name"].split(',')]
-        else:
-            store_names = state["store_name"]
-        
-        for store in store_names:
-            # 더미데이터점들인 경우 가짜 데이터 생성
-            if store.startswith("더미데이터점"):
-                answer += self._generate_dummy_data_for_store(store)
-                continue
-                
-            # 실제 매장인 경우 DB 조회
-            database = "plusinsight"  # 기본 데이터베이스
-            store_client = None
-            try:
-                # 매장별 연결 정보 기반 클라이언트 시도
-                store_client = get_site_client(store, database=database)
-                if not store_client:
-                    # 폴백: 환경변수 기반 기본 연결
-                    self.logger.warning(
-                        f"{store}: get_site_client 실패, 기본 환경 연결로 폴백 시도"
-                    )
-                    store_client = self._create_clickhouse_client(database=database)
-                if not store_client:
-                    answer += f"\n{store} 데이터베이스 연결 실패"
-                    continue
-
-                result = store_client.query(query)
-
-                if len(result.result_rows) > 0:
-                    # 섹션별로 데이터 분류
-                    sections = {
-                        '일평균': [],
-                        '성별경향': [],
-                        '연령대경향': [],
-                        '시간대경향': []
-                    }
-                    
-                    for row in result.result_rows:
-                        section, label, value_cnt, value_pct = row
-                        sections[section].append((label, value_cnt, value_pct))
-                    
-                    # 표 형태로 포맷팅 (mcp_diagnose.py와 동일한 형식)
-                    store_answer = f"\n=== {store} ===\n"
-                    
-                    # 1. 일평균 방문객수
-                    store_answer += "일평균 방문객수\n"
-                    for label, cnt, _ in sections['일평균']:
-                        store_answer += f"  {label}: {cnt}명\n"
-                    
-                    # 2. 성별경향
-                    store_answer += "\n성별경향\n"
-                    for label, cnt, pct in sections['성별경향']:
-                        gender_display = 'M' if label == '남성' else 'F'
-                        store_answer += f"  {gender_display}: {pct}%\n"
-                    
-                    # 3. 연령대별 순위 (상위 3개)
-                    store_answer += "\n연령대별 순위\n"
-                    for label, cnt, pct in sections['연령대경향']:
-                        rank = label.split('위_')[0]
-                        age_group = label.split('위_')[1]
-                        store_answer += f"  {rank}: {age_group} - {pct}%\n"
-                    
-                    # 4. 주요 방문시간대
-                    store_answer += "\n주요 방문시간대\n"
-                    
-                    # 시간대 명칭 매핑
-                    time_names = {
-                        '22-01': '심야',
-                        '02-05': '새벽',
-                        '06-09': '아침',
-                        '10-13': '낮',
-                        '14-17': '오후',
-                        '18-21': '저녁'
-                    }
-                    
-                    # 평일 시간대 분리
-                    weekday_slots = [item for item in sections['시간대경향'] if '평일_' in item[0]]
-                    weekend_slots = [item for item in sections['시간대경향'] if '주말_' in item[0]]
-                    
-                    store_answer += "  평일:\n"
-                    for label, cnt, pct in weekday_slots:
-                        rank = label.split('_')[1]
-                        time_range = label.split('_')[2]
-                        time_name = time_names.get(time_range, time_range)
-                        store_answer += f"    {rank}: {time_name}({time_range}) - {pct}%\n"
-                    
-                    store_answer += "  주말:\n"
-                    for label, cnt, pct in weekend_slots:
-                        rank = label.split('_')[1]
-                        time_range = label.split('_')[2]
-                        time_name = time_names.get(time_range, time_range)
-                        store_answer += f"    {rank}: {time_name}({time_range}) - {pct}%\n"
-                    
-                    answer += store_answer
-                else:
-                    answer += f"\n{store} 데이터가 없습니다."
-                
-            except Exception as e:
-                self.logger.error(f"{store} 데이터 조회 오류: {e}")
-                answer += f"\n{store} 데이터 조회 오류: {e}"
-            finally:
-                try:
-                    if store_client:
-                        store_client.close()
-                except Exception:
-                    pass
+        store_names = _split_store_names(state["store_name"])
+
+        metric_dict: Dict[str, StoreMetrics] = {}
+        fetch_errors: List[str] = []
+        for outcome in self._fetch_stores(store_names, start, end):
+            if isinstance(outcome, StoreMetrics):
+                metric_dict[outcome.store] = outcome
+            else:
+                fetch_errors.append(outcome)
+        for message in fetch_errors:
+            self.logger.warning(message)
 
-        state["raw_answer"] = answer
+        state["metric_dict"] = metric_dict
+        state["fetch_errors"] = fetch_errors
+        self.logger.info(f"조회 완료 - 매장 수: {len(metric_dict)}, 실패: {len(fetch_errors)}")
         return state
 
-    def _create_clickhouse_client(self, database="plusinsight"):
-        """ClickHouse 클라이언트 생성 (mcp_diagnose.py의 로직을 그대로 사용)"""
-        import clickhouse_connect
-        from dotenv import load_dotenv
-        
-        load_dotenv()
-        
-        # 환경변수 로드
-        CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST")
-        CLICKHOUSE_PORT = os.getenv("CLICKHOUSE_PORT")
-        CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER")
-        CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD")
-        SSH_HOST = os.getenv("SSH_HOST")
-        SSH_PORT = int(os.getenv("SSH_PORT", "22"))
-        SSH_USERNAME = os.getenv("SSH_USERNAME")
-        SSH_PASSWORD = os.getenv("SSH_PASSWORD")
-        
-        # SSH 터널링이 필요한 경우 (sshtunnel 사용)
+    def _fetch_stores(self, store_names: List[str], start: str, end: str) -> List[Union[StoreMetrics, str]]:
+        """매장별 조회를 스레드 풀에서 동시에 실행하고 입력 순서대로 결과(StoreMetrics 또는 실패 안내) 반환
+
+        매장별 제한 시간(VISITOR_DIAGNOSE_STORE_TIMEOUT)을 넘긴 매장은 시간 초과 문구로 대신하고
+        나머지 매장 결과는 그대로 보고서에 사용합니다. 기다리지 않기로 한 매장의 쿼리도
+        서버 측 max_execution_time으로 함께 끝나며, 그 클라이언트는 풀에 반납하지 않고 닫습니다.
+        """
+        if not store_names:
+            return []
+
+        workers = max(1, min(VISITOR_DIAGNOSE_WORKERS, len(store_names)))
+        timeout = VISITOR_DIAGNOSE_STORE_TIMEOUT
+        results: Dict[int, Union[StoreMetrics, str]] = {}
+        started: Dict[int, float] = {}
+        wall_started = time.perf_counter()
+
+        def run(index: int, store: str) -> Union[StoreMetrics, str]:
+            started[index] = time.monotonic()
+            answer = self._fetch_store(store, start, end)
+            self.logger.info(f"✅ {store} 조회 완료 ({time.monotonic() - started[index]:.2f}s)")
+            return answer
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="visitor-diagnose")
+        futures = {executor.submit(run, i, store): i for i, store in enumerate(store_names)}
+        pending = set(futures)
         try:
-            from sshtunnel import SSHTunnelForwarder
-            SSH_AVAILABLE = True
-        except ImportError:
-            SSH_AVAILABLE = False
-            
-        if SSH_AVAILABLE and SSH_HOST:
-            try:
-                ssh_tunnel = SSHTunnelForwarder(
-                    (SSH_HOST, SSH_PORT),
-                    ssh_username=SSH_USERNAME,
-                    ssh_password=SSH_PASSWORD,
-                    remote_bind_address=(CLICKHOUSE_HOST, int(CLICKHOUSE_PORT)),
-                    local_bind_address=("localhost", 0),
-                )
-                ssh_tunnel.start()
-                self.logger.info(f"SSH 터널 생성: localhost:{ssh_tunnel.local_bind_port}")
-                
-                host = "localhost"
-                port = ssh_tunnel.local_bind_port
-                
-            except Exception as e:
-                self.logger.error(f"SSH 터널 생성 실패: {e}, 직접 연결 시도")
-                host = CLICKHOUSE_HOST
-                port = int(CLICKHOUSE_PORT)
-        else:
-            # 직접 연결
-            host = CLICKHOUSE_HOST
-            port = int(CLICKHOUSE_PORT)
-        
+            while pending:
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        self.logger.error(f"{store_names[index]} 데이터 조회 오류: {e}")
+                        results[index] = f"{store_names[index]} 데이터 조회 오류: {e}"
+
+                # 실행을 시작한 지 제한 시간이 지난 매장은 기다리지 않음 (대기 중인 매장은 제외)
+                now = time.monotonic()
+                for future in [f for f in pending if now - started.get(futures[f], now) > timeout]:
+                    pending.discard(future)
+                    index = futures[future]
+                    self.logger.error(f"⏱️ {store_names[index]} 조회 시간 초과 ({timeout:.0f}s)")
+                    results[index] = f"{store_names[index]} 데이터 조회 시간 초과 ({timeout:.0f}초)"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self.logger.info(
+            f"매장 {len(store_names)}개 조회 완료 ({time.perf_counter() - wall_started:.2f}s, 동시 실행 {workers}개)"
+        )
+        return [results[i] for i in range(len(store_names))]
+
+    def _fetch_store(self, store: str, start: str, end: str) -> Union[StoreMetrics, str]:
+        """한 매장의 방문객 데이터를 조회해 StoreMetrics로 반환 (실패 시 안내 문자열)"""
+        # 더미데이터점들인 경우 가짜 데이터 생성
+        if store.startswith("더미데이터점"):
+            return self._generate_dummy_data_for_store(store)
+
+        # 실제 매장인 경우 DB 조회 (풀에서 빌린 클라이언트, 없으면 환경변수 기반 연결로 폴백)
+        # 조회 중 예외(서버 측 시간 초과 포함)가 난 클라이언트는 site_client가 풀에 반납하지 않고 닫음
+        database = "plusinsight"  # 기본 데이터베이스
+        deadline = time.monotonic() + VISITOR_DIAGNOSE_STORE_TIMEOUT
         try:
-            client = clickhouse_connect.get_client(
-                host=host,
-                port=port,
-                username=CLICKHOUSE_USER,
-                password=CLICKHOUSE_PASSWORD,
-                database=database,
-            )
-            self.logger.info(f"ClickHouse 연결 성공: {host}:{port}, db={database}")
-            return client
+            with site_client(store, database=database) as pooled_client:
+                if pooled_client:
+                    return self._query_store(store, start, end, pooled_client, deadline)
+
+                # 폴백: 환경변수 기반 기본 연결
+                self.logger.warning(f"{store}: site_client 실패, 기본 환경 연결로 폴백 시도")
+                fallback_client = self._create_clickhouse_client(database=database)
+                if not fallback_client:
+                    return f"{store} 데이터베이스 연결 실패"
+                try:
+                    return self._query_store(store, start, end, fallback_client, deadline)
+                finally:
+                    try:
+                        fallback_client.close()
+                    except Exception:
+                        pass
         except Exception as e:
-            self.logger.error(f"ClickHouse 연결 실패: {e}")
-            return None
+            self.logger.error(f"{store} 데이터 조회 오류: {e}")
+            return f"{store} 데이터 조회 오류: {e}"
 
-    def _parse_node(self, state: VisitorDiagnoseState) -> VisitorDiagnoseState:
-        """raw_text → metric_dict - 모든 데이터 파싱"""
-        import re
+    def _query_store(self, store: str, start: str, end: str, client: Any, deadline: float) -> Union[StoreMetrics, str]:
+        """diagnose_avg_in과 같은 쿼리로 한 매장 조회 (기간이 모두 사전 집계되어 있으면 요약 테이블 조회)
 
-        self.logger.info(f"파싱할 raw_answer 길이: {len(state['raw_answer'])}")
-        
-        metric_dict = {}
-        current_store = None
-        current_section = None
-        
-        for line in state["raw_answer"].splitlines():
-            line = line.strip()
-            if not line:
-                continue
-                
-            # 매장명 파싱
-            m = re.match(r"===\s(.+)\s===", line)
-            if m:
-                current_store = m.group(1)
-                metric_dict[current_store] = {
-                    'daily_avg': {},      # 일평균 방문객수
-                    'gender': {},         # 성별경향  
-                    'age_rank': {},       # 연령대별 순위
-                    'time_slots': {}      # 주요 방문시간대
-                }
-                self.logger.info(f"매장 발견: {current_store}")
-                continue
-            
-            # 섹션 헤더 파싱
-            if line in ['일평균 방문객수', '성별경향', '연령대별 순위', '주요 방문시간대']:
-                current_section = line
-                continue
-                
-            if not current_store or not current_section:
-                continue
-                
-            # 각 섹션별 데이터 파싱
-            if current_section == '일평균 방문객수':
-                m = re.match(r"(.+):\s+(\d+)명", line)
-                if m:
-                    label, count = m.groups()
-                    metric_dict[current_store]['daily_avg'][label] = int(count)
-                    
-            elif current_section == '성별경향':
-                m = re.match(r"([MF]):\s+(\d+)%", line)
-                if m:
-                    gender, pct = m.groups()
-                    gender_name = '남성' if gender == 'M' else '여성'
-                    metric_dict[current_store]['gender'][gender_name] = int(pct)
-                    
-            elif current_section == '연령대별 순위':
-                m = re.match(r"(\d+):\s+(.+)\s+-\s+(\d+)%", line)
-                if m:
-                    rank, age_group, pct = m.groups()
-                    metric_dict[current_store]['age_rank'][f"{rank}위_{age_group}"] = int(pct)
-                    
-            elif current_section == '주요 방문시간대':
-                # 평일/주말 구분
-                if line in ['평일:', '주말:']:
-                    current_day_type = line.rstrip(':')
-                    if current_day_type not in metric_dict[current_store]['time_slots']:
-                        metric_dict[current_store]['time_slots'][current_day_type] = {}
-                    continue
-                    
-                # 시간대 데이터 파싱
-                m = re.match(r"(\d+):\s+(.+)\((.+)\)\s+-\s+(\d+)%", line)
-                if m and 'current_day_type' in locals():
-                    rank, time_name, time_range, pct = m.groups()
-                    key = f"{rank}위_{time_name}_{time_range}"
-                    metric_dict[current_store]['time_slots'][current_day_type][key] = int(pct)
+        서버에서도 매장별 제한 시간을 넘기면 쿼리를 중단(max_execution_time)하고,
+        제한 시간이 지난 뒤에 끝난 조회는 호출 쪽이 이미 포기했으므로 예외로 올려 클라이언트를 폐기합니다.
+        """
+        template = AVG_IN_SUMMARY_QUERY if covers(store, start, end, client=client) else AVG_IN_QUERY
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"제한 시간 {VISITOR_DIAGNOSE_STORE_TIMEOUT:.0f}초 초과")
+        result = client.query(
+            template.sql,
+            parameters=template.bind(start_date=start, end_date=end),
+            settings={"max_execution_time": max(1, int(remaining))},
+        )
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"제한 시간 {VISITOR_DIAGNOSE_STORE_TIMEOUT:.0f}초 초과")
 
-        state["metric_dict"] = metric_dict
-        self.logger.info(f"파싱 완료 - 매장 수: {len(metric_dict)}")
-        for store, data in metric_dict.items():
-            self.logger.info(f"{store} 파싱 결과:")
-            self.logger.info(f"  일평균: {data['daily_avg']}")
-            self.logger.info(f"  성별: {data['gender']}")
-            self.logger.info(f"  연령대: {data['age_rank']}")
-            self.logger.info(f"  시간대: {data['time_slots']}")
-        return state
+        if len(result.result_rows) > 0:
+            return StoreMetrics.from_rows(store, result.result_rows)
+        return f"{store} 데이터가 없습니다."
+
+    def _create_clickhouse_client(self, database="plusinsight"):
+        """ClickHouse 클라이언트 생성 (환경변수 기반, 공유 SSH 터널 사용)"""
+        return get_env_client(database=database)
 
     def _generate_html_node(self, state: VisitorDiagnoseState) -> VisitorDiagnoseState:
         """
-        방문객 진단 데이터를 HTML 테이블로 변환
+        방문객 진단 데이터를 HTML 보고서로 렌더링 (미리 컴파일된 Jinja2 템플릿)
         """
-        import os
-        from datetime import datetime
-        
-        metric_dict = state["metric_dict"]
-        
-        # report 디렉토리 생성
-        if not os.path.exists("report"):
-            os.makedirs("report", exist_ok=True)
-        
-        # HTML 템플릿 시작
-        html_content = self._create_html_template(metric_dict, state["period"])
+        started = time.perf_counter()
+        html_content = render_report(state["metric_dict"], state["period"], state.get("highlights") or [])
         
         state["html_content"] = html_content
-        self.logger.info(f"HTML 콘텐츠 생성 완료: {len(html_content)} 문자")
+        self.logger.info(
+            f"HTML 콘텐츠 생성 완료: {len(html_content)} 문자, 매장 {len(state['metric_dict'])}개 "
+            f"({(time.perf_counter() - started) * 1000:.1f}ms)"
+        )
         
         return state
 
-    def _create_html_template(self, metric_dict: dict, period: str) -> str:
-        """
-        HTML 보고서 템플릿 생성
-        """
-        from datetime import datetime
-        
-        stores = list(metric_dict.keys())
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        html = f"""
-<!DOCTYPE html>
-<html lang="ko">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>매장 방문객 진단 보고서</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: 'Pretendard', -apple-system, BlinkMacSystemFont, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }}
-        
-        .container {{
-            max-width: 1400px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            overflow: hidden;
-        }}
-        
-        .header {{
-            background: linear-gradient(135deg, #2c3e50 0%, #34495e 100%);
-            color: white;
-            padding: 30px;
-            text-align: center;
-        }}
-        
-        .header h1 {{
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-            font-weight: 700;
-        }}
-        
-        .header .period {{
-            font-size: 1.2rem;
-            opacity: 0.9;
-            margin-bottom: 5px;
-        }}
-        
-        .header .generated {{
-            font-size: 0.9rem;
-            opacity: 0.7;
-        }}
-        
-        .content {{
-            padding: 40px;
-        }}
-        
-        .store-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(320px, 1fr));
-            gap: 20px;
-            margin-bottom: 40px;
-        }}
-        
-        .store-card {{
-            background: #fff;
-            border-radius: 12px;
-            box-shadow: 0 6px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e8ed;
-            overflow: hidden;
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }}
-        
-        .store-card:hover {{
-            transform: translateY(-5px);
-            box-shadow: 0 15px 35px rgba(0,0,0,0.15);
-        }}
-        
-        .store-header {{
-            background: linear-gradient(135deg, #3498db 0%, #2980b9 100%);
-            color: white;
-            padding: 15px;
-            text-align: center;
-        }}
-        
-        .store-name {{
-            font-size: 1.3rem;
-            font-weight: 600;
-            margin-bottom: 3px;
-        }}
-        
-        .store-body {{
-            padding: 18px;
-        }}
-        
-        .metric-section {{
-            margin-bottom: 18px;
-        }}
-        
-        .metric-title {{
-            font-size: 1.0rem;
-            font-weight: 600;
-            color: #2c3e50;
-            margin-bottom: 12px;
-            padding-bottom: 6px;
-            border-bottom: 2px solid #3498db;
-        }}
-        
-        .metric-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(100px, 1fr));
-            gap: 8px;
-        }}
-        
-        .metric-item {{
-            background: #f8f9fa;
-            padding: 12px;
-            border-radius: 8px;
-            text-align: center;
-            border: 1px solid #e9ecef;
-        }}
-        
-        .metric-label {{
-            font-size: 0.85rem;
-            color: #6c757d;
-            margin-bottom: 5px;
-        }}
-        
-        .metric-value {{
-            font-size: 1.2rem;
-            font-weight: 700;
-            color: #2c3e50;
-        }}
-        
-        .metric-value.highlight-red {{
-            color: #e74c3c;
-            font-weight: 800;
-        }}
-        
-        .metric-value.highlight-blue {{
-            color: #3498db;
-            font-weight: 800;
-        }}
-        
-        .time-slots {{
-            display: flex;
-            justify-content: space-between;
-            gap: 12px;
-        }}
-        
-        .time-slot-group {{
-            flex: 1;
-            background: #f8f9fa;
-            padding: 12px;
-            border-radius: 8px;
-            border: 1px solid #e9ecef;
-        }}
-        
-        .time-slot-title {{
-            font-weight: 600;
-            color: #495057;
-            margin-bottom: 10px;
-            text-align: center;
-        }}
-        
-        .time-slot-item {{
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            padding: 8px 0;
-            border-bottom: 1px solid #dee2e6;
-        }}
-        
-        .time-slot-item:last-child {{
-            border-bottom: none;
-        }}
-        
-        .time-slot-rank {{
-            background: #6c757d;
-            color: white;
-            width: 20px;
-            height: 20px;
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 0.8rem;
-            font-weight: 600;
-        }}
-        
-        .time-slot-time {{
-            font-size: 0.9rem;
-            color: #495057;
-        }}
-        
-        .time-slot-percent {{
-            font-weight: 600;
-            color: #2c3e50;
-        }}
-        
-        .time-slot-percent.highlight-red {{
-            color: #e74c3c;
-            font-weight: 800;
-        }}
-        
-        .time-slot-percent.highlight-blue {{
-            color: #3498db;
-            font-weight: 800;
-        }}
-        
-        .comparison-table {{
-            width: 100%;
-            margin-top: 40px;
-            border-collapse: collapse;
-            background: white;
-            border-radius: 15px;
-            overflow: hidden;
-            box-shadow: 0 8px 25px rgba(0,0,0,0.08);
-        }}
-        
-        .comparison-table th {{
-            background: linear-gradient(135deg, #34495e 0%, #2c3e50 100%);
-            color: white;
-            padding: 20px;
-            text-align: center;
-            font-weight: 600;
-        }}
-        
-        .comparison-table td {{
-            padding: 15px;
-            text-align: center;
-            border-bottom: 1px solid #e1e8ed;
-        }}
-        
-        .comparison-table tbody tr:hover {{
-            background: #f8f9fa;
-        }}
-        
-        .footer {{
-            background: #2c3e50;
-            color: white;
-            text-align: center;
-            padding: 20px;
-            font-size: 0.9rem;
-        }}
-        
-        @media (max-width: 768px) {{
-            .container {{
-                margin: 10px;
-                border-radius: 15px;
-            }}
-            
-            .content {{
-                padding: 20px;
-            }}
-            
-            .store-grid {{
-                grid-template-columns: 1fr;
-                gap: 20px;
-            }}
-            
-            .time-slots {{
-                flex-direction: column;
-                gap: 15px;
-            }}
-            
-            .header h1 {{
-                font-size: 2rem;
-            }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🏪 매장 방문객 진단 보고서</h1>
-            <div class="period">📅 분석 기간: {period}</div>
-            <div class="generated">⏰ 생성 시간: {current_time}</div>
-        </div>
-        
-        <div class="content">
-            <div class="store-grid">
-"""
-        
-        # 각 매장별 카드 생성
-        for store, data in metric_dict.items():
-            html += self._create_store_card_html(store, data)
-        
-        html += """
-            </div>
-            
-            <!-- 매장 간 비교 테이블 -->
-            <h2 style="text-align: center; margin-bottom: 30px; color: #2c3e50; font-size: 2rem;">📊 매장 간 비교</h2>
-"""
-        
-        # 비교 테이블 생성
-        html += self._create_comparison_table_html(metric_dict)
-        
-        html += f"""
-        </div>
-        
-        <div class="footer">
-            <p>💡 이 보고서는 방문객 진단 워크플로우에 의해 자동 생성되었습니다.</p>
-            <p>🔄 마지막 업데이트: {current_time}</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        
-        return html
-
-    def _create_store_card_html(self, store_name: str, data: dict) -> str:
-        """개별 매장 카드 HTML 생성"""
-        daily_avg = data.get('daily_avg', {})
-        gender = data.get('gender', {})
-        age_rank = data.get('age_rank', {})
-        time_slots = data.get('time_slots', {})
-        
-        html = f"""
-                <div class="store-card">
-                    <div class="store-header">
-                        <div class="store-name">{store_name}</div>
-                    </div>
-                    <div class="store-body">
-                        <!-- 일평균 방문객수 -->
-                        <div class="metric-section">
-                            <div class="metric-title">👥 일평균 방문객수</div>
-                            <div class="metric-grid">
-                                <div class="metric-item">
-                                    <div class="metric-label">전체</div>
-                                    <div class="metric-value">{daily_avg.get('전체', 0):,}명</div>
-                                </div>
-                                <div class="metric-item">
-                                    <div class="metric-label">평일</div>
-                                    <div class="metric-value">{daily_avg.get('평일', 0):,}명</div>
-                                </div>
-                                <div class="metric-item">
-                                    <div class="metric-label">주말</div>
-                                    <div class="metric-value">{daily_avg.get('주말', 0):,}명</div>
-                                </div>
-                            </div>
-                        </div>
-                        
-                        <!-- 성별 경향 -->
-                        <div class="metric-section">
-                            <div class="metric-title">👫 성별 경향</div>
-                            <div class="metric-grid">
-                                <div class="metric-item">
-                                    <div class="metric-label">남성</div>
-                                    <div class="metric-value">{gender.get('남성', 0)}%</div>
-                                </div>
-                                <div class="metric-item">
-                                    <div class="metric-label">여성</div>
-                                    <div class="metric-value">{gender.get('여성', 0)}%</div>
-                                </div>
-                            </div>
-                        </div>
-                        
-                        <!-- 연령대 순위 -->
-                        <div class="metric-section">
-                            <div class="metric-title">🎯 연령대별 순위</div>
-                            <div class="metric-grid">
-"""
-        
-        # 연령대 순위 데이터 추가
-        for i in range(1, 4):
-            rank_key = None
-            for key in age_rank.keys():
-                if key.startswith(f"{i}위_"):
-                    rank_key = key
-                    break
-
-            if rank_key:
-                age_group = rank_key.split('위_')[1]
-                pct = age_rank.get(rank_key, 0)
-                html += f"""
-                                <div class="metric-item">
-                                    <div class="metric-label">{i}위</div>
-                                    <div class="metric-value">{age_group}<br><small>{pct}%</small></div>
-                                </div>
-"""
-        
-        html += """
-                            </div>
-                        </div>
-                        
-                        <!-- 시간대 경향 -->
-                        <div class="metric-section">
-                            <div class="metric-title">⏰ 주요 방문시간대</div>
-                            <div class="time-slots">
-"""
-        
-        # 평일/주말 시간대 데이터 추가
-        for day_type in ['평일', '주말']:
-            icon = '💼' if day_type == '평일' else '🎉'
-            slots = time_slots.get(day_type, {})
-            
-            html += f"""
-                                <div class="time-slot-group">
-                                    <div class="time-slot-title">{icon} {day_type}</div>
-"""
-            
-            for i in range(1, 4):
-                rank_key = None
-                for key in slots.keys():
-                    if key.startswith(f"{i}위_"):
-                        rank_key = key
-                        break
-                
-                if rank_key:
-                    parts = rank_key.split('_')
-                    if len(parts) >= 3:
-                        time_name = parts[1]
-                        time_range = parts[2]
-                        pct = slots.get(rank_key, 0)
-                        
-                        html += f"""
-                                    <div class="time-slot-item">
-                                        <div class="time-slot-rank">{i}</div>
-                                        <div class="time-slot-time">{time_name}({time_range})</div>
-                                        <div class="time-slot-percent">{pct}%</div>
-                                    </div>
-"""
-            
-            html += """
-                                </div>
-"""
-        
-        html += """
-                            </div>
-                        </div>
-                    </div>
-                </div>
-"""
-        
-        return html
-
-    def _create_comparison_table_html(self, metric_dict: dict) -> str:
-        """매장 간 비교 테이블 HTML 생성"""
-        stores = list(metric_dict.keys())
-        
-        html = """
-            <table class="comparison-table">
-                <thead>
-                    <tr>
-                        <th>구분</th>
-                        <th>항목</th>
-"""
-        
-        # 매장명 헤더
-        for store in stores:
-            html += f"<th>{store}</th>"
-        
-        html += """
-                    </tr>
-                </thead>
-                <tbody>
-"""
-        
-        # 일평균 방문객수 행들
-        daily_items = [('전체', '전체'), ('평일', '평일'), ('주말', '주말')]
-        for i, (label, key) in enumerate(daily_items):
-            rowspan = 'rowspan="3"' if i == 0 else ''
-            html += f"""
-                    <tr>
-                        {'<td ' + rowspan + '>일평균 방문객수</td>' if i == 0 else ''}
-                        <td>{label}</td>
-"""
-            for store in stores:
-                value = metric_dict[store].get('daily_avg', {}).get(key, 0)
-                html += f"<td>{value:,}명</td>"
-            html += "</tr>"
-        
-        # 성별 경향 행들
-        gender_items = [('남성', '남성'), ('여성', '여성')]
-        for i, (label, key) in enumerate(gender_items):
-            rowspan = 'rowspan="2"' if i == 0 else ''
-            html += f"""
-                    <tr>
-                        {'<td ' + rowspan + '>성별 경향</td>' if i == 0 else ''}
-                        <td>{label}</td>
-"""
-            for store in stores:
-                value = metric_dict[store].get('gender', {}).get(key, 0)
-                html += f"<td>{value}%</td>"
-            html += "</tr>"
-        
-        # 연령대 순위 행들
-        for rank in range(1, 4):
-            rowspan = 'rowspan="3"' if rank == 1 else ''
-            html += f"""
-                    <tr>
-                        {'<td ' + rowspan + '>연령대 순위</td>' if rank == 1 else ''}
-                        <td>{rank}위</td>
-"""
-            for store in stores:
-                age_rank = metric_dict[store].get('age_rank', {})
-                rank_key = None
-                for key in age_rank.keys():
-                    if key.startswith(f"{rank}위_"):
-                        rank_key = key
-                        break
-                
-                if rank_key:
-                    age_group = rank_key.split('위_')[1]
-                    pct = age_rank.get(rank_key, 0)
-                    html += f"<td>{age_group} ({pct}%)</td>"
-                else:
-                    html += "<td>-</td>"
-            html += "</tr>"
-        
-        html += """
-                </tbody>
-            </table>
-"""
-        
-        return html
-
     def _save_html_node(self, state: VisitorDiagnoseState) -> VisitorDiagnoseState:
         """
-        생성된 HTML을 파일로 저장
+        생성된 HTML을 보고서 저장소에 저장 (같은 데이터의 보고서가 있으면 기존 URL 사용)
         """
-        import os
-        from datetime import datetime
-        
         html_content = state.get("html_content", "")
         if not html_content:
             state["final_result"] = "HTML 콘텐츠가 없음"
             return state
         
-        # 하이라이트 적용
-        highlights = state.get("highlights", [])
-        if highlights:
-            html_content = self._apply_html_highlights(html_content, highlights)
-        
-        # HTML 파일 저장
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"방문객진단_{timestamp}.html"
-        
-        # 현재 디렉토리와 chat 디렉토리 모두에 저장 (백엔드 호환성)
-        # /app/chat/mcp_tools/report  경로에 저장해야 FastAPI StaticFiles(/reports) 가 서빙
-        html_path = f"report/{filename}"  # 로컬(작업 디렉토리) 보관
-        chat_html_path = f"../chat/report/{filename}"
+        # 보고서 내용을 결정하는 데이터 (생성 시각은 제외)
+        fetch_errors = state.get("fetch_errors") or []
+        data_fingerprint = report_store.fingerprint({
+            "template": TEMPLATE_DIGEST,
+            "metrics": [asdict(metrics) for metrics in state["metric_dict"].values()],
+            "highlights": state.get("highlights") or [],
+            "fetch_errors": fetch_errors,
+        })
+        # 실패했거나 데이터가 없는 매장이 있으면 다음 요청에서 다시 조회하도록 요청 참조를 남기지 않음
+        complete = bool(state["metric_dict"]) and not fetch_errors
         
         try:
-            # 로컬 report 디렉토리에 저장
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            # Chat 디렉토리(report)에도 저장 (백엔드 서빙용)
-            chat_dir = os.path.dirname(chat_html_path)
-            if not os.path.exists(chat_dir):
-                os.makedirs(chat_dir, exist_ok=True)
-            with open(chat_html_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            self.logger.info(f"HTML 보고서 저장 완료: {html_path}")
-            self.logger.info(f"백엔드 서빙용 저장 완료: {chat_html_path}")
-            
-            # 웹 접근 가능한 상대 경로 URL (컨테이너/리버스프록시 환경에서도 안정)
-            web_url = f"/reports/{filename}"
-
-            # 마크다운 링크로 반환 (코드블록 없이 한 줄 텍스트)
-            state["final_result"] = (
-                "📊 HTML 보고서 생성 완료!\n\n"
-                f"🔗 [웹에서 보기]({web_url})\n\n"
-                "보고서를 클릭하여 새 탭에서 확인하세요!"
+            web_url = report_store.put(
+                self.workflow_name,
+                _split_store_names(state["store_name"]),
+                state["period"],
+                data_fingerprint,
+                html_content,
+                prefix="방문객진단",
+                remember=complete,
             )
+            state["final_result"] = _report_result(web_url)
 
             # DEBUG: 로그로 raw 문자열 확인
             self.logger.info(f"FINAL_RESULT_RAW: {repr(state['final_result'])}")
@@ -1145,66 +523,6 @@ ORDER BY ord
         
         return state
 
-    def _apply_html_highlights(self, html_content: str, highlights: list) -> str:
-        """
-        HTML에 하이라이트 효과 적용
-        """
-        import re
-        
-        for highlight in highlights:
-            metric = highlight.get("metric", "")
-            store = highlight.get("store", "")
-            color = highlight.get("color", "red")
-            reason = highlight.get("reason", "")
-            
-            self.logger.info(f"하이라이트 적용: {store} - {metric} ({color}) - {reason}")
-            
-            # 매장명과 메트릭에 따라 해당 섹션을 찾아서 하이라이트 적용
-            if metric == "방문객수":
-                # 방문객수 섹션의 metric-value들을 하이라이트
-                pattern = f'(<div class="store-name">{re.escape(store)}</div>.*?<div class="metric-title">👥 일평균 방문객수</div>.*?<div class="metric-value">)([^<]+)(</div>)'
-                html_content = re.sub(
-                    pattern,
-                    f'\\1<span class="highlight-{color}">\\2</span>\\3',
-                    html_content,
-                    flags=re.DOTALL,
-                    count=1
-                )
-            
-            elif metric == "성별경향":
-                # 성별경향 섹션을 하이라이트
-                pattern = f'(<div class="store-name">{re.escape(store)}</div>.*?<div class="metric-title">👫 성별 경향</div>.*?<div class="metric-grid">.*?</div>)'
-                def add_highlight(match):
-                    content = match.group(1)
-                    # 모든 metric-value에 하이라이트 클래스 추가
-                    content = content.replace('class="metric-value"', f'class="metric-value highlight-{color}"')
-                    return content
-                
-                html_content = re.sub(pattern, add_highlight, html_content, flags=re.DOTALL, count=1)
-                
-            elif metric == "연령대순위":
-                # 연령대 순위 섹션을 하이라이트
-                pattern = f'(<div class="store-name">{re.escape(store)}</div>.*?<div class="metric-title">🎯 연령대별 순위</div>.*?<div class="metric-grid">.*?</div>)'
-                def add_highlight(match):
-                    content = match.group(1)
-                    content = content.replace('class="metric-value"', f'class="metric-value highlight-{color}"')
-                    return content
-                
-                html_content = re.sub(pattern, add_highlight, html_content, flags=re.DOTALL, count=1)
-                
-            elif metric == "시간대경향":
-                # 시간대 경향 섹션을 하이라이트
-                pattern = f'(<div class="store-name">{re.escape(store)}</div>.*?<div class="metric-title">⏰ 주요 방문시간대</div>.*?<div class="time-slots">.*?</div>.*?</div>)'
-                def add_highlight(match):
-                    content = match.group(1)
-                    # time-slot-percent에 하이라이트 클래스 추가
-                    content = content.replace('class="time-slot-percent"', f'class="time-slot-percent highlight-{color}"')
-                    return content
-                
-                html_content = re.sub(pattern, add_highlight, html_content, flags=re.DOTALL, count=1)
-        
-        return html_content
-
     def _highlight_node(self, state: VisitorDiagnoseState) -> VisitorDiagnoseState:
         """LLM을 사용해 하이라이트 대상 메트릭을 결정"""
         try:
@@ -1228,9 +546,10 @@ ORDER BY ord
             self.logger.info(f"LLM 응답 내용: '{response.content}'")
             
             highlights = []
+            content = response.content
             try:
                 # 마크다운 코드 블록 제거
-                content = response.content.strip()
+                content = content.strip()
                 if content.startswith("```json"):
                     content = content[7:]  # ```json 제거
                 if content.endswith("```"):
@@ -1240,7 +559,7 @@ ORDER BY ord
                 highlights = _json.loads(content)["highlight"]
             except Exception as e:
                 self.logger.error(f"highlight JSON 파싱 실패: {e}")
-                self.logger.error(f"파싱 시도한 내용: '{content[:200] if 'content' in locals() else response.content[:200]}'")
+                self.logger.error(f"파싱 시도한 내용: '{content[:200]}'")
 
             state["highlights"] = highlights
             self.logger.info(f"하이라이트 선정: {highlights}")
@@ -1250,7 +569,7 @@ ORDER BY ord
             state["highlights"] = []
             return state
 
-    def _format_metrics_for_highlight(self, metric_dict: dict) -> str:
+    def _format_metrics_for_highlight(self, metric_dict: Dict[str, StoreMetrics]) -> str:
         """
         metric_dict를 LLM이 분석하기 좋은 표 형식으로 변환
         """
@@ -1258,49 +577,14 @@ ORDER BY ord
         table_lines.append("매장별 방문객 진단 데이터:")
         table_lines.append("=" * 50)
         
-        for store, data in metric_dict.items():
-            table_lines.append(f"\n[{store}]")
-            
-            # 일평균 방문객수
-            daily_avg = data.get('daily_avg', {})
-            table_lines.append(f"일평균 방문객수: 전체 {daily_avg.get('전체', 0)}명, 평일 {daily_avg.get('평일', 0)}명, 주말 {daily_avg.get('주말', 0)}명")
-            
-            # 성별 경향
-            gender = data.get('gender', {})
-            table_lines.append(f"성별 경향: 남성 {gender.get('남성', 0)}%, 여성 {gender.get('여성', 0)}%")
-            
-            # 연령대 순위
-            age_rank = data.get('age_rank', {})
-            age_info = []
-            for i in range(1, 4):
-                for key, pct in age_rank.items():
-                    if key.startswith(f"{i}위_"):
-                        age_group = key.split('위_')[1]
-                        age_info.append(f"{i}위: {age_group} ({pct}%)")
-                        break
-            table_lines.append(f"연령대 순위: {', '.join(age_info)}")
-            
-            # 시간대 경향
-            time_slots = data.get('time_slots', {})
-            for day_type in ['평일', '주말']:
-                slots = time_slots.get(day_type, {})
-                time_info = []
-                for i in range(1, 4):
-                    for key, pct in slots.items():
-                        if key.startswith(f"{i}위_"):
-                            parts = key.split('_')
-                            if len(parts) >= 3:
-                                time_name = parts[1]
-                                time_range = parts[2]
-                                time_info.append(f"{i}위: {time_name}({time_range}) {pct}%")
-                            break
-                table_lines.append(f"{day_type} 시간대: {', '.join(time_info)}")
+        for metrics in metric_dict.values():
+            table_lines.append(f"\n{metrics.render()}")
         
         return "\n".join(table_lines)
 
 # 기존 엑셀 관련 메서드들은 HTML 버전으로 대체되었습니다.
 
-    def _generate_dummy_data_for_store(self, store_name: str) -> str:
+    def _generate_dummy_data_for_store(self, store_name: str) -> StoreMetrics:
         """더미데이터점들을 위한 가짜 데이터 생성 (각 매장마다 다른 특성)"""
         self.logger.info(f"{store_name} 더미 데이터 생성")
         
@@ -1346,34 +630,21 @@ ORDER BY ord
         # 해당 매장의 패턴 가져오기 (없으면 기본 더미데이터점 패턴 사용)
         pattern = dummy_patterns.get(store_name, dummy_patterns["더미데이터점"])
         
-        # 더미 데이터 생성
-        dummy_data = f"""
-=== {store_name} ===
-일평균 방문객수
-  전체: {pattern['daily']['전체']}명
-  평일: {pattern['daily']['평일']}명
-  주말: {pattern['daily']['주말']}명
-
-성별경향
-  M: {pattern['gender']['M']}%
-  F: {pattern['gender']['F']}%
-
-연령대별 순위
-  1: {pattern['age'][0][0]} - {pattern['age'][0][1]}%
-  2: {pattern['age'][1][0]} - {pattern['age'][1][1]}%
-  3: {pattern['age'][2][0]} - {pattern['age'][2][1]}%
-
-주요 방문시간대
-  평일:
-    1: {pattern['time_weekday'][0][0]} - {pattern['time_weekday'][0][1]}%
-    2: {pattern['time_weekday'][1][0]} - {pattern['time_weekday'][1][1]}%
-    3: {pattern['time_weekday'][2][0]} - {pattern['time_weekday'][2][1]}%
-  주말:
-    1: {pattern['time_weekend'][0][0]} - {pattern['time_weekend'][0][1]}%
-    2: {pattern['time_weekend'][1][0]} - {pattern['time_weekend'][1][1]}%
-    3: {pattern['time_weekend'][2][0]} - {pattern['time_weekend'][2][1]}%
-"""
-        return dummy_data
+        # 더미 데이터 생성 ("오후(14-17)" -> 명칭/범위 분리)
+        def slots(entries):
+            result = {}
+            for rank, (label, pct) in enumerate(entries, start=1):
+                time_name, time_range = label.rstrip(')').split('(')
+                result[f"{rank}위_{time_name}_{time_range}"] = pct
+            return result
+
+        return StoreMetrics(
+            store=store_name,
+            daily_avg=dict(pattern['daily']),
+            gender={'남성': pattern['gender']['M'], '여성': pattern['gender']['F']},
+            age_rank={f"{rank}위_{age}": pct for rank, (age, pct) in enumerate(pattern['age'], start=1)},
+            time_slots={'평일': slots(pattern['time_weekday']), '주말': slots(pattern['time_weekend'])},
+        )
 
 
 # FastMCP 인스턴스 (툴 서버 등록용)